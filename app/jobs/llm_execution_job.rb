@@ -1,6 +1,11 @@
+require 'zlib'
+
 class LlmExecutionJob < ApplicationJob
   queue_as :default
 
+  # Request bodies at least this large (long-context prompts) are sent gzip-compressed
+  GZIP_MIN_BYTES = ENV.fetch('LLM_SERVICE_GZIP_MIN_BYTES', 1_048_576).to_i
+
   def perform(execution_id, streaming = false)
     execution = Execution.find(execution_id)
     prompt = execution.prompt
@@ -8,37 +13,25 @@ class LlmExecutionJob < ApplicationJob
     # Update status to running
     execution.update!(status: 'running')
     
-    # Call Python LLM service for each iteration
-    (1..execution.iterations).each do |iteration_num|
-      begin
-        if streaming
-          # Call with streaming support
-          stream_llm_response(execution, prompt, iteration_num)
-        else
-          response = call_llm_service(prompt, iteration_num)
-          
-          # Save result
-          result = execution.results.create!(
-            iteration_number: iteration_num,
-            response_text: response[:text],
-            tokens_used: response[:tokens_used],
-            response_time_ms: response[:response_time_ms],
-            status: response[:status],
-            error_message: response[:error_message]
-          )
+    if streaming
+      channel = open_channel
+      if channel
+        # Every iteration streams concurrently over one WebSocket to the Python side
+        stream_over_channel(channel, execution, prompt)
+      else
+        # Call Python LLM service for each iteration
+        (1..execution.iterations).each do |iteration_num|
+          begin
+            # Call with streaming support
+            stream_llm_response(execution, prompt, iteration_num)
+          rescue => e
+            record_iteration_error(execution, iteration_num, e.message)
+          end
         end
-        
-      rescue => e
-        Rails.logger.error "LLM Execution Error: #{e.message}"
-        execution.results.create!(
-          iteration_number: iteration_num,
-          status: 'error',
-          error_message: e.message
-        )
-        
-        # Broadcast error via ActionCable
-        PromptChannel.broadcast_error(execution, iteration_num, e.message)
       end
+    else
+      # One batch request runs every iteration concurrently on the Python side
+      run_batch(execution, prompt)
     end
     
     # Update execution status
@@ -56,39 +49,170 @@ class LlmExecutionJob < ApplicationJob
   
   private
   
-  def call_llm_service(prompt, iteration_num)
-    Rails.logger.info "Calling LLM service for iteration #{iteration_num}"
-    
-    # Call Python FastAPI service
-    response = HTTParty.post(
-      'http://localhost:8000/generate',
-      body: {
-        model_id: prompt.selected_model,
-        system_prompt: prompt.system_prompt,
-        user_prompt: prompt.user_prompt,
-        temperature: prompt.parameters['temperature'],
-        max_tokens: prompt.parameters['max_tokens'],
-        top_p: prompt.parameters['top_p'],
-        stream: false
-      }.to_json,
-      headers: { 'Content-Type' => 'application/json' },
-      timeout: 60
+  # JSON body plus headers, gzip-compressed once it is large enough to be worth it
+  def encode_request(body)
+    headers = { 'Content-Type' => 'application/json' }
+    if GZIP_MIN_BYTES.positive? && body.bytesize >= GZIP_MIN_BYTES
+      body = Zlib.gzip(body, level: Zlib::BEST_SPEED)
+      headers['Content-Encoding'] = 'gzip'
+    end
+    [body, headers]
+  end
+
+  def record_iteration_error(execution, iteration_num, message)
+    Rails.logger.error "LLM Execution Error: #{message}"
+    execution.results.create!(
+      iteration_number: iteration_num,
+      status: 'error',
+      error_message: message
     )
     
-    if response.success?
-      JSON.parse(response.body).symbolize_keys
-    else
-      raise "LLM Service Error: #{response.code} - #{response.body}"
+    # Broadcast error via ActionCable
+    PromptChannel.broadcast_error(execution, iteration_num, message)
+  end
+  
+  def run_batch(execution, prompt)
+    Rails.logger.info "Calling LLM batch service for #{execution.iterations} iterations"
+    
+    received = []
+    uri = URI('http://localhost:8000/batch_generate')
+    
+    request_body = {
+      model_id: prompt.selected_model,
+      system_prompt: prompt.system_prompt,
+      user_prompt: prompt.user_prompt,
+      temperature: prompt.parameters['temperature'],
+      max_tokens: prompt.parameters['max_tokens'],
+      top_p: prompt.parameters['top_p'],
+      iterations: execution.iterations,
+      stream: true,
+      format: 'ndjson'
+    }.to_json
+    
+    Net::HTTP.start(uri.host, uri.port, read_timeout: 120) do |http|
+      body, headers = encode_request(request_body)
+      request = Net::HTTP::Post.new(uri, headers)
+      request.body = body
+      
+      http.request(request) do |response|
+        raise "LLM Service Error: #{response.code} - #{response.body}" unless response.is_a?(Net::HTTPSuccess)
+        
+        buffer = +""
+        response.read_body do |chunk|
+          buffer << chunk
+          # Each NDJSON line is one finished iteration
+          while (newline = buffer.index("\n"))
+            line = buffer.slice!(0..newline).strip
+            next if line.empty?
+            
+            data = JSON.parse(line)
+            next if data['done']
+            
+            result = execution.results.create!(
+              iteration_number: data['iteration'],
+              response_text: data['text'],
+              tokens_used: data['tokens_used'],
+              response_time_ms: data['response_time_ms'],
+              status: data['status'],
+              error_message: data['error_message']
+            )
+            received << data['iteration']
+            PromptChannel.broadcast_complete(execution, data['iteration'], result)
+          end
+        end
+      end
     end
   rescue => e
-    Rails.logger.error "HTTP Request Error: #{e.message}"
-    {
-      text: '',
-      tokens_used: { input: 0, output: 0, total: 0 },
-      response_time_ms: 0,
-      status: 'error',
-      error_message: e.message
+    Rails.logger.error "Batch Request Error: #{e.message}"
+  ensure
+    # Iterations the service never reported are recorded as errors
+    ((1..execution.iterations).to_a - received).each do |iteration_num|
+      record_iteration_error(execution, iteration_num, e&.message || 'No result returned by LLM service')
+    end
+  end
+  
+  def open_channel
+    LlmChannelClient.new
+  rescue => e
+    Rails.logger.warn "LLM channel unavailable (#{e.message}); streaming iterations one by one"
+    nil
+  end
+  
+  def stream_over_channel(channel, execution, prompt)
+    Rails.logger.info "Streaming #{execution.iterations} iterations over one LLM service channel"
+    
+    received = []
+    params = {
+      model_id: prompt.selected_model,
+      system_prompt: prompt.system_prompt,
+      user_prompt: prompt.user_prompt,
+      temperature: prompt.parameters['temperature'],
+      max_tokens: prompt.parameters['max_tokens'],
+      top_p: prompt.parameters['top_p'],
+      stream: true,
+      # Iterations share one prompt; each must be a fresh provider call, not a cached copy
+      cache: false
     }
+    
+    (1..execution.iterations).each do |iteration_num|
+      start_time = Time.current
+      accumulated_text = +""
+      stream_stats = nil
+      
+      channel.generate(iteration_num, params) do |frame|
+        # A frame that failed to save has already recorded this iteration
+        next if received.include?(iteration_num)
+        
+        begin
+          case frame['type']
+          when 'chunk'
+            accumulated_text << frame['text']
+            PromptChannel.broadcast_chunk(execution, iteration_num, frame['text'])
+          when 'stats'
+            # Provider token usage and timing
+            stream_stats = frame['stats']
+          when 'done'
+            status = if frame['cancelled']
+                       'cancelled'
+                     elsif stream_stats && stream_stats['status'] != 'success'
+                       'error'
+                     else
+                       'success'
+                     end
+            result = execution.results.create!(
+              iteration_number: iteration_num,
+              response_text: accumulated_text,
+              tokens_used: stream_stats&.dig('tokens_used') || { input: 0, output: accumulated_text.split.length },
+              response_time_ms: ((Time.current - start_time) * 1000).round,
+              status: status,
+              error_message: status == 'error' ? "LLM stream ended with status #{stream_stats['status']}" : nil
+            )
+            received << iteration_num
+            PromptChannel.broadcast_complete(execution, iteration_num, result)
+          when 'error'
+            received << iteration_num
+            record_iteration_error(execution, iteration_num, frame['error_message'])
+          end
+        rescue => e
+          # Keep serving the other iterations multiplexed on the channel
+          Rails.logger.error "Channel frame error for iteration #{iteration_num}: #{e.message}"
+          unless received.include?(iteration_num)
+            received << iteration_num
+            record_iteration_error(execution, iteration_num, e.message)
+          end
+        end
+      end
+    end
+    
+    channel.run
+  rescue => e
+    Rails.logger.error "Channel Error: #{e.message}"
+  ensure
+    channel.close
+    # Iterations the service never finished are recorded as errors
+    ((1..execution.iterations).to_a - received).each do |iteration_num|
+      record_iteration_error(execution, iteration_num, e&.message || 'No result returned by LLM service')
+    end
   end
   
   def stream_llm_response(execution, prompt, iteration_num)
@@ -96,6 +220,9 @@ class LlmExecutionJob < ApplicationJob
     
     start_time = Time.current
     accumulated_text = ""
+    stream_stats = nil
+    cancelled = false
+    http_error = nil
     
     # Use Server-Sent Events for streaming
     uri = URI('http://localhost:8000/generate')
@@ -111,11 +238,12 @@ class LlmExecutionJob < ApplicationJob
     }.to_json
     
     Net::HTTP.start(uri.host, uri.port) do |http|
-      request = Net::HTTP::Post.new(uri)
-      request['Content-Type'] = 'application/json'
-      request.body = request_body
+      body, headers = encode_request(request_body)
+      request = Net::HTTP::Post.new(uri, headers)
+      request.body = body
       
       http.request(request) do |response|
+        http_error = "LLM service returned HTTP #{response.code}" unless response.is_a?(Net::HTTPSuccess)
         response.read_body do |chunk|
           # Parse SSE chunks
           chunk.each_line do |line|
@@ -126,9 +254,14 @@ class LlmExecutionJob < ApplicationJob
               begin
                 json_data = JSON.parse(data)
                 
-                if json_data['done']
+                if json_data['cancelled']
+                  cancelled = true
+                elsif json_data['done']
                   # Streaming completed
                   Rails.logger.info "Streaming completed for iteration #{iteration_num}"
+                elsif json_data['stats']
+                  # Final stats event carries provider token usage and timing
+                  stream_stats = json_data['stats']
                 elsif json_data['text']
                   content = json_data['text']
                   accumulated_text += content
@@ -147,13 +280,23 @@ class LlmExecutionJob < ApplicationJob
     # Calculate response time
     response_time_ms = ((Time.current - start_time) * 1000).round
     
+    # Same status rules as stream_over_channel
+    status = if cancelled
+               'cancelled'
+             elsif http_error || (stream_stats && stream_stats['status'] != 'success')
+               'error'
+             else
+               'success'
+             end
+    
     # Save the complete result
     result = execution.results.create!(
       iteration_number: iteration_num,
       response_text: accumulated_text,
-      tokens_used: { input: 0, output: accumulated_text.split.length }, # Approximate
+      tokens_used: stream_stats&.dig('tokens_used') || { input: 0, output: accumulated_text.split.length }, # Approximate without stats
       response_time_ms: response_time_ms,
-      status: 'completed'
+      status: status,
+      error_message: status == 'error' ? (http_error || "LLM stream ended with status #{stream_stats['status']}") : nil
     )
     
     # Broadcast completion
@@ -0,0 +1,94 @@
+require 'socket'
+require 'websocket/driver'
+
+# One long-lived WebSocket to the LLM service's /ws endpoint carrying many
+# concurrent generate requests. Every frame is JSON tagged with a stream id;
+# chunk credit is handed back as frames are consumed so the service keeps
+# streaming.
+class LlmChannelClient
+  DEFAULT_URL = ENV.fetch('LLM_SERVICE_WS_URL', 'ws://localhost:8000/ws')
+  WINDOW = 32
+
+  attr_reader :url
+
+  def initialize(url = DEFAULT_URL, read_timeout: 120)
+    @url = url
+    @read_timeout = read_timeout
+    @handlers = {}
+    @consumed = Hash.new(0)
+    @open = false
+    @closed = false
+
+    uri = URI(url)
+    @socket = TCPSocket.new(uri.host, uri.port)
+    @driver = WebSocket::Driver.client(self)
+    @driver.on(:open) { @open = true }
+    @driver.on(:message) { |event| dispatch(JSON.parse(event.data)) }
+    @driver.on(:close) { @closed = true }
+    @driver.start
+    pump until @open || @closed
+    raise "LLM service refused the WebSocket channel at #{url}" unless @open
+  end
+
+  # Called by websocket-driver with encoded frames
+  def write(data)
+    @socket.write(data)
+  end
+
+  # Start a request; the block receives every frame for it
+  # (start, chunk, stats or result, then done or error)
+  def generate(id, params, &block)
+    @handlers[id.to_s] = block
+    send_frame(params.merge(type: 'generate', id: id.to_s, window: WINDOW))
+  end
+
+  def cancel(id)
+    send_frame(type: 'cancel', id: id.to_s)
+  end
+
+  # Read frames until every started request has finished or the service hangs up
+  def run
+    pump until @handlers.empty? || @closed
+  end
+
+  def close
+    @driver.close unless @closed
+    @socket.close unless @socket.closed?
+  rescue IOError, SystemCallError
+    # Already gone
+  end
+
+  private
+
+  def dispatch(frame)
+    id = frame['id']
+    handler = @handlers[id]
+    return unless handler
+
+    if frame['type'] == 'chunk'
+      # Return credit in batches rather than one frame per chunk
+      @consumed[id] += 1
+      if @consumed[id] >= WINDOW / 2
+        send_frame(type: 'credit', id: id, n: @consumed.delete(id))
+      end
+    end
+
+    handler.call(frame)
+    if %w[done error].include?(frame['type'])
+      @handlers.delete(id)
+      @consumed.delete(id)
+    end
+  end
+
+  def send_frame(frame)
+    @driver.text(frame.to_json)
+  end
+
+  def pump
+    raise Timeout::Error, "No data from LLM service for #{@read_timeout}s" unless IO.select([@socket], nil, nil, @read_timeout)
+
+    @driver.parse(@socket.readpartial(16_384))
+  rescue EOFError
+    @closed = true
+  end
+end
@@ -0,0 +1,293 @@
+"""Large-prompt ingestion: latency and memory for 1-20 MB prompts.
+
+Usage (from lib/):
+    python benchmarks/large_prompt_bench.py [--sizes-mb 1,5,10,20] [--scripts ascii,korean] [--repeats 3] [--no-server]
+
+Three parts, each per prompt size and script (English-like ASCII text, or
+Korean text with ASCII punctuation and numbers):
+
+- request path: the per-request prompt work behind /generate on Gemini:
+  fingerprint, token counting at preflight, rate-limit reservation and prefix
+  caching, and building the Gemini prompt with its Korean check. It runs
+  once as the code did before memoized text profiles ("baseline") and once
+  through llm_services ("current"). Time is the median over --repeats on
+  cold caches; memory is the tracemalloc peak above the prompt itself.
+- wire: body size and encode/decode time for gzip (levels 1 and 6) and
+  zstd (when the zstandard package is installed).
+- server: POST /count_tokens against a real uvicorn server, with a plain
+  body and a gzip body. It reports latency and how far the server's peak
+  RSS rises above idle; each case gets a fresh server. Prompts past the
+  model's context window are answered with 400 after being counted, so
+  they still measure ingestion. Run the script at two revisions to compare
+  servers.
+
+Results go to benchmarks/results/.
+"""
+import argparse
+import asyncio
+import gc
+import gzip
+import hashlib
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from load_test import RESULTS_DIR, free_port, git_rev, start_server, wait_until_ready  # noqa: E402
+from llm_services.fingerprint import request_fingerprint  # noqa: E402
+from llm_services.gemini_llm import GeminiLLM  # noqa: E402
+from llm_services.request_body import zstandard  # noqa: E402
+from llm_services.text_profile import text_profiles  # noqa: E402
+from llm_services.tokenizer import HeuristicTokenizer, token_counter  # noqa: E402
+
+MODEL = 'gemini-2.5-pro'
+SYSTEM_PROMPT = "You are a careful analyst. Answer using only the attached documents."
+HINT = "[Please provide a helpful response in the same language as the user's input]"
+
+ASCII_WORDS = (
+    "the of and to in a is that for it as was with be by on not he this are or his from at which but have an "
+    "they you were her she there been one all we their has would when if so no more other into time only "
+    "report revenue quarter growth customer service latency request model context window document section"
+).split()
+KOREAN_WORDS = (
+    "그리고 하지만 그래서 보고서 매출 분기 성장 고객 서비스 지연 요청 모델 문맥 문서 항목 결과 분석 데이터 "
+    "사용자 시스템 처리 응답 시간 비용 토큰 입력 출력 검토 요약 기준 변경 사항 회의 일정 계약 조건"
+).split()
+
+
+def make_prompt(size_mb: float, script: str, seed: int = 7) -> str:
+    """Pseudo-random prose of about size_mb MB UTF-8 (compresses like text, not like a repeated string)"""
+    rng = random.Random(seed)
+    words = ASCII_WORDS if script == 'ascii' else KOREAN_WORDS
+    target = int(size_mb * 1024 * 1024)
+    parts = []
+    size = 0
+    while size < target:
+        sentence = " ".join(rng.choice(words) for _ in range(rng.randint(6, 18)))
+        if script != 'ascii' and rng.random() < 0.2:
+            sentence += f" ({rng.randint(1, 9999)})"
+        sentence += ". " if rng.random() < 0.9 else ".\n\n"
+        parts.append(sentence)
+        size += len(sentence.encode('utf-8'))
+    return "".join(parts)
+
+
+# --- the prompt work as it was before text profiles -------------------------
+
+def baseline_fingerprint(model_id, system_prompt, user_prompt, temperature, max_tokens, top_p) -> str:
+    payload = {
+        'model_id': model_id,
+        'system_prompt': system_prompt or "",
+        'user_prompt': user_prompt,
+        'temperature': round(float(temperature), 6),
+        'max_tokens': int(max_tokens),
+        'top_p': round(float(top_p), 6),
+    }
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class BaselineTokenCounter:
+    def __init__(self):
+        self.counts = {}
+
+    @staticmethod
+    def heuristic(text: str) -> int:
+        if text.isascii():
+            return math.ceil(len(text) / 4)
+        other = sum(1 for ch in text if ord(ch) > 127)
+        return math.ceil((len(text) - other) / 4 + other)
+
+    def count(self, text: str) -> int:
+        key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        if key not in self.counts:
+            self.counts[key] = self.heuristic(text)
+        return self.counts[key]
+
+    def count_prompt(self, system_prompt: str, user_prompt: str) -> int:
+        return self.count(user_prompt) + self.count(system_prompt) + 8
+
+
+def baseline_build_prompt(system_prompt: str, user_prompt: str) -> str:
+    full_prompt = f"System: {system_prompt}\n\nUser: {user_prompt}"
+    if any(ord(char) >= 0xAC00 and ord(char) <= 0xD7A3 for char in full_prompt):
+        full_prompt = f"{HINT}\n\n{full_prompt}"
+    return full_prompt
+
+
+def baseline_path(user_prompt: str):
+    counter = BaselineTokenCounter()
+    baseline_fingerprint(MODEL, SYSTEM_PROMPT, user_prompt, 0.7, 2048, 1.0)
+    for _ in range(3):  # preflight, reserve_capacity, cacheable_prefix
+        counter.count_prompt(SYSTEM_PROMPT, user_prompt)
+    return baseline_build_prompt(SYSTEM_PROMPT, user_prompt)
+
+
+def current_path(user_prompt: str):
+    text_profiles.clear()
+    token_counter.clear()
+    request_fingerprint(MODEL, SYSTEM_PROMPT, user_prompt, 0.7, 2048, 1.0)
+    for _ in range(3):
+        token_counter.count_prompt('gemini', MODEL, SYSTEM_PROMPT, user_prompt)
+    return GeminiLLM._build_prompt(None, SYSTEM_PROMPT, user_prompt, False)
+
+
+def measure(func, prompt: str, repeats: int) -> dict:
+    times = []
+    for _ in range(repeats):
+        gc.collect()
+        started = time.perf_counter()
+        func(prompt)
+        times.append((time.perf_counter() - started) * 1000)
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    result = func(prompt)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    del result
+    return {'ms': round(statistics.median(times), 1), 'peak_mb': round(peak / 1024 / 1024, 1)}
+
+
+def check_equivalent(prompt: str):
+    assert baseline_fingerprint(MODEL, SYSTEM_PROMPT, prompt, 0.7, 2048, 1.0) == \
+        request_fingerprint(MODEL, SYSTEM_PROMPT, prompt, 0.7, 2048, 1.0), "fingerprint changed"
+    assert BaselineTokenCounter.heuristic(prompt) == HeuristicTokenizer().count(prompt), "token estimate changed"
+
+
+def wire(body: bytes, repeats: int) -> dict:
+    codecs = {
+        'gzip-1': (lambda data: gzip.compress(data, 1), gzip.decompress),
+        'gzip-6': (lambda data: gzip.compress(data, 6), gzip.decompress),
+    }
+    if zstandard is not None:
+        codecs['zstd-3'] = (
+            lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+            lambda data: zstandard.ZstdDecompressor().decompress(data),
+        )
+    row = {'raw_mb': round(len(body) / 1024 / 1024, 2)}
+    for name, (encode, decode) in codecs.items():
+        started = time.perf_counter()
+        encoded = encode(body)
+        encode_ms = (time.perf_counter() - started) * 1000
+        decode_times = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            decode(encoded)
+            decode_times.append((time.perf_counter() - started) * 1000)
+        row[name] = {
+            'mb': round(len(encoded) / 1024 / 1024, 2),
+            'ratio': round(len(body) / len(encoded), 1),
+            'encode_ms': round(encode_ms, 1),
+            'decode_ms': round(statistics.median(decode_times), 1),
+        }
+    return row
+
+
+def vm_kb(pid: int, field: str):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+async def serve_once(body: bytes, headers: dict, repeats: int) -> dict:
+    """Fresh server per case so peak RSS belongs to this body alone"""
+    port = free_port()
+    server = start_server(port, 1)
+    try:
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', timeout=300) as client:
+            await wait_until_ready(client)
+            idle = vm_kb(server.pid, 'VmRSS')
+            times = []
+            status = None
+            for _ in range(repeats):
+                started = time.perf_counter()
+                response = await client.post('/count_tokens', content=body, headers=headers)
+                times.append((time.perf_counter() - started) * 1000)
+                status = response.status_code
+            peak = vm_kb(server.pid, 'VmHWM')
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    return {
+        'status': status,
+        'ms': round(statistics.median(times), 1),
+        'sent_mb': round(len(body) / 1024 / 1024, 2),
+        'peak_rss_over_idle_mb': round((peak - idle) / 1024, 1) if peak and idle else None,
+    }
+
+
+async def run(args):
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_rev': git_rev(),
+        'python': sys.version.split()[0],
+        'zstandard': zstandard is not None,
+        'results': [],
+    }
+    for script in args.scripts:
+        for size_mb in args.sizes_mb:
+            prompt = make_prompt(size_mb, script)
+            check_equivalent(prompt)
+            row = {'script': script, 'size_mb': size_mb, 'chars': len(prompt)}
+            row['request_path'] = {
+                'baseline': measure(baseline_path, prompt, args.repeats),
+                'current': measure(current_path, prompt, args.repeats),
+            }
+            body = json.dumps({'model_id': MODEL, 'system_prompt': SYSTEM_PROMPT, 'user_prompt': prompt},
+                              ensure_ascii=False).encode('utf-8')
+            row['wire'] = wire(body, args.repeats)
+            if args.server:
+                plain = {'Content-Type': 'application/json'}
+                row['server'] = {
+                    'plain': await serve_once(body, plain, args.repeats),
+                    'gzip-1': await serve_once(gzip.compress(body, 1), {**plain, 'Content-Encoding': 'gzip'}, args.repeats),
+                }
+            report['results'].append(row)
+
+            path_row = row['request_path']
+            line = (
+                f"{script:<6} {size_mb:>5} MB  request path {path_row['baseline']['ms']:>8} -> {path_row['current']['ms']:>7} ms, "
+                f"peak {path_row['baseline']['peak_mb']:>6} -> {path_row['current']['peak_mb']:>5} MB  "
+                f"gzip-1 x{row['wire']['gzip-1']['ratio']} ({row['wire']['gzip-1']['decode_ms']} ms to decode)"
+            )
+            if args.server:
+                line += "  server " + ", ".join(
+                    f"{name} {case['ms']} ms / +{case['peak_rss_over_idle_mb']} MB [{case['status']}]"
+                    for name, case in row['server'].items()
+                )
+            print(line)
+            del prompt, body
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"large_prompt-{time.strftime('%Y%m%d-%H%M%S')}-{report['git_rev']}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes-mb', default='1,5,10,20', type=lambda v: [float(x) for x in v.split(',')])
+    parser.add_argument('--scripts', default='ascii,korean', type=lambda v: v.split(','))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--no-server', dest='server', action='store_false', help="skip the uvicorn runs")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""End-to-end load test against a real uvicorn server backed by the mock provider.
+
+Usage (from lib/):
+    python benchmarks/load_test.py [--concurrency 1,4,16,64] [--requests 64] [--model mock-fast]
+
+The server is started as a subprocess with LLM_MOCK_ENABLED=1, so no API key
+or network access is needed; LLM_MOCK_* variables already set in the
+environment (TTFT, token rate, error/429 rates) are passed through. Each
+scenario (/generate, streaming /generate, /batch_generate) runs at every
+concurrency level and reports throughput, p50/p95/p99 latency, client-side
+time to first token, event-loop lag (from /stats) and server RSS.
+
+Requests send cache=false so caching and coalescing do not hide provider
+latency. Results are written to benchmarks/results/load_test-<time>-<rev>.json.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+LIB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(LIB_DIR, 'benchmarks', 'results')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def git_rev() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=LIB_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def rss_mb(pid: int):
+    """Resident set size of the server process (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))], 1)
+
+
+def start_server(port: int, workers: int) -> subprocess.Popen:
+    env = dict(os.environ, LLM_MOCK_ENABLED='1')
+    # Mock calls are never rate limited unless the caller asks for it
+    env.setdefault('LLM_CONCURRENCY_MOCK', '1000')
+    command = [
+        sys.executable, '-m', 'uvicorn', 'llm_api_server:app',
+        '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning',
+    ]
+    if workers > 1:
+        command += ['--workers', str(workers)]
+    return subprocess.Popen(command, cwd=LIB_DIR, env=env)
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get('/health')).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError('server did not become ready')
+
+
+def payload(args, **extra) -> dict:
+    body = {
+        'model_id': args.model,
+        'system_prompt': 'You are a load test.',
+        'user_prompt': 'Say something long.',
+        'max_tokens': args.max_tokens,
+        'cache': False,
+    }
+    body.update(extra)
+    return body
+
+
+async def call_generate(client, args):
+    response = await client.post('/generate', json=payload(args))
+    data = response.json()
+    return {'ok': response.status_code == 200 and data.get('status') == 'success', 'ttft_ms': None}
+
+
+async def call_stream(client, args):
+    started = time.perf_counter()
+    ttft_ms = None
+    ok = False
+    async with client.stream('POST', '/generate', json=payload(args, stream=True)) as response:
+        async for line in response.aiter_lines():
+            if not line.startswith('data: '):
+                continue
+            event = json.loads(line[6:])
+            if 'text' in event and ttft_ms is None:
+                ttft_ms = (time.perf_counter() - started) * 1000
+            if 'stats' in event:
+                ok = event['stats'].get('status') == 'success'
+    return {'ok': ok and response.status_code == 200, 'ttft_ms': ttft_ms}
+
+
+async def call_batch(client, args):
+    started = time.perf_counter()
+    ttft_ms = None
+    ok = True
+    body = payload(args, stream=True, iterations=args.batch_iterations)
+    async with client.stream('POST', '/batch_generate', json=body) as response:
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            item = json.loads(line)
+            if 'iteration' in item:
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started) * 1000
+                ok = ok and item.get('status') == 'success'
+    return {'ok': ok and response.status_code == 200, 'ttft_ms': ttft_ms}
+
+
+SCENARIOS = {
+    'generate': call_generate,
+    'stream': call_stream,
+    'batch': call_batch,
+}
+
+
+async def run_level(client, scenario, concurrency, total, args, server_pid):
+    call = SCENARIOS[scenario]
+    latencies, ttfts = [], []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                result = await call(client, args)
+            except (httpx.HTTPError, ValueError):
+                result = {'ok': False, 'ttft_ms': None}
+            latencies.append((time.perf_counter() - started) * 1000)
+            if result['ttft_ms'] is not None:
+                ttfts.append(result['ttft_ms'])
+            if not result['ok']:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    stats = (await client.get('/stats')).json()
+    units = total * (args.batch_iterations if scenario == 'batch' else 1)
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': total,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_sec': round(total / elapsed, 2),
+        'generations_per_sec': round(units / elapsed, 2),
+        'latency_ms': {'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95), 'p99': percentile(latencies, 99)},
+        'ttft_ms': {'p50': percentile(ttfts, 50), 'p95': percentile(ttfts, 95), 'p99': percentile(ttfts, 99)},
+        'event_loop': stats.get('event_loop'),
+        'server_rss_mb': rss_mb(server_pid),
+    }
+
+
+async def run(args):
+    port = free_port()
+    server = start_server(port, args.workers)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    try:
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', timeout=300, limits=limits) as client:
+            await wait_until_ready(client)
+            idle_rss = rss_mb(server.pid)
+            results = []
+            for scenario in args.scenarios:
+                for concurrency in args.concurrency:
+                    total = max(args.requests, concurrency)
+                    row = await run_level(client, scenario, concurrency, total, args, server.pid)
+                    results.append(row)
+                    print(
+                        f"{scenario:<9} c={concurrency:<4} {row['requests_per_sec']:>8.1f} req/s  "
+                        f"p50 {row['latency_ms']['p50']:>7} ms  p99 {row['latency_ms']['p99']:>7} ms  "
+                        f"ttft p50 {row['ttft_ms']['p50']} ms  "
+                        f"loop lag max {(row['event_loop'] or {}).get('recent_max_ms')} ms  "
+                        f"rss {row['server_rss_mb']} MB  errors {row['errors']}"
+                    )
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_rev': git_rev(),
+        'python': sys.version.split()[0],
+        'config': {
+            'model': args.model,
+            'workers': args.workers,
+            'max_tokens': args.max_tokens,
+            'batch_iterations': args.batch_iterations,
+            'mock_env': {key: value for key, value in os.environ.items() if key.startswith('LLM_MOCK_')},
+        },
+        'idle_rss_mb': idle_rss,
+        'results': results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"load_test-{time.strftime('%Y%m%d-%H%M%S')}-{report['git_rev']}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', default='1,4,16,64', type=lambda v: [int(x) for x in v.split(',')])
+    parser.add_argument('--requests', type=int, default=64, help='requests per concurrency level')
+    parser.add_argument('--scenarios', default='generate,stream,batch', type=lambda v: v.split(','))
+    parser.add_argument('--model', default='mock-fast')
+    parser.add_argument('--max-tokens', type=int, default=256)
+    parser.add_argument('--batch-iterations', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+"""Near-duplicate prompt index: build cost, memory, lookup latency and hit rate at 100k prompts.
+
+Usage (from lib/):
+    python benchmarks/near_dup_bench.py [--prompts 100000] [--queries 2000] [--thresholds 0.8,0.9] [--no-numpy]
+
+Indexes --prompts synthetic prompts (English-like and Korean, 80-1500
+characters, drawn from a few thousand words with a skewed frequency so
+unrelated prompts share some shingles, as real ones do) into one scope of
+llm_services.near_duplicates. Then, per threshold, it looks up --queries
+variants of indexed prompts in each of these classes:
+
+- format: case, spacing and punctuation changed (same normalized text)
+- one_word: one word replaced
+- two_words: two words inserted
+- novel: a prompt that was never indexed (any match is a false positive)
+
+It reports the hit rate per class next to what an exact-match cache would
+get, lookup latency percentiles, LSH candidates per lookup, and a linear
+scan over all signatures for comparison. Memory is the tracemalloc size of
+the index after the build. With NumPy installed shingles are hashed
+vectorized; --no-numpy measures the pure-Python path.
+
+Results go to benchmarks/results/.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from load_test import RESULTS_DIR, git_rev  # noqa: E402
+from llm_services import near_duplicates as near_dup  # noqa: E402
+from llm_services.near_duplicates import NearDuplicateIndex, similarity  # noqa: E402
+
+SCOPE = ('bench-model',)
+KINDS = ('format', 'one_word', 'two_words', 'novel')
+TEMPLATES = (
+    "Summarize the following {doc} and list {n} key points about {a} and {b}: {body}",
+    "Write a short email to the {a} team explaining the {b} changes. Context: {body}",
+    "Translate this {doc} into Korean, keeping the {a} terms unchanged: {body}",
+    "You are reviewing a {doc}. Point out problems with {a} and suggest fixes for {b}. {body}",
+    "다음 {doc}를 읽고 {a}와 {b}에 대해 {n}가지로 요약해 주세요: {body}",
+)
+
+
+def vocabulary(seed: int, size: int, korean: bool) -> list:
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        if korean:
+            words.add("".join(chr(0xAC00 + rng.randrange(0, 11172, 28)) for _ in range(rng.randint(2, 4))))
+        else:
+            words.add("".join(rng.choice("bcdfghklmnprstvz") + rng.choice("aeiou") for _ in range(rng.randint(1, 4))))
+    return sorted(words)
+
+
+ASCII_WORDS = vocabulary(1, 5000, False)
+KOREAN_WORDS = vocabulary(2, 3000, True)
+
+
+def pick(rng: random.Random, words: list) -> str:
+    # Half the words from a heavy head (Zipf-like), half uniformly
+    if rng.random() < 0.5:
+        return words[min(len(words), int(rng.paretovariate(1.1))) - 1]
+    return rng.choice(words)
+
+
+def make_prompt(rng: random.Random) -> str:
+    korean = rng.random() < 0.3
+    words = KOREAN_WORDS if korean else ASCII_WORDS
+    sentences = []
+    for _ in range(rng.choice((1, 2, 3, 5, 8, 13))):
+        sentence = " ".join(pick(rng, words) for _ in range(rng.randint(6, 16)))
+        sentences.append(sentence[:1].upper() + sentence[1:] + ".")
+    template = TEMPLATES[4] if korean else rng.choice(TEMPLATES[:4])
+    return template.format(
+        doc=pick(rng, words), a=pick(rng, words), b=pick(rng, words), n=rng.randint(2, 9),
+        body=" ".join(sentences),
+    )
+
+
+def perturb(prompt: str, kind: str, rng: random.Random) -> str:
+    if kind == 'format':
+        variant = prompt.upper() if rng.random() < 0.5 else prompt.lower()
+        variant = variant.replace(". ", " .  ").replace(": ", ":\n")
+        return variant.rstrip(".") + "!!"
+    words = prompt.split(" ")
+    vocabulary = ASCII_WORDS if prompt.isascii() else KOREAN_WORDS
+    if kind == 'one_word':
+        index = rng.randrange(len(words))
+        words[index] = rng.choice(vocabulary)
+    else:  # two_words
+        for _ in range(2):
+            words.insert(rng.randrange(len(words) + 1), rng.choice(vocabulary))
+    return " ".join(words)
+
+
+def build(args, prompts: list):
+    index = NearDuplicateIndex(
+        enabled=True,
+        serve=True,
+        max_entries=len(prompts),
+        threshold=args.thresholds[0],
+        num_perm=args.num_perm,
+        bands=args.bands,
+        shingle_chars=5,
+        max_chars=8192,
+    )
+    gc.collect()
+    started = time.perf_counter()
+    for i, prompt in enumerate(prompts):
+        index.add(SCOPE, prompt, f"key{i}")
+    return index, time.perf_counter() - started
+
+
+def index_mb(args, prompts: list) -> float:
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    index, _ = build(args, prompts)
+    size = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del index
+    return round(size / 1024 / 1024, 1)
+
+
+def ms_stats(values: list) -> dict:
+    ordered = sorted(values)
+
+    def at(p):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 3)
+
+    return {'mean': round(statistics.fmean(ordered), 3), 'p50': at(0.5), 'p99': at(0.99), 'max': round(ordered[-1], 3)}
+
+
+def lookups(index: NearDuplicateIndex, queries: list, known: set, threshold: float) -> dict:
+    latencies = []
+    hits = correct = exact = candidates = 0
+    scores = []
+    for target, query in queries:
+        exact += query in known
+        before = index.candidates
+        started = time.perf_counter()
+        matches = index.lookup(SCOPE, query, threshold)
+        latencies.append((time.perf_counter() - started) * 1000)
+        candidates += index.candidates - before
+        if matches:
+            hits += 1
+            scores.append(matches[0][0])
+            correct += target is not None and matches[0][2] == f"key{target}"
+    return {
+        'hit_rate': round(hits / len(queries), 4),
+        'correct_rate': round(correct / len(queries), 4),
+        'exact_match_hit_rate': round(exact / len(queries), 4),
+        'mean_similarity': round(statistics.fmean(scores), 3) if scores else None,
+        'candidates_per_lookup': round(candidates / len(queries), 2),
+        'lookup_ms': ms_stats(latencies),
+    }
+
+
+def run(args) -> dict:
+    if not args.numpy:
+        near_dup.numpy = None
+    rng = random.Random(args.seed)
+    prompts = [make_prompt(rng) for _ in range(args.prompts)]
+    lengths = [len(p) for p in prompts]
+
+    index, build_s = build(args, prompts)
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_rev': git_rev(),
+        'python': sys.version.split()[0],
+        'numpy': near_dup.numpy is not None,
+        'prompts': args.prompts,
+        'prompt_chars': {'mean': round(statistics.fmean(lengths)), 'max': max(lengths)},
+        'num_perm': args.num_perm,
+        'bands': args.bands,
+        'build': {
+            'seconds': round(build_s, 2),
+            'us_per_prompt': round(build_s / args.prompts * 1e6, 1),
+            'index_mb': index_mb(args, prompts) if args.memory else None,
+        },
+        'thresholds': {},
+    }
+
+    known = set(prompts)
+    queries = {kind: [] for kind in KINDS}
+    for kind in KINDS:
+        for _ in range(args.queries):
+            if kind == 'novel':
+                queries[kind].append((None, make_prompt(rng)))
+            else:
+                target = rng.randrange(len(prompts))
+                queries[kind].append((target, perturb(prompts[target], kind, rng)))
+    for threshold in args.thresholds:
+        report['thresholds'][str(threshold)] = {
+            kind: lookups(index, queries[kind], known, threshold) for kind in KINDS
+        }
+
+    # Linear scan over every signature: what the LSH bands save
+    entries = list(index._entries.values())
+    scan_times = []
+    for target, query in queries['one_word'][:args.scan_queries]:
+        signature, _ = index._prepare(query)
+        started = time.perf_counter()
+        max(similarity(signature, entry.signature) for entry in entries)
+        scan_times.append((time.perf_counter() - started) * 1000)
+    report['linear_scan_ms'] = ms_stats(scan_times)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--prompts', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=2000, help="lookups per class and threshold")
+    parser.add_argument('--scan-queries', type=int, default=20)
+    parser.add_argument('--thresholds', default='0.8,0.9', type=lambda v: [float(x) for x in v.split(',')])
+    parser.add_argument('--num-perm', type=int, default=64)
+    parser.add_argument('--bands', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=11)
+    parser.add_argument('--no-numpy', dest='numpy', action='store_false', help="force the pure-Python hashing path")
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="skip the tracemalloc rebuild")
+    args = parser.parse_args()
+
+    report = run(args)
+    build_row = report['build']
+    print(
+        f"{report['prompts']} prompts, ~{report['prompt_chars']['mean']} chars (numpy={report['numpy']}): "
+        f"built in {build_row['seconds']} s ({build_row['us_per_prompt']} us/prompt), index {build_row['index_mb']} MB"
+    )
+    for threshold, rows in report['thresholds'].items():
+        print(f"  threshold {threshold}")
+        for kind, row in rows.items():
+            print(
+                f"    {kind:<10} hit {row['hit_rate']:>7.2%} (correct {row['correct_rate']:.2%}, "
+                f"exact cache {row['exact_match_hit_rate']:.2%})  "
+                f"lookup p50 {row['lookup_ms']['p50']} ms p99 {row['lookup_ms']['p99']} ms  "
+                f"{row['candidates_per_lookup']} candidates"
+            )
+    print(f"  linear scan p50 {report['linear_scan_ms']['p50']} ms")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"near_dup-{time.strftime('%Y%m%d-%H%M%S')}-{report['git_rev']}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
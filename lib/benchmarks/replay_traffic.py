@@ -0,0 +1,139 @@
+"""Replay a recorded provider trace against the service, with provider responses served from the same trace.
+
+Usage (from lib/):
+    # 1. capture: run the service with LLM_RECORD_PATH=/tmp/trace.jsonl and send it real traffic
+    # 2. replay:
+    python benchmarks/replay_traffic.py /tmp/trace.jsonl [--speed 1] [--provider-speed 1] [--on-miss error]
+
+The server is started with LLM_REPLAY_PATH pointing at the trace, so no
+API keys or network are needed. Every recorded call is sent to /generate
+(streaming or not, as recorded) at its original arrival offset divided by
+--speed; the replay provider reproduces each response with its recorded
+timing divided by --provider-speed (0 for no delays). The report compares
+client-observed latency with the recorded provider latency, so the gap is
+what the service itself adds. Results go to benchmarks/results/.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import RESULTS_DIR, free_port, git_rev, percentile, start_server, wait_until_ready  # noqa: E402
+
+
+def load_trace(path):
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    entries.sort(key=lambda entry: entry['ts'])
+    return entries
+
+
+async def send(client, entry, args):
+    body = dict(entry['request'], model_id=entry['model'], stream=entry['mode'] == 'stream', cache=False)
+    started = time.perf_counter()
+    first_token_ms = None
+    status = 'success'
+    if body['stream']:
+        async with client.stream('POST', '/generate', json=body) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith('data: '):
+                    continue
+                event = json.loads(line[6:])
+                if 'text' in event and first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - started) * 1000
+                if 'stats' in event:
+                    status = event['stats']['status']
+    else:
+        response = await client.post('/generate', json=body)
+        status = response.json().get('status', 'error') if response.status_code == 200 else f'http_{response.status_code}'
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    recorded = entry['response']
+    return {
+        'mode': entry['mode'],
+        'status': status,
+        'recorded_status': recorded.get('status'),
+        'latency_ms': elapsed_ms,
+        'recorded_ms': recorded.get('response_time_ms') or 0,
+        'ttft_ms': first_token_ms,
+        'recorded_ttft_ms': recorded.get('ttft_ms'),
+    }
+
+
+async def run(args):
+    entries = load_trace(args.trace)
+    if not entries:
+        raise SystemExit(f"no recorded calls in {args.trace}")
+    os.environ['LLM_REPLAY_PATH'] = os.path.abspath(args.trace)
+    os.environ['LLM_REPLAY_SPEED'] = str(args.provider_speed)
+    os.environ['LLM_REPLAY_ON_MISS'] = args.on_miss
+    os.environ.pop('LLM_RECORD_PATH', None)
+    port = free_port()
+    server = start_server(port, 1)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    try:
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', timeout=300, limits=limits) as client:
+            await wait_until_ready(client)
+            first_ts = entries[0]['ts']
+            started = time.perf_counter()
+
+            async def scheduled(entry):
+                delay = (entry['ts'] - first_ts) / args.speed - (time.perf_counter() - started) if args.speed > 0 else 0
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                return await send(client, entry, args)
+
+            results = await asyncio.gather(*(scheduled(entry) for entry in entries))
+            elapsed = time.perf_counter() - started
+            replay_stats = (await client.get('/stats')).json().get('replay')
+    finally:
+        server.terminate()
+        server.wait(timeout=20)
+
+    mismatched = sum(1 for r in results if r['status'] != r['recorded_status'])
+    overhead = [r['latency_ms'] - r['recorded_ms'] / (args.provider_speed or float('inf')) for r in results if r['mode'] == 'generate']
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_rev': git_rev(),
+        'trace': os.path.abspath(args.trace),
+        'calls': len(results),
+        'speed': args.speed,
+        'provider_speed': args.provider_speed,
+        'elapsed_s': round(elapsed, 3),
+        'status_mismatches': mismatched,
+        'replay_store': replay_stats,
+        'latency_ms': {p: percentile([r['latency_ms'] for r in results], p) for p in (50, 95, 99)},
+        'recorded_latency_ms': {p: percentile([r['recorded_ms'] for r in results], p) for p in (50, 95, 99)},
+        'service_overhead_ms': {p: percentile(overhead, p) for p in (50, 95, 99)},
+        'ttft_ms': {p: percentile([r['ttft_ms'] for r in results if r['ttft_ms'] is not None], p) for p in (50, 95)},
+    }
+    print(json.dumps({k: v for k, v in report.items() if k not in ('timestamp', 'git_rev')}, indent=2))
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"replay-{time.strftime('%Y%m%d-%H%M%S')}-{report['git_rev']}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('trace')
+    parser.add_argument('--speed', type=float, default=1.0, help='arrival-time scale (0 = send everything at once)')
+    parser.add_argument('--provider-speed', type=float, default=1.0, help='recorded response timing scale (0 = no delays)')
+    parser.add_argument('--on-miss', choices=['error', 'model'], default='error')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
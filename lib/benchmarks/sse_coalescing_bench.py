@@ -0,0 +1,124 @@
+"""SSE streaming benchmark: events and CPU per response, per-delta framing vs coalescing.
+
+Usage (from lib/):
+    python benchmarks/sse_coalescing_bench.py [--tokens 2000] [--rate 400] [--responses 5]
+
+A fake provider emits single-token deltas at --rate tokens/sec. The baseline
+frames every delta with json.dumps like the original stream_generator; the
+coalesced path goes through llm_services.sse. Both are served through a real
+StreamingResponse and read with httpx over ASGI, so the per-event cost of the
+response path is included in the CPU figures.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_services.sse import DONE_FRAME, coalesce, orjson, sse_frame  # noqa: E402
+
+
+async def fake_stream(tokens: int, rate: float):
+    """Single-token deltas, sleeping in small batches to approximate the arrival rate"""
+    interval = 1.0 / rate
+    started = time.monotonic()
+    for i in range(tokens):
+        yield "토큰" if i % 7 == 0 else " tok"
+        target = started + (i + 1) * interval
+        delay = target - time.monotonic()
+        if delay > 0.001:
+            await asyncio.sleep(delay)
+
+
+async def baseline(tokens: int, rate: float):
+    async for chunk in fake_stream(tokens, rate):
+        yield f"data: {json.dumps({'text': chunk})}\n\n"
+    yield f"data: {json.dumps({'done': True})}\n\n"
+
+
+async def coalesced(tokens: int, rate: float):
+    async for text in coalesce(fake_stream(tokens, rate)):
+        if text is not None:
+            yield sse_frame({'text': text})
+    yield DONE_FRAME
+
+
+# httpx's ASGI transport buffers the body, so time to first frame is taken server-side
+first_frame_ms = []
+
+
+async def timed(frames):
+    started = time.perf_counter()
+    first = True
+    async for frame in frames:
+        if first:
+            first_frame_ms.append((time.perf_counter() - started) * 1000)
+            first = False
+        yield frame
+
+
+def build_app(tokens: int, rate: float) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/baseline")
+    async def baseline_route():
+        return StreamingResponse(timed(baseline(tokens, rate)), media_type="text/event-stream")
+
+    @app.get("/coalesced")
+    async def coalesced_route():
+        return StreamingResponse(timed(coalesced(tokens, rate)), media_type="text/event-stream")
+
+    return app
+
+
+async def measure(client: httpx.AsyncClient, name: str, path: str, responses: int):
+    events = 0
+    payload = 0
+    first_frame_ms.clear()
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    for _ in range(responses):
+        pending = b""
+        async with client.stream("GET", path) as response:
+            async for data in response.aiter_bytes():
+                payload += len(data)
+                pending += data
+                *frames, pending = pending.split(b"\n\n")
+                events += len(frames)
+    cpu = time.process_time() - cpu_started
+    wall = time.perf_counter() - wall_started
+    return {
+        'name': name,
+        'events_per_response': events / responses,
+        'bytes_per_response': payload / responses,
+        'cpu_ms_per_response': round(cpu * 1000 / responses, 2),
+        'wall_s_per_response': round(wall / responses, 3),
+        'first_frame_ms_avg': round(sum(first_frame_ms) / len(first_frame_ms), 3),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tokens', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=400.0, help="tokens per second")
+    parser.add_argument('--responses', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"encoder: {'orjson' if orjson else 'json'}; {args.tokens} tokens @ {args.rate}/s x {args.responses}")
+    app = build_app(args.tokens, args.rate)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, path in (('per-delta json.dumps', '/baseline'), ('coalesced + pre-encoded', '/coalesced')):
+            result = await measure(client, name, path, args.responses)
+            print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
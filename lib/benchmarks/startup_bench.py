@@ -0,0 +1,135 @@
+"""Cold-start cost: module import time and time to the first served request.
+
+Usage (from lib/):
+    python benchmarks/startup_bench.py [--repeats 5]
+
+Import times are measured in fresh interpreters: the service module on its
+own (provider SDKs load lazily), each provider SDK on its own, and the
+service plus every SDK, which is what each start and worker spawn used to
+pay. Server runs spawn uvicorn with the mock provider and time spawn ->
+ready (/health) -> first /generate, with and without LLM_WARMUP; the
+warm-up run sets dummy provider keys so it has SDKs to import in the
+background. Results go to benchmarks/results/.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import LIB_DIR, RESULTS_DIR, free_port, git_rev, rss_mb, start_server  # noqa: E402
+
+SDK_MODULES = {'openai': 'openai', 'anthropic': 'anthropic', 'gemini': 'google.generativeai'}
+
+
+def import_ms(statement: str) -> float:
+    """Wall time of `statement` in a fresh interpreter"""
+    code = (
+        "import time; started = time.perf_counter(); "
+        f"{statement}; print((time.perf_counter() - started) * 1000)"
+    )
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=LIB_DIR, text=True)
+    return float(output.strip().splitlines()[-1])
+
+
+def median_import_ms(statement: str, repeats: int) -> float:
+    return round(statistics.median(import_ms(statement) for _ in range(repeats)), 1)
+
+
+async def first_request(warm_up: bool) -> dict:
+    env_backup = dict(os.environ)
+    os.environ['LLM_WARMUP'] = '1' if warm_up else '0'
+    if warm_up:
+        for key in ('OPENAI_API_KEY', 'ANTHROPIC_API_KEY', 'GOOGLE_GEMINI_API_KEY'):
+            os.environ.setdefault(key, 'dummy-key-for-warmup')
+    port = free_port()
+    spawned = time.perf_counter()
+    server = start_server(port, 1)
+    try:
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', timeout=60) as client:
+            while True:
+                try:
+                    if (await client.get('/health')).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.perf_counter() - spawned > 60:
+                    raise RuntimeError('server did not become ready')
+                await asyncio.sleep(0.02)
+            ready = time.perf_counter()
+            response = await client.post('/generate', json={
+                'model_id': 'mock-fast', 'user_prompt': 'hello', 'max_tokens': 8, 'cache': False,
+            })
+            served = time.perf_counter()
+            response.raise_for_status()
+            # Give a background warm-up time to finish so its import timings are visible
+            await asyncio.sleep(3 if warm_up else 0)
+            stats = (await client.get('/stats')).json()
+    finally:
+        rss = rss_mb(server.pid)
+        server.terminate()
+        server.wait(timeout=20)
+        os.environ.clear()
+        os.environ.update(env_backup)
+    return {
+        'warm_up': warm_up,
+        'ready_ms': round((ready - spawned) * 1000, 1),
+        'first_request_ms': round((served - ready) * 1000, 1),
+        'time_to_first_response_ms': round((served - spawned) * 1000, 1),
+        'providers_loaded_ms': stats.get('providers_loaded'),
+        'rss_mb': rss,
+    }
+
+
+async def run(args):
+    os.environ.setdefault('LLM_MOCK_TTFT_MS', '1')
+    os.environ.setdefault('LLM_MOCK_TTFT_JITTER_MS', '0')
+    imports = {'llm_api_server': median_import_ms('import llm_api_server', args.repeats)}
+    for provider, module in SDK_MODULES.items():
+        imports[f'sdk:{provider}'] = median_import_ms(f'import {module}', args.repeats)
+    imports['llm_api_server+all_sdks'] = median_import_ms(
+        'import llm_api_server, ' + ', '.join(SDK_MODULES.values()), args.repeats
+    )
+    for name, value in imports.items():
+        print(f"import {name:<26} {value:>8.1f} ms")
+
+    servers = []
+    for warm_up in (False, True):
+        row = await first_request(warm_up)
+        servers.append(row)
+        print(
+            f"warm_up={str(warm_up):<5}  ready {row['ready_ms']:>7.1f} ms  first request {row['first_request_ms']:>6.1f} ms  "
+            f"spawn->first response {row['time_to_first_response_ms']:>7.1f} ms  providers {row['providers_loaded_ms']}"
+        )
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_rev': git_rev(),
+        'python': sys.version.split()[0],
+        'repeats': args.repeats,
+        'import_ms': imports,
+        'servers': servers,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"startup-{time.strftime('%Y%m%d-%H%M%S')}-{report['git_rev']}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Throughput by uvicorn worker count, with state shared through LLM_SHARED_STATE_DIR.
+
+Usage (from lib/):
+    python benchmarks/worker_scaling_bench.py [--workers 1,2,4] [--concurrency 128] [--requests 2000]
+
+Each run starts a fresh server with the mock provider tuned to be nearly
+free (1 ms TTFT, very high token rate) so request handling on the server,
+not simulated provider latency, is what limits throughput. The shared
+SQLite state (limiter budgets, response cache tier, metrics snapshots) is
+enabled for every run, including the single-worker one, so the numbers
+include its overhead. Results go to benchmarks/results/.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import RESULTS_DIR, call_generate, free_port, git_rev, percentile, start_server, wait_until_ready  # noqa: E402
+
+
+async def drive(client, args, total, concurrency):
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                result = await call_generate(client, args)
+            except (httpx.HTTPError, ValueError):
+                result = {'ok': False}
+            latencies.append((time.perf_counter() - started) * 1000)
+            if not result['ok']:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies, errors
+
+
+async def run_workers(workers, args):
+    state_dir = tempfile.mkdtemp(prefix='llm_shared_')
+    os.environ['LLM_SHARED_STATE_DIR'] = state_dir
+    port = free_port()
+    server = start_server(port, workers)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    try:
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', timeout=120, limits=limits) as client:
+            await wait_until_ready(client)
+            # Warm every worker's pooled client and imports before measuring
+            await drive(client, args, args.concurrency, args.concurrency)
+            elapsed, latencies, errors = await drive(client, args, args.requests, args.concurrency)
+            # Let every worker publish its latest snapshot before reading the aggregate
+            await asyncio.sleep(float(os.environ['LLM_SHARED_METRICS_INTERVAL_S']) * 2)
+            metrics_text = (await client.get('/metrics')).text
+    finally:
+        server.terminate()
+        server.wait(timeout=20)
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    # The aggregated counter proves the metrics view spans all workers
+    aggregated = sum(
+        float(line.rsplit(' ', 1)[1])
+        for line in metrics_text.splitlines()
+        if line.startswith('llm_requests_total{')
+    )
+    return {
+        'workers': workers,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_sec': round(args.requests / elapsed, 1),
+        'latency_ms': {'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95), 'p99': percentile(latencies, 99)},
+        'aggregated_requests_total': aggregated,
+    }
+
+
+async def run(args):
+    os.environ.setdefault('LLM_MOCK_TTFT_MS', '1')
+    os.environ.setdefault('LLM_MOCK_TTFT_JITTER_MS', '0')
+    os.environ.setdefault('LLM_MOCK_TOKENS_PER_SEC', '1000000')
+    os.environ.setdefault('LLM_MOCK_OUTPUT_DIST', 'fixed')
+    os.environ.setdefault('LLM_SHARED_METRICS_INTERVAL_S', '1')
+    results = []
+    baseline = None
+    for workers in args.workers:
+        row = await run_workers(workers, args)
+        baseline = baseline or row['requests_per_sec']
+        row['speedup'] = round(row['requests_per_sec'] / baseline, 2)
+        results.append(row)
+        print(
+            f"workers={workers:<3} {row['requests_per_sec']:>8.1f} req/s  x{row['speedup']:<5} "
+            f"p50 {row['latency_ms']['p50']} ms  p99 {row['latency_ms']['p99']} ms  "
+            f"errors {row['errors']}  /metrics total {row['aggregated_requests_total']:.0f}"
+        )
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_rev': git_rev(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"worker_scaling-{time.strftime('%Y%m%d-%H%M%S')}-{report['git_rev']}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default='1,2,4', type=lambda v: [int(x) for x in v.split(',')])
+    parser.add_argument('--concurrency', type=int, default=128)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--model', default='mock-fast')
+    parser.add_argument('--max-tokens', type=int, default=64)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
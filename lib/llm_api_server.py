@@ -1,19 +1,83 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import List, Literal, Optional
+from contextlib import asynccontextmanager, nullcontext
+from dataclasses import replace
 import uvicorn
 import asyncio
 import json
-from llm_services.llm_factory import LLMFactory
+import os
+import tempfile
+from llm_services.llm_factory import LLMFactory, warmup_executor
 from llm_services.base_llm import LLMResponse
+from llm_services.fingerprint import request_fingerprint
+from llm_services.response_cache import response_cache
+from llm_services.singleflight import single_flight
+from llm_services.concurrency import provider_concurrency
+from llm_services.thread_bridge import executor_stats
+from llm_services.rate_limiter import rate_limiters
+from llm_services.sse import DONE_FRAME, HEARTBEAT_FRAME, HEARTBEAT_INTERVAL_S, coalesce, dumps, sse_frame
+from llm_services.metrics import CallStats, loop_lag, metrics, model_scores
+from llm_services.shared_state import MetricsPublisher, shared_store
+from llm_services.settings import env_bool, env_float, env_int
+from llm_services.tokenizer import Preflight, token_counter
+from llm_services.hedging import hedger
+from llm_services.cancellation import RequestHandle, cancellations, run_attached, watching_disconnect
+from llm_services.job_queue import Job, JobQueueFull, job_queue
+from llm_services.prompt_cache import cacheable_prefix, prefix_cache_enabled
+from llm_services.circuit_breaker import CircuitOpenError, breakers
+from llm_services.recording import recorder
+from llm_services.bulk import ITEM_FIELDS, bulk_jobs
+from llm_services.ws_channel import Channel, ChannelStream, TooManyStreams, channels
+from llm_services.request_body import DecompressRequestMiddleware, decoded_bodies
+from llm_services.text_profile import text_profiles
+from llm_services.sessions import SessionBusy, SessionNotFound, SessionTurn, sessions
+from llm_services.near_duplicates import near_duplicates, scope_of
+from llm_services.router import is_routed
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="LLM API Service", version="1.0.0")
+# Set when LLM_SHARED_STATE_DIR is configured (multi-worker mode)
+metrics_publisher = (
+    MetricsPublisher(shared_store, metrics, env_float('LLM_SHARED_METRICS_INTERVAL_S', 5.0))
+    if shared_store is not None else None
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Keep provider clients alive for the process and close them on shutdown"""
+    warm_up = None
+    if env_bool('LLM_WARMUP', False):
+        # Import configured provider SDKs (and build clients for LLM_WARMUP_MODELS) off the
+        # event loop while the server already accepts requests
+        models = [m.strip() for m in os.getenv('LLM_WARMUP_MODELS', '').split(',') if m.strip()]
+        warm_up = asyncio.ensure_future(warmup_executor.run(lambda: LLMFactory.warm_up(models)))
+    loop_lag.start()
+    job_queue.start()
+    if recorder is not None:
+        recorder.start()
+    if metrics_publisher is not None:
+        metrics_publisher.start()
+    # Resume polling bulk jobs left running by a previous process
+    bulk_jobs.start()
+    yield
+    if warm_up is not None and not warm_up.done():
+        warm_up.cancel()
+    if metrics_publisher is not None:
+        await metrics_publisher.stop()
+    if recorder is not None:
+        await recorder.stop()
+    await job_queue.stop()
+    await bulk_jobs.stop()
+    await loop_lag.stop()
+    await LLMFactory.shutdown()
+    response_cache.close()
+
+app = FastAPI(title="LLM API Service", version="1.0.0", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -23,6 +87,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Large prompts may arrive gzip/zstd-compressed (Content-Encoding)
+app.add_middleware(DecompressRequestMiddleware)
 
 class GenerateRequest(BaseModel):
     model_id: str
@@ -32,6 +98,96 @@ class GenerateRequest(BaseModel):
     max_tokens: int = 2048
     top_p: float = 1.0
     stream: bool = False
+    cache: bool = True  # set False to always call the provider (no caching or coalescing)
+    # What to do when prompt + max_tokens exceeds the model's context window
+    context_overflow: Literal["clamp", "reject"] = "clamp"
+    # Race a duplicate call when this one runs into the model's latency tail (None: LLM_HEDGE_ENABLED)
+    hedge: Optional[bool] = None
+    # Caller-chosen id for POST /cancel/{request_id}; generated when omitted
+    request_id: Optional[str] = None
+    # Mark the stable prompt prefix as cacheable with the provider (None: LLM_PREFIX_CACHE)
+    prefix_cache: Optional[bool] = None
+    # auto:<tier> / "a -> b" model ids: move on to the next model after this long (None: LLM_ROUTER_SLO_MS)
+    latency_slo_ms: Optional[int] = Field(None, ge=0)
+    # Continue a server-side conversation (POST /sessions): send only the new turn as user_prompt
+    session_id: Optional[str] = None
+    # Accept a cached response to a near-identical prompt (None: LLM_NEAR_DUP_SERVE)
+    near_duplicate: Optional[bool] = None
+    _turn: Optional[SessionTurn] = PrivateAttr(None)
+
+    @property
+    def history(self) -> Optional[List[dict]]:
+        return self._turn.history if self._turn is not None else None
+
+class BatchGenerateRequest(GenerateRequest):
+    iterations: int = Field(1, ge=1, le=100)
+    format: Literal["ndjson", "sse"] = "ndjson"  # wire format when stream=true
+
+class JobRequest(GenerateRequest):
+    iterations: int = Field(1, ge=1, le=100)
+    priority: Literal["high", "normal", "low"] = "normal"
+
+class ChannelGenerateRequest(GenerateRequest):
+    id: str  # client-chosen, unique among the connection's running streams
+    window: Optional[int] = Field(None, ge=1)  # initial flow-control credit in frames (None: LLM_WS_STREAM_WINDOW)
+
+class BulkItemRequest(BaseModel):
+    custom_id: Optional[str] = None  # echoed back with the item's result
+    # Unset fields fall back to the job's values
+    model_id: Optional[str] = None
+    system_prompt: Optional[str] = None
+    user_prompt: Optional[str] = None
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+    top_p: Optional[float] = None
+
+class BulkRequest(BaseModel):
+    model_id: str
+    system_prompt: Optional[str] = ""
+    user_prompt: str = ""
+    temperature: float = 1.0
+    max_tokens: int = 2048
+    top_p: float = 1.0
+    # Either explicit items (e.g. dataset rows) or the job's prompt repeated `iterations` times
+    items: List[BulkItemRequest] = Field(default_factory=list, max_length=100000)
+    iterations: int = Field(1, ge=1, le=100000)
+    # "local" runs the job on the in-process stand-in instead of the provider's batch API
+    backend: Literal["auto", "local"] = "auto"
+
+class CompareRequest(BaseModel):
+    model_ids: List[str] = Field(..., min_length=1, max_length=10)
+    system_prompt: Optional[str] = ""
+    user_prompt: str
+    temperature: float = 1.0
+    max_tokens: int = 2048
+    top_p: float = 1.0
+    stream: bool = True
+
+class SessionMessage(BaseModel):
+    role: Literal["user", "assistant"]
+    content: str
+
+class SessionRequest(BaseModel):
+    session_id: Optional[str] = Field(None, min_length=1, max_length=128)  # generated when omitted
+    system_prompt: Optional[str] = ""
+    # Earlier turns to start from, oldest first (user/assistant pairs)
+    messages: List[SessionMessage] = Field(default_factory=list)
+
+class NearDuplicateRequest(BaseModel):
+    model_id: str
+    system_prompt: Optional[str] = ""
+    user_prompt: str
+    temperature: float = 0.0
+    max_tokens: int = 2048
+    top_p: float = 1.0
+    threshold: Optional[float] = Field(None, ge=0, le=1)  # None: LLM_NEAR_DUP_THRESHOLD
+    limit: int = Field(3, ge=1, le=20)
+
+class CountTokensRequest(BaseModel):
+    model_id: str
+    system_prompt: Optional[str] = ""
+    user_prompt: str
+    max_tokens: int = 2048
 
 class GenerateResponse(BaseModel):
     text: str
@@ -40,42 +196,381 @@ class GenerateResponse(BaseModel):
     response_time_ms: int
     status: str
     error_message: Optional[str] = None
+    cache_hit: bool = False
+    saved_latency_ms: int = 0
+    max_tokens_clamped_to: Optional[int] = None
+    request_id: Optional[str] = None
+    routed_from: Optional[str] = None
+    attempts: Optional[List[dict]] = None
+    session_id: Optional[str] = None
+    history_messages: Optional[int] = None  # earlier session messages sent with this turn
+    near_duplicate_similarity: Optional[float] = None
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy", "service": "llm_api"}
+    """Health check endpoint; lists models whose circuit breaker is open"""
+    unavailable = breakers.unavailable()
+    return {
+        "status": "degraded" if unavailable else "healthy",
+        "service": "llm_api",
+        "unavailable_models": unavailable,
+        "circuits": breakers.stats(),
+    }
+
+@app.get("/stats")
+async def get_stats():
+    """Runtime counters for clients, caching, coalescing, concurrency, worker pools, rate limits and loop lag"""
+    if shared_store is not None:
+        # Both read the shared SQLite file, which another worker may be holding locked
+        rate_limits, live_workers = await asyncio.to_thread(
+            lambda: (rate_limiters.stats(), shared_store.workers(metrics_publisher.max_age_s))
+        )
+    else:
+        rate_limits, live_workers = rate_limiters.stats(), 1
+    return {
+        "client_pool": LLMFactory.pool_stats(),
+        "providers_loaded": LLMFactory.loaded_providers(),
+        "response_cache": response_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "provider_concurrency": provider_concurrency.stats(),
+        "executors": executor_stats(),
+        "rate_limits": rate_limits,
+        "event_loop": loop_lag.stats(),
+        "token_counter": token_counter.stats(),
+        "text_profiles": text_profiles.stats(),
+        "request_bodies": decoded_bodies.stats(),
+        "hedging": hedger.stats(),
+        "cancellation": cancellations.stats(),
+        "jobs": job_queue.stats(),
+        "circuits": breakers.stats(),
+        "model_scores": model_scores.stats(),
+        "websocket": channels.stats(),
+        "bulk": bulk_jobs.stats(),
+        "sessions": sessions.stats(),
+        "near_duplicates": near_duplicates.stats(),
+        "recording": recorder.stats() if recorder is not None else None,
+        "replay": LLMFactory.replay_stats(),
+        "worker": {
+            "pid": os.getpid(),
+            "shared_state": shared_store.path if shared_store is not None else None,
+            "live_workers": live_workers,
+        },
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Per-model latency histograms and counters in Prometheus text format"""
+    # In multi-worker mode every worker answers with the sum over all workers
+    registry = await metrics_publisher.aggregate() if metrics_publisher is not None else metrics
+    body = registry.render_prometheus() + loop_lag.render_prometheus()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
 
 @app.get("/models")
 async def get_available_models():
     """Get list of available models"""
     try:
         models = LLMFactory.get_available_models()
-        return {"models": models}
+        # Breaker state lets the UI grey out models that are currently failing fast
+        return {"models": models, "unavailable": breakers.unavailable(), "circuits": breakers.stats()}
     except Exception as e:
         logger.error(f"Error getting models: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def preflight(request: GenerateRequest) -> Preflight:
+    """Count prompt tokens locally and clamp (or reject) max_tokens before any network I/O"""
+    provider = LLMFactory.provider_for(request.model_id)
+    await token_counter.precount_prompt(
+        provider, request.model_id, request.system_prompt, request.user_prompt, request.history
+    )
+    check = token_counter.preflight(
+        provider,
+        request.model_id,
+        request.system_prompt,
+        request.user_prompt,
+        request.max_tokens,
+        request.context_overflow,
+        request.history
+    )
+    if check.clamped:
+        logger.info(f"Clamped max_tokens for {request.model_id}: {check.requested_max_tokens} -> {check.max_tokens}")
+        request.max_tokens = check.max_tokens
+    return check
+
+@app.post("/count_tokens")
+async def count_tokens(request: CountTokensRequest):
+    """Local prompt token count and how much output still fits the model's context window"""
+    try:
+        provider = LLMFactory.provider_for(request.model_id)
+        await token_counter.precount_prompt(provider, request.model_id, request.system_prompt, request.user_prompt)
+        check = token_counter.preflight(
+            provider,
+            request.model_id,
+            request.system_prompt,
+            request.user_prompt,
+            request.max_tokens
+        )
+        return {"model": request.model_id, "fits": not check.clamped, **check.to_dict()}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/near_duplicates")
+async def find_near_duplicates(request: NearDuplicateRequest):
+    """Cached responses to recent prompts nearly identical to this one (same model, system prompt and parameters)"""
+    try:
+        provider = LLMFactory.provider_for(request.model_id)
+        await token_counter.precount_prompt(provider, request.model_id, request.system_prompt, request.user_prompt)
+        check = token_counter.preflight(
+            provider,
+            request.model_id,
+            request.system_prompt,
+            request.user_prompt,
+            request.max_tokens
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Indexed under the clamped max_tokens, like the /generate call that cached them
+    scope = scope_of(request.model_id, request.system_prompt, request.temperature, check.max_tokens, request.top_p)
+    matches = await near_duplicate_matches(scope, request.user_prompt, request.threshold, request.limit)
+    return {
+        "model": request.model_id,
+        "matches": [
+            {
+                "similarity": round(similarity, 3),
+                "text": response.text,
+                "tokens_used": response.tokens_used,
+                "saved_latency_ms": response.saved_latency_ms,
+            }
+            for similarity, response in matches
+        ],
+    }
+
+@app.post("/cancel/{request_id}")
+async def cancel_request(request_id: str):
+    """Stop a running /generate or /batch_generate request and its provider calls"""
+    if not cancellations.cancel(request_id):
+        raise HTTPException(status_code=404, detail=f"No running request with id {request_id}")
+    return {"request_id": request_id, "cancelled": True}
+
+def circuit_open(e: CircuitOpenError) -> HTTPException:
+    logger.warning(str(e))
+    return HTTPException(
+        status_code=503,
+        detail={"status": "circuit_open", "model": e.model_id, "error_message": str(e), "retry_after_s": round(e.retry_after_s, 1)},
+        headers={"Retry-After": str(max(1, int(e.retry_after_s + 0.999)))}
+    )
+
+async def load_llm(model_id: str):
+    """create_llm, with any first-time provider import done off the event loop"""
+    await LLMFactory.load_providers(model_id)
+    return LLMFactory.create_llm(model_id)
+
+def cancelled_response(request: GenerateRequest, handle: RequestHandle) -> LLMResponse:
+    return LLMResponse(
+        text="",
+        model=request.model_id,
+        tokens_used={'input': 0, 'output': 0, 'total': 0},
+        response_time_ms=0,
+        status="cancelled",
+        error_message=f"Request cancelled ({handle.cancel_reason})"
+    )
+
+async def begin_turn(request: GenerateRequest):
+    """Open the request's session turn: the session's system prompt and the history that fits the model"""
+    turn = await sessions.begin(request.session_id, request.system_prompt)
+    request._turn = turn
+    request.system_prompt = turn.system_prompt
+    turn.fit(LLMFactory.provider_for(request.model_id), request.model_id, request.user_prompt, request.max_tokens)
+
+def commit_turn(request: GenerateRequest, text: str):
+    """Store a successful reply as the session's newest turn"""
+    if request._turn is not None:
+        request._turn.commit(request.user_prompt, text)
+
+def end_turn(request: GenerateRequest):
+    if request._turn is not None:
+        request._turn.release()
+
+def session_error(e: Exception) -> HTTPException:
+    return HTTPException(status_code=404 if isinstance(e, SessionNotFound) else 409, detail=str(e))
+
+async def open_request(request: GenerateRequest):
+    """Load the model, fail fast on an open circuit, preflight and register the request for cancellation.
+
+    With a session_id the session's turn stays open (later turns wait) until end_turn().
+    """
+    llm = await load_llm(request.model_id)
+    # Model known to be down: fail fast instead of queueing behind retries
+    breakers.check(LLMFactory.provider_for(request.model_id), request.model_id)
+    try:
+        if request.session_id is not None:
+            await begin_turn(request)
+        check = await preflight(request)
+        handle = cancellations.register(
+            request.request_id,
+            LLMFactory.provider_for(request.model_id),
+            request.model_id,
+            request.max_tokens
+        )
+    except BaseException:
+        end_turn(request)
+        raise
+    fingerprint = request_fingerprint(
+        request.model_id,
+        request.system_prompt,
+        request.user_prompt,
+        request.temperature,
+        request.max_tokens,
+        request.top_p,
+        # Only session turns carry history, so other requests keep their fingerprints
+        history=request.history or None
+    )
+    return llm, check, handle, fingerprint
+
+def stream_chunks(llm, request: GenerateRequest, fingerprint: str):
+    """Provider stream ending with its CallStats; identical concurrent cacheable streams share one upstream"""
+    async def upstream():
+        stats = CallStats()
+        async for chunk in llm.stream_generate(
+            system_prompt=request.system_prompt,
+            user_prompt=request.user_prompt,
+            temperature=request.temperature,
+            max_tokens=request.max_tokens,
+            top_p=request.top_p,
+            prefix_cache=request.prefix_cache,
+            latency_slo_ms=request.latency_slo_ms,
+            history=request.history,
+            call_stats=stats
+        ):
+            yield chunk
+        # In-band trailer so coalesced subscribers get the stats too
+        yield stats
+    
+    # Sampled requests each get their own output, exactly as the response cache treats them
+    if response_cache.is_cacheable(request.temperature, request.cache):
+        return single_flight.stream(fingerprint, upstream)
+    return upstream()
+
+async def near_duplicate_matches(scope: tuple, user_prompt: str, threshold: Optional[float] = None, limit: int = 1):
+    """(similarity, cached response) for indexed near-duplicates whose response is still cached"""
+    found = []
+    for similarity, entry_id, key in near_duplicates.lookup(scope, user_prompt, threshold, limit):
+        response = await response_cache.get(key, record=False)
+        if response is None:
+            # Expired or evicted from the response cache; nothing left to serve
+            near_duplicates.remove(entry_id)
+            near_duplicates.stale += 1
+            continue
+        found.append((similarity, response))
+    return found
+
+async def near_duplicate_response(scope: tuple, user_prompt: str) -> Optional[LLMResponse]:
+    # A few candidates in case the best one's response has left the cache
+    for similarity, response in await near_duplicate_matches(scope, user_prompt, limit=3):
+        near_duplicates.served += 1
+        return replace(response, near_duplicate_similarity=round(similarity, 3))
+    return None
+
+async def generate_once(llm, request: GenerateRequest, fingerprint: str, handle: RequestHandle) -> LLMResponse:
+    """Non-streaming call through the response cache and single-flight, cancellable through the handle"""
+    def upstream():
+        return llm.generate(
+            system_prompt=request.system_prompt,
+            user_prompt=request.user_prompt,
+            temperature=request.temperature,
+            max_tokens=request.max_tokens,
+            top_p=request.top_p,
+            hedge=request.hedge,
+            prefix_cache=request.prefix_cache,
+            latency_slo_ms=request.latency_slo_ms,
+            history=request.history
+        )
+    
+    # Only requests the cache could answer are interchangeable; sampled calls are never coalesced
+    cacheable = response_cache.is_cacheable(request.temperature, request.cache)
+    call = (lambda: single_flight.do(fingerprint, upstream)) if cacheable else upstream
+    # Near-duplicate prompts follow the response cache's policy; session turns depend on their history
+    scope = None
+    if cacheable and not request.history:
+        scope = scope_of(request.model_id, request.system_prompt, request.temperature, request.max_tokens, request.top_p)
+    generate = call
+    if scope is not None and near_duplicates.should_serve(request.near_duplicate):
+        async def generate():
+            return await near_duplicate_response(scope, request.user_prompt) or await call()
+    
+    # Served from the response cache when allowed; identical concurrent misses share one provider call
+    response = await run_attached(handle, response_cache.get_or_generate(
+        fingerprint,
+        request.temperature,
+        request.cache,
+        generate
+    ))
+    if response is None:
+        return cancelled_response(request, handle)
+    handle.completed_calls = 1
+    if scope is not None and response.status == 'success' and response.near_duplicate_similarity is None:
+        near_duplicates.add(scope, request.user_prompt, fingerprint)
+    if response.status == 'success':
+        commit_turn(request, response.text)
+    return response
+
+def generate_response(
+    response: LLMResponse, check: Preflight, handle: RequestHandle, request: GenerateRequest
+) -> GenerateResponse:
+    return GenerateResponse(
+        text=response.text,
+        model=response.model,
+        tokens_used=response.tokens_used,
+        response_time_ms=response.response_time_ms,
+        status=response.status,
+        error_message=response.error_message,
+        cache_hit=response.cache_hit,
+        saved_latency_ms=response.saved_latency_ms,
+        max_tokens_clamped_to=check.max_tokens if check.clamped else None,
+        request_id=handle.request_id,
+        routed_from=response.routed_from,
+        attempts=response.attempts,
+        near_duplicate_similarity=response.near_duplicate_similarity,
+        session_id=request.session_id,
+        history_messages=len(request.history) if request.history is not None else None
+    )
+
 @app.post("/generate")
-async def generate(request: GenerateRequest):
+async def generate(request: GenerateRequest, http_request: Request):
     """Generate text from LLM"""
     try:
-        # Create LLM instance
-        llm = LLMFactory.create_llm(request.model_id)
+        llm, check, handle, fingerprint = await open_request(request)
         
         if request.stream:
+            chunks = stream_chunks(llm, request, fingerprint)
+            
             # Return streaming response
             async def stream_generator():
-                async for chunk in llm.stream_generate(
-                    system_prompt=request.system_prompt,
-                    user_prompt=request.user_prompt,
-                    temperature=request.temperature,
-                    max_tokens=request.max_tokens,
-                    top_p=request.top_p
-                ):
-                    # Send as Server-Sent Events format
-                    yield f"data: {json.dumps({'text': chunk})}\n\n"
-                yield f"data: {json.dumps({'done': True})}\n\n"
+                # Session turns keep the text to store it once the stream has succeeded
+                parts = [] if request.session_id is not None else None
+                try:
+                    # Cancelling the handle (disconnect or /cancel) cancels the task reading the upstream
+                    async with watching_disconnect(http_request, handle):
+                        # Merge single-token deltas into fewer events; None means idle, send a heartbeat
+                        async for item in coalesce(handle.track(chunks)):
+                            if item is None:
+                                yield HEARTBEAT_FRAME
+                            elif isinstance(item, CallStats):
+                                handle.completed_calls = 1
+                                if parts is not None and item.status == 'success' and not handle.cancelled:
+                                    commit_turn(request, "".join(parts))
+                                # Final stats event: usage, TTFT and generation speed
+                                yield sse_frame({'stats': item.to_dict()})
+                            else:
+                                if parts is not None:
+                                    parts.append(item)
+                                # Send as Server-Sent Events format
+                                yield sse_frame({'text': item})
+                    if handle.cancelled:
+                        yield sse_frame({'cancelled': True, 'reason': handle.cancel_reason})
+                    yield DONE_FRAME
+                finally:
+                    cancellations.finish(handle)
+                    end_turn(request)
             
             return StreamingResponse(
                 stream_generator(),
@@ -83,27 +578,25 @@ async def generate(request: GenerateRequest):
                 headers={
                     "Cache-Control": "no-cache",
                     "Connection": "keep-alive",
+                    "X-Request-Id": handle.request_id,
+                    **({"X-Max-Tokens-Clamped-To": str(check.max_tokens)} if check.clamped else {}),
+                    **({"X-History-Messages": str(len(request.history))} if request.history is not None else {}),
                 }
             )
         else:
-            # Regular generation
-            response = await llm.generate(
-                system_prompt=request.system_prompt,
-                user_prompt=request.user_prompt,
-                temperature=request.temperature,
-                max_tokens=request.max_tokens,
-                top_p=request.top_p
-            )
+            try:
+                async with watching_disconnect(http_request, handle):
+                    response = await generate_once(llm, request, fingerprint, handle)
+            finally:
+                cancellations.finish(handle)
+                end_turn(request)
             
-            return GenerateResponse(
-                text=response.text,
-                model=response.model,
-                tokens_used=response.tokens_used,
-                response_time_ms=response.response_time_ms,
-                status=response.status,
-                error_message=response.error_message
-            )
+            return generate_response(response, check, handle, request)
             
+    except CircuitOpenError as e:
+        raise circuit_open(e)
+    except (SessionNotFound, SessionBusy) as e:
+        raise session_error(e)
     except ValueError as e:
         logger.error(f"Value error: {e}")
         raise HTTPException(status_code=400, detail=str(e))
@@ -111,44 +604,616 @@ async def generate(request: GenerateRequest):
         logger.error(f"Generation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def reject_session(request: GenerateRequest):
+    if request.session_id is not None:
+        # Iterations would all answer the same turn; sessions take one reply per turn
+        raise HTTPException(status_code=400, detail="session_id is only supported by /generate and /ws")
+
+async def run_batch_iteration(llm, request: GenerateRequest, provider: str, iteration: int, handle: RequestHandle) -> dict:
+    """Run one batch iteration under the provider's concurrency cap; failures become error results"""
+    # Routed models hold the slot of whichever provider each attempt goes to, not one for 'router'
+    routed = is_routed(request.model_id)
+    # Already cancelled: don't wait for a provider slot just to report it
+    async with provider_concurrency.slot(provider) if not handle.cancelled and not routed else nullcontext():
+        try:
+            response = None
+            if not handle.cancelled:
+                response = await run_attached(handle, llm.generate(
+                    system_prompt=request.system_prompt,
+                    user_prompt=request.user_prompt,
+                    temperature=request.temperature,
+                    max_tokens=request.max_tokens,
+                    top_p=request.top_p,
+                    hedge=request.hedge,
+                    prefix_cache=request.prefix_cache,
+                    latency_slo_ms=request.latency_slo_ms,
+                    **({'provider_slots': True} if routed else {})
+                ))
+            if response is None:
+                response = cancelled_response(request, handle)
+            else:
+                handle.completed_calls += 1
+        except Exception as e:
+            logger.error(f"Batch iteration {iteration} error: {e}")
+            response = LLMResponse(
+                text="",
+                model=request.model_id,
+                tokens_used={'input': 0, 'output': 0, 'total': 0},
+                response_time_ms=0,
+                status="error",
+                error_message=str(e)
+            )
+    
+    return {
+        'iteration': iteration,
+        'model': response.model,
+        'text': response.text,
+        'tokens_used': response.tokens_used,
+        'response_time_ms': response.response_time_ms,
+        # A circuit that opens (or only lets probes through) mid-batch fails the iteration like any provider error
+        'status': 'error' if response.status == 'circuit_open' else response.status,
+        'error_message': response.error_message
+    }
+
 @app.post("/batch_generate")
-async def batch_generate(request: GenerateRequest):
+async def batch_generate(request: BatchGenerateRequest, http_request: Request):
     """Generate multiple iterations of the same prompt"""
-    iterations = request.dict().get('iterations', 1)
-    results = []
+    reject_session(request)
+    try:
+        llm = await load_llm(request.model_id)
+        provider = LLMFactory.provider_for(request.model_id)
+        breakers.check(provider, request.model_id)
+        await preflight(request)
+        handle = cancellations.register(
+            request.request_id,
+            provider,
+            request.model_id,
+            request.max_tokens,
+            expected_calls=request.iterations
+        )
+    except CircuitOpenError as e:
+        raise circuit_open(e)
+    except ValueError as e:
+        logger.error(f"Value error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    def start_iterations():
+        first = asyncio.ensure_future(run_batch_iteration(llm, request, provider, 1, handle))
+        if request.iterations > 1 and prefix_cache_enabled(request.prefix_cache) and cacheable_prefix(
+            provider, request.model_id, request.system_prompt, request.user_prompt
+        ):
+            # Let the first iteration write the provider's prefix cache so the rest read it
+            async def after_first(iteration):
+                await asyncio.wait([first])
+                return await run_batch_iteration(llm, request, provider, iteration, handle)
+        else:
+            def after_first(iteration):
+                return run_batch_iteration(llm, request, provider, iteration, handle)
+        return [first] + [
+            asyncio.ensure_future(after_first(i + 1))
+            for i in range(1, request.iterations)
+        ]
+    
+    if request.stream:
+        # Send each iteration as soon as it finishes instead of waiting for the slowest
+        sse = request.format == "sse"
+        
+        async def batch_stream():
+            tasks = start_iterations()
+            try:
+                async with watching_disconnect(http_request, handle):
+                    for next_done in asyncio.as_completed(tasks):
+                        result = await next_done
+                        yield sse_frame(result) if sse else dumps(result) + b"\n"
+                summary = {'done': True, 'model': request.model_id, 'iterations': request.iterations}
+                if handle.cancelled:
+                    summary['cancelled'] = handle.cancel_reason
+                yield sse_frame(summary) if sse else dumps(summary) + b"\n"
+            finally:
+                # Client went away: stop iterations nobody will read
+                for task in tasks:
+                    task.cancel()
+                cancellations.finish(handle)
+        
+        return StreamingResponse(
+            batch_stream(),
+            media_type="text/event-stream" if sse else "application/x-ndjson",
+            headers={
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+                "X-Request-Id": handle.request_id,
+            }
+        )
+    
+    try:
+        async with watching_disconnect(http_request, handle):
+            results = await asyncio.gather(*start_iterations())
+        return {"results": list(results), "model": request.model_id, "request_id": handle.request_id}
+        
+    except Exception as e:
+        logger.error(f"Batch generation error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cancellations.finish(handle)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    """Queue a batch on the in-service worker pool and return its id immediately"""
+    reject_session(request)
+    try:
+        llm = await load_llm(request.model_id)
+        provider = LLMFactory.provider_for(request.model_id)
+        breakers.check(provider, request.model_id)
+        await preflight(request)
+        handle = cancellations.register(
+            request.request_id,
+            provider,
+            request.model_id,
+            request.max_tokens,
+            expected_calls=request.iterations
+        )
+    except CircuitOpenError as e:
+        raise circuit_open(e)
+    except ValueError as e:
+        logger.error(f"Value error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    job = Job(
+        handle,
+        request.iterations,
+        request.priority,
+        lambda iteration: run_batch_iteration(llm, request, provider, iteration, handle)
+    )
+    try:
+        job_queue.submit(job)
+    except JobQueueFull as e:
+        cancellations.finish(handle)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    
+    return {"job_id": job.job_id, "status": job.status, "queued_ahead": job_queue.position(job)}
+
+@app.post("/sessions", status_code=201)
+async def create_session(request: SessionRequest):
+    """Start a server-side conversation; /generate and /ws requests with its session_id send only the new turn"""
+    try:
+        session = sessions.create(
+            request.session_id,
+            request.system_prompt,
+            [message.model_dump() for message in request.messages]
+        )
+    except SessionBusy as e:
+        raise session_error(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return session.to_dict()
+
+def find_session(session_id: str):
+    try:
+        return sessions.get(session_id)
+    except SessionNotFound as e:
+        raise session_error(e)
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    """Session state, including the stored history (oldest first) and summary of compacted turns"""
+    return find_session(session_id).to_dict(include_messages=True)
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """Forget a conversation; a turn still running finishes but is not stored"""
+    find_session(session_id)
+    return sessions.delete(session_id).to_dict()
+
+def find_job(job_id: str) -> Job:
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired job {job_id}")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    after: int = Query(0, ge=0),
+    wait: float = Query(0, ge=0, le=60)
+):
+    """Job status and the results after the first `after`; with wait>0, long-poll until there is something new"""
+    job = find_job(job_id)
+    deadline = asyncio.get_running_loop().time() + wait
+    while not job.finished and len(job.results) <= after:
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0 or not await job.wait_for_change(job.version, remaining):
+            break
+    return job.to_dict(after)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """SSE subscription: one event per finished iteration, then a final job summary"""
+    job = find_job(job_id)
+    
+    async def event_stream():
+        sent = 0
+        while True:
+            version = job.version
+            while sent < len(job.results):
+                yield sse_frame(job.results[sent])
+                sent += 1
+            if job.finished:
+                summary = job.to_dict(len(job.results))
+                del summary['results']
+                yield sse_frame({'done': True, **summary})
+                break
+            if not await job.wait_for_change(version, HEARTBEAT_INTERVAL_S):
+                yield HEARTBEAT_FRAME
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        }
+    )
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a job: running iterations are stopped and queued ones are skipped"""
+    job = find_job(job_id)
+    if not job.finished:
+        cancellations.cancel(job_id)
+    return job.to_dict(len(job.results))
+
+def bulk_items(request: BulkRequest) -> List[dict]:
+    """Per-item requests with the job's defaults filled in and max_tokens checked against each model"""
+    defaults = {field: getattr(request, field) for field in ITEM_FIELDS}
+    if request.items:
+        items = [
+            {**defaults, **item.model_dump(exclude_none=True, exclude={'custom_id'}), 'custom_id': item.custom_id}
+            for item in request.items
+        ]
+    else:
+        items = [dict(defaults) for _ in range(request.iterations)]
+    for index, item in enumerate(items):
+        if not item['user_prompt']:
+            raise ValueError(f"Item {index} has no user_prompt")
+        check = token_counter.preflight(
+            LLMFactory.provider_for(item['model_id']),
+            item['model_id'],
+            item['system_prompt'],
+            item['user_prompt'],
+            item['max_tokens']
+        )
+        item['max_tokens'] = check.max_tokens
+    return items
+
+@app.post("/bulk", status_code=202)
+async def submit_bulk(request: BulkRequest):
+    """Offline bulk job: packed into provider batch jobs (cheaper, no rate limits, results within hours)"""
+    try:
+        # Counting every item's prompt can take a while for big jobs; keep it off the event loop
+        items = await asyncio.to_thread(bulk_items, request)
+        return await bulk_jobs.submit(items, request.backend)
+    except ValueError as e:
+        logger.error(f"Value error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def find_bulk_job(job_id: str) -> dict:
+    job = await bulk_jobs.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown bulk job {job_id}")
+    return job
+
+@app.get("/bulk/{job_id}")
+async def get_bulk_job(job_id: str):
+    """Item counts and the state of every provider batch"""
+    return await find_bulk_job(job_id)
+
+@app.get("/bulk/{job_id}/results")
+async def bulk_results(
+    job_id: str,
+    after: int = Query(0, ge=0),
+    follow: bool = False
+):
+    """Finished items as JSONL in completion order, from result `after` on.
+
+    Each line carries `seq` (resume with after=<last seq>), the item's
+    `index` in the submission and its `custom_id`. With follow=true the
+    stream stays open until the job has finished.
+    """
+    await find_bulk_job(job_id)
+    
+    async def result_lines():
+        cursor = after
+        while True:
+            # Checked before reading, so results stored just before the job finished are still sent
+            finished = not follow or (await bulk_jobs.status(job_id))['finished_at'] is not None
+            lines = await bulk_jobs.results(job_id, cursor)
+            for line in lines:
+                cursor = line['seq']
+                yield dumps(line) + b"\n"
+            if lines:
+                continue
+            if finished:
+                break
+            await asyncio.sleep(bulk_jobs.tick_s)
     
+    return StreamingResponse(
+        result_lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+@app.delete("/bulk/{job_id}")
+async def cancel_bulk_job(job_id: str):
+    """Cancel a bulk job; items that already finished keep their results"""
+    await find_bulk_job(job_id)
+    return await bulk_jobs.cancel(job_id)
+
+async def compare_max_tokens(model_id: str, request: CompareRequest) -> int:
+    """max_tokens one compared model runs with; CircuitOpenError or ValueError when it can't run at all"""
+    if is_routed(model_id):
+        # The router checks circuits and clamps for each of its candidates
+        return request.max_tokens
+    provider = LLMFactory.provider_for(model_id)
+    breakers.check(provider, model_id)
+    await token_counter.precount_prompt(provider, model_id, request.system_prompt, request.user_prompt)
+    check = token_counter.preflight(
+        provider, model_id, request.system_prompt, request.user_prompt, request.max_tokens, "clamp"
+    )
+    return check.max_tokens
+
+def compare_failure(model_id: str, e: Exception) -> dict:
+    """Result for a model that could not be started, so the other models still run"""
+    if isinstance(e, CircuitOpenError):
+        logger.warning(str(e))
+        return {'model': model_id, 'status': 'circuit_open', 'error_message': str(e), 'retry_after_s': round(e.retry_after_s, 1)}
+    return {'model': model_id, 'status': 'error', 'error_message': str(e)}
+
+def clamped_to(max_tokens: int, request: CompareRequest) -> dict:
+    return {'max_tokens_clamped_to': max_tokens} if max_tokens < request.max_tokens else {}
+
+async def stream_model_into(queue: asyncio.Queue, model_id: str, llm, request: CompareRequest, max_tokens: int):
+    """Stream one model's output into the shared compare queue, ending with its own completion event"""
+    stats = CallStats()
+    routed = is_routed(model_id)
     try:
-        llm = LLMFactory.create_llm(request.model_id)
+        async with provider_concurrency.slot(LLMFactory.provider_for(model_id)) if not routed else nullcontext():
+            chunks = llm.stream_generate(
+                system_prompt=request.system_prompt,
+                user_prompt=request.user_prompt,
+                temperature=request.temperature,
+                max_tokens=max_tokens,
+                top_p=request.top_p,
+                call_stats=stats,
+                **({'provider_slots': True} if routed else {})
+            )
+            async for chunk in coalesce(chunks, idle_s=0):
+                await queue.put({'model': model_id, 'text': chunk})
         
-        # Run iterations in parallel
-        tasks = []
-        for i in range(iterations):
-            task = llm.generate(
+        event = {
+            'model': model_id,
+            'done': True,
+            'status': stats.status,
+            'response_time_ms': int(stats.duration_ms),
+            'ttft_ms': int(stats.ttft_ms) if stats.ttft_ms is not None else None,
+            'tokens_used': stats.tokens_used,
+            'tokens_estimated': stats.tokens_estimated,
+            **clamped_to(max_tokens, request),
+        }
+    except Exception as e:
+        logger.error(f"Compare error for {model_id}: {e}")
+        event = {
+            'model': model_id,
+            'done': True,
+            'status': 'error',
+            'response_time_ms': int(stats.duration_ms),
+            'error_message': str(e),
+        }
+    await queue.put(event)
+
+@app.post("/compare")
+async def compare(request: CompareRequest):
+    """Run one prompt against several models concurrently over a single multiplexed SSE stream"""
+    model_ids = list(dict.fromkeys(request.model_ids))
+    try:
+        llms = {model_id: await load_llm(model_id) for model_id in model_ids}
+    except ValueError as e:
+        logger.error(f"Value error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # An open circuit or a prompt too long for one model fails only that model
+    max_tokens = {}
+    failures = {}
+    for model_id in model_ids:
+        try:
+            max_tokens[model_id] = await compare_max_tokens(model_id, request)
+        except (CircuitOpenError, ValueError) as e:
+            failures[model_id] = compare_failure(model_id, e)
+    
+    if not request.stream:
+        runnable = list(max_tokens)
+        responses = await asyncio.gather(*[
+            llms[model_id].generate(
                 system_prompt=request.system_prompt,
                 user_prompt=request.user_prompt,
                 temperature=request.temperature,
-                max_tokens=request.max_tokens,
+                max_tokens=max_tokens[model_id],
                 top_p=request.top_p
             )
-            tasks.append(task)
-        
-        responses = await asyncio.gather(*tasks)
-        
-        for i, response in enumerate(responses):
-            results.append({
-                'iteration': i + 1,
-                'text': response.text,
-                'tokens_used': response.tokens_used,
-                'response_time_ms': response.response_time_ms,
-                'status': response.status,
-                'error_message': response.error_message
-            })
-        
-        return {"results": results, "model": request.model_id}
-        
+            for model_id in runnable
+        ], return_exceptions=True)
+        results = dict(failures)
+        for model_id, response in zip(runnable, responses):
+            if isinstance(response, Exception):
+                results[model_id] = {'model': model_id, 'status': 'error', 'error_message': str(response)}
+            else:
+                results[model_id] = {
+                    'model': model_id,
+                    'text': response.text,
+                    'tokens_used': response.tokens_used,
+                    'response_time_ms': response.response_time_ms,
+                    'status': response.status,
+                    'error_message': response.error_message,
+                    **clamped_to(max_tokens[model_id], request),
+                }
+        return {"results": [results[model_id] for model_id in model_ids]}
+    
+    async def compare_stream():
+        for failure in failures.values():
+            yield sse_frame({**failure, 'done': True})
+        queue: asyncio.Queue = asyncio.Queue()
+        tasks = [
+            asyncio.ensure_future(stream_model_into(queue, model_id, llms[model_id], request, model_max_tokens))
+            for model_id, model_max_tokens in max_tokens.items()
+        ]
+        remaining = len(tasks)
+        try:
+            while remaining:
+                event = await queue.get()
+                if event.get('done'):
+                    remaining -= 1
+                yield sse_frame(event)
+            yield sse_frame({'done': True, 'models': model_ids})
+        finally:
+            # Client went away: stop the remaining model streams
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(
+        compare_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        }
+    )
+
+async def run_channel_stream(channel: Channel, stream: ChannelStream, request: ChannelGenerateRequest):
+    """Serve one multiplexed request: chunk frames paced by the stream's credit, or a single result frame"""
+    stream_id = stream.stream_id
+    try:
+        llm, check, handle, fingerprint = await open_request(request)
+    except asyncio.CancelledError:
+        # Cancelled while loading the model
+        await channel.send(stream_id, 'done', cancelled='cancelled')
+        return
+    except CircuitOpenError as e:
+        logger.warning(str(e))
+        await channel.send(stream_id, 'error', status='circuit_open', error_message=str(e), retry_after_s=round(e.retry_after_s, 1))
+        return
+    except SessionNotFound as e:
+        await channel.send(stream_id, 'error', status='unknown_session', error_message=str(e))
+        return
+    except SessionBusy as e:
+        await channel.send(stream_id, 'error', status='session_busy', error_message=str(e))
+        return
+    except ValueError as e:
+        await channel.send(stream_id, 'error', status='invalid_request', error_message=str(e))
+        return
     except Exception as e:
-        logger.error(f"Batch generation error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"Channel request error: {e}")
+        await channel.send(stream_id, 'error', status='error', error_message=str(e))
+        return
+    
+    stream.handle = handle
+    try:
+        await channel.send(
+            stream_id,
+            'start',
+            request_id=handle.request_id,
+            max_tokens_clamped_to=check.max_tokens if check.clamped else None
+        )
+        if handle.cancelled:
+            pass  # cancelled before the provider call started
+        elif request.stream:
+            parts = [] if request.session_id is not None else None
+            # Deltas keep merging while the stream waits for credit
+            async for item in coalesce(handle.track(stream_chunks(llm, request, fingerprint)), idle_s=0):
+                if isinstance(item, CallStats):
+                    handle.completed_calls = 1
+                    if parts is not None and item.status == 'success' and not handle.cancelled:
+                        commit_turn(request, "".join(parts))
+                    await channel.send(stream_id, 'stats', stats=item.to_dict())
+                    continue
+                await stream.credit.take()
+                if handle.cancelled:
+                    break
+                if parts is not None:
+                    parts.append(item)
+                await channel.send(stream_id, 'chunk', text=item)
+        else:
+            response = await generate_once(llm, request, fingerprint, handle)
+            await channel.send(stream_id, 'result', **generate_response(response, check, handle, request).model_dump())
+        await channel.send(stream_id, 'done', cancelled=handle.cancel_reason)
+    except Exception as e:
+        logger.error(f"Channel stream {stream_id} error: {e}")
+        await channel.send(stream_id, 'error', status='error', error_message=str(e))
+    finally:
+        cancellations.finish(handle)
+        end_turn(request)
+
+async def handle_channel_frame(channel: Channel, message: dict):
+    stream_id = message.get('id')
+    kind = message.get('type')
+    if kind == 'generate':
+        try:
+            request = ChannelGenerateRequest.model_validate(message)
+            channel.open(request.id, request.window, lambda stream: run_channel_stream(channel, stream, request))
+        except TooManyStreams as e:
+            await channel.send(stream_id, 'error', status='too_many_streams', error_message=str(e))
+        except ValueError as e:
+            await channel.send(stream_id, 'error', status='invalid_request', error_message=str(e))
+    elif kind == 'credit':
+        try:
+            credit = int(message.get('n', 1))
+        except (TypeError, ValueError):
+            credit = 0
+        if credit > 0:
+            channel.grant(str(stream_id), credit)
+    elif kind == 'cancel':
+        if not channel.cancel(str(stream_id)):
+            await channel.send(stream_id, 'error', status='not_running', error_message=f"No running stream {stream_id}")
+    elif kind == 'ping':
+        await channel.send(stream_id, 'pong')
+    else:
+        await channel.send(stream_id, 'error', status='invalid_frame', error_message=f"Unknown frame type {kind!r}")
+
+@app.websocket("/ws")
+async def generate_channel(websocket: WebSocket):
+    """Many concurrent generate requests over one long-lived connection.
+
+    Client frames (JSON text): {"type": "generate", "id", ...GenerateRequest
+    fields, "window"}, {"type": "credit", "id", "n"}, {"type": "cancel",
+    "id"} and {"type": "ping"}. Every server frame carries the stream id:
+    start, then chunk/stats (stream=true) or result, then done; or error.
+    A stream sends at most `window` chunk frames until the client grants
+    more credit. Closing the connection cancels everything still running.
+    """
+    await websocket.accept()
+    channel = Channel(websocket)
+    channel.start()
+    channels.add(channel)
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                message = None
+            if not isinstance(message, dict):
+                await channel.send(None, 'error', status='invalid_frame', error_message="Frames must be JSON objects")
+                continue
+            await handle_channel_frame(channel, message)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        channels.discard(channel)
+        await channel.close()
 
 if __name__ == "__main__":
-    uvicorn.run("llm_api_server:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    workers = env_int('LLM_WORKERS', 1)
+    if workers > 1:
+        # Worker processes share limiter budgets, cache entries and metrics through SQLite files
+        os.environ.setdefault('LLM_SHARED_STATE_DIR', os.path.join(tempfile.gettempdir(), 'llm_api_shared_state'))
+        uvicorn.run("llm_api_server:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run("llm_api_server:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
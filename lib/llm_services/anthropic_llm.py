@@ -1,7 +1,11 @@
 from anthropic import AsyncAnthropic
-from typing import AsyncIterator
+from typing import AsyncIterator, Dict, List, Optional
+import httpx
 import time
 from .base_llm import BaseLLM, LLMResponse
+from .prompt_cache import (
+    anthropic_history, anthropic_system, anthropic_tokens, anthropic_user_content, prefix_cache_enabled
+)
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,9 +13,12 @@ logger = logging.getLogger(__name__)
 class AnthropicLLM(BaseLLM):
     """Anthropic Claude models implementation"""
     
-    def __init__(self, api_key: str, model_id: str):
+    provider = "anthropic"
+    
+    def __init__(self, api_key: str, model_id: str, http_client: Optional[httpx.AsyncClient] = None):
         super().__init__(api_key, model_id)
-        self.client = AsyncAnthropic(api_key=api_key)
+        # A pooled http_client lets every model of this provider share keep-alive connections
+        self.client = AsyncAnthropic(api_key=api_key, http_client=http_client)
         
         # Map our model IDs to Anthropic model names
         self.model_mapping = {
@@ -20,6 +27,50 @@ class AnthropicLLM(BaseLLM):
             'claude-opus-4-1-20250805': 'claude-opus-4-1-20250805'
         }
         
+    def _prompt_params(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        prefix_cache: Optional[bool],
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> dict:
+        """messages/system params, with cache breakpoints on the system prompt, session history and user prompt when prefix caching is on"""
+        if not prefix_cache_enabled(prefix_cache):
+            params = {"messages": [*(history or ()), {"role": "user", "content": user_prompt}]}
+            if system_prompt:
+                params["system"] = system_prompt
+            return params
+        params = {"messages": [
+            *anthropic_history(history or []),
+            {"role": "user", "content": anthropic_user_content(user_prompt)},
+        ]}
+        if system_prompt:
+            params["system"] = anthropic_system(system_prompt)
+        return params
+    
+    def message_params(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        temperature: float,
+        max_tokens: int,
+        top_p: float,
+        prefix_cache: Optional[bool] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> dict:
+        """Messages API params shared by generate, stream_generate and batch requests"""
+        params = {
+            "model": self.model_mapping.get(self.model_id, self.model_id),
+            **self._prompt_params(system_prompt, user_prompt, prefix_cache, history),
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+        
+        # Claude Opus 4.1 doesn't support both temperature and top_p
+        if 'opus-4-1' not in self.model_id:
+            params["top_p"] = top_p
+        return params
+        
     async def generate(
         self,
         system_prompt: str,
@@ -32,27 +83,23 @@ class AnthropicLLM(BaseLLM):
         """Generate response from Anthropic Claude"""
         start_time = time.time()
         
+        reservation = None
         try:
             # Prepare the message
-            message_params = {
-                "model": self.model_mapping.get(self.model_id, self.model_id),
-                "messages": [{"role": "user", "content": user_prompt}],
-                "max_tokens": max_tokens,
-                "temperature": temperature
-            }
-            
-            # Claude Opus 4.1 doesn't support both temperature and top_p
-            if 'opus-4-1' not in self.model_id:
-                message_params["top_p"] = top_p
-            
-            # Add system prompt if provided
-            if system_prompt:
-                message_params["system"] = system_prompt
+            message_params = self.message_params(
+                system_prompt, user_prompt, temperature, max_tokens, top_p, kwargs.get('prefix_cache'),
+                kwargs.get('history')
+            )
             
-            response = await self.retry_with_exponential_backoff(
-                self.client.messages.create,
+            reservation = await self.reserve_capacity(system_prompt, user_prompt, max_tokens, kwargs.get('history'))
+            # Raw response exposes the anthropic-ratelimit-* headers for the limiter
+            raw_response = await self.retry_with_exponential_backoff(
+                self.client.messages.with_raw_response.create,
                 **message_params
             )
+            response = raw_response.parse()
+            tokens_used = anthropic_tokens(response.usage)
+            reservation.settle(tokens_used['total'], raw_response.headers)
             
             response_time = int((time.time() - start_time) * 1000)
             
@@ -64,16 +111,14 @@ class AnthropicLLM(BaseLLM):
             return LLMResponse(
                 text=text,
                 model=self.model_id,
-                tokens_used={
-                    'input': response.usage.input_tokens,
-                    'output': response.usage.output_tokens,
-                    'total': response.usage.input_tokens + response.usage.output_tokens
-                },
+                tokens_used=tokens_used,
                 response_time_ms=response_time,
                 status="success"
             )
             
         except Exception as e:
+            if reservation is not None:
+                reservation.refund()
             logger.error(f"Anthropic generation error: {e}")
             response_time = int((time.time() - start_time) * 1000)
             
@@ -96,26 +141,29 @@ class AnthropicLLM(BaseLLM):
         **kwargs
     ) -> AsyncIterator[str]:
         """Stream response from Anthropic Claude"""
+        reservation = None
+        streaming = False
         try:
-            message_params = {
-                "model": self.model_mapping.get(self.model_id, self.model_id),
-                "messages": [{"role": "user", "content": user_prompt}],
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "stream": True
-            }
-            
-            # Claude Opus 4.1 doesn't support both temperature and top_p
-            if 'opus-4-1' not in self.model_id:
-                message_params["top_p"] = top_p
-            
-            if system_prompt:
-                message_params["system"] = system_prompt
+            message_params = self.message_params(
+                system_prompt, user_prompt, temperature, max_tokens, top_p, kwargs.get('prefix_cache'),
+                kwargs.get('history')
+            )
             
+            reservation = await self.reserve_capacity(system_prompt, user_prompt, max_tokens, kwargs.get('history'))
             async with self.client.messages.stream(**message_params) as stream:
                 async for text in stream.text_stream:
+                    streaming = True
                     yield text
+                final_message = await stream.get_final_message()
+                tokens_used = anthropic_tokens(final_message.usage)
+                self.record_usage(tokens_used)
+                reservation.settle(tokens_used['total'])
                     
         except Exception as e:
+            if reservation is not None and streaming:
+                reservation.settle()
+            elif reservation is not None:
+                reservation.refund()
             logger.error(f"Anthropic streaming error: {e}")
+            self.record_error()
             yield f"Error: {str(e)}"
\ No newline at end of file
@@ -1,9 +1,16 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional, AsyncIterator
+from typing import Dict, Any, List, Optional, AsyncIterator
 import asyncio
+import functools
 import time
 from dataclasses import dataclass
 import logging
+from .metrics import CallStats, current_call, metrics, model_scores, unbind_call
+from .rate_limiter import ModelLimiter, Reservation, rate_limiters
+from .tokenizer import token_counter
+from .hedging import hedger
+from .circuit_breaker import OPEN, CircuitOpenError, breakers
+from .recording import recorder, request_fields
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -17,10 +24,161 @@ class LLMResponse:
     response_time_ms: int
     status: str = "success"
     error_message: Optional[str] = None
+    cache_hit: bool = False
+    saved_latency_ms: int = 0
+    routed_from: Optional[str] = None  # auto:<tier> or fallback chain that picked `model`
+    attempts: Optional[List[Dict[str, Any]]] = None
+    near_duplicate_similarity: Optional[float] = None  # served for a near-duplicate prompt (see near_duplicates)
+
+def _instrument_generate(func):
+    """Time a provider's generate() and fold the result into per-model metrics.
+
+    hedge=True (or LLM_HEDGE_ENABLED) races a duplicate call when the first is
+    slower than the model's recent tail latency; see hedging.Hedger. While the
+    model's circuit is open the call fails fast with status "circuit_open".
+    """
+    @functools.wraps(func)
+    async def generate(self, *args, call_stats: Optional[CallStats] = None, hedge: Optional[bool] = None, **kwargs):
+        stats = call_stats or CallStats()
+        stats.model = self.model_id
+        stats.mode = 'generate'
+        token = current_call.set(stats)
+        started = time.perf_counter()
+        started_at = time.time()
+        breaker = breakers.get(self.provider, self.model_id) if breakers.enabled else None
+        permit = breaker.acquire() if breaker is not None else None
+        try:
+            if breaker is not None and permit is None:
+                stats.status = 'circuit_open'
+                return LLMResponse(
+                    text="",
+                    model=self.model_id,
+                    tokens_used={'input': 0, 'output': 0, 'total': 0},
+                    response_time_ms=0,
+                    status="circuit_open",
+                    error_message=str(CircuitOpenError(self.model_id, breaker.retry_after_s()))
+                )
+            if hedger.enabled if hedge is None else hedge:
+                # Don't add duplicates while callers are already queued for rate-limit budget
+                response = await hedger.run(
+                    self.model_id,
+                    lambda: func(self, *args, **kwargs),
+                    lambda: not self.rate_limiter.waiting
+                )
+            else:
+                response = await func(self, *args, **kwargs)
+                if response.status == 'success':
+                    hedger.observe(self.model_id, time.perf_counter() - started)
+            stats.status = response.status
+            stats.tokens_used = dict(response.tokens_used)
+            if recorder is not None and self.recordable:
+                recorder.record_generate(self, request_fields(func, self, args, kwargs), started_at, response)
+            if permit is not None:
+                # An error that still carries usage (e.g. a safety block) means the provider answered
+                answered = response.status == 'success' or bool(response.tokens_used.get('total'))
+                breaker.record(permit, answered, time.perf_counter() - started)
+            return response
+        except asyncio.CancelledError:
+            stats.status = 'cancelled'
+            if permit is not None:
+                breaker.release(permit)
+            raise
+        except Exception:
+            stats.status = 'error'
+            if permit is not None:
+                breaker.record(permit, False, time.perf_counter() - started)
+            raise
+        finally:
+            stats.duration_ms = (time.perf_counter() - started) * 1000
+            current_call.reset(token)
+            metrics.record_call(stats)
+            model_scores.observe(stats)
+    return generate
+
+def _instrument_stream(func):
+    """Measure TTFT and inter-chunk gaps of a provider's stream_generate()"""
+    @functools.wraps(func)
+    async def stream_generate(self, system_prompt, user_prompt, *args, call_stats: Optional[CallStats] = None, **kwargs):
+        stats = call_stats or CallStats()
+        stats.model = self.model_id
+        stats.mode = 'stream'
+        # Generators run in their consumer's context, so the binding must be undone on exit
+        token = current_call.set(stats)
+        started = time.perf_counter()
+        started_at = time.time()
+        last_chunk_at = None
+        gaps = []
+        parts = []
+        # (ms since start, text) per chunk, kept only while recording traffic
+        timeline = [] if recorder is not None and self.recordable else None
+        breaker = breakers.get(self.provider, self.model_id) if breakers.enabled else None
+        permit = breaker.acquire() if breaker is not None else None
+        try:
+            if breaker is not None and permit is None:
+                # Same in-band error convention as the providers' own stream failures
+                stats.status = 'circuit_open'
+                yield f"Error: {CircuitOpenError(self.model_id, breaker.retry_after_s())}"
+                return
+            async for chunk in func(self, system_prompt, user_prompt, *args, **kwargs):
+                now = time.perf_counter()
+                if last_chunk_at is None:
+                    stats.ttft_ms = (now - started) * 1000
+                else:
+                    gaps.append(now - last_chunk_at)
+                last_chunk_at = now
+                stats.chunks += 1
+                parts.append(chunk)
+                if timeline is not None:
+                    timeline.append(((now - started) * 1000, chunk))
+                yield chunk
+            if timeline is not None:
+                stats.duration_ms = (time.perf_counter() - started) * 1000
+                request = request_fields(func, self, (system_prompt, user_prompt) + args, kwargs)
+                recorder.record_stream(self, request, started_at, timeline, stats)
+            if permit is not None:
+                # Streams are judged by time to first token; long outputs are not a provider fault
+                latency_s = (stats.ttft_ms if stats.ttft_ms is not None else (time.perf_counter() - started) * 1000) / 1000
+                breaker.record(permit, stats.status == 'success', latency_s)
+        except (asyncio.CancelledError, GeneratorExit):
+            stats.status = 'cancelled'
+            if permit is not None:
+                breaker.release(permit)
+            raise
+        except Exception:
+            stats.status = 'error'
+            if permit is not None:
+                breaker.record(permit, False, time.perf_counter() - started)
+            raise
+        finally:
+            stats.duration_ms = (time.perf_counter() - started) * 1000
+            stats.max_gap_ms = max(gaps) * 1000 if gaps else 0.0
+            if not stats.tokens_used:
+                # Provider gave no usage for this stream; fall back to local estimates
+                input_tokens = self.calculate_tokens(system_prompt or "") + self.calculate_tokens(user_prompt)
+                for message in kwargs.get('history') or ():
+                    input_tokens += self.calculate_tokens(message['content'])
+                output_tokens = self.calculate_tokens("".join(parts))
+                stats.tokens_used = {'input': input_tokens, 'output': output_tokens, 'total': input_tokens + output_tokens}
+                stats.tokens_estimated = True
+            metrics.record_call(stats, gaps)
+            model_scores.observe(stats)
+            unbind_call(token)
+    return stream_generate
 
 class BaseLLM(ABC):
     """Base class for all LLM providers"""
     
+    provider = ""  # set by subclasses; keys per-provider limits
+    recordable = True  # calls are captured when LLM_RECORD_PATH is set
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Every provider gets the same latency instrumentation without repeating it
+        if 'generate' in cls.__dict__:
+            cls.generate = _instrument_generate(cls.__dict__['generate'])
+        if 'stream_generate' in cls.__dict__:
+            cls.stream_generate = _instrument_stream(cls.__dict__['stream_generate'])
+    
     def __init__(self, api_key: str, model_id: str):
         self.api_key = api_key
         self.model_id = model_id
@@ -53,20 +211,72 @@ class BaseLLM(ABC):
         """Stream response from the LLM"""
         pass
     
+    @property
+    def circuit_open(self) -> bool:
+        """True once this model's breaker has tripped; retry loops stop early instead of backing off"""
+        return breakers.enabled and breakers.get(self.provider, self.model_id).state == OPEN
+    
+    @property
+    def rate_limiter(self) -> ModelLimiter:
+        return rate_limiters.get(self.provider, self.model_id)
+    
+    async def reserve_capacity(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> Reservation:
+        """Wait for RPM/TPM budget before calling the provider (estimated prompt tokens + max_tokens)"""
+        await token_counter.precount_prompt(self.provider, self.model_id, system_prompt, user_prompt, history)
+        estimated = token_counter.count_prompt(
+            self.provider, self.model_id, system_prompt, user_prompt, history
+        ) + max_tokens
+        reservation = await self.rate_limiter.acquire(estimated)
+        stats = current_call.get()
+        if stats is not None:
+            stats.queue_wait_ms += reservation.wait_ms
+        return reservation
+    
+    def record_usage(self, tokens_used: Dict[str, int]):
+        """Report provider usage for the current call (streams only learn it at the end)"""
+        stats = current_call.get()
+        if stats is not None:
+            stats.tokens_used = dict(tokens_used)
+            stats.tokens_estimated = False
+    
+    def record_error(self):
+        """Mark the current call as failed when the provider reports the error in-band"""
+        stats = current_call.get()
+        if stats is not None:
+            stats.status = 'error'
+    
+    def record_retry(self):
+        stats = current_call.get()
+        if stats is not None:
+            stats.retries += 1
+    
     async def retry_with_exponential_backoff(self, func, *args, **kwargs):
         """Retry function with exponential backoff"""
         for attempt in range(self.max_retries):
             try:
                 return await func(*args, **kwargs)
             except Exception as e:
-                if attempt == self.max_retries - 1:
+                if attempt == self.max_retries - 1 or self.circuit_open:
                     raise e
+                
+                self.record_retry()
+                if getattr(e, 'status_code', None) == 429:
+                    # Queue behind the limiter (honouring retry-after) instead of sleeping blindly
+                    self.rate_limiter.record_rate_limit(e)
+                    logger.warning(f"Attempt {attempt + 1} rate limited. Waiting for rate-limit budget...")
+                    await self.rate_limiter.acquire(0)
+                    continue
                     
                 wait_time = (2 ** attempt) + 0.1
                 logger.warning(f"Attempt {attempt + 1} failed: {e}. Retrying in {wait_time}s...")
                 await asyncio.sleep(wait_time)
                 
     def calculate_tokens(self, text: str) -> int:
-        """Rough estimation of tokens (can be overridden for specific providers)"""
-        # Simple estimation: ~4 characters per token
-        return len(text) // 4
\ No newline at end of file
+        """Local token count from the provider's tokenizer (cached; see tokenizer.register_tokenizer)"""
+        return token_counter.count(self.provider, self.model_id, text)
\ No newline at end of file
@@ -0,0 +1,276 @@
+import asyncio
+import json
+import logging
+import uuid
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from .concurrency import provider_concurrency
+from .prompt_cache import anthropic_tokens, openai_tokens
+from .settings import env_float
+
+logger = logging.getLogger(__name__)
+
+# Batch states reported by poll(); anything but RUNNING means results can be fetched
+RUNNING = 'running'
+ENDED = 'ended'
+FAILED = 'failed'
+EXPIRED = 'expired'
+
+
+@dataclass
+class BatchItem:
+    """One request of a bulk job. `custom_id` is the backend-safe id, not the caller's"""
+    custom_id: str
+    model_id: str
+    system_prompt: str
+    user_prompt: str
+    temperature: float
+    max_tokens: int
+    top_p: float
+
+
+@dataclass
+class BatchStatus:
+    state: str
+    succeeded: int = 0
+    failed: int = 0
+    error: Optional[str] = None
+
+
+def item_result(custom_id: str, text: str = "", tokens_used: Optional[Dict[str, int]] = None,
+                status: str = "success", error_message: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        'custom_id': custom_id,
+        'text': text,
+        'tokens_used': tokens_used or {'input': 0, 'output': 0, 'total': 0},
+        'status': status,
+        'error_message': error_message,
+    }
+
+
+def _namespace(value: Any) -> Any:
+    """JSON dicts as attribute objects, so the SDK-object token helpers read them too"""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: _namespace(item) for key, item in value.items()})
+    return value
+
+
+class BatchBackend:
+    """Runs packed requests asynchronously and hands back one result per item"""
+
+    name = "base"
+    # First poll after submitting; later polls back off from here
+    first_poll_s = 30.0
+
+    async def submit(self, items: List[BatchItem]) -> str:
+        raise NotImplementedError
+
+    async def poll(self, batch_id: str) -> BatchStatus:
+        raise NotImplementedError
+
+    def results(self, batch_id: str) -> AsyncIterator[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def cancel(self, batch_id: str):
+        raise NotImplementedError
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI Batch API: a JSONL file of chat completions, results within 24h at half price"""
+
+    name = "openai"
+    first_poll_s = 30.0
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.client = llm.client
+
+    async def submit(self, items: List[BatchItem]) -> str:
+        lines = [
+            json.dumps({
+                'custom_id': item.custom_id,
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': self.llm.completion_params(
+                    item.system_prompt, item.user_prompt, item.temperature, item.max_tokens, item.top_p
+                ),
+            }, ensure_ascii=False)
+            for item in items
+        ]
+        data = ("\n".join(lines) + "\n").encode('utf-8')
+        upload = await self.client.files.create(file=('bulk.jsonl', data), purpose='batch')
+        batch = await self.client.batches.create(
+            input_file_id=upload.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h'
+        )
+        return batch.id
+
+    async def poll(self, batch_id: str) -> BatchStatus:
+        batch = await self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        succeeded = counts.completed if counts else 0
+        failed = counts.failed if counts else 0
+        if batch.status in ('validating', 'in_progress', 'finalizing', 'cancelling'):
+            return BatchStatus(RUNNING, succeeded, failed)
+        if batch.status == 'failed':
+            errors = batch.errors.data if batch.errors and batch.errors.data else []
+            message = "; ".join(error.message for error in errors if error.message) or "Batch failed validation"
+            return BatchStatus(FAILED, succeeded, failed, message)
+        # completed, expired and cancelled batches all have output for what finished
+        return BatchStatus(EXPIRED if batch.status == 'expired' else ENDED, succeeded, failed)
+
+    async def results(self, batch_id: str) -> AsyncIterator[Dict[str, Any]]:
+        batch = await self.client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = await self.client.files.content(file_id)
+            for line in content.text.splitlines():
+                if line.strip():
+                    yield self._parse(json.loads(line))
+
+    @staticmethod
+    def _parse(line: Dict[str, Any]) -> Dict[str, Any]:
+        custom_id = line['custom_id']
+        response = line.get('response') or {}
+        body = response.get('body') or {}
+        if response.get('status_code') == 200 and body.get('choices'):
+            message = body['choices'][0].get('message') or {}
+            tokens_used = openai_tokens(_namespace(body['usage'])) if body.get('usage') else None
+            return item_result(custom_id, message.get('content') or "", tokens_used)
+        error = line.get('error') or body.get('error') or {}
+        return item_result(custom_id, status="error", error_message=error.get('message') or f"HTTP {response.get('status_code')}")
+
+    async def cancel(self, batch_id: str):
+        await self.client.batches.cancel(batch_id)
+
+
+class AnthropicBatchBackend(BatchBackend):
+    """Anthropic Message Batches: up to 100k requests, results within 24h at half price"""
+
+    name = "anthropic"
+    first_poll_s = 30.0
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.client = llm.client
+
+    async def submit(self, items: List[BatchItem]) -> str:
+        batch = await self.client.messages.batches.create(requests=[
+            {
+                'custom_id': item.custom_id,
+                'params': self.llm.message_params(
+                    item.system_prompt, item.user_prompt, item.temperature, item.max_tokens, item.top_p
+                ),
+            }
+            for item in items
+        ])
+        return batch.id
+
+    async def poll(self, batch_id: str) -> BatchStatus:
+        batch = await self.client.messages.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        failed = counts.errored + counts.canceled
+        if batch.processing_status != 'ended':
+            return BatchStatus(RUNNING, counts.succeeded, failed)
+        if counts.expired:
+            # results() leaves expired requests out, so the job resubmits them
+            return BatchStatus(EXPIRED, counts.succeeded, failed, f"{counts.expired} requests expired")
+        return BatchStatus(ENDED, counts.succeeded, failed)
+
+    async def results(self, batch_id: str) -> AsyncIterator[Dict[str, Any]]:
+        async for entry in await self.client.messages.batches.results(batch_id):
+            result = entry.result
+            if result.type == 'succeeded':
+                message = result.message
+                text = "".join(block.text for block in message.content if getattr(block, 'text', None))
+                yield item_result(entry.custom_id, text, anthropic_tokens(message.usage))
+            elif result.type == 'errored':
+                error = getattr(result.error, 'error', None)
+                yield item_result(entry.custom_id, status="error", error_message=getattr(error, 'message', None) or str(result.error))
+            elif result.type != 'expired':
+                # canceled before it ran
+                yield item_result(entry.custom_id, status="error", error_message=f"Request {result.type}")
+
+    async def cancel(self, batch_id: str):
+        await self.client.messages.batches.cancel(batch_id)
+
+
+class _LocalBatch:
+    def __init__(self, items: List[BatchItem]):
+        self.items = items
+        self.results: List[Dict[str, Any]] = []
+        self.task: Optional[asyncio.Task] = None
+
+
+class LocalBatchBackend(BatchBackend):
+    """Stand-in batch service that runs items through the regular providers in-process.
+
+    Used for providers without a batch API (Gemini, mock, replay) and for
+    LLM_BULK_BACKEND=local, so the submit/poll/fetch pipeline runs without
+    network access. Items run under the provider's concurrency cap after
+    LLM_BULK_LOCAL_DELAY_S, which simulates a provider's batch queue. Batches
+    live in this process only; after a restart poll() reports them expired
+    and the job resubmits their items.
+    """
+
+    name = "local"
+    first_poll_s = 0.5
+
+    def __init__(self, create_llm: Callable[[str], Any], provider_for: Callable[[str], str]):
+        self.create_llm = create_llm
+        self.provider_for = provider_for
+        self.delay_s = env_float('LLM_BULK_LOCAL_DELAY_S', 0.0)
+        self._batches: Dict[str, _LocalBatch] = {}
+
+    async def submit(self, items: List[BatchItem]) -> str:
+        batch_id = f"local_{uuid.uuid4().hex}"
+        batch = _LocalBatch(items)
+        batch.task = asyncio.ensure_future(self._run(batch))
+        self._batches[batch_id] = batch
+        return batch_id
+
+    async def _run(self, batch: _LocalBatch):
+        if self.delay_s > 0:
+            await asyncio.sleep(self.delay_s)
+        await asyncio.gather(*(self._run_item(item, batch) for item in batch.items))
+
+    async def _run_item(self, item: BatchItem, batch: _LocalBatch):
+        try:
+            llm = self.create_llm(item.model_id)
+            async with provider_concurrency.slot(self.provider_for(item.model_id)):
+                response = await llm.generate(
+                    system_prompt=item.system_prompt,
+                    user_prompt=item.user_prompt,
+                    temperature=item.temperature,
+                    max_tokens=item.max_tokens,
+                    top_p=item.top_p
+                )
+            batch.results.append(item_result(
+                item.custom_id, response.text, response.tokens_used, response.status, response.error_message
+            ))
+        except Exception as e:
+            batch.results.append(item_result(item.custom_id, status="error", error_message=str(e)))
+
+    async def poll(self, batch_id: str) -> BatchStatus:
+        batch = self._batches.get(batch_id)
+        if batch is None:
+            return BatchStatus(EXPIRED, error="Local batch is gone (service restarted)")
+        succeeded = sum(1 for result in batch.results if result['status'] == 'success')
+        failed = len(batch.results) - succeeded
+        if not batch.task.done():
+            return BatchStatus(RUNNING, succeeded, failed)
+        return BatchStatus(ENDED, succeeded, failed)
+
+    async def results(self, batch_id: str) -> AsyncIterator[Dict[str, Any]]:
+        batch = self._batches.pop(batch_id, None)
+        for result in batch.results if batch is not None else []:
+            yield result
+
+    async def cancel(self, batch_id: str):
+        batch = self._batches.get(batch_id)
+        if batch is not None and not batch.task.done():
+            batch.task.cancel()
@@ -0,0 +1,635 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from .batch_backends import (
+    ENDED, EXPIRED, FAILED, RUNNING,
+    AnthropicBatchBackend, BatchBackend, BatchItem, LocalBatchBackend, OpenAIBatchBackend, item_result,
+)
+from .llm_factory import LLMFactory, replay_enabled
+from .router import is_routed
+from .settings import env_float, env_int
+from .shared_state import shared_path
+from .thread_bridge import InstrumentedExecutor
+
+logger = logging.getLogger(__name__)
+
+# Providers with a native batch API; everything else runs on the local stand-in
+PROVIDER_BACKENDS = {
+    'openai': OpenAIBatchBackend,
+    'anthropic': AnthropicBatchBackend,
+}
+
+# Request fields every item carries (the job's defaults fill in what an item leaves out)
+ITEM_FIELDS = ('model_id', 'system_prompt', 'user_prompt', 'temperature', 'max_tokens', 'top_p')
+
+
+class BulkStore:
+    """SQLite record of bulk jobs, the provider batches they were packed into, and every item's result.
+
+    Jobs survive restarts: the poller picks submitted batches back up from
+    here. Claiming a batch takes a short lease, so with several workers
+    sharing the file each batch is polled by one of them at a time.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bulk_jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " items INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " finished_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bulk_batches ("
+            " batch_key INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " job_id TEXT NOT NULL,"
+            " backend TEXT NOT NULL,"
+            " model_id TEXT NOT NULL,"
+            " round INTEGER NOT NULL DEFAULT 0,"
+            " status TEXT NOT NULL,"
+            " provider_batch_id TEXT,"
+            " owner TEXT,"
+            " items INTEGER NOT NULL,"
+            " succeeded INTEGER NOT NULL DEFAULT 0,"
+            " failed INTEGER NOT NULL DEFAULT 0,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " poll_interval_s REAL NOT NULL DEFAULT 0,"
+            " next_poll_at REAL NOT NULL,"
+            " lease_until REAL NOT NULL DEFAULT 0,"
+            " submitted_at REAL,"
+            " finished_at REAL,"
+            " error TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bulk_items ("
+            " item_key INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " job_id TEXT NOT NULL,"
+            " batch_key INTEGER NOT NULL,"
+            " item_index INTEGER NOT NULL,"
+            " custom_id TEXT,"
+            " request TEXT NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'pending',"
+            " result TEXT,"
+            " result_seq INTEGER)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bulk_items_batch ON bulk_items (batch_key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bulk_items_results ON bulk_items (job_id, result_seq)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bulk_batches_due ON bulk_batches (status, next_poll_at)")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def create_job(self, job_id: str, batches: List[Tuple[str, str, List[Tuple[int, Dict[str, Any]]]]]) -> int:
+        """Insert a job with its batches, each a (backend, model_id, [(item_index, request), ...])"""
+        now = time.time()
+        total = sum(len(items) for _, _, items in batches)
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO bulk_jobs (job_id, status, items, created_at) VALUES (?, 'running', ?, ?)",
+                (job_id, total, now)
+            )
+            for backend, model_id, items in batches:
+                self._insert_batch(conn, job_id, backend, model_id, 0, len(items), now)
+                batch_key = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                conn.executemany(
+                    "INSERT INTO bulk_items (job_id, batch_key, item_index, custom_id, request) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (job_id, batch_key, index, request.pop('custom_id', None), json.dumps(request, ensure_ascii=False))
+                        for index, request in items
+                    ]
+                )
+        return total
+
+    @staticmethod
+    def _insert_batch(conn, job_id: str, backend: str, model_id: str, round_: int, items: int, now: float):
+        conn.execute(
+            "INSERT INTO bulk_batches (job_id, backend, model_id, round, status, items, next_poll_at)"
+            " VALUES (?, ?, ?, ?, 'pending', ?, ?)",
+            (job_id, backend, model_id, round_, items, now)
+        )
+
+    def claim_due(self, owner: str, lease_s: float, limit: int, stale_owner_s: float) -> List[Dict[str, Any]]:
+        """Batches that are due for submitting or polling, leased to this worker.
+
+        A local batch only exists in the worker that submitted it, so only
+        that worker polls it, unless it has not been touched for
+        `stale_owner_s` (the worker is gone and the batch must be redone).
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT batch_key, job_id, backend, model_id, round, status, provider_batch_id, attempts,"
+                " poll_interval_s, submitted_at FROM bulk_batches"
+                " WHERE status IN ('pending', 'submitted') AND next_poll_at <= ? AND lease_until <= ?"
+                " AND (owner IS NULL OR owner = ? OR next_poll_at <= ?)"
+                " ORDER BY next_poll_at LIMIT ?",
+                (now, now, owner, now - stale_owner_s, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE bulk_batches SET lease_until = ? WHERE batch_key = ?",
+                [(now + lease_s, row[0]) for row in rows]
+            )
+        columns = ('batch_key', 'job_id', 'backend', 'model_id', 'round', 'status', 'provider_batch_id',
+                   'attempts', 'poll_interval_s', 'submitted_at')
+        return [dict(zip(columns, row)) for row in rows]
+
+    def batch_items(self, batch_key: int) -> List[Tuple[int, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT item_key, request FROM bulk_items WHERE batch_key = ? AND status = 'pending'", (batch_key,)
+            ).fetchall()
+        return [(item_key, json.loads(request)) for item_key, request in rows]
+
+    def mark_submitted(self, batch_key: int, provider_batch_id: str, owner: Optional[str], next_poll_s: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE bulk_batches SET status = 'submitted', provider_batch_id = ?, owner = ?, submitted_at = ?,"
+                " poll_interval_s = ?, next_poll_at = ?, lease_until = 0, error = NULL WHERE batch_key = ?",
+                (provider_batch_id, owner, now, next_poll_s, now + next_poll_s, batch_key)
+            )
+
+    def release(self, batch_keys: List[int]):
+        """Drop leases early (shutdown interrupted these batches) so they are picked up right away"""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE bulk_batches SET lease_until = 0 WHERE batch_key = ?", [(key,) for key in batch_keys]
+            )
+
+    def reschedule(self, batch_key: int, interval_s: float, succeeded: Optional[int] = None,
+                   failed: Optional[int] = None, error: Optional[str] = None, attempt: bool = False):
+        """Poll (or retry the submit) again after interval_s"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE bulk_batches SET poll_interval_s = ?, next_poll_at = ?, lease_until = 0,"
+                " succeeded = COALESCE(?, succeeded), failed = COALESCE(?, failed), error = ?,"
+                " attempts = attempts + ? WHERE batch_key = ?",
+                (interval_s, now + interval_s, succeeded, failed, error, 1 if attempt else 0, batch_key)
+            )
+
+    def finish_batch(self, batch: Dict[str, Any], status: str, results: Dict[str, Dict[str, Any]],
+                     error: Optional[str], retry_missing: bool) -> int:
+        """Store a finished batch's results; items it did not return are retried in a new batch or failed.
+
+        Returns the number of items moved to a retry batch.
+        """
+        now = time.time()
+        retried = 0
+        with self._transaction() as conn:
+            pending = conn.execute(
+                "SELECT item_key FROM bulk_items WHERE batch_key = ? AND status = 'pending' ORDER BY item_key",
+                (batch['batch_key'],)
+            ).fetchall()
+            seq = conn.execute(
+                "SELECT COALESCE(MAX(result_seq), 0) FROM bulk_items WHERE job_id = ?", (batch['job_id'],)
+            ).fetchone()[0]
+            job_status = conn.execute(
+                "SELECT status FROM bulk_jobs WHERE job_id = ?", (batch['job_id'],)
+            ).fetchone()[0]
+            missing = []
+            updates = []
+            for (item_key,) in pending:
+                result = results.get(f"i{item_key}")
+                if result is None:
+                    missing.append(item_key)
+                    continue
+                seq += 1
+                updates.append((result['status'], json.dumps(result, ensure_ascii=False), seq, item_key))
+            if missing and retry_missing and job_status == 'running':
+                self._insert_batch(conn, batch['job_id'], batch['backend'], batch['model_id'], batch['round'] + 1, len(missing), now)
+                retry_key = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                conn.executemany(
+                    "UPDATE bulk_items SET batch_key = ? WHERE item_key = ?", [(retry_key, key) for key in missing]
+                )
+                retried = len(missing)
+            else:
+                message = error or f"No result returned by the {batch['backend']} batch ({status})"
+                for item_key in missing:
+                    seq += 1
+                    result = item_result(f"i{item_key}", status="error", error_message=message)
+                    updates.append(('error', json.dumps(result), seq, item_key))
+            conn.executemany(
+                "UPDATE bulk_items SET status = ?, result = ?, result_seq = ? WHERE item_key = ?", updates
+            )
+            succeeded = sum(1 for update in updates if update[0] == 'success')
+            conn.execute(
+                "UPDATE bulk_batches SET status = ?, succeeded = ?, failed = ?, finished_at = ?, lease_until = 0,"
+                " error = ? WHERE batch_key = ?",
+                (status, succeeded, len(updates) - succeeded, now, error, batch['batch_key'])
+            )
+            self._finish_job_if_done(conn, batch['job_id'], now)
+        return retried
+
+    @staticmethod
+    def _finish_job_if_done(conn, job_id: str, now: float):
+        open_batches = conn.execute(
+            "SELECT COUNT(*) FROM bulk_batches WHERE job_id = ? AND status IN ('pending', 'submitted')", (job_id,)
+        ).fetchone()[0]
+        if open_batches == 0:
+            conn.execute(
+                "UPDATE bulk_jobs SET status = CASE status WHEN 'cancelling' THEN 'cancelled' ELSE 'completed' END,"
+                " finished_at = ? WHERE job_id = ? AND finished_at IS NULL",
+                (now, job_id)
+            )
+
+    def cancel_job(self, job_id: str) -> List[Dict[str, Any]]:
+        """Mark a job cancelling, drop its unsubmitted batches and return the submitted ones to cancel"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE bulk_jobs SET status = 'cancelling' WHERE job_id = ? AND finished_at IS NULL", (job_id,)
+            )
+            seq = conn.execute(
+                "SELECT COALESCE(MAX(result_seq), 0) FROM bulk_items WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+            unsent = conn.execute(
+                "SELECT item_key FROM bulk_items WHERE job_id = ? AND status = 'pending' AND batch_key IN"
+                " (SELECT batch_key FROM bulk_batches WHERE job_id = ? AND status = 'pending') ORDER BY item_key",
+                (job_id, job_id)
+            ).fetchall()
+            updates = []
+            for (item_key,) in unsent:
+                seq += 1
+                result = item_result(f"i{item_key}", status="cancelled", error_message="Job cancelled before submission")
+                updates.append((json.dumps(result), seq, item_key))
+            conn.executemany(
+                "UPDATE bulk_items SET status = 'cancelled', result = ?, result_seq = ? WHERE item_key = ?", updates
+            )
+            conn.execute(
+                "UPDATE bulk_batches SET status = 'cancelled', finished_at = ? WHERE job_id = ? AND status = 'pending'",
+                (now, job_id)
+            )
+            submitted = conn.execute(
+                "SELECT batch_key, backend, model_id, provider_batch_id FROM bulk_batches"
+                " WHERE job_id = ? AND status = 'submitted'",
+                (job_id,)
+            ).fetchall()
+            self._finish_job_if_done(conn, job_id, now)
+        return [dict(zip(('batch_key', 'backend', 'model_id', 'provider_batch_id'), row)) for row in submitted]
+
+    def job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT status, items, created_at, finished_at FROM bulk_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM bulk_items WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+            batches = self._conn.execute(
+                "SELECT backend, model_id, round, status, provider_batch_id, items, succeeded, failed, attempts,"
+                " submitted_at, finished_at, next_poll_at, error FROM bulk_batches WHERE job_id = ? ORDER BY batch_key",
+                (job_id,)
+            ).fetchall()
+        status, items, created_at, finished_at = job
+        batch_columns = ('backend', 'model', 'round', 'status', 'provider_batch_id', 'items', 'succeeded', 'failed',
+                         'submit_attempts', 'submitted_at', 'finished_at', 'next_poll_at', 'error')
+        return {
+            'job_id': job_id,
+            'status': status,
+            'items': items,
+            'pending': counts.get('pending', 0),
+            'succeeded': counts.get('success', 0),
+            'failed': items - counts.get('pending', 0) - counts.get('success', 0),
+            'created_at': created_at,
+            'finished_at': finished_at,
+            'batches': [dict(zip(batch_columns, row)) for row in batches],
+        }
+
+    def results(self, job_id: str, after: int, limit: int) -> List[Dict[str, Any]]:
+        """Finished items in completion order, starting after result `after`"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT result_seq, item_index, custom_id, result FROM bulk_items"
+                " WHERE job_id = ? AND result_seq > ? ORDER BY result_seq LIMIT ?",
+                (job_id, after, limit)
+            ).fetchall()
+        lines = []
+        for seq, index, custom_id, result in rows:
+            line = json.loads(result)
+            line.update(seq=seq, index=index, custom_id=custom_id)
+            lines.append(line)
+        return lines
+
+    def counts(self) -> Dict[str, Any]:
+        with self._lock:
+            jobs = dict(self._conn.execute("SELECT status, COUNT(*) FROM bulk_jobs GROUP BY status").fetchall())
+            batches = dict(self._conn.execute("SELECT status, COUNT(*) FROM bulk_batches GROUP BY status").fetchall())
+        return {'jobs': jobs, 'batches': batches}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class BulkJobs:
+    """Offline bulk mode: requests packed into provider batch jobs, tracked in SQLite, polled with backoff.
+
+    submit() only writes the job; a background poller submits its batches
+    (OpenAI Batch, Anthropic Message Batches, or the local stand-in for
+    other providers), polls them starting at the backend's first interval
+    and backing off by LLM_BULK_POLL_BACKOFF up to LLM_BULK_POLL_MAX_S, and
+    stores each item's result as the batch ends. Results are read back in
+    completion order with results().
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_batch_items: int,
+        poll_max_s: float,
+        poll_backoff: float,
+        submit_attempts: int,
+        resubmit_rounds: int,
+        tick_s: float,
+    ):
+        self.path = path
+        self.max_batch_items = max(1, max_batch_items)
+        self.poll_max_s = poll_max_s
+        self.poll_backoff = max(1.0, poll_backoff)
+        self.submit_attempts = submit_attempts
+        self.resubmit_rounds = resubmit_rounds
+        self.tick_s = tick_s
+        self.lease_s = env_float('LLM_BULK_LEASE_S', 120.0)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._store: Optional[BulkStore] = None
+        self._executor = InstrumentedExecutor('bulk-store', 1)
+        self._backends: Dict[Tuple[str, str], BatchBackend] = {}
+        self._local: Optional[LocalBatchBackend] = None
+        self._active: Dict[int, asyncio.Task] = {}
+        self._task = None
+        self._wake: Optional[asyncio.Event] = None
+        self.polls = 0
+        self.submits = 0
+        self.errors = 0
+
+    @property
+    def store(self) -> BulkStore:
+        if self._store is None:
+            self._store = BulkStore(self.path)
+        return self._store
+
+    async def _db(self, func, *args):
+        return await self._executor.run(lambda: func(*args))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        interrupted = list(self._active)
+        for task in list(self._active.values()):
+            task.cancel()
+        if interrupted:
+            try:
+                await self._db(self.store.release, interrupted)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not release bulk batch leases: {e}")
+
+    def backend_name(self, model_id: str, backend: str) -> str:
+        if is_routed(model_id):
+            raise ValueError(f"Bulk jobs need a concrete model, not {model_id}")
+        provider = LLMFactory.provider_for(model_id)
+        if backend == 'local' or replay_enabled() or provider not in PROVIDER_BACKENDS:
+            return 'local'
+        return provider
+
+    def backend(self, name: str, model_id: str) -> BatchBackend:
+        if name == 'local':
+            if self._local is None:
+                self._local = LocalBatchBackend(LLMFactory.create_llm, LLMFactory.provider_for)
+            return self._local
+        key = (name, model_id)
+        if key not in self._backends:
+            self._backends[key] = PROVIDER_BACKENDS[name](LLMFactory.create_llm(model_id))
+        return self._backends[key]
+
+    async def submit(self, requests: List[Dict[str, Any]], backend: str = 'auto') -> Dict[str, Any]:
+        """Record a job; `requests` are dicts of ITEM_FIELDS plus an optional custom_id"""
+        groups: Dict[Tuple[str, str], List[Tuple[int, Dict[str, Any]]]] = {}
+        for index, request in enumerate(requests):
+            name = self.backend_name(request['model_id'], backend)
+            groups.setdefault((name, request['model_id']), []).append((index, request))
+        for name, model_id in groups:
+            await LLMFactory.load_providers(model_id)
+            # Missing API keys are reported now rather than when the poller submits
+            LLMFactory.create_llm(model_id)
+        batches = []
+        for (name, model_id), items in groups.items():
+            for start in range(0, len(items), self.max_batch_items):
+                batches.append((name, model_id, items[start:start + self.max_batch_items]))
+        job_id = f"bulk_{uuid.uuid4().hex}"
+        await self._db(self.store.create_job, job_id, batches)
+        self.start()
+        self._wake.set()
+        return await self.status(job_id)
+
+    async def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._db(self.store.job, job_id)
+
+    async def results(self, job_id: str, after: int = 0, limit: int = 500) -> List[Dict[str, Any]]:
+        return await self._db(self.store.results, job_id, after, limit)
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Cancel what is still running; batches end normally and keep the results they already have"""
+        submitted = await self._db(self.store.cancel_job, job_id)
+        for batch in submitted:
+            try:
+                await self.backend(batch['backend'], batch['model_id']).cancel(batch['provider_batch_id'])
+            except Exception as e:
+                logger.warning(f"Could not cancel {batch['backend']} batch {batch['provider_batch_id']}: {e}")
+        if self._wake is not None:
+            self._wake.set()
+        return await self.status(job_id)
+
+    async def _claim(self) -> List[Dict[str, Any]]:
+        """Lease the due batches; if stop() interrupts the claim, the leases it took are handed back"""
+        claim = asyncio.ensure_future(self._db(
+            self.store.claim_due, self.owner, self.lease_s, 64, env_float('LLM_BULK_STALE_OWNER_S', 600.0)
+        ))
+        try:
+            return await asyncio.shield(claim)
+        except asyncio.CancelledError:
+            try:
+                due = await claim
+                await self._db(self.store.release, [batch['batch_key'] for batch in due])
+            except sqlite3.Error as e:
+                logger.warning(f"Could not release bulk batch leases: {e}")
+            raise
+
+    async def _run(self):
+        while True:
+            try:
+                due = await self._claim()
+            except sqlite3.Error as e:
+                logger.warning(f"Bulk job store unavailable: {e}")
+                due = []
+            for batch in due:
+                if batch['batch_key'] not in self._active:
+                    task = asyncio.ensure_future(self._advance(batch))
+                    self._active[batch['batch_key']] = task
+                    task.add_done_callback(lambda _, key=batch['batch_key']: self._active.pop(key, None))
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.tick_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def _next_interval(self, interval_s: float) -> float:
+        # Jitter keeps batches submitted together from being polled in lockstep
+        return min(self.poll_max_s, interval_s * self.poll_backoff) * random.uniform(0.9, 1.1)
+
+    async def _advance(self, batch: Dict[str, Any]):
+        try:
+            await self._step(batch)
+        except Exception as e:
+            # The lease runs out and the batch is picked up again
+            self.errors += 1
+            logger.error(f"Bulk batch {batch['batch_key']} of {batch['job_id']} failed to advance: {e}")
+
+    async def _step(self, batch: Dict[str, Any]):
+        """Submit a pending batch, or poll a submitted one and collect its results once it has ended"""
+        backend = self.backend(batch['backend'], batch['model_id'])
+        if batch['status'] == 'pending':
+            await self._submit(backend, batch)
+            return
+        try:
+            status = await backend.poll(batch['provider_batch_id'])
+            self.polls += 1
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Polling {backend.name} batch {batch['provider_batch_id']} failed: {e}")
+            await self._db(self.store.reschedule, batch['batch_key'], self._next_interval(batch['poll_interval_s']), None, None, str(e))
+            return
+        if status.state == RUNNING:
+            await self._db(
+                self.store.reschedule, batch['batch_key'], self._next_interval(batch['poll_interval_s']),
+                status.succeeded, status.failed
+            )
+            return
+
+        results = {}
+        if status.state != FAILED:
+            try:
+                async for result in backend.results(batch['provider_batch_id']):
+                    results[result['custom_id']] = result
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Fetching results of {backend.name} batch {batch['provider_batch_id']} failed: {e}")
+                await self._db(self.store.reschedule, batch['batch_key'], self._next_interval(batch['poll_interval_s']), None, None, str(e))
+                return
+        # Items an expired batch never ran get another round; failed batches report their error
+        retry = status.state == EXPIRED and batch['round'] < self.resubmit_rounds
+        retried = await self._db(
+            self.store.finish_batch, batch, ENDED if status.state != FAILED else FAILED, results, status.error, retry
+        )
+        logger.info(
+            f"{backend.name} batch {batch['provider_batch_id']} of {batch['job_id']} {status.state}: "
+            f"{len(results)} results" + (f", {retried} items resubmitted" if retried else "")
+        )
+        if retried:
+            self._wake.set()
+
+    async def _submit(self, backend: BatchBackend, batch: Dict[str, Any]):
+        items = await self._db(self.store.batch_items, batch['batch_key'])
+        if not items:
+            await self._db(self.store.finish_batch, batch, ENDED, {}, None, False)
+            return
+        try:
+            provider_batch_id = await backend.submit([
+                BatchItem(
+                    custom_id=f"i{item_key}",
+                    model_id=request['model_id'],
+                    system_prompt=request['system_prompt'],
+                    user_prompt=request['user_prompt'],
+                    temperature=request['temperature'],
+                    max_tokens=request['max_tokens'],
+                    top_p=request['top_p'],
+                )
+                for item_key, request in items
+            ])
+        except Exception as e:
+            self.errors += 1
+            attempts = batch['attempts'] + 1
+            logger.warning(f"Submitting {backend.name} batch for {batch['job_id']} failed (attempt {attempts}): {e}")
+            if attempts >= self.submit_attempts:
+                await self._db(self.store.finish_batch, batch, FAILED, {}, f"Batch submission failed: {e}", False)
+            else:
+                await self._db(
+                    self.store.reschedule, batch['batch_key'], min(self.poll_max_s, 5.0 * 2 ** attempts), None, None, str(e), True
+                )
+            return
+        self.submits += 1
+        # A local batch only exists in this process
+        owner = self.owner if backend.name == 'local' else None
+        await self._db(self.store.mark_submitted, batch['batch_key'], provider_batch_id, owner, backend.first_poll_s)
+        logger.info(f"Submitted {len(items)} items of {batch['job_id']} as {backend.name} batch {provider_batch_id}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            'path': self.path,
+            'active_batches': len(self._active),
+            'submits': self.submits,
+            'polls': self.polls,
+            'errors': self.errors,
+        }
+        if self._store is not None:
+            try:
+                stats.update(self._store.counts())
+            except sqlite3.Error:
+                pass
+        return stats
+
+
+def _store_path() -> str:
+    return (
+        os.getenv('LLM_BULK_DB_PATH', '')
+        or shared_path('bulk_jobs.sqlite3')
+        or os.path.join(tempfile.gettempdir(), 'llm_bulk_jobs.sqlite3')
+    )
+
+
+bulk_jobs = BulkJobs(
+    _store_path(),
+    env_int('LLM_BULK_MAX_BATCH_ITEMS', 10000),
+    env_float('LLM_BULK_POLL_MAX_S', 300.0),
+    env_float('LLM_BULK_POLL_BACKOFF', 1.5),
+    env_int('LLM_BULK_SUBMIT_ATTEMPTS', 5),
+    env_int('LLM_BULK_RESUBMIT_ROUNDS', 1),
+    env_float('LLM_BULK_TICK_S', 1.0),
+)
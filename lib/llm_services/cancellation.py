@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Set
+
+from .metrics import metrics
+from .tokenizer import token_counter
+
+logger = logging.getLogger(__name__)
+
+
+class RequestHandle:
+    """A running request that can be cancelled by id or by its client going away.
+
+    Tasks doing provider work are attached to the handle; cancelling it
+    cancels them, which unwinds the provider SDK stream and releases its
+    connection instead of reading output nobody will see.
+    """
+
+    def __init__(self, request_id: str, provider: str, model_id: str, max_tokens: int, expected_calls: int = 1):
+        self.request_id = request_id
+        self.provider = provider
+        self.model_id = model_id
+        self.max_tokens = max_tokens
+        self.expected_calls = expected_calls
+        self.started_at = time.time()
+        self.cancel_reason: Optional[str] = None
+        self.completed_calls = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._parts: List[str] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_reason is not None
+
+    def attach(self, task: asyncio.Task):
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def cancel(self, reason: str) -> bool:
+        if self.cancelled:
+            return False
+        self.cancel_reason = reason
+        for task in list(self._tasks):
+            task.cancel()
+        return True
+
+    async def track(self, chunks: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        """Attach whichever task consumes this iterator and remember the text it produced"""
+        self.attach(asyncio.current_task())
+        async for chunk in chunks:
+            if isinstance(chunk, str):
+                self._parts.append(chunk)
+            yield chunk
+
+    def produced_tokens(self) -> int:
+        return token_counter.count(self.provider, self.model_id, "".join(self._parts))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'request_id': self.request_id,
+            'model': self.model_id,
+            'running_s': round(time.time() - self.started_at, 1),
+            'cancelled': self.cancel_reason,
+        }
+
+
+class CancellationRegistry:
+    """In-flight requests by id, plus counters for what cancellation saved.
+
+    Saved tokens are an upper bound: output not yet produced, up to
+    max_tokens, for every call that was cut short.
+    """
+
+    def __init__(self):
+        self._requests: Dict[str, RequestHandle] = {}
+        self.cancelled: Dict[str, int] = {}
+        self.tokens_saved = 0
+
+    def register(
+        self,
+        request_id: Optional[str],
+        provider: str,
+        model_id: str,
+        max_tokens: int,
+        expected_calls: int = 1,
+    ) -> RequestHandle:
+        request_id = request_id or uuid.uuid4().hex
+        if request_id in self._requests:
+            raise ValueError(f"Request {request_id} is already running")
+        handle = RequestHandle(request_id, provider, model_id, max_tokens, expected_calls)
+        self._requests[request_id] = handle
+        return handle
+
+    def cancel(self, request_id: str, reason: str = "cancelled") -> bool:
+        handle = self._requests.get(request_id)
+        if handle is None:
+            return False
+        if handle.cancel(reason):
+            logger.info(f"Cancelling request {request_id} ({reason})")
+        return True
+
+    def finish(self, handle: RequestHandle):
+        """Forget a finished request and, if it was cut short, count what that saved"""
+        if self._requests.get(handle.request_id) is handle:
+            del self._requests[handle.request_id]
+        if not handle.cancelled:
+            return
+        unfinished = max(0, handle.expected_calls - handle.completed_calls)
+        saved = max(0, unfinished * handle.max_tokens - handle.produced_tokens())
+        reason = handle.cancel_reason
+        self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+        self.tokens_saved += saved
+        metrics.inc('llm_cancellations_total', model=handle.model_id, reason=reason)
+        metrics.inc('llm_cancelled_output_tokens_saved_total', saved, model=handle.model_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'in_flight': len(self._requests),
+            'requests': [handle.to_dict() for handle in list(self._requests.values())[:50]],
+            'cancelled': dict(self.cancelled),
+            'output_tokens_saved': self.tokens_saved,
+        }
+
+
+async def run_attached(handle: RequestHandle, awaitable: Awaitable[Any]) -> Any:
+    """Await work as a task the handle can cancel; returns None if the handle cancelled it"""
+    task = asyncio.ensure_future(awaitable)
+    handle.attach(task)
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if task.cancelled() and handle.cancelled:
+            return None
+        raise
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def watch_disconnect(request, handle: RequestHandle):
+    """Cancel the handle as soon as the ASGI server reports the client is gone.
+
+    The request body has already been read, so the next receive() only
+    returns when the connection closes.
+    """
+    while True:
+        message = await request.receive()
+        if message['type'] == 'http.disconnect':
+            handle.cancel('client_disconnected')
+            return
+
+
+@asynccontextmanager
+async def watching_disconnect(request, handle: RequestHandle):
+    """Watch for the client going away for the duration of the block"""
+    watcher = asyncio.ensure_future(watch_disconnect(request, handle))
+    try:
+        yield
+    finally:
+        watcher.cancel()
+
+
+cancellations = CancellationRegistry()
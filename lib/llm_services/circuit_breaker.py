@@ -0,0 +1,223 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from .metrics import metrics
+from .settings import env_bool, env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """The model's circuit is open; calls fail fast until it has recovered"""
+
+    def __init__(self, model_id: str, retry_after_s: float):
+        super().__init__(f"{model_id} is temporarily unavailable (circuit open, retry in {retry_after_s:.0f}s)")
+        self.model_id = model_id
+        self.retry_after_s = retry_after_s
+
+
+class Permit:
+    """Admission for one call; probes are the calls that test a half-open circuit"""
+
+    __slots__ = ('probe',)
+
+    def __init__(self, probe: bool):
+        self.probe = probe
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over one model's recent calls.
+
+    Trips when, over the last `window_s` seconds and at least `min_calls`
+    calls, the failure rate or the rate of calls slower than `slow_call_s`
+    reaches its threshold. While open every call is rejected; after
+    `open_s` it lets `probes` calls through at a time, closing again once
+    that many succeed in a row and re-opening on the first failure.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        window_s: float,
+        min_calls: int,
+        failure_rate: float,
+        slow_call_s: float,
+        slow_rate: float,
+        open_s: float,
+        probes: int,
+    ):
+        self.model_id = model_id
+        self.window_s = window_s
+        self.min_calls = max(1, min_calls)
+        self.failure_rate = failure_rate
+        self.slow_call_s = slow_call_s
+        self.slow_rate = slow_rate
+        self.open_s = open_s
+        self.probes = max(1, probes)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.last_reason: Optional[str] = None
+        self.trips = 0
+        self.rejected = 0
+        self._calls: deque = deque()  # (finished_at, failed, slow)
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    def retry_after_s(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.open_s - time.monotonic())
+
+    def acquire(self) -> Optional[Permit]:
+        """A permit to call the provider, or None if the call should fail fast"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() >= self.opened_at + self.open_s:
+                self._transition(HALF_OPEN)
+            if self.state == CLOSED:
+                return Permit(probe=False)
+            if self.state == HALF_OPEN and self._probes_in_flight < self.probes:
+                self._probes_in_flight += 1
+                return Permit(probe=True)
+        self.reject()
+        return None
+
+    def reject(self):
+        self.rejected += 1
+        metrics.inc('llm_circuit_rejections_total', model=self.model_id)
+
+    def release(self, permit: Permit):
+        """Give back a permit whose call ended without a verdict (e.g. cancelled)"""
+        if permit.probe:
+            with self._lock:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def record(self, permit: Permit, ok: bool, latency_s: float):
+        slow = latency_s >= self.slow_call_s
+        with self._lock:
+            if permit.probe:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if self.state != HALF_OPEN:
+                    return
+                if not ok or slow:
+                    self._open("probe failed" if not ok else f"probe took {latency_s:.1f}s")
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.probes:
+                    self._transition(CLOSED)
+                return
+            if self.state != CLOSED:
+                # A call admitted before the circuit opened; its verdict is already out of date
+                return
+            now = time.monotonic()
+            self._calls.append((now, not ok, slow))
+            while self._calls and self._calls[0][0] < now - self.window_s:
+                self._calls.popleft()
+            total = len(self._calls)
+            if total < self.min_calls:
+                return
+            failed = sum(1 for _, f, _ in self._calls if f)
+            slow_calls = sum(1 for _, _, s in self._calls if s)
+            if failed / total >= self.failure_rate:
+                self._open(f"{failed}/{total} calls failed")
+            elif slow_calls / total >= self.slow_rate:
+                self._open(f"{slow_calls}/{total} calls slower than {self.slow_call_s:.0f}s")
+
+    def _open(self, reason: str):
+        self.opened_at = time.monotonic()
+        self.last_reason = reason
+        self.trips += 1
+        metrics.inc('llm_circuit_trips_total', model=self.model_id)
+        logger.warning(f"Circuit for {self.model_id} opened: {reason}")
+        self._transition(OPEN)
+
+    def _transition(self, state: str):
+        if state != OPEN:
+            logger.info(f"Circuit for {self.model_id} {state.replace('_', '-')}")
+        self.state = state
+        self._probe_successes = 0
+        if state != HALF_OPEN:
+            self._probes_in_flight = 0
+        if state == CLOSED:
+            self._calls.clear()
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            if self.state == OPEN and time.monotonic() >= self.opened_at + self.open_s:
+                state = HALF_OPEN
+            else:
+                state = self.state
+            failed = sum(1 for _, f, _ in self._calls if f)
+            return {
+                'state': state,
+                'available': state != OPEN,
+                'retry_after_s': round(self.retry_after_s(), 1),
+                'reason': self.last_reason if state != CLOSED else None,
+                'recent_calls': len(self._calls),
+                'recent_failures': failed,
+                'trips': self.trips,
+                'rejected': self.rejected,
+            }
+
+
+class BreakerRegistry:
+    """One breaker per provider/model, all sharing the LLM_CIRCUIT_* settings"""
+
+    def __init__(self):
+        self.enabled = env_bool('LLM_CIRCUIT_ENABLED', True)
+        self.window_s = env_float('LLM_CIRCUIT_WINDOW_S', 60.0)
+        self.min_calls = env_int('LLM_CIRCUIT_MIN_CALLS', 10)
+        self.failure_rate = env_float('LLM_CIRCUIT_FAILURE_RATE', 0.5)
+        self.slow_call_s = env_float('LLM_CIRCUIT_SLOW_CALL_S', 60.0)
+        self.slow_rate = env_float('LLM_CIRCUIT_SLOW_RATE', 0.8)
+        self.open_s = env_float('LLM_CIRCUIT_OPEN_S', 30.0)
+        self.probes = env_int('LLM_CIRCUIT_PROBES', 1)
+        self._breakers: Dict[tuple, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, model_id: str) -> CircuitBreaker:
+        key = (provider, model_id)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(key)
+                if breaker is None:
+                    breaker = CircuitBreaker(
+                        model_id,
+                        self.window_s,
+                        self.min_calls,
+                        self.failure_rate,
+                        self.slow_call_s,
+                        self.slow_rate,
+                        self.open_s,
+                        self.probes,
+                    )
+                    self._breakers[key] = breaker
+        return breaker
+
+    def check(self, provider: str, model_id: str):
+        """Raise CircuitOpenError before doing any work for a model whose circuit is open"""
+        if not self.enabled:
+            return
+        breaker = self._breakers.get((provider, model_id))
+        if breaker is not None and breaker.state == OPEN:
+            retry_after = breaker.retry_after_s()
+            if retry_after > 0:
+                breaker.reject()
+                raise CircuitOpenError(model_id, retry_after)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {model_id: breaker.to_dict() for (_, model_id), breaker in list(self._breakers.items())}
+
+    def unavailable(self) -> list:
+        return [model_id for model_id, state in self.stats().items() if not state['available']]
+
+
+breakers = BreakerRegistry()
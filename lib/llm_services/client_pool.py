@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import httpx
+
+from .settings import env_bool, env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+
+def _http2_available() -> bool:
+    """httpx only speaks HTTP/2 when the optional h2 package is installed"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def key_fingerprint(api_key: str) -> str:
+    """Short, non-reversible id for an API key so raw keys never sit in dict keys or logs"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class ClientPool:
+    """Process-wide registry of long-lived provider clients and LLM instances.
+
+    HTTP clients are shared per (provider, api key) so every model of a provider
+    reuses the same keep-alive connection pool. LLM instances are cached per
+    (provider, api key, model) so their SDK objects are built once.
+    """
+
+    def __init__(
+        self,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        http2: Optional[bool] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.max_connections = max_connections or env_int('LLM_POOL_MAX_CONNECTIONS', 100)
+        self.max_keepalive_connections = max_keepalive_connections or env_int('LLM_POOL_MAX_KEEPALIVE', 20)
+        self.keepalive_expiry = keepalive_expiry or env_float('LLM_POOL_KEEPALIVE_EXPIRY', 30.0)
+        self.timeout = timeout or env_float('LLM_POOL_TIMEOUT', 600.0)
+
+        if http2 is None:
+            http2 = env_bool('LLM_HTTP2', True)
+        self.http2 = http2 and _http2_available()
+
+        self._http_clients: Dict[Tuple[str, str], httpx.AsyncClient] = {}
+        self._llms: Dict[Tuple[str, str, str], Any] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_http_client(self, provider: str, api_key: str) -> httpx.AsyncClient:
+        """Return the shared httpx client for a provider/API key, creating it on first use"""
+        key = (provider, key_fingerprint(api_key))
+        with self._lock:
+            client = self._http_clients.get(key)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_keepalive_connections,
+                        keepalive_expiry=self.keepalive_expiry,
+                    ),
+                    timeout=httpx.Timeout(self.timeout, connect=10.0),
+                    http2=self.http2,
+                )
+                self._http_clients[key] = client
+                logger.info(f"Created pooled HTTP client for {provider} (http2={self.http2})")
+            return client
+
+    def get_llm(self, provider: str, api_key: str, model_id: str, builder: Callable[[], Any]) -> Any:
+        """Return the cached LLM instance for provider/API key/model, building it on a miss"""
+        key = (provider, key_fingerprint(api_key), model_id)
+        with self._lock:
+            llm = self._llms.get(key)
+            if llm is not None:
+                self.hits += 1
+                return llm
+            self.misses += 1
+
+        llm = builder()
+        with self._lock:
+            # Another caller may have raced us; keep the first instance
+            return self._llms.setdefault(key, llm)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool hit/miss counters and current sizes"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'llm_instances': len(self._llms),
+                'http_clients': len(self._http_clients),
+                'max_connections': self.max_connections,
+                'max_keepalive_connections': self.max_keepalive_connections,
+                'keepalive_expiry': self.keepalive_expiry,
+                'http2': self.http2,
+            }
+
+    async def aclose(self):
+        """Close every pooled HTTP client and forget cached LLM instances"""
+        with self._lock:
+            clients = list(self._http_clients.values())
+            llms = list(self._llms.values())
+            self._http_clients.clear()
+            self._llms.clear()
+
+        for llm in llms:
+            close = getattr(llm, 'aclose', None)
+            if close is not None:
+                try:
+                    await close()
+                except Exception as e:
+                    logger.warning(f"Error closing LLM instance: {e}")
+
+        for client in clients:
+            if not client.is_closed:
+                await client.aclose()
+        logger.info(f"Closed {len(clients)} pooled HTTP client(s)")
+
+
+# Shared by LLMFactory and the FastAPI lifespan
+client_pool = ClientPool()
@@ -0,0 +1,62 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from .settings import env_int
+
+
+class ProviderConcurrency:
+    """Per-provider caps on how many provider calls run at once.
+
+    The cap for a provider comes from LLM_CONCURRENCY_<PROVIDER> (for example
+    LLM_CONCURRENCY_OPENAI), falling back to LLM_CONCURRENCY_DEFAULT.
+    """
+
+    def __init__(self):
+        self.default_limit = env_int('LLM_CONCURRENCY_DEFAULT', 8)
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._limits: Dict[str, int] = {}
+        self._active: Dict[str, int] = {}
+        self._waiting: Dict[str, int] = {}
+
+    def limit_for(self, provider: str) -> int:
+        if provider not in self._limits:
+            value = env_int(f'LLM_CONCURRENCY_{provider.upper()}', self.default_limit)
+            self._limits[provider] = max(1, value)
+        return self._limits[provider]
+
+    def _semaphore(self, provider: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limit_for(provider))
+            self._semaphores[provider] = semaphore
+        return semaphore
+
+    @asynccontextmanager
+    async def slot(self, provider: str):
+        """Hold one of the provider's concurrency slots for the duration of the block"""
+        semaphore = self._semaphore(provider)
+        self._waiting[provider] = self._waiting.get(provider, 0) + 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting[provider] -= 1
+        self._active[provider] = self._active.get(provider, 0) + 1
+        try:
+            yield
+        finally:
+            self._active[provider] -= 1
+            semaphore.release()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            provider: {
+                'limit': self.limit_for(provider),
+                'active': self._active.get(provider, 0),
+                'waiting': self._waiting.get(provider, 0),
+            }
+            for provider in self._semaphores
+        }
+
+
+provider_concurrency = ProviderConcurrency()
@@ -0,0 +1,62 @@
+import hashlib
+import json
+from json.encoder import encode_basestring_ascii
+from typing import Any
+
+from .text_profile import CHUNK_CHARS, iter_chunks
+
+
+def _dumps(value: Any) -> bytes:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def request_fingerprint(
+    model_id: str,
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float,
+    max_tokens: int,
+    top_p: float,
+    **extra: Any
+) -> str:
+    """Canonical hash of the fields that determine a generation result.
+
+    Floats are normalised so 0 and 0.0 hash the same, and keys are sorted so
+    callers can pass extra fields in any order. The hash covers the compact
+    sorted-key JSON of those fields; long prompts are escaped and fed to it a
+    chunk at a time instead of building the whole document, which gives the
+    same digest (recorded captures are matched by it) without two extra
+    full-size copies of a multi-MB prompt.
+    """
+    payload = {
+        'model_id': model_id,
+        'system_prompt': system_prompt or "",
+        'user_prompt': user_prompt,
+        'temperature': round(float(temperature), 6),
+        'max_tokens': int(max_tokens),
+        'top_p': round(float(top_p), 6),
+    }
+    for key, value in extra.items():
+        if value is not None:
+            payload[key] = value
+    digest = hashlib.sha256(b'{')
+    for index, key in enumerate(sorted(payload)):
+        if index:
+            digest.update(b',')
+        digest.update(_dumps(key) + b':')
+        value = payload[key]
+        if isinstance(value, str) and len(value) > CHUNK_CHARS:
+            # JSON escaping is per character, so escaping chunk by chunk matches escaping the whole
+            digest.update(b'"')
+            for piece in iter_chunks(value):
+                if piece.isascii() and '\x7f' not in piece:
+                    # Same output for ASCII text, about twice as fast as the ensure_ascii=False encoder;
+                    # only DEL is escaped differently (\u007f instead of kept as is)
+                    digest.update(encode_basestring_ascii(piece)[1:-1].encode('ascii'))
+                else:
+                    digest.update(_dumps(piece)[1:-1])
+            digest.update(b'"')
+        else:
+            digest.update(_dumps(value))
+    digest.update(b'}')
+    return digest.hexdigest()
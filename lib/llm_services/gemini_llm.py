@@ -1,20 +1,40 @@
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
-from typing import AsyncIterator
+from typing import AsyncIterator, Dict, List, Optional, Union
 import time
 import asyncio
+from contextlib import aclosing
 from .base_llm import BaseLLM, LLMResponse
+from .prompt_cache import gemini_tokens, prefix_cache_enabled
+from .settings import env_bool, env_int
+from .text_profile import text_profiles
+from .thread_bridge import InstrumentedExecutor
 import logging
 import random
 
 logger = logging.getLogger(__name__)
 
+# Blocking SDK calls (sync fallback path) get their own pool instead of the loop's default executor
+gemini_executor = InstrumentedExecutor('gemini', env_int('LLM_GEMINI_EXECUTOR_WORKERS', 32))
+
+# genai.configure sets process-global state, so only redo it when the key changes
+_configured_api_key = None
+
+
+def _ensure_configured(api_key: str):
+    global _configured_api_key
+    if _configured_api_key != api_key:
+        genai.configure(api_key=api_key)
+        _configured_api_key = api_key
+
 class GeminiLLM(BaseLLM):
     """Google Gemini models implementation"""
     
+    provider = "gemini"
+    
     def __init__(self, api_key: str, model_id: str):
         super().__init__(api_key, model_id)
-        genai.configure(api_key=api_key)
+        _ensure_configured(api_key)
         
         # Map our model IDs to Gemini model names
         self.model_mapping = {
@@ -51,6 +71,87 @@ class GeminiLLM(BaseLLM):
             safety_settings=self.safety_settings
         )
         
+        # Prefer the SDK's native async methods; the thread bridge is the fallback
+        self.use_async = env_bool('LLM_GEMINI_ASYNC', True) and hasattr(self.model, 'generate_content_async')
+    
+    async def _generate_content(self, full_prompt, generation_config):
+        """Single non-streaming call without blocking the event loop"""
+        if self.use_async:
+            return await self.model.generate_content_async(
+                full_prompt,
+                generation_config=generation_config,
+                safety_settings=self.safety_settings
+            )
+        return await gemini_executor.run(
+            lambda: self.model.generate_content(
+                full_prompt,
+                generation_config=generation_config,
+                safety_settings=self.safety_settings
+            )
+        )
+    
+    async def _stream_content(self, full_prompt, generation_config) -> AsyncIterator:
+        """Yield raw stream chunks; the sync fallback iterates on a worker thread"""
+        if self.use_async:
+            response = await self.model.generate_content_async(
+                full_prompt,
+                generation_config=generation_config,
+                safety_settings=self.safety_settings,
+                stream=True
+            )
+            async for chunk in response:
+                yield chunk
+        else:
+            async for chunk in gemini_executor.iterate(
+                lambda: self.model.generate_content(
+                    full_prompt,
+                    generation_config=generation_config,
+                    safety_settings=self.safety_settings,
+                    stream=True
+                )
+            ):
+                yield chunk
+        
+    def _build_prompt(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        prefix_cache: Optional[bool],
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> Union[str, List[dict]]:
+        """Combine system and user prompts into one Gemini prompt, copying them once.
+
+        With session history the result is a list of user/model contents
+        instead, the system prompt leading the first turn.
+        """
+        parts = ["System: ", system_prompt, "\n\nUser: ", user_prompt] if system_prompt else [user_prompt]
+        
+        # Add a note for Korean language prompts
+        # Sometimes Gemini's safety filters are overly sensitive to non-English text
+        # The scan is memoized per prompt (preflight and token counting look at the same text)
+        if text_profiles.has_hangul(user_prompt) or (system_prompt and text_profiles.has_hangul(system_prompt)):
+            logger.info("Korean text detected in prompt")
+            # Add a hint to Gemini to respond appropriately
+            hint = "[Please provide a helpful response in the same language as the user's input]"
+            if prefix_cache_enabled(prefix_cache) or history:
+                # Keep the system prompt at the very start so implicit caching can reuse it across prompts
+                parts.append(f"\n\n{hint}")
+            else:
+                parts.insert(0, f"{hint}\n\n")
+        if not history:
+            return "".join(parts)
+        
+        contents = [
+            {"role": "model" if message["role"] == "assistant" else "user", "parts": [message["content"]]}
+            for message in history
+        ]
+        if system_prompt:
+            # Each turn is a list of text parts, so the system prompt leads without copying the first turn
+            contents[0]["parts"] = ["System: ", system_prompt, "\n\nUser: ", *contents[0]["parts"]]
+            parts = parts[3:]
+        contents.append({"role": "user", "parts": ["".join(parts)]})
+        return contents
+        
     async def generate(
         self,
         system_prompt: str,
@@ -63,21 +164,11 @@ class GeminiLLM(BaseLLM):
         """Generate response from Google Gemini"""
         start_time = time.time()
         
+        reservation = None
         try:
-            # Combine system and user prompts
-            full_prompt = ""
-            if system_prompt:
-                full_prompt = f"System: {system_prompt}\n\nUser: {user_prompt}"
-            else:
-                full_prompt = user_prompt
-            
-            # Add a note for Korean language prompts
-            # Sometimes Gemini's safety filters are overly sensitive to non-English text
-            has_korean = any(ord(char) >= 0xAC00 and ord(char) <= 0xD7A3 for char in full_prompt)
-            if has_korean:
-                logger.info("Korean text detected in prompt")
-                # Add a hint to Gemini to respond appropriately
-                full_prompt = f"[Please provide a helpful response in the same language as the user's input]\n\n{full_prompt}"
+            full_prompt = self._build_prompt(
+                system_prompt, user_prompt, kwargs.get('prefix_cache'), kwargs.get('history')
+            )
             
             # Configure generation parameters
             generation_config = genai.GenerationConfig(
@@ -92,33 +183,30 @@ class GeminiLLM(BaseLLM):
             response = None
             last_error = None
             
+            reservation = await self.reserve_capacity(system_prompt, user_prompt, max_tokens, kwargs.get('history'))
             while retry_count < max_retries:
                 try:
-                    # Generate response (Gemini SDK is synchronous, so we run in executor)
-                    response = await asyncio.get_event_loop().run_in_executor(
-                        None,
-                        lambda: self.model.generate_content(
-                            full_prompt,
-                            generation_config=generation_config,
-                            safety_settings=self.safety_settings
-                        )
-                    )
+                    response = await self._generate_content(full_prompt, generation_config)
                     break  # Success, exit retry loop
                     
                 except Exception as e:
                     error_msg = str(e)
+                    if "429" in error_msg:
+                        self.rate_limiter.record_rate_limit(e)
                     # Check if it's a 500 Internal Server Error
                     if "500" in error_msg or "internal error" in error_msg.lower():
                         retry_count += 1
                         last_error = e
                         
-                        if retry_count < max_retries:
+                        # An open circuit means the outage is already known; fail now instead of backing off
+                        if retry_count < max_retries and not self.circuit_open:
+                            self.record_retry()
                             # Exponential backoff with jitter
                             wait_time = (2 ** retry_count) + random.uniform(0, 1)
                             logger.warning(f"Gemini API 500 error, retrying in {wait_time:.1f}s (attempt {retry_count}/{max_retries})")
                             await asyncio.sleep(wait_time)
                         else:
-                            logger.error(f"Gemini API failed after {max_retries} retries: {error_msg}")
+                            logger.error(f"Gemini API failed after {retry_count} attempts: {error_msg}")
                             raise e
                     else:
                         # Not a 500 error, don't retry
@@ -132,11 +220,8 @@ class GeminiLLM(BaseLLM):
             # Extract token counts if available
             tokens_used = {'input': 0, 'output': 0, 'total': 0}
             if hasattr(response, 'usage_metadata'):
-                tokens_used = {
-                    'input': response.usage_metadata.prompt_token_count,
-                    'output': response.usage_metadata.candidates_token_count,
-                    'total': response.usage_metadata.total_token_count
-                }
+                tokens_used = gemini_tokens(response.usage_metadata)
+            reservation.settle(tokens_used['total'])
             
             # Check if response has valid content
             response_text = ""
@@ -208,6 +293,8 @@ class GeminiLLM(BaseLLM):
             )
             
         except Exception as e:
+            if reservation is not None:
+                reservation.refund()
             logger.error(f"Gemini generation error: {e}")
             response_time = int((time.time() - start_time) * 1000)
             
@@ -241,21 +328,12 @@ class GeminiLLM(BaseLLM):
         **kwargs
     ) -> AsyncIterator[str]:
         """Stream response from Google Gemini"""
+        reservation = None
+        streaming = False
         try:
-            # Combine system and user prompts
-            full_prompt = ""
-            if system_prompt:
-                full_prompt = f"System: {system_prompt}\n\nUser: {user_prompt}"
-            else:
-                full_prompt = user_prompt
-            
-            # Add a note for Korean language prompts
-            # Sometimes Gemini's safety filters are overly sensitive to non-English text
-            has_korean = any(ord(char) >= 0xAC00 and ord(char) <= 0xD7A3 for char in full_prompt)
-            if has_korean:
-                logger.info("Korean text detected in prompt")
-                # Add a hint to Gemini to respond appropriately
-                full_prompt = f"[Please provide a helpful response in the same language as the user's input]\n\n{full_prompt}"
+            full_prompt = self._build_prompt(
+                system_prompt, user_prompt, kwargs.get('prefix_cache'), kwargs.get('history')
+            )
             
             generation_config = genai.GenerationConfig(
                 temperature=temperature,
@@ -263,39 +341,45 @@ class GeminiLLM(BaseLLM):
                 top_p=top_p
             )
             
-            # Generate streaming response
-            response = await asyncio.get_event_loop().run_in_executor(
-                None,
-                lambda: self.model.generate_content(
-                    full_prompt,
-                    generation_config=generation_config,
-                    safety_settings=self.safety_settings,
-                    stream=True
-                )
-            )
+            reservation = await self.reserve_capacity(system_prompt, user_prompt, max_tokens, kwargs.get('history'))
             
-            for chunk in response:
-                if hasattr(chunk, 'text'):
-                    try:
-                        yield chunk.text
-                    except:
-                        # Handle case where chunk doesn't have valid text
-                        if hasattr(chunk, 'candidates') and chunk.candidates:
-                            candidate = chunk.candidates[0]
-                            if candidate.content and candidate.content.parts:
-                                yield candidate.content.parts[0].text
-                            elif hasattr(candidate, 'finish_reason'):
-                                # Check if finish_reason is SAFETY (value = 2)
-                                finish_reason_value = candidate.finish_reason
-                                if hasattr(finish_reason_value, 'value'):
-                                    finish_reason_value = finish_reason_value.value
-                                else:
-                                    finish_reason_value = int(finish_reason_value)
+            # Generate streaming response; aclosing stops the upstream promptly on break
+            total_tokens = None
+            async with aclosing(self._stream_content(full_prompt, generation_config)) as chunks:
+                async for chunk in chunks:
+                    streaming = True
+                    usage_metadata = getattr(chunk, 'usage_metadata', None)
+                    if usage_metadata and usage_metadata.total_token_count:
+                        # Each chunk carries the running totals; the last one is the final usage
+                        self.record_usage(gemini_tokens(usage_metadata))
+                        total_tokens = usage_metadata.total_token_count
+                    if hasattr(chunk, 'text'):
+                        try:
+                            yield chunk.text
+                        except Exception:
+                            # Handle case where chunk doesn't have valid text
+                            if hasattr(chunk, 'candidates') and chunk.candidates:
+                                candidate = chunk.candidates[0]
+                                if candidate.content and candidate.content.parts:
+                                    yield candidate.content.parts[0].text
+                                elif hasattr(candidate, 'finish_reason'):
+                                    # Check if finish_reason is SAFETY (value = 2)
+                                    finish_reason_value = candidate.finish_reason
+                                    if hasattr(finish_reason_value, 'value'):
+                                        finish_reason_value = finish_reason_value.value
+                                    else:
+                                        finish_reason_value = int(finish_reason_value)
                                 
-                                if finish_reason_value == 2:
-                                    yield "[Content filtered by Gemini safety settings - please try a different prompt or model]"
-                                break
+                                    if finish_reason_value == 2:
+                                        yield "[Content filtered by Gemini safety settings - please try a different prompt or model]"
+                                    break
+            reservation.settle(total_tokens)
                     
         except Exception as e:
+            if reservation is not None and streaming:
+                reservation.settle()
+            elif reservation is not None:
+                reservation.refund()
             logger.error(f"Gemini streaming error: {e}")
+            self.record_error()
             yield f"Error: {str(e)}"
\ No newline at end of file
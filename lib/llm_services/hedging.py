@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .metrics import metrics
+from .settings import env_bool, env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+
+class ModelHedger:
+    """Latency history and hedge budget for one model.
+
+    The hedge delay is a percentile of recent successful call latencies. The
+    budget is a small bucket that every call tops up by `budget_ratio` and
+    every hedge drains by one, so at most that fraction of calls (with a
+    short burst allowance) ever send a duplicate.
+    """
+
+    def __init__(self, model_id: str, percentile: float, min_samples: int, window: int,
+                 budget_ratio: float, burst: float, min_delay_s: float):
+        self.model_id = model_id
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget_ratio = budget_ratio
+        self.burst = burst
+        self.min_delay_s = min_delay_s
+        self.latencies = deque(maxlen=window)
+        self._sorted_cache = None
+        self.budget = burst
+        self.calls = 0
+        self.fired = 0
+        self.won = 0
+        self.skipped_budget = 0
+
+    def observe(self, latency_s: float):
+        self.latencies.append(latency_s)
+        self._sorted_cache = None
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None while there is too little history"""
+        if len(self.latencies) < self.min_samples:
+            return None
+        if self._sorted_cache is None:
+            self._sorted_cache = sorted(self.latencies)
+        ordered = self._sorted_cache
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay_s, ordered[index])
+
+    def earn(self):
+        self.calls += 1
+        self.budget = min(self.burst, self.budget + self.budget_ratio)
+
+    def try_spend(self) -> bool:
+        if self.budget < 1:
+            self.skipped_budget += 1
+            metrics.inc('llm_hedges_total', model=self.model_id, outcome='skipped_budget')
+            return False
+        self.budget -= 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        delay = self.delay()
+        return {
+            'calls': self.calls,
+            'samples': len(self.latencies),
+            'hedge_delay_ms': round(delay * 1000, 1) if delay is not None else None,
+            'fired': self.fired,
+            'won': self.won,
+            'skipped_budget': self.skipped_budget,
+            'fire_rate': round(self.fired / self.calls, 4) if self.calls else 0.0,
+            'win_rate': round(self.won / self.fired, 3) if self.fired else 0.0,
+            'budget': round(self.budget, 2),
+        }
+
+
+def _succeeded(result: Any) -> bool:
+    return getattr(result, 'status', 'success') == 'success'
+
+
+class Hedger:
+    """Hedged execution of non-streaming calls, one ModelHedger per model.
+
+    Configured with LLM_HEDGE_ENABLED (default off; requests can opt in),
+    LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES, LLM_HEDGE_WINDOW,
+    LLM_HEDGE_BUDGET (fraction of calls that may hedge), LLM_HEDGE_BURST and
+    LLM_HEDGE_MIN_DELAY_MS.
+    """
+
+    def __init__(self):
+        self.enabled = env_bool('LLM_HEDGE_ENABLED', False)
+        self.percentile = env_float('LLM_HEDGE_PERCENTILE', 95.0)
+        self.min_samples = env_int('LLM_HEDGE_MIN_SAMPLES', 20)
+        self.window = env_int('LLM_HEDGE_WINDOW', 200)
+        self.budget_ratio = env_float('LLM_HEDGE_BUDGET', 0.05)
+        self.burst = env_float('LLM_HEDGE_BURST', 3.0)
+        self.min_delay_s = env_float('LLM_HEDGE_MIN_DELAY_MS', 200.0) / 1000
+        self._models: Dict[str, ModelHedger] = {}
+
+    def get(self, model_id: str) -> ModelHedger:
+        hedger = self._models.get(model_id)
+        if hedger is None:
+            hedger = ModelHedger(
+                model_id, self.percentile, self.min_samples, self.window,
+                self.budget_ratio, self.burst, self.min_delay_s
+            )
+            self._models[model_id] = hedger
+        return hedger
+
+    def observe(self, model_id: str, latency_s: float):
+        """Record an unhedged successful call so the delay is known before hedging is first used"""
+        self.get(model_id).observe(latency_s)
+
+    async def run(
+        self,
+        model_id: str,
+        call: Callable[[], Awaitable[Any]],
+        can_hedge: Callable[[], bool] = lambda: True,
+    ) -> Any:
+        """Run call(); if it is slower than the model's hedge delay, race a duplicate.
+
+        The first successful result wins and the other attempt is cancelled.
+        An error result only wins when both attempts fail.
+        """
+        hedger = self.get(model_id)
+        hedger.earn()
+        started = time.perf_counter()
+        primary = asyncio.ensure_future(call())
+        attempts = [primary]
+        try:
+            delay = hedger.delay()
+            if delay is not None:
+                done, _ = await asyncio.wait([primary], timeout=delay)
+                if not done and can_hedge() and hedger.try_spend():
+                    hedger.fired += 1
+                    metrics.inc('llm_hedges_total', model=model_id, outcome='fired')
+                    logger.info(f"Hedging {model_id} after {delay * 1000:.0f}ms")
+                    attempts.append(asyncio.ensure_future(call()))
+
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and _succeeded(task.result()):
+                        if task is not primary:
+                            hedger.won += 1
+                            metrics.inc('llm_hedges_total', model=model_id, outcome='won')
+                        hedger.observe(time.perf_counter() - started)
+                        return task.result()
+            # Every attempt failed: surface the primary's outcome
+            return primary.result()
+        finally:
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'percentile': self.percentile,
+            'budget': self.budget_ratio,
+            'models': {model_id: hedger.stats() for model_id, hedger in self._models.items()},
+        }
+
+
+hedger = Hedger()
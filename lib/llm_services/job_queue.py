@@ -0,0 +1,212 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .cancellation import RequestHandle, cancellations
+from .settings import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+
+def _rank(job: 'Job') -> int:
+    return PRIORITIES.get(job.priority, PRIORITIES['normal'])
+
+
+class JobQueueFull(Exception):
+    """Too many unfinished jobs; the caller should retry later"""
+
+
+class Job:
+    """A submitted batch whose iterations run on the shared worker pool"""
+
+    def __init__(
+        self,
+        handle: RequestHandle,
+        iterations: int,
+        priority: str,
+        run_iteration: Callable[[int], Awaitable[Dict[str, Any]]],
+    ):
+        self.handle = handle
+        self.job_id = handle.request_id
+        self.model_id = handle.model_id
+        self.iterations = iterations
+        self.priority = priority
+        self.run_iteration = run_iteration
+        self.status = 'queued'
+        self.queued = 0  # iterations still waiting for a worker
+        self.results: List[Dict[str, Any]] = []
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.version = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def _notify(self):
+        self.version += 1
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def mark_started(self):
+        if self.started_at is None:
+            self.started_at = time.time()
+            self.status = 'running'
+            self._notify()
+
+    def add_result(self, result: Dict[str, Any]):
+        self.results.append(result)
+        if len(self.results) >= self.iterations:
+            self.finished_at = time.time()
+            self.status = 'cancelled' if self.handle.cancelled else 'completed'
+        self._notify()
+
+    async def wait_for_change(self, version: int, timeout: float) -> bool:
+        """Wait until the job moves past `version`; False on timeout"""
+        if self.version != version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def to_dict(self, after: int = 0) -> Dict[str, Any]:
+        """Snapshot with the results completed after the first `after`, in completion order"""
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'model': self.model_id,
+            'priority': self.priority,
+            'iterations': self.iterations,
+            'completed_iterations': len(self.results),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'version': self.version,
+            'results': self.results[after:],
+        }
+
+
+class JobQueue:
+    """Bounded asyncio worker pool running job iterations by priority.
+
+    Iterations of every job share one priority queue, so a high-priority
+    job's iterations overtake queued low-priority ones while still running
+    concurrently. Finished jobs are kept for LLM_JOB_RETENTION_S seconds and
+    at most LLM_JOB_MAX_FINISHED of them, oldest evicted first.
+    """
+
+    def __init__(self, workers: int, max_pending: int, max_finished: int, retention_s: float):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.retention_s = retention_s
+        self._queue: asyncio.PriorityQueue = None
+        self._tasks: List[asyncio.Task] = []
+        self._sequence = itertools.count()
+        self._pending: Dict[str, Job] = {}
+        self._finished: "OrderedDict[str, Job]" = OrderedDict()
+        self.submitted = 0
+        self.rejected = 0
+        self.evicted = 0
+        self.busy = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for job in self._pending.values():
+            job.handle.cancel('shutdown')
+
+    def submit(self, job: Job):
+        if not self._tasks:
+            raise RuntimeError("Job queue is not running")
+        if len(self._pending) >= self.max_pending:
+            self.rejected += 1
+            raise JobQueueFull(f"{len(self._pending)} jobs are already pending")
+        self.submitted += 1
+        self._pending[job.job_id] = job
+        rank = _rank(job)
+        job.queued = job.iterations
+        for iteration in range(1, job.iterations + 1):
+            self._queue.put_nowait((rank, next(self._sequence), job, iteration))
+
+    def position(self, job: Job) -> int:
+        """Queued iterations that will run before this job's first one"""
+        rank = _rank(job)
+        return sum(other.queued for other in self._pending.values() if other is not job and _rank(other) <= rank)
+
+    async def _worker(self):
+        while True:
+            _, _, job, iteration = await self._queue.get()
+            job.queued -= 1
+            self.busy += 1
+            try:
+                job.mark_started()
+                # Iterations of a cancelled job come back as cancelled results without a provider call
+                result = await job.run_iteration(iteration)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job.job_id} iteration {iteration} failed: {e}")
+                result = {'iteration': iteration, 'status': 'error', 'error_message': str(e)}
+            finally:
+                self.busy -= 1
+                self._queue.task_done()
+            job.add_result(result)
+            if job.finished:
+                self._retire(job)
+
+    def _retire(self, job: Job):
+        self._pending.pop(job.job_id, None)
+        cancellations.finish(job.handle)
+        self._finished[job.job_id] = job
+        self._evict()
+
+    def _evict(self):
+        cutoff = time.time() - self.retention_s
+        while self._finished:
+            oldest = next(iter(self._finished.values()))
+            if len(self._finished) <= self.max_finished and oldest.finished_at >= cutoff:
+                break
+            self._finished.popitem(last=False)
+            self.evicted += 1
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._evict()
+        return self._pending.get(job_id) or self._finished.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'workers': self.workers,
+            'busy_workers': self.busy,
+            'queued_iterations': self._queue.qsize() if self._queue is not None else 0,
+            'pending_jobs': len(self._pending),
+            'finished_jobs': len(self._finished),
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'evicted': self.evicted,
+        }
+
+
+job_queue = JobQueue(
+    env_int('LLM_JOB_WORKERS', 16),
+    env_int('LLM_JOB_MAX_PENDING', 1000),
+    env_int('LLM_JOB_MAX_FINISHED', 1000),
+    env_float('LLM_JOB_RETENTION_S', 3600.0),
+)
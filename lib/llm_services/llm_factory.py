@@ -1,42 +1,130 @@
-from typing import Optional
+from typing import Dict, Iterable, List, Optional, Type
 from .base_llm import BaseLLM
-from .openai_llm import OpenAILLM
-from .anthropic_llm import AnthropicLLM
-from .gemini_llm import GeminiLLM
+from .router import RoutedLLM, is_routed, resolve, tier_models, tier_names
+from .client_pool import client_pool
+from .thread_bridge import InstrumentedExecutor, shutdown_executors
+from .tokenizer import token_counter
+import importlib
+import logging
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Provider modules pull in heavy SDKs (google.generativeai alone takes over a second),
+# so each is imported the first time one of its models is needed
+PROVIDER_MODULES = {
+    'openai': ('.openai_llm', 'OpenAILLM'),
+    'anthropic': ('.anthropic_llm', 'AnthropicLLM'),
+    'gemini': ('.gemini_llm', 'GeminiLLM'),
+    'mock': ('.mock_llm', 'MockLLM'),
+    'replay': ('.replay_llm', 'ReplayLLM'),
+}
+_provider_classes: Dict[str, Type[BaseLLM]] = {}
+provider_import_ms: Dict[str, float] = {}
+
+# Imports run here rather than on the event loop, which they would stall; the optional
+# startup warm-up has its own thread so requests never queue behind it
+import_executor = InstrumentedExecutor('provider-import', 1)
+warmup_executor = InstrumentedExecutor('provider-warmup', 1)
+
+
+def replay_enabled() -> bool:
+    return bool(os.getenv('LLM_REPLAY_PATH'))
+
+
+def provider_class(provider: str) -> Type[BaseLLM]:
+    """The provider's LLM class, importing its module (and SDK) on first use"""
+    cls = _provider_classes.get(provider)
+    if cls is None:
+        module_name, class_name = PROVIDER_MODULES[provider]
+        started = time.perf_counter()
+        cls = getattr(importlib.import_module(module_name, __package__), class_name)
+        provider_import_ms[provider] = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"Loaded {provider} provider in {provider_import_ms[provider]} ms")
+        _provider_classes[provider] = cls
+    return cls
+
+# Environment variable that makes each provider usable
+PROVIDER_KEYS = {
+    'openai': 'OPENAI_API_KEY',
+    'anthropic': 'ANTHROPIC_API_KEY',
+    'gemini': 'GOOGLE_GEMINI_API_KEY',
+    'mock': 'LLM_MOCK_ENABLED',
+}
+
 class LLMFactory:
     """Factory class to create appropriate LLM instances"""
     
     @staticmethod
     def create_llm(model_id: str) -> Optional[BaseLLM]:
-        """Create an LLM instance based on model ID"""
+        """Return a pooled LLM instance based on model ID (built once per provider/key/model)"""
+        
+        # auto:<tier> and "a -> b" chains pick a concrete model per call
+        if is_routed(model_id):
+            return client_pool.get_llm(
+                'router', 'router', model_id,
+                lambda: RoutedLLM(model_id, LLMFactory.create_llm, LLMFactory.provider_for)
+            )
+        
+        if replay_enabled():
+            # Serve recorded traffic for every model instead of calling providers
+            LLMFactory.provider_for(model_id)
+            return client_pool.get_llm(
+                'replay', 'replay', model_id,
+                lambda: provider_class('replay')('replay', model_id)
+            )
         
         # Determine provider from model ID
         if model_id.startswith('gpt'):
             api_key = os.getenv('OPENAI_API_KEY')
             if not api_key:
                 raise ValueError("OpenAI API key not found in environment")
-            return OpenAILLM(api_key, model_id)
+            return client_pool.get_llm(
+                'openai', api_key, model_id,
+                lambda: provider_class('openai')(api_key, model_id, http_client=client_pool.get_http_client('openai', api_key))
+            )
             
         elif model_id.startswith('claude'):
             api_key = os.getenv('ANTHROPIC_API_KEY')
             if not api_key:
                 raise ValueError("Anthropic API key not found in environment")
-            return AnthropicLLM(api_key, model_id)
+            return client_pool.get_llm(
+                'anthropic', api_key, model_id,
+                lambda: provider_class('anthropic')(api_key, model_id, http_client=client_pool.get_http_client('anthropic', api_key))
+            )
             
         elif model_id.startswith('gemini'):
             api_key = os.getenv('GOOGLE_GEMINI_API_KEY')
             if not api_key:
                 raise ValueError("Google Gemini API key not found in environment")
-            return GeminiLLM(api_key, model_id)
+            return client_pool.get_llm('gemini', api_key, model_id, lambda: provider_class('gemini')(api_key, model_id))
+            
+        elif model_id.startswith('mock'):
+            # Local fake provider for load tests; needs no API key
+            return client_pool.get_llm('mock', 'mock', model_id, lambda: provider_class('mock')('mock', model_id))
             
         else:
             raise ValueError(f"Unknown model ID: {model_id}")
     
+    @staticmethod
+    def provider_for(model_id: str) -> str:
+        """Provider name for a model ID (used to key per-provider limits)"""
+        if is_routed(model_id):
+            return 'router'
+        elif model_id.startswith('gpt'):
+            return 'openai'
+        elif model_id.startswith('claude'):
+            return 'anthropic'
+        elif model_id.startswith('gemini'):
+            return 'gemini'
+        elif model_id.startswith('mock'):
+            return 'mock'
+        raise ValueError(f"Unknown model ID: {model_id}")
+    
     @staticmethod
     def get_available_models():
         """Get list of available models based on configured API keys"""
@@ -51,4 +139,85 @@ class LLMFactory:
         if os.getenv('GOOGLE_GEMINI_API_KEY'):
             available.extend(['gemini-2-flash', 'gemini-2-pro'])
             
-        return available
\ No newline at end of file
+        if os.getenv('LLM_MOCK_ENABLED'):
+            available.extend(['mock-fast', 'mock-slow'])
+        
+        # Router tiers that have at least one usable model
+        for tier in tier_names():
+            if any(LLMFactory.is_configured(model) for model in tier_models(tier)):
+                available.append(f'auto:{tier}')
+            
+        return available
+    
+    @staticmethod
+    def is_configured(model_id: str) -> bool:
+        """Whether the provider for a model ID has its API key (or, for mock, is enabled)"""
+        try:
+            provider = LLMFactory.provider_for(model_id)
+        except ValueError:
+            return False
+        return LLMFactory.is_configured_provider(provider)
+    
+    @staticmethod
+    def configured_providers() -> List[str]:
+        return [provider for provider, key in PROVIDER_KEYS.items() if os.getenv(key)]
+    
+    @staticmethod
+    async def load_providers(model_id: str):
+        """Import the provider module(s) a model ID needs on a worker thread instead of the event loop"""
+        if replay_enabled():
+            if 'replay' not in _provider_classes:
+                # Reading the capture file can take as long as an SDK import
+                await import_executor.run(lambda: provider_class('replay').load_store())
+            return
+        try:
+            models = resolve(model_id)[0] if is_routed(model_id) else [model_id]
+            providers = {LLMFactory.provider_for(model) for model in models}
+        except ValueError:
+            return  # create_llm reports the bad model ID
+        for provider in providers:
+            if provider not in _provider_classes and LLMFactory.is_configured_provider(provider):
+                await import_executor.run(lambda: provider_class(provider))
+    
+    @staticmethod
+    def is_configured_provider(provider: str) -> bool:
+        key = PROVIDER_KEYS.get(provider)
+        return bool(key and os.getenv(key))
+    
+    @staticmethod
+    def warm_up(model_ids: Iterable[str] = ()):
+        """Import every configured provider and build pooled clients and tokenizers for model_ids (blocking)"""
+        for provider in LLMFactory.configured_providers():
+            provider_class(provider)
+        for model_id in model_ids:
+            try:
+                LLMFactory.create_llm(model_id)
+            except ValueError as e:
+                logger.warning(f"Skipping warm-up of {model_id}: {e}")
+                continue
+            # tiktoken loads (or downloads) its encoding on first use
+            if not is_routed(model_id):
+                token_counter.tokenizer_for(LLMFactory.provider_for(model_id), model_id)
+    
+    @staticmethod
+    def loaded_providers() -> Dict[str, float]:
+        """Providers imported so far, with how long each import took in ms"""
+        return dict(provider_import_ms)
+    
+    @staticmethod
+    def replay_stats() -> Optional[Dict]:
+        """Hit/miss counts of the replay capture, once replay mode has loaded it"""
+        if 'replay' not in _provider_classes:
+            return None
+        return _provider_classes['replay'].load_store().stats()
+    
+    @staticmethod
+    def pool_stats():
+        """Hit/miss counters for the shared client pool"""
+        return client_pool.stats()
+    
+    @staticmethod
+    async def shutdown():
+        """Close pooled provider clients and worker pools (called from the FastAPI lifespan)"""
+        await client_pool.aclose()
+        shutdown_executors()
@@ -0,0 +1,322 @@
+import asyncio
+import bisect
+import contextvars
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0, 120.0)
+GAP_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+RATE_BUCKETS = (5, 10, 20, 40, 60, 80, 100, 150, 200, 400)
+
+
+@dataclass
+class CallStats:
+    """Timing and usage of one provider call, filled in as the call progresses"""
+    model: str = ""
+    mode: str = ""
+    status: str = "success"
+    queue_wait_ms: float = 0.0
+    ttft_ms: Optional[float] = None
+    duration_ms: float = 0.0
+    chunks: int = 0
+    max_gap_ms: float = 0.0
+    retries: int = 0
+    tokens_used: Dict[str, int] = field(default_factory=dict)
+    tokens_estimated: bool = False
+    # Set when a router picked the model: the requested auto:/chain id and every model tried
+    routed_from: Optional[str] = None
+    attempts: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def output_tokens_per_sec(self) -> Optional[float]:
+        output = self.tokens_used.get('output') or 0
+        # Generation speed excludes the wait for the first token (or for rate-limit budget)
+        generating_ms = self.duration_ms - (self.ttft_ms if self.ttft_ms is not None else self.queue_wait_ms)
+        if output <= 0 or generating_ms <= 0:
+            return None
+        return output / (generating_ms / 1000)
+
+    def to_dict(self) -> Dict[str, Any]:
+        rate = self.output_tokens_per_sec
+        return {
+            'model': self.model,
+            'status': self.status,
+            'queue_wait_ms': round(self.queue_wait_ms, 1),
+            'ttft_ms': round(self.ttft_ms, 1) if self.ttft_ms is not None else None,
+            'duration_ms': round(self.duration_ms, 1),
+            'chunks': self.chunks,
+            'max_gap_ms': round(self.max_gap_ms, 1),
+            'retries': self.retries,
+            'output_tokens_per_sec': round(rate, 1) if rate is not None else None,
+            'tokens_used': self.tokens_used,
+            'tokens_estimated': self.tokens_estimated,
+            **({'routed_from': self.routed_from, 'attempts': self.attempts} if self.routed_from else {}),
+        }
+
+
+# The call currently running in this task; lets retry loops and providers report into it
+current_call: contextvars.ContextVar[Optional[CallStats]] = contextvars.ContextVar('current_call', default=None)
+
+
+def unbind_call(token: contextvars.Token):
+    """Undo current_call.set(); streams closed from another context (e.g. by the GC) can't, and needn't"""
+    try:
+        current_call.reset(token)
+    except ValueError:
+        pass
+
+
+class Histogram:
+    """Fixed-bucket histogram: one bisect and two adds per observation"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Per-model latency histograms and counters, rendered in Prometheus text format"""
+
+    HISTOGRAMS = {
+        'llm_request_duration_seconds': ('Total provider call duration', LATENCY_BUCKETS),
+        'llm_queue_wait_seconds': ('Time spent waiting for rate-limit budget', LATENCY_BUCKETS),
+        'llm_time_to_first_token_seconds': ('Time from request to first streamed chunk', LATENCY_BUCKETS),
+        'llm_inter_chunk_seconds': ('Gap between consecutive streamed chunks', GAP_BUCKETS),
+        'llm_output_tokens_per_second': ('Output tokens per second while generating', RATE_BUCKETS),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+
+    def _histogram(self, name: str, model: str) -> Histogram:
+        key = (name, model)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = Histogram(self.HISTOGRAMS[name][1])
+            self._histograms[key] = histogram
+        return histogram
+
+    def observe(self, name: str, model: str, value: float):
+        with self._lock:
+            self._histogram(name, model).observe(value)
+
+    def observe_many(self, name: str, model: str, values: List[float]):
+        if not values:
+            return
+        with self._lock:
+            histogram = self._histogram(name, model)
+            for value in values:
+                histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1.0, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + amount
+
+    def record_call(self, stats: CallStats, gaps: Optional[List[float]] = None):
+        """Fold a finished call into the per-model metrics"""
+        model = stats.model
+        self.inc('llm_requests_total', model=model, mode=stats.mode, status=stats.status)
+        if stats.retries:
+            self.inc('llm_retries_total', stats.retries, model=model)
+        self.observe('llm_request_duration_seconds', model, stats.duration_ms / 1000)
+        self.observe('llm_queue_wait_seconds', model, stats.queue_wait_ms / 1000)
+        if stats.ttft_ms is not None:
+            self.observe('llm_time_to_first_token_seconds', model, stats.ttft_ms / 1000)
+        if gaps:
+            self.observe_many('llm_inter_chunk_seconds', model, gaps)
+        rate = stats.output_tokens_per_sec
+        if rate is not None:
+            self.observe('llm_output_tokens_per_second', model, rate)
+        for kind, count in stats.tokens_used.items():
+            if count and kind != 'total':
+                self.inc('llm_tokens_total', count, model=model, kind=kind)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-serialisable copy of every series, for aggregating across worker processes"""
+        with self._lock:
+            return {
+                'histograms': [
+                    [name, model, list(histogram.counts), histogram.sum, histogram.count]
+                    for (name, model), histogram in self._histograms.items()
+                ],
+                'counters': [
+                    [name, [list(label) for label in labels], value]
+                    for (name, labels), value in self._counters.items()
+                ],
+            }
+
+    @classmethod
+    def merge(cls, snapshots: List[Dict[str, Any]]) -> "MetricsRegistry":
+        """A registry holding the sum of several snapshots (bucket counts, sums and counters add up)"""
+        merged = cls()
+        for snapshot in snapshots:
+            for name, model, counts, total, count in snapshot.get('histograms', []):
+                if name not in cls.HISTOGRAMS:
+                    continue
+                histogram = merged._histogram(name, model)
+                for i, value in enumerate(counts[:len(histogram.counts)]):
+                    histogram.counts[i] += value
+                histogram.sum += total
+                histogram.count += count
+            for name, labels, value in snapshot.get('counters', []):
+                key = (name, tuple(tuple(label) for label in labels))
+                merged._counters[key] = merged._counters.get(key, 0.0) + value
+        return merged
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        by_name: Dict[str, List[Tuple[str, Histogram]]] = {}
+        for (name, model), histogram in histograms:
+            by_name.setdefault(name, []).append((model, histogram))
+        for name, series in by_name.items():
+            lines.append(f"# HELP {name} {self.HISTOGRAMS[name][0]}")
+            lines.append(f"# TYPE {name} histogram")
+            for model, histogram in series:
+                label = _escape(model)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{model="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{model="{label}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{model="{label}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{model="{label}"}} {histogram.count}')
+
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            rendered = ",".join(f'{key}="{_escape(val)}"' for key, val in labels)
+            lines.append(f"{name}{{{rendered}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class LoopLagMonitor:
+    """Measure how late the event loop wakes up from a short sleep.
+
+    Lag is the clearest sign that something is blocking the loop (sync SDK
+    calls, large JSON encodes) and stalling every other request on the worker.
+    """
+
+    def __init__(self, interval_s: float = 0.1, window: int = 600):
+        self.interval_s = interval_s
+        self.histogram = Histogram(GAP_BUCKETS)
+        self.recent = deque(maxlen=window)
+        self.max_lag_s = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval_s)
+            lag = max(0.0, time.perf_counter() - started - self.interval_s)
+            self.histogram.observe(lag)
+            self.recent.append(lag)
+            self.max_lag_s = max(self.max_lag_s, lag)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        recent = sorted(self.recent)
+        p99 = recent[min(len(recent) - 1, int(len(recent) * 0.99))] if recent else 0.0
+        return {
+            'samples': self.histogram.count,
+            'avg_ms': round(self.histogram.sum / self.histogram.count * 1000, 2) if self.histogram.count else 0.0,
+            'max_ms': round(self.max_lag_s * 1000, 2),
+            'recent_max_ms': round(max(recent) * 1000, 2) if recent else 0.0,
+            'recent_p99_ms': round(p99 * 1000, 2),
+        }
+
+    def render_prometheus(self) -> str:
+        name = 'llm_event_loop_lag_seconds'
+        lines = [f"# HELP {name} How late the event loop woke from a {self.interval_s}s sleep", f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.histogram.buckets, self.histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.histogram.count}')
+        lines.append(f'{name}_sum {self.histogram.sum}')
+        lines.append(f'{name}_count {self.histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+class ModelScores:
+    """EWMA latency and error rate per model and mode, fed by every provider call.
+
+    Latency is the full duration for generate() and time to first token for
+    streams, since that is what a caller waits for before switching models.
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._scores: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stats: CallStats):
+        if stats.status in ('cancelled', 'circuit_open') or not stats.model:
+            return
+        latency_ms = stats.ttft_ms if stats.mode == 'stream' and stats.ttft_ms is not None else stats.duration_ms
+        self.record(stats.model, stats.mode, latency_ms, stats.status == 'success')
+
+    def record(self, model: str, mode: str, latency_ms: float, ok: bool):
+        with self._lock:
+            score = self._scores.get((model, mode))
+            if score is None:
+                self._scores[(model, mode)] = {'latency_ms': latency_ms, 'error_rate': 0.0 if ok else 1.0, 'calls': 1}
+                return
+            score['latency_ms'] += self.alpha * (latency_ms - score['latency_ms'])
+            score['error_rate'] += self.alpha * ((0.0 if ok else 1.0) - score['error_rate'])
+            score['calls'] += 1
+
+    def get(self, model: str, mode: str) -> Optional[Dict[str, float]]:
+        score = self._scores.get((model, mode))
+        return dict(score) if score is not None else None
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                f"{model}/{mode}": {
+                    'latency_ms': round(score['latency_ms'], 1),
+                    'error_rate': round(score['error_rate'], 3),
+                    'calls': score['calls'],
+                }
+                for (model, mode), score in self._scores.items()
+            }
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = MetricsRegistry()
+loop_lag = LoopLagMonitor()
+model_scores = ModelScores()
@@ -0,0 +1,171 @@
+from typing import AsyncIterator, Dict
+import asyncio
+import random
+import time
+from .base_llm import BaseLLM, LLMResponse
+from .settings import env_float, env_int
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+class MockProviderError(Exception):
+    """Injected provider failure; carries status_code/response like the SDK errors do"""
+
+    class _Response:
+        def __init__(self, headers: Dict[str, str]):
+            self.headers = headers
+
+    def __init__(self, message: str, status_code: int, headers: Dict[str, str] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = self._Response(headers or {})
+
+class MockLLM(BaseLLM):
+    """Local fake provider for load tests: simulated TTFT, token rate, output length and failures.
+
+    Model IDs start with "mock" (e.g. "mock-fast", "mock-slow"). Behaviour is
+    configured with LLM_MOCK_* environment variables and never touches the network.
+    """
+
+    provider = "mock"
+
+    def __init__(self, api_key: str, model_id: str):
+        super().__init__(api_key, model_id)
+        self.ttft_ms = env_float('LLM_MOCK_TTFT_MS', 300.0)
+        self.ttft_jitter_ms = env_float('LLM_MOCK_TTFT_JITTER_MS', 100.0)
+        self.tokens_per_sec = max(1.0, env_float('LLM_MOCK_TOKENS_PER_SEC', 80.0))
+        self.output_tokens = env_int('LLM_MOCK_OUTPUT_TOKENS', 200)
+        # fixed | uniform (0.5x-1.5x) | lognormal (long tail around the mean)
+        self.output_distribution = os.getenv('LLM_MOCK_OUTPUT_DIST', 'lognormal')
+        self.error_rate = env_float('LLM_MOCK_ERROR_RATE', 0.0)
+        self.rate_limit_rate = env_float('LLM_MOCK_429_RATE', 0.0)
+        self.retry_after_s = env_float('LLM_MOCK_RETRY_AFTER_S', 1.0)
+        # Tokens per streamed chunk (1 mimics real token-by-token deltas)
+        self.chunk_tokens = max(1, env_int('LLM_MOCK_CHUNK_TOKENS', 1))
+
+        # "mock-slow" models answer four times slower than "mock-fast" ones
+        if 'slow' in model_id:
+            self.ttft_ms *= 4
+            self.tokens_per_sec /= 4
+
+    def _output_length(self, max_tokens: int) -> int:
+        mean = self.output_tokens
+        if self.output_distribution == 'fixed':
+            length = mean
+        elif self.output_distribution == 'uniform':
+            length = int(random.uniform(0.5 * mean, 1.5 * mean))
+        else:
+            length = int(random.lognormvariate(0, 0.5) * mean)
+        return max(1, min(length, max_tokens))
+
+    def _maybe_fail(self):
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            raise MockProviderError(
+                "Mock rate limit exceeded",
+                429,
+                {'retry-after': str(self.retry_after_s)}
+            )
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise MockProviderError("Mock internal server error", 500)
+
+    async def _wait_for_first_token(self):
+        delay = max(0.0, random.gauss(self.ttft_ms, self.ttft_jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+
+    async def _complete(self, user_prompt: str, max_tokens: int):
+        self._maybe_fail()
+        await self._wait_for_first_token()
+        length = self._output_length(max_tokens)
+        await asyncio.sleep(length / self.tokens_per_sec)
+        return length
+
+    async def generate(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        temperature: float = 1.0,
+        max_tokens: int = 2048,
+        top_p: float = 1.0,
+        **kwargs
+    ) -> LLMResponse:
+        """Generate a fake response after a simulated provider delay"""
+        start_time = time.time()
+
+        reservation = None
+        try:
+            reservation = await self.reserve_capacity(system_prompt, user_prompt, max_tokens, kwargs.get('history'))
+            length = await self.retry_with_exponential_backoff(self._complete, user_prompt, max_tokens)
+
+            input_tokens = self.calculate_tokens(system_prompt or "") + self.calculate_tokens(user_prompt)
+            for message in kwargs.get('history') or ():
+                input_tokens += self.calculate_tokens(message['content'])
+            reservation.settle(input_tokens + length)
+
+            return LLMResponse(
+                text=" ".join(f"tok{i}" for i in range(length)),
+                model=self.model_id,
+                tokens_used={
+                    'input': input_tokens,
+                    'output': length,
+                    'total': input_tokens + length
+                },
+                response_time_ms=int((time.time() - start_time) * 1000),
+                status="success"
+            )
+
+        except Exception as e:
+            if reservation is not None:
+                reservation.refund()
+            logger.error(f"Mock generation error: {e}")
+
+            return LLMResponse(
+                text="",
+                model=self.model_id,
+                tokens_used={'input': 0, 'output': 0, 'total': 0},
+                response_time_ms=int((time.time() - start_time) * 1000),
+                status="error",
+                error_message=str(e)
+            )
+
+    async def stream_generate(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        temperature: float = 1.0,
+        max_tokens: int = 2048,
+        top_p: float = 1.0,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """Stream fake tokens at the configured rate"""
+        reservation = None
+        streaming = False
+        try:
+            reservation = await self.reserve_capacity(system_prompt, user_prompt, max_tokens, kwargs.get('history'))
+            self._maybe_fail()
+            await self._wait_for_first_token()
+            streaming = True
+
+            length = self._output_length(max_tokens)
+            interval = self.chunk_tokens / self.tokens_per_sec
+            for start in range(0, length, self.chunk_tokens):
+                end = min(start + self.chunk_tokens, length)
+                yield "".join(f"tok{i} " for i in range(start, end))
+                if end < length:
+                    await asyncio.sleep(interval)
+
+            input_tokens = self.calculate_tokens(system_prompt or "") + self.calculate_tokens(user_prompt)
+            for message in kwargs.get('history') or ():
+                input_tokens += self.calculate_tokens(message['content'])
+            self.record_usage({'input': input_tokens, 'output': length, 'total': input_tokens + length})
+            reservation.settle(input_tokens + length)
+
+        except Exception as e:
+            if reservation is not None and streaming:
+                reservation.settle()
+            elif reservation is not None:
+                reservation.refund()
+            logger.error(f"Mock streaming error: {e}")
+            self.record_error()
+            yield f"Error: {str(e)}"
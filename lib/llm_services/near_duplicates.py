@@ -0,0 +1,332 @@
+import hashlib
+import logging
+import re
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from operator import eq
+from typing import Any, Dict, List, Optional, Tuple
+
+from .settings import env_bool, env_float, env_int
+from .text_profile import text_profiles
+
+try:
+    import numpy
+except ImportError:  # optional: vectorized shingle hashing for longer prompts
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r'[^\w\s]+')
+_MASK64 = (1 << 64) - 1
+_EMPTY = _MASK64
+
+
+def normalize(text: str) -> str:
+    """Case, width, punctuation and whitespace differences removed"""
+    text = _PUNCTUATION.sub(' ', unicodedata.normalize('NFKC', text).casefold())
+    return ' '.join(text.split())
+
+
+def _bins_python(text: str, k: int, num_perm: int) -> List[int]:
+    count = max(1, len(text) - k + 1)
+    shingles = set(map(text.__getitem__, map(slice, range(count), range(k, count + k))))
+    # str hash runs in C (SipHash, salted per process). The top bits pick the bin, so sorting
+    # groups each bin's hashes together and its minimum is the first one at or above the bin's start.
+    hashes = sorted(map(hash, shingles))
+    shift = 64 - num_perm.bit_length() + 1
+    bins = [_EMPTY] * num_perm
+    position = 0
+    for b in range(num_perm):
+        position = bisect_left(hashes, (b - num_perm // 2) << shift, position)
+        if position == len(hashes):
+            break
+        if hashes[position] < (b + 1 - num_perm // 2) << shift:
+            bins[b] = hashes[position] & _MASK64
+    return bins
+
+
+def _bins_numpy(text: str, k: int, num_perm: int) -> List[int]:
+    codes = numpy.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=numpy.uint32).astype(numpy.uint64)
+    count = max(1, len(codes) - k + 1)
+    # Polynomial hash of every k-gram at once (uint64 arithmetic wraps), then the MurmurHash3 finalizer
+    h = numpy.zeros(count, dtype=numpy.uint64)
+    for j in range(min(k, len(codes))):
+        h = h * numpy.uint64(1_000_003) + codes[j:j + count]
+    h ^= h >> numpy.uint64(33)
+    h *= numpy.uint64(0xff51afd7ed558ccd)
+    h ^= h >> numpy.uint64(33)
+    h *= numpy.uint64(0xc4ceb9fe1a85ec53)
+    h ^= h >> numpy.uint64(33)
+    bins = numpy.full(num_perm, _EMPTY, dtype=numpy.uint64)
+    numpy.minimum.at(bins, (h >> numpy.uint64(64 - num_perm.bit_length() + 1)).astype(numpy.intp), h)
+    return bins.tolist()
+
+
+def minhash(text: str, num_perm: int = 64, shingle_chars: int = 5) -> array:
+    """One-permutation MinHash of a normalized text's character shingles.
+
+    Each shingle is hashed once; the top bits pick one of num_perm bins and
+    the hash competes for that bin's minimum, which estimates Jaccard
+    similarity like num_perm separate permutations at 1/num_perm of the
+    cost. Empty bins borrow the next filled bin's value (rotation
+    densification). With NumPy installed all shingles are hashed in one
+    vectorized pass. Either way signatures are only comparable within one
+    process, which is all the in-memory index needs.
+    """
+    if numpy is not None:
+        bins = _bins_numpy(text, shingle_chars, num_perm)
+    else:
+        bins = _bins_python(text, shingle_chars, num_perm)
+    if _EMPTY in bins and bins.count(_EMPTY) < num_perm:
+        # Right to left twice round: the first lap only finds the nearest filled bin for the last ones
+        carried, distance = None, 0
+        for i in range(2 * num_perm - 1, -1, -1):
+            value = bins[i % num_perm]
+            if value != _EMPTY:
+                carried, distance = value, 0
+            else:
+                distance += 1
+                if i < num_perm:
+                    # XOR with the distance keeps borrowed values apart from each other and from real ones
+                    bins[i] = carried ^ distance
+    return array('Q', bins)
+
+
+def similarity(a: array, b: array) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(map(eq, a, b)) / len(a)
+
+
+def scope_of(model_id: str, system_prompt: Optional[str], temperature: float, max_tokens: int, top_p: float) -> Tuple:
+    """Prompts are only near-duplicates of prompts sent with the same model, system prompt and parameters"""
+    return (
+        model_id,
+        text_profiles.profile(system_prompt or "").digest,
+        round(float(temperature), 6),
+        int(max_tokens),
+        round(float(top_p), 6),
+    )
+
+
+class _Entry:
+    __slots__ = ('scope', 'key', 'signature', 'digest')
+
+    def __init__(self, scope: Tuple, key: str, signature: array, digest: bytes):
+        self.scope = scope
+        self.key = key
+        self.signature = signature
+        self.digest = digest
+
+
+class NearDuplicateIndex:
+    """MinHash/LSH index from recent prompts to their response-cache fingerprints.
+
+    The exact response cache misses prompts that differ only in whitespace,
+    punctuation, case or a few words. This index finds such near-duplicates
+    among recently cached responses so they can be served (opt-in per
+    request, or LLM_NEAR_DUP_SERVE) or suggested (POST /near_duplicates).
+    Prompts are compared within a scope: same model, same system prompt
+    and same sampling parameters. Signatures are split into `bands` LSH
+    bands; prompts sharing any band are candidates, checked against the
+    full signature. Entries only hold fingerprints, so the responses stay
+    bounded by the response cache; the index itself keeps at most
+    `max_entries` (least recently used first out) and drops entries whose
+    response has left the cache. Prompts longer than `max_chars` are not
+    indexed: hashing is linear in length and runs on the event loop.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        serve: bool,
+        max_entries: int,
+        threshold: float,
+        num_perm: int,
+        bands: int,
+        shingle_chars: int,
+        max_chars: int,
+    ):
+        if num_perm & (num_perm - 1) or num_perm % bands:
+            raise ValueError("num_perm must be a power of two and a multiple of bands")
+        self.enabled = enabled
+        self.serve = serve
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_chars = shingle_chars
+        self.max_chars = max_chars
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        # (scope, normalized text digest) -> entry id: one entry per distinct prompt, the newest response wins
+        self._by_text: Dict[Tuple[Tuple, bytes], int] = {}
+        # scope -> one bucket table per band: band hash -> entry id (or a list of ids)
+        self._tables: Dict[Tuple, List[Dict[int, Any]]] = {}
+        self._next_id = 0
+        self.indexed = 0
+        self.skipped = 0
+        self.evicted = 0
+        self.lookups = 0
+        self.hits = 0
+        self.candidates = 0
+        self.served = 0
+        self.stale = 0
+        self._latencies_ms = deque(maxlen=1024)
+
+    def should_serve(self, requested: Optional[bool]) -> bool:
+        return self.enabled and (self.serve if requested is None else requested)
+
+    def _band_keys(self, signature: array) -> List[int]:
+        rows = self.rows
+        return [hash(tuple(signature[i:i + rows])) for i in range(0, self.num_perm, rows)]
+
+    def _prepare(self, prompt: str) -> Optional[Tuple[array, bytes]]:
+        if len(prompt) > self.max_chars:
+            return None
+        text = normalize(prompt)
+        digest = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        return minhash(text, self.num_perm, self.shingle_chars), digest
+
+    def add(self, scope: Tuple, prompt: str, key: str):
+        """Index a prompt whose response is cached under `key`"""
+        if not self.enabled:
+            return
+        prepared = self._prepare(prompt)
+        if prepared is None:
+            self.skipped += 1
+            return
+        existing = self._by_text.get((scope, prepared[1]))
+        if existing is not None:
+            if self._entries[existing].key == key:
+                self._entries.move_to_end(existing)
+                return
+            self.remove(existing)
+        entry_id = self._next_id
+        self._next_id += 1
+        entry = _Entry(scope, key, *prepared)
+        tables = self._tables.get(scope)
+        if tables is None:
+            tables = self._tables[scope] = [{} for _ in range(self.bands)]
+        for table, band in zip(tables, self._band_keys(entry.signature)):
+            bucket = table.get(band)
+            if bucket is None:
+                table[band] = entry_id
+            elif isinstance(bucket, list):
+                bucket.append(entry_id)
+            else:
+                table[band] = [bucket, entry_id]
+        self._entries[entry_id] = entry
+        self._by_text[(scope, entry.digest)] = entry_id
+        self.indexed += 1
+        while len(self._entries) > self.max_entries:
+            self.remove(next(iter(self._entries)))
+            self.evicted += 1
+
+    def remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        del self._by_text[(entry.scope, entry.digest)]
+        tables = self._tables[entry.scope]
+        for table, band in zip(tables, self._band_keys(entry.signature)):
+            bucket = table.get(band)
+            if bucket == entry_id:
+                del table[band]
+            elif isinstance(bucket, list):
+                bucket.remove(entry_id)
+                if len(bucket) == 1:
+                    table[band] = bucket[0]
+        if not any(tables):
+            del self._tables[entry.scope]
+
+    def lookup(
+        self,
+        scope: Tuple,
+        prompt: str,
+        threshold: Optional[float] = None,
+        limit: int = 1,
+    ) -> List[Tuple[float, int, str]]:
+        """Best (similarity, entry id, fingerprint) matches at or above the threshold, most similar first"""
+        if not self.enabled:
+            return []
+        started = time.perf_counter()
+        self.lookups += 1
+        matches = []
+        tables = self._tables.get(scope)
+        prepared = self._prepare(prompt) if tables else None
+        if prepared is not None:
+            signature, digest = prepared
+            threshold = self.threshold if threshold is None else threshold
+            seen = set()
+            for table, band in zip(tables, self._band_keys(signature)):
+                bucket = table.get(band)
+                if bucket is None:
+                    continue
+                for entry_id in (bucket if isinstance(bucket, list) else (bucket,)):
+                    if entry_id in seen:
+                        continue
+                    seen.add(entry_id)
+                    entry = self._entries[entry_id]
+                    # Same normalized text is a certain match whatever the estimate says
+                    score = 1.0 if entry.digest == digest else similarity(signature, entry.signature)
+                    if score >= threshold:
+                        matches.append((score, entry_id, entry.key))
+            self.candidates += len(seen)
+            matches.sort(key=lambda match: (-match[0], -match[1]))
+            matches = matches[:limit]
+        if matches:
+            self.hits += 1
+            for _, entry_id, _ in matches:
+                self._entries.move_to_end(entry_id)
+        self._latencies_ms.append((time.perf_counter() - started) * 1000)
+        return matches
+
+    def clear(self):
+        self._entries.clear()
+        self._by_text.clear()
+        self._tables.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies_ms)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3) if latencies else None
+
+        return {
+            'enabled': self.enabled,
+            'serve_by_default': self.serve,
+            'numpy': numpy is not None,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'scopes': len(self._tables),
+            'threshold': self.threshold,
+            'num_perm': self.num_perm,
+            'bands': self.bands,
+            'indexed': self.indexed,
+            'skipped': self.skipped,
+            'evicted': self.evicted,
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            'served': self.served,
+            'stale': self.stale,
+            'candidates_per_lookup': round(self.candidates / self.lookups, 2) if self.lookups else 0.0,
+            'lookup_ms_p50': percentile(0.5),
+            'lookup_ms_p99': percentile(0.99),
+        }
+
+
+near_duplicates = NearDuplicateIndex(
+    enabled=env_bool('LLM_NEAR_DUP_ENABLED', True),
+    # Serve near-duplicates unless a request says otherwise (off: only requests with near_duplicate=true)
+    serve=env_bool('LLM_NEAR_DUP_SERVE', False),
+    max_entries=env_int('LLM_NEAR_DUP_MAX_ENTRIES', 20000),
+    threshold=env_float('LLM_NEAR_DUP_THRESHOLD', 0.9),
+    num_perm=env_int('LLM_NEAR_DUP_NUM_PERM', 64),
+    bands=env_int('LLM_NEAR_DUP_BANDS', 8),
+    shingle_chars=env_int('LLM_NEAR_DUP_SHINGLE_CHARS', 5),
+    max_chars=env_int('LLM_NEAR_DUP_MAX_CHARS', 8192),
+)
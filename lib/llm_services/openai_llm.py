@@ -1,7 +1,9 @@
 from openai import AsyncOpenAI
-from typing import AsyncIterator
+from typing import AsyncIterator, Dict, List, Optional
+import httpx
 import time
 from .base_llm import BaseLLM, LLMResponse
+from .prompt_cache import openai_tokens
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,9 +11,12 @@ logger = logging.getLogger(__name__)
 class OpenAILLM(BaseLLM):
     """OpenAI GPT models implementation"""
     
-    def __init__(self, api_key: str, model_id: str):
+    provider = "openai"
+    
+    def __init__(self, api_key: str, model_id: str, http_client: Optional[httpx.AsyncClient] = None):
         super().__init__(api_key, model_id)
-        self.client = AsyncOpenAI(api_key=api_key)
+        # A pooled http_client lets every model of this provider share keep-alive connections
+        self.client = AsyncOpenAI(api_key=api_key, http_client=http_client)
         
         # Map our model IDs to OpenAI model names
         self.model_mapping = {
@@ -24,6 +29,40 @@ class OpenAILLM(BaseLLM):
         # Models that don't support temperature/top_p
         self.reasoning_models = {'gpt-5', 'gpt-5-mini'}
         
+    def completion_params(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        temperature: float,
+        max_tokens: int,
+        top_p: float,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> dict:
+        """Chat completion body shared by generate, stream_generate and batch requests"""
+        # System prompt first: OpenAI caches the longest previously seen prefix automatically
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        # Earlier session turns, oldest first, so each turn extends the previous prefix
+        messages.extend(history or ())
+        messages.append({"role": "user", "content": user_prompt})
+        
+        params = {
+            "model": self.model_mapping.get(self.model_id, self.model_id),
+            "messages": messages
+        }
+        
+        # GPT-5 models use different parameter names
+        if self.model_id in self.reasoning_models:
+            # GPT-5 uses max_completion_tokens instead of max_tokens
+            params["max_completion_tokens"] = max_tokens
+        else:
+            # Other models use max_tokens
+            params["max_tokens"] = max_tokens
+            params["temperature"] = temperature
+            params["top_p"] = top_p
+        return params
+        
     async def generate(
         self,
         system_prompt: str,
@@ -36,33 +75,23 @@ class OpenAILLM(BaseLLM):
         """Generate response from OpenAI"""
         start_time = time.time()
         
+        reservation = None
         try:
-            messages = []
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            messages.append({"role": "user", "content": user_prompt})
-            
-            # Build completion parameters
             completion_params = {
-                "model": self.model_mapping.get(self.model_id, self.model_id),
-                "messages": messages,
+                **self.completion_params(
+                    system_prompt, user_prompt, temperature, max_tokens, top_p, kwargs.get('history')
+                ),
                 "stream": False
             }
             
-            # GPT-5 models use different parameter names
-            if self.model_id in self.reasoning_models:
-                # GPT-5 uses max_completion_tokens instead of max_tokens
-                completion_params["max_completion_tokens"] = max_tokens
-            else:
-                # Other models use max_tokens
-                completion_params["max_tokens"] = max_tokens
-                completion_params["temperature"] = temperature
-                completion_params["top_p"] = top_p
-            
-            response = await self.retry_with_exponential_backoff(
-                self.client.chat.completions.create,
+            reservation = await self.reserve_capacity(system_prompt, user_prompt, max_tokens, kwargs.get('history'))
+            # Raw response exposes the x-ratelimit-* headers for the limiter
+            raw_response = await self.retry_with_exponential_backoff(
+                self.client.chat.completions.with_raw_response.create,
                 **completion_params
             )
+            response = raw_response.parse()
+            reservation.settle(response.usage.total_tokens, raw_response.headers)
             
             response_time = int((time.time() - start_time) * 1000)
             
@@ -85,16 +114,14 @@ class OpenAILLM(BaseLLM):
             return LLMResponse(
                 text=response_text,
                 model=self.model_id,
-                tokens_used={
-                    'input': response.usage.prompt_tokens,
-                    'output': response.usage.completion_tokens,
-                    'total': response.usage.total_tokens
-                },
+                tokens_used=openai_tokens(response.usage),
                 response_time_ms=response_time,
                 status="success"
             )
             
         except Exception as e:
+            if reservation is not None:
+                reservation.refund()
             logger.error(f"OpenAI generation error: {e}")
             response_time = int((time.time() - start_time) * 1000)
             
@@ -117,37 +144,39 @@ class OpenAILLM(BaseLLM):
         **kwargs
     ) -> AsyncIterator[str]:
         """Stream response from OpenAI"""
+        reservation = None
+        streaming = False
         try:
-            messages = []
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            messages.append({"role": "user", "content": user_prompt})
-            
-            # Build completion parameters
             completion_params = {
-                "model": self.model_mapping.get(self.model_id, self.model_id),
-                "messages": messages,
-                "stream": True
+                **self.completion_params(
+                    system_prompt, user_prompt, temperature, max_tokens, top_p, kwargs.get('history')
+                ),
+                "stream": True,
+                # Final chunk carries token usage (with an empty choices list)
+                "stream_options": {"include_usage": True}
             }
             
-            # GPT-5 models use different parameter names
-            if self.model_id in self.reasoning_models:
-                # GPT-5 uses max_completion_tokens instead of max_tokens
-                completion_params["max_completion_tokens"] = max_tokens
-            else:
-                # Other models use max_tokens
-                completion_params["max_tokens"] = max_tokens
-                completion_params["temperature"] = temperature
-                completion_params["top_p"] = top_p
-            
+            reservation = await self.reserve_capacity(system_prompt, user_prompt, max_tokens, kwargs.get('history'))
             stream = await self.client.chat.completions.create(
                 **completion_params
             )
             
-            async for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+            # Closing the stream on cancellation releases its pooled connection right away
+            async with stream:
+                async for chunk in stream:
+                    streaming = True
+                    if chunk.usage:
+                        self.record_usage(openai_tokens(chunk.usage))
+                        reservation.settle(chunk.usage.total_tokens)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            reservation.settle()
                     
         except Exception as e:
+            if reservation is not None and streaming:
+                reservation.settle()
+            elif reservation is not None:
+                reservation.refund()
             logger.error(f"OpenAI streaming error: {e}")
+            self.record_error()
             yield f"Error: {str(e)}"
\ No newline at end of file
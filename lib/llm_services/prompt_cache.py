@@ -0,0 +1,106 @@
+from typing import Any, Dict, List, Optional
+
+from .settings import env_bool
+from .tokenizer import token_counter
+
+# Off unless LLM_PREFIX_CACHE is set or a request passes prefix_cache=True
+PREFIX_CACHE_DEFAULT = env_bool('LLM_PREFIX_CACHE', False)
+
+EPHEMERAL = {"type": "ephemeral"}
+
+
+def prefix_cache_enabled(flag: Optional[bool]) -> bool:
+    return PREFIX_CACHE_DEFAULT if flag is None else flag
+
+
+def min_cacheable_tokens(provider: str, model_id: str) -> Optional[int]:
+    """Shortest prompt prefix the provider will cache, or None when it has no prefix cache"""
+    if provider == 'anthropic':
+        return 2048 if 'haiku' in model_id else 1024
+    if provider == 'openai':
+        return 1024
+    if provider == 'gemini':
+        return 2048 if 'pro' in model_id else 1024
+    return None
+
+
+def cacheable_prefix(provider: str, model_id: str, system_prompt: Optional[str], user_prompt: str) -> bool:
+    """Whether the prompt is long enough that later identical calls can read it from the provider's cache"""
+    minimum = min_cacheable_tokens(provider, model_id)
+    if minimum is None:
+        return False
+    return token_counter.count_prompt(provider, model_id, system_prompt, user_prompt) >= minimum
+
+
+def anthropic_system(system_prompt: str) -> List[Dict[str, Any]]:
+    """System prompt as a single cache breakpoint: it is the prefix shared by every iteration and rerun"""
+    return [{"type": "text", "text": system_prompt, "cache_control": EPHEMERAL}]
+
+
+def anthropic_user_content(user_prompt: str) -> List[Dict[str, Any]]:
+    """User prompt with its own breakpoint so repeated iterations of the same prompt reuse it too.
+
+    Blocks shorter than the model's minimum are simply not cached, so marking
+    them costs nothing.
+    """
+    return [{"type": "text", "text": user_prompt, "cache_control": EPHEMERAL}]
+
+
+def anthropic_history(history: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+    """Earlier session turns with a breakpoint on the newest one.
+
+    The next turn of the conversation starts with exactly this prefix, so it
+    is read from the cache however many turns back the previous write was.
+    """
+    messages = [dict(message) for message in history]
+    if messages:
+        last = messages[-1]
+        last["content"] = [{"type": "text", "text": last["content"], "cache_control": EPHEMERAL}]
+    return messages
+
+
+def anthropic_tokens(usage) -> Dict[str, int]:
+    """tokens_used from an Anthropic usage block.
+
+    Anthropic reports cache reads and writes separately from input_tokens;
+    `input` is the full prompt so it stays comparable with other providers.
+    """
+    cache_read = getattr(usage, 'cache_read_input_tokens', None) or 0
+    cache_write = getattr(usage, 'cache_creation_input_tokens', None) or 0
+    prompt = usage.input_tokens + cache_read + cache_write
+    tokens = {
+        'input': prompt,
+        'output': usage.output_tokens,
+        'total': prompt + usage.output_tokens,
+    }
+    if cache_read or cache_write:
+        tokens['cached_input'] = cache_read
+        tokens['cache_write'] = cache_write
+    return tokens
+
+
+def openai_tokens(usage) -> Dict[str, int]:
+    """tokens_used from an OpenAI usage block; prompt_tokens already includes cached tokens"""
+    tokens = {
+        'input': usage.prompt_tokens,
+        'output': usage.completion_tokens,
+        'total': usage.total_tokens,
+    }
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached = getattr(details, 'cached_tokens', None) if details is not None else None
+    if cached:
+        tokens['cached_input'] = cached
+    return tokens
+
+
+def gemini_tokens(usage_metadata) -> Dict[str, int]:
+    """tokens_used from Gemini usage metadata (implicit caching reports cached_content_token_count)"""
+    tokens = {
+        'input': usage_metadata.prompt_token_count,
+        'output': usage_metadata.candidates_token_count,
+        'total': usage_metadata.total_token_count,
+    }
+    cached = getattr(usage_metadata, 'cached_content_token_count', None)
+    if cached:
+        tokens['cached_input'] = cached
+    return tokens
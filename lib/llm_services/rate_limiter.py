@@ -0,0 +1,364 @@
+import asyncio
+import logging
+import re
+import time
+from typing import Any, Callable, Dict, Mapping, Optional, Set, Tuple
+
+from .settings import env_int
+from .shared_state import SharedStateStore, shared_store
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Continuously refilling budget of `capacity` units per minute (None means unlimited)"""
+
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, capacity: Optional[int]):
+        self.capacity = capacity
+        self.level = float(capacity) if capacity else 0.0
+        self.updated_at = self.clock()
+
+    @property
+    def limited(self) -> bool:
+        return bool(self.capacity)
+
+    def _refill(self):
+        now = self.clock()
+        if self.limited:
+            rate = self.capacity / 60.0
+            self.level = min(float(self.capacity), self.level + (now - self.updated_at) * rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available"""
+        if not self.limited:
+            return 0.0
+        self._refill()
+        # A single request larger than the whole budget only has to wait for a full bucket
+        amount = min(amount, float(self.capacity))
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / (self.capacity / 60.0)
+
+    def consume(self, amount: float):
+        if self.limited:
+            self._refill()
+            self.level -= min(amount, float(self.capacity))
+
+    def adjust(self, delta: float):
+        """Give back (positive) or take (negative) units after the fact"""
+        if self.limited:
+            self._refill()
+            self.level = min(float(self.capacity), self.level + delta)
+
+    def observe(self, limit: Optional[int], remaining: Optional[int]):
+        """Align with the provider's own view of the budget"""
+        if limit:
+            if not self.limited:
+                self.level = float(limit)
+            self.capacity = limit
+        if remaining is not None and self.limited:
+            self._refill()
+            self.level = min(self.level, float(remaining))
+
+    def available(self) -> Optional[int]:
+        if not self.limited:
+            return None
+        self._refill()
+        return int(self.level)
+
+
+class SharedTokenBucket(TokenBucket):
+    """TokenBucket whose level lives in the shared store, so all workers draw from one budget.
+
+    Each call loads the row, applies the normal bucket logic and writes it
+    back in one transaction. Between a wait_time() and the following
+    consume() another worker may take budget, so a bucket can briefly
+    over-admit by one request per worker; the negative level then delays
+    the next callers. Unlimited buckets skip the store until a limit is
+    configured or observed.
+    """
+
+    # Wall-clock time is comparable across processes; monotonic time is not
+    clock = staticmethod(time.time)
+
+    def __init__(self, store: SharedStateStore, key: str, capacity: Optional[int]):
+        super().__init__(capacity)
+        self.store = store
+        self.key = key
+
+    def wait_time(self, amount: float) -> float:
+        if not self.limited:
+            return 0.0
+        with self.store.bucket(self.key, self):
+            return super().wait_time(amount)
+
+    def consume(self, amount: float):
+        if not self.limited:
+            return
+        with self.store.bucket(self.key, self):
+            super().consume(amount)
+
+    def adjust(self, delta: float):
+        if not self.limited:
+            return
+        with self.store.bucket(self.key, self):
+            super().adjust(delta)
+
+    def observe(self, limit: Optional[int], remaining: Optional[int]):
+        with self.store.bucket(self.key, self):
+            super().observe(limit, remaining)
+
+    def available(self) -> Optional[int]:
+        if not self.limited:
+            return None
+        with self.store.bucket(self.key, self):
+            return super().available()
+
+
+class Reservation:
+    """Budget taken for one request, settled once actual usage is known"""
+
+    def __init__(self, limiter: "ModelLimiter", estimated_tokens: int, wait_ms: float):
+        self.limiter = limiter
+        self.estimated_tokens = estimated_tokens
+        self.wait_ms = wait_ms
+        self.settled = False
+
+    def settle(self, actual_tokens: Optional[int] = None, headers: Optional[Mapping[str, str]] = None):
+        """Reconcile the estimate with real usage and any rate-limit headers"""
+        if self.settled:
+            return
+        self.settled = True
+        if actual_tokens:
+            self.limiter.reconcile(self.estimated_tokens, actual_tokens)
+        if headers is not None:
+            self.limiter.update_from_headers(headers)
+
+    def refund(self):
+        """Give the estimate back when the call failed before producing any output"""
+        if self.settled:
+            return
+        self.settled = True
+        self.limiter.refund(self.estimated_tokens)
+
+
+def _parse_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse retry-after style values: '2', '1.5', '6m0s', '20ms'"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r'([\d.]+)(ms|s|m|h)', value):
+        matched = True
+        total += float(amount) * {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}[unit]
+    return total if matched else None
+
+
+# (limit header, remaining header) pairs for requests and tokens, per provider
+_HEADER_NAMES = {
+    'openai': (
+        ('x-ratelimit-limit-requests', 'x-ratelimit-remaining-requests'),
+        ('x-ratelimit-limit-tokens', 'x-ratelimit-remaining-tokens'),
+    ),
+    'anthropic': (
+        ('anthropic-ratelimit-requests-limit', 'anthropic-ratelimit-requests-remaining'),
+        ('anthropic-ratelimit-tokens-limit', 'anthropic-ratelimit-tokens-remaining'),
+    ),
+}
+
+
+class ModelLimiter:
+    """Requests-per-minute and tokens-per-minute budgets for one provider/model.
+
+    Waiters are served strictly in arrival order: the head of the queue holds
+    the lock while it sleeps for budget, so a small request cannot starve a
+    large one that arrived first.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        model_id: str,
+        rpm: Optional[int],
+        tpm: Optional[int],
+        store: Optional[SharedStateStore] = None,
+    ):
+        self.provider = provider
+        self.model_id = model_id
+        self.store = store
+        if store is not None:
+            key = f"{provider}/{model_id}"
+            self.requests = SharedTokenBucket(store, f"{key}:requests", rpm)
+            self.tokens = SharedTokenBucket(store, f"{key}:tokens", tpm)
+        else:
+            self.requests = TokenBucket(rpm)
+            self.tokens = TokenBucket(tpm)
+        self._queue = asyncio.Lock()
+        self._blocked_until = 0.0
+        self.waiting = 0
+        self.acquired = 0
+        self.delayed = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.rate_limited = 0
+        self.estimate_error_tokens = 0
+        self.refunded = 0
+        self._updates: Set[asyncio.Future] = set()
+
+    async def acquire(self, estimated_tokens: int) -> Reservation:
+        """Wait in line until one request and `estimated_tokens` fit in the budgets"""
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._queue:
+                while True:
+                    if self.store is not None:
+                        # Shared buckets are SQLite transactions that can wait on another worker's lock
+                        wait = await asyncio.to_thread(self._try_take, estimated_tokens)
+                    else:
+                        wait = self._try_take(estimated_tokens)
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+        finally:
+            self.waiting -= 1
+
+        wait_ms = (time.monotonic() - started) * 1000
+        self.acquired += 1
+        if wait_ms >= 1:
+            self.delayed += 1
+        self.total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        return Reservation(self, estimated_tokens, wait_ms)
+
+    def _try_take(self, estimated_tokens: int) -> float:
+        """Take one request and the tokens if both fit now, else return the seconds to wait"""
+        wait = max(
+            self._blocked_until_s(),
+            self.requests.wait_time(1),
+            self.tokens.wait_time(estimated_tokens),
+        )
+        if wait <= 0:
+            self.requests.consume(1)
+            self.tokens.consume(estimated_tokens)
+        return wait
+
+    def _update(self, func: Callable[..., Any], *args):
+        """Apply a budget update; shared ones go to a worker thread so callers on the loop never wait for SQLite"""
+        if self.store is None:
+            func(*args)
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            func(*args)
+            return
+        update = loop.run_in_executor(None, func, *args)
+        self._updates.add(update)
+        update.add_done_callback(self._update_done)
+
+    def _update_done(self, update: asyncio.Future):
+        self._updates.discard(update)
+        if not update.cancelled() and update.exception() is not None:
+            logger.warning(f"Could not update shared budget for {self.provider}/{self.model_id}: {update.exception()}")
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: int):
+        self._update(self.tokens.adjust, estimated_tokens - actual_tokens)
+        self.estimate_error_tokens += actual_tokens - estimated_tokens
+
+    def refund(self, estimated_tokens: int):
+        self._update(self.tokens.adjust, estimated_tokens)
+        self.refunded += 1
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        names = _HEADER_NAMES.get(self.provider)
+        if not names:
+            return
+        (req_limit, req_remaining), (tok_limit, tok_remaining) = names
+        self._update(self.requests.observe, _parse_int(headers.get(req_limit)), _parse_int(headers.get(req_remaining)))
+        self._update(self.tokens.observe, _parse_int(headers.get(tok_limit)), _parse_int(headers.get(tok_remaining)))
+
+    def _blocked_until_s(self) -> float:
+        """Seconds left on a 429 back-off (shared by all workers in multi-worker mode)"""
+        if self.store is not None:
+            return self.store.blocked_until(f"{self.provider}/{self.model_id}") - time.time()
+        return self._blocked_until - time.monotonic()
+
+    def block_for(self, seconds: Optional[float]):
+        """Hold every queued request after a 429 instead of letting them all hit the wall"""
+        self.rate_limited += 1
+        seconds = seconds if seconds is not None else 1.0
+        if self.store is not None:
+            self._update(self.store.block_until, f"{self.provider}/{self.model_id}", time.time() + seconds)
+        else:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def record_rate_limit(self, error: Exception):
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        if headers:
+            self.update_from_headers(headers)
+        self.block_for(_parse_duration(headers.get('retry-after')) if headers else None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'rpm_limit': self.requests.capacity,
+            'tpm_limit': self.tokens.capacity,
+            'requests_available': self.requests.available(),
+            'tokens_available': self.tokens.available(),
+            'waiting': self.waiting,
+            'acquired': self.acquired,
+            'delayed': self.delayed,
+            'avg_wait_ms': round(self.total_wait_ms / self.acquired, 2) if self.acquired else 0.0,
+            'max_wait_ms': round(self.max_wait_ms, 2),
+            'rate_limited': self.rate_limited,
+            'estimate_error_tokens': self.estimate_error_tokens,
+            'refunded': self.refunded,
+        }
+
+
+class RateLimiterRegistry:
+    """One limiter per provider/model.
+
+    Budgets come from LLM_RPM_<PROVIDER> / LLM_TPM_<PROVIDER> (0 or unset
+    means no local budget until the provider's rate-limit headers reveal one).
+    With LLM_SHARED_STATE_DIR set, budgets are shared by every worker process.
+    """
+
+    def __init__(self):
+        self._limiters: Dict[Tuple[str, str], ModelLimiter] = {}
+
+    def get(self, provider: str, model_id: str) -> ModelLimiter:
+        key = (provider, model_id)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = ModelLimiter(
+                provider,
+                model_id,
+                env_int(f'LLM_RPM_{provider.upper()}', 0) or None,
+                env_int(f'LLM_TPM_{provider.upper()}', 0) or None,
+                shared_store,
+            )
+            self._limiters[key] = limiter
+        return limiter
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        # A copy, since /stats reads shared budgets from a worker thread while the loop may add limiters
+        return {f"{provider}/{model_id}": limiter.stats() for (provider, model_id), limiter in list(self._limiters.items())}
+
+
+rate_limiters = RateLimiterRegistry()
@@ -0,0 +1,189 @@
+import asyncio
+import inspect
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .fingerprint import request_fingerprint
+from .settings import env_float, env_int
+from .thread_bridge import InstrumentedExecutor
+
+logger = logging.getLogger(__name__)
+
+RECORD_VERSION = 1
+
+_signatures: Dict[Callable, inspect.Signature] = {}
+
+
+def request_fields(func: Callable, llm, args: Tuple, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """The generation parameters of a provider call, however the caller passed them"""
+    signature = _signatures.get(func)
+    if signature is None:
+        signature = _signatures[func] = inspect.signature(func)
+    bound = signature.bind(llm, *args, **kwargs)
+    bound.apply_defaults()
+    values = bound.arguments
+    fields = {
+        'system_prompt': values.get('system_prompt') or "",
+        'user_prompt': values.get('user_prompt', ""),
+        'temperature': values.get('temperature', 1.0),
+        'max_tokens': values.get('max_tokens', 2048),
+        'top_p': values.get('top_p', 1.0),
+    }
+    history = values.get('kwargs', {}).get('history')
+    if history:
+        # Session turns; absent for single-turn calls so their captures stay as they were
+        fields['history'] = history
+    return fields
+
+
+def fingerprint_of(model_id: str, request: Dict[str, Any]) -> str:
+    return request_fingerprint(
+        model_id,
+        request['system_prompt'],
+        request['user_prompt'],
+        request['temperature'],
+        request['max_tokens'],
+        request['top_p'],
+        history=request.get('history'),
+    )
+
+
+class TrafficRecorder:
+    """Append-only JSONL capture of provider calls: request, response and chunk timing.
+
+    record() only appends to an in-memory batch; a background task hands
+    batches to a dedicated writer thread every `flush_interval_s` (sooner
+    once `max_batch` entries are waiting), so the event loop never touches
+    the file. Each batch is a single append, so several worker processes
+    can share one file. Entries beyond `max_pending` are dropped and
+    counted rather than growing memory without bound.
+    """
+
+    def __init__(self, path: str, flush_interval_s: float, max_batch: int, max_pending: int):
+        self.path = path
+        self.flush_interval_s = flush_interval_s
+        self.max_batch = max(1, max_batch)
+        self.max_pending = max_pending
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self._pending: List[Dict[str, Any]] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task = None
+        self._executor = InstrumentedExecutor('recorder', 1)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def record(self, entry: Dict[str, Any]):
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        entry['v'] = RECORD_VERSION
+        self._pending.append(entry)
+        self.recorded += 1
+        # Calls made outside the app lifespan (scripts, tests) start the writer on demand
+        self.start()
+        if len(self._pending) >= self.max_batch:
+            self._wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except OSError as e:
+                logger.warning(f"Could not write traffic recording to {self.path}: {e}")
+
+    async def flush(self):
+        batch, self._pending = self._pending, []
+        if batch:
+            await self._executor.run(lambda: self._write(batch))
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        data = "".join(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n" for entry in batch)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(data)
+        self.written += len(batch)
+        self.batches += 1
+
+    def record_generate(self, llm, request: Dict[str, Any], started_at: float, response) -> None:
+        self.record({
+            'ts': started_at,
+            'fingerprint': fingerprint_of(llm.model_id, request),
+            'provider': llm.provider,
+            'model': llm.model_id,
+            'mode': 'generate',
+            'request': request,
+            'response': {
+                'text': response.text,
+                'status': response.status,
+                'error_message': response.error_message,
+                'tokens_used': response.tokens_used,
+                'response_time_ms': response.response_time_ms,
+            },
+        })
+
+    def record_stream(self, llm, request: Dict[str, Any], started_at: float, chunks: List[Tuple[float, str]], stats) -> None:
+        self.record({
+            'ts': started_at,
+            'fingerprint': fingerprint_of(llm.model_id, request),
+            'provider': llm.provider,
+            'model': llm.model_id,
+            'mode': 'stream',
+            'request': request,
+            # [ms since the call started, text]
+            'chunks': [[round(offset_ms, 1), text] for offset_ms, text in chunks],
+            'response': {
+                'status': stats.status,
+                'tokens_used': stats.tokens_used,
+                'ttft_ms': stats.ttft_ms,
+                'response_time_ms': int(stats.duration_ms),
+            },
+        })
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'path': self.path,
+            'recorded': self.recorded,
+            'written': self.written,
+            'pending': len(self._pending),
+            'dropped': self.dropped,
+            'batches': self.batches,
+        }
+
+
+def _open_recorder() -> Optional[TrafficRecorder]:
+    path = os.getenv('LLM_RECORD_PATH', '')
+    if not path:
+        return None
+    logger.info(f"Recording provider traffic to {path}")
+    return TrafficRecorder(
+        path,
+        env_float('LLM_RECORD_FLUSH_INTERVAL_S', 0.5),
+        env_int('LLM_RECORD_MAX_BATCH', 500),
+        env_int('LLM_RECORD_MAX_PENDING', 10000),
+    )
+
+
+# None unless LLM_RECORD_PATH is set
+recorder = _open_recorder()
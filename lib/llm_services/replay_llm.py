@@ -0,0 +1,198 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .base_llm import BaseLLM, LLMResponse
+from .fingerprint import request_fingerprint
+from .settings import env_float
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayStore:
+    """Recorded calls from LLM_REPLAY_PATH (a JSONL capture, or a directory of them), by fingerprint"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._by_fingerprint: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._by_model: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._next: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self.entries = 0
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+        files = [path]
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.jsonl'))
+        for name in files:
+            self._load(name)
+        logger.info(f"Loaded {self.entries} recorded calls from {path}")
+
+    def _load(self, name: str):
+        with open(name, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    fingerprint = entry['fingerprint']
+                    model = entry['model']
+                except (ValueError, KeyError):
+                    # A torn last line from a recorder that was killed mid-write
+                    self.skipped += 1
+                    continue
+                self._by_fingerprint[fingerprint].append(entry)
+                self._by_model[model].append(entry)
+                self.entries += 1
+
+    def _pick(self, key: str, candidates: List[Dict[str, Any]], mode: str) -> Dict[str, Any]:
+        """Prefer recordings of the same mode; repeated requests cycle through the recordings"""
+        same_mode = [entry for entry in candidates if entry.get('mode') == mode] or candidates
+        with self._lock:
+            index = self._next[key]
+            self._next[key] = index + 1
+        return same_mode[index % len(same_mode)]
+
+    def find(self, fingerprint: str, model_id: str, mode: str, on_miss: str) -> Optional[Dict[str, Any]]:
+        candidates = self._by_fingerprint.get(fingerprint)
+        if candidates:
+            self.hits += 1
+            return self._pick(fingerprint, candidates, mode)
+        self.misses += 1
+        if on_miss == 'model' and self._by_model.get(model_id):
+            return self._pick(f"model:{model_id}", self._by_model[model_id], mode)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'path': self.path,
+            'entries': self.entries,
+            'skipped_lines': self.skipped,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+_store: Optional[ReplayStore] = None
+_store_lock = threading.Lock()
+
+
+def replay_store() -> ReplayStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ReplayStore(os.environ['LLM_REPLAY_PATH'])
+    return _store
+
+
+def _chunks(entry: Dict[str, Any]) -> List[List[Any]]:
+    """[offset_ms, text] pairs; a recorded generate() becomes one chunk at its response time"""
+    if entry.get('chunks') is not None:
+        return entry['chunks']
+    response = entry['response']
+    return [[response.get('response_time_ms', 0), response.get('text') or response.get('error_message') or ""]]
+
+
+class ReplayLLM(BaseLLM):
+    """Serves recorded provider responses instead of calling the provider.
+
+    Calls are matched to the capture by request fingerprint (model, prompts,
+    sampling parameters), so the same traffic replays against the service
+    without API keys or network. Timing follows the recording divided by
+    LLM_REPLAY_SPEED (2 = twice as fast, 0 = no delays). Requests with no
+    recording fail, or with LLM_REPLAY_ON_MISS=model get any recording of
+    the same model.
+    """
+
+    provider = "replay"
+    recordable = False  # replaying a capture must not append to one
+
+    def __init__(self, api_key: str, model_id: str):
+        super().__init__(api_key, model_id)
+        self.store = self.load_store()
+        self.speed = env_float('LLM_REPLAY_SPEED', 1.0)
+        self.on_miss = os.getenv('LLM_REPLAY_ON_MISS', 'error')
+
+    @staticmethod
+    def load_store() -> ReplayStore:
+        return replay_store()
+
+    def _find(self, system_prompt, user_prompt, temperature, max_tokens, top_p, mode, history=None) -> Optional[Dict[str, Any]]:
+        fingerprint = request_fingerprint(
+            self.model_id, system_prompt, user_prompt, temperature, max_tokens, top_p, history=history or None
+        )
+        return self.store.find(fingerprint, self.model_id, mode, self.on_miss)
+
+    async def _sleep_until(self, started: float, offset_ms: float):
+        if self.speed <= 0:
+            return
+        delay = offset_ms / 1000 / self.speed - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _miss_message(self) -> str:
+        return f"No recorded response for this {self.model_id} request in {self.store.path}"
+
+    async def generate(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        temperature: float = 1.0,
+        max_tokens: int = 2048,
+        top_p: float = 1.0,
+        **kwargs
+    ) -> LLMResponse:
+        """Return the recorded response after its recorded (scaled) latency"""
+        started = time.perf_counter()
+        entry = self._find(system_prompt, user_prompt, temperature, max_tokens, top_p, 'generate', kwargs.get('history'))
+        if entry is None:
+            return LLMResponse(
+                text="",
+                model=self.model_id,
+                tokens_used={'input': 0, 'output': 0, 'total': 0},
+                response_time_ms=0,
+                status="error",
+                error_message=self._miss_message()
+            )
+        response = entry['response']
+        chunks = _chunks(entry)
+        text = response['text'] if 'text' in response else "".join(text for _, text in chunks)
+        await self._sleep_until(started, response.get('response_time_ms') or (chunks[-1][0] if chunks else 0))
+        return LLMResponse(
+            text=text,
+            model=self.model_id,
+            tokens_used=dict(response.get('tokens_used') or {'input': 0, 'output': 0, 'total': 0}),
+            response_time_ms=int((time.perf_counter() - started) * 1000),
+            status=response.get('status', 'success'),
+            error_message=response.get('error_message')
+        )
+
+    async def stream_generate(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        temperature: float = 1.0,
+        max_tokens: int = 2048,
+        top_p: float = 1.0,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """Re-emit the recorded chunks at their recorded (scaled) offsets"""
+        started = time.perf_counter()
+        entry = self._find(system_prompt, user_prompt, temperature, max_tokens, top_p, 'stream', kwargs.get('history'))
+        if entry is None:
+            self.record_error()
+            yield f"Error: {self._miss_message()}"
+            return
+        response = entry['response']
+        if response.get('status', 'success') != 'success':
+            self.record_error()
+        for offset_ms, text in _chunks(entry):
+            await self._sleep_until(started, offset_ms)
+            yield text
+        if response.get('tokens_used'):
+            self.record_usage(response['tokens_used'])
@@ -0,0 +1,247 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, fields, replace
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .base_llm import LLMResponse
+from .settings import env_bool, env_float, env_int
+from .shared_state import shared_path
+
+logger = logging.getLogger(__name__)
+
+_RESPONSE_FIELDS = {f.name for f in fields(LLMResponse)}
+
+
+class SQLiteCacheTier:
+    """Persistent cache tier so cached responses survive a restart"""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses(created_at)")
+        self._writes = 0
+
+    def get(self, key: str, ttl: float) -> Optional[Tuple[Dict[str, Any], float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if ttl > 0 and time.time() - row[1] > ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            return json.loads(row[0]), row[1]
+
+    def put(self, key: str, value: Dict[str, Any], created_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), created_at)
+            )
+            self._writes += 1
+            # Prune occasionally rather than on every write
+            if self._writes % 100 == 0:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    " SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """LRU + TTL cache of successful LLM responses with an optional SQLite tier.
+
+    Only deterministic requests (temperature 0) are cached unless
+    LLM_CACHE_NONDETERMINISTIC is set, since sampling at a higher temperature
+    is usually the point of re-running a prompt.
+    """
+
+    def __init__(
+        self,
+        enabled: Optional[bool] = None,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        sqlite_path: Optional[str] = None,
+        cache_nondeterministic: Optional[bool] = None,
+    ):
+        self.enabled = env_bool('LLM_CACHE_ENABLED', True) if enabled is None else enabled
+        self.max_entries = max_entries or env_int('LLM_CACHE_MAX_ENTRIES', 1024)
+        self.max_bytes = max_bytes or env_int('LLM_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else env_float('LLM_CACHE_TTL', 3600.0)
+        if cache_nondeterministic is None:
+            cache_nondeterministic = env_bool('LLM_CACHE_NONDETERMINISTIC', False)
+        self.cache_nondeterministic = cache_nondeterministic
+
+        self._entries: "OrderedDict[str, Tuple[LLMResponse, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        if sqlite_path is None:
+            # In multi-worker mode the disk tier doubles as the cache shared between workers
+            sqlite_path = os.getenv('LLM_CACHE_SQLITE_PATH', '') or shared_path('response_cache.sqlite3') or ''
+        self.disk: Optional[SQLiteCacheTier] = None
+        if self.enabled and sqlite_path:
+            try:
+                self.disk = SQLiteCacheTier(sqlite_path, env_int('LLM_CACHE_DISK_MAX_ENTRIES', 100000))
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache disk tier disabled ({sqlite_path}): {e}")
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.saved_latency_ms = 0
+
+    def is_cacheable(self, temperature: float, use_cache: bool = True) -> bool:
+        """Apply the per-request opt-out and the deterministic-only policy"""
+        if not self.enabled or not use_cache:
+            return False
+        return self.cache_nondeterministic or temperature <= 0
+
+    @staticmethod
+    def _entry_size(response: LLMResponse) -> int:
+        return len(response.text.encode('utf-8')) + 256
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+
+    def _remember(self, key: str, response: LLMResponse, created_at: float):
+        size = self._entry_size(response)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (response, created_at, size)
+            self._bytes += size
+            self._evict()
+
+    def _hit(self, response: LLMResponse, started: float, record: bool = True) -> LLMResponse:
+        if record:
+            self.hits += 1
+            self.saved_latency_ms += response.response_time_ms
+        return replace(
+            response,
+            cache_hit=True,
+            saved_latency_ms=response.response_time_ms,
+            response_time_ms=int((time.perf_counter() - started) * 1000)
+        )
+
+    async def get(self, key: str, record: bool = True) -> Optional[LLMResponse]:
+        """Look a fingerprint up in memory, then on disk (record=False leaves the hit/miss counters alone)"""
+        started = time.perf_counter()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                response, created_at, size = entry
+                if self.ttl_seconds > 0 and now - created_at > self.ttl_seconds:
+                    del self._entries[key]
+                    self._bytes -= size
+                else:
+                    self._entries.move_to_end(key)
+                    return self._hit(response, started, record)
+
+        if self.disk is not None:
+            try:
+                found = await asyncio.to_thread(self.disk.get, key, self.ttl_seconds)
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache disk read failed: {e}")
+                found = None
+            if found is not None:
+                value, created_at = found
+                response = LLMResponse(**{k: v for k, v in value.items() if k in _RESPONSE_FIELDS})
+                self._remember(key, response, created_at)
+                if record:
+                    self.disk_hits += 1
+                return self._hit(response, started, record)
+
+        if record:
+            self.misses += 1
+        return None
+
+    async def put(self, key: str, response: LLMResponse):
+        """Store a successful response under its fingerprint"""
+        if response.status != "success" or response.cache_hit:
+            return
+        created_at = time.time()
+        self._remember(key, response, created_at)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.put, key, asdict(response), created_at)
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache disk write failed: {e}")
+
+    async def get_or_generate(
+        self,
+        key: str,
+        temperature: float,
+        use_cache: bool,
+        generate: Callable[[], Awaitable[LLMResponse]]
+    ) -> LLMResponse:
+        """Serve from cache when the policy allows it, otherwise call generate and remember the result"""
+        if not self.is_cacheable(temperature, use_cache):
+            self.skipped += 1
+            return await generate()
+
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+
+        response = await generate()
+        await self.put(key, response)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = len(self._entries)
+            size = self._bytes
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'skipped': self.skipped,
+            'entries': entries,
+            'bytes': size,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl_seconds,
+            'disk_enabled': self.disk is not None,
+            'saved_latency_ms': self.saved_latency_ms,
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import nullcontext
+from dataclasses import fields
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from .base_llm import BaseLLM, LLMResponse
+from .circuit_breaker import OPEN, breakers
+from .concurrency import provider_concurrency
+from .metrics import CallStats, current_call, model_scores, unbind_call
+from .settings import env_int
+from .tokenizer import token_counter
+
+logger = logging.getLogger(__name__)
+
+AUTO_PREFIX = 'auto:'
+CHAIN_SEPARATOR = '->'
+
+# Candidate models per tier, best first; override one with LLM_ROUTER_TIER_<NAME>="a -> b -> c"
+DEFAULT_TIERS: Dict[str, List[str]] = {
+    'fast': ['gemini-2.5-flash', 'gpt-4o-mini', 'claude-3-5-haiku-20241022'],
+    'balanced': ['gpt-4o', 'claude-sonnet-4-20250514', 'gemini-2.5-flash'],
+    'best': ['claude-opus-4-1-20250805', 'gpt-5', 'gemini-2.5-pro'],
+    'mock': ['mock-fast', 'mock-slow'],
+}
+
+# Latency SLO per attempt before moving to the next model; 0 disables it (requests can override)
+DEFAULT_SLO_MS = env_int('LLM_ROUTER_SLO_MS', 0)
+
+
+def is_routed(model_id: str) -> bool:
+    return model_id.startswith(AUTO_PREFIX) or CHAIN_SEPARATOR in model_id
+
+
+def parse_chain(text: str) -> List[str]:
+    return [model.strip() for model in text.split(CHAIN_SEPARATOR) if model.strip()]
+
+
+def tier_names() -> List[str]:
+    names = list(DEFAULT_TIERS)
+    for key in os.environ:
+        if key.startswith('LLM_ROUTER_TIER_'):
+            name = key[len('LLM_ROUTER_TIER_'):].lower()
+            if name and name not in names:
+                names.append(name)
+    return names
+
+
+def tier_models(tier: str) -> List[str]:
+    override = os.getenv(f'LLM_ROUTER_TIER_{tier.upper()}')
+    if override:
+        return parse_chain(override)
+    return list(DEFAULT_TIERS.get(tier, []))
+
+
+def resolve(model_id: str) -> Tuple[List[str], bool]:
+    """Candidate models for a routed id, and whether live scores may reorder them.
+
+    auto:<tier> is adaptive; an explicit "a -> b -> c" chain keeps its order
+    and only falls through on failure.
+    """
+    if model_id.startswith(AUTO_PREFIX):
+        tier = model_id[len(AUTO_PREFIX):]
+        models = tier_models(tier)
+        if not models:
+            raise ValueError(f"Unknown router tier: {tier}")
+        return models, True
+    models = parse_chain(model_id)
+    if not models:
+        raise ValueError(f"Empty fallback chain: {model_id}")
+    return models, False
+
+
+def expected_latency_ms(model: str, mode: str) -> float:
+    """Latency inflated by the chance of having to fall through; models never seen score 0 so they get tried"""
+    score = model_scores.get(model, mode)
+    if score is None:
+        return 0.0
+    return score['latency_ms'] / max(0.05, 1.0 - score['error_rate'])
+
+
+class RoutedLLM:
+    """Stands in for a provider LLM and serves each call from the first model in its chain that works.
+
+    Models whose circuit is open go last. A model that errors, or that is
+    still running when latency_slo_ms expires, is abandoned for the next one;
+    the final candidate always runs to completion. Responses name the model
+    that actually served the call and every attempt made. With
+    provider_slots=True each attempt holds a concurrency slot of the
+    provider it goes to, so batches stay under the real per-provider caps.
+    """
+
+    provider = 'router'
+
+    def __init__(
+        self,
+        model_id: str,
+        create_llm: Callable[[str], BaseLLM],
+        provider_for: Callable[[str], str],
+    ):
+        self.model_id = model_id
+        self.models, self.adaptive = resolve(model_id)
+        self._create_llm = create_llm
+        self._provider_for = provider_for
+
+    def candidates(self, mode: str) -> List[str]:
+        order = {model: position for position, model in enumerate(self.models)}
+
+        def rank(model):
+            circuit_open = breakers.enabled and breakers.get(self._provider_for(model), model).state == OPEN
+            latency = expected_latency_ms(model, mode) if self.adaptive else 0.0
+            return (circuit_open, latency, order[model])
+
+        return sorted(self.models, key=rank)
+
+    async def _prepare(
+        self, model: str, system_prompt: str, user_prompt: str, max_tokens: int, history=None
+    ) -> Tuple[BaseLLM, int]:
+        """Concrete LLM for a candidate and max_tokens clamped to its limits; ValueError if it can't serve"""
+        llm = self._create_llm(model)
+        provider = self._provider_for(model)
+        await token_counter.precount_prompt(provider, model, system_prompt, user_prompt, history)
+        check = token_counter.preflight(provider, model, system_prompt, user_prompt, max_tokens, "clamp", history)
+        return llm, check.max_tokens
+
+    def _slot(self, model: str, provider_slots: bool):
+        return provider_concurrency.slot(self._provider_for(model)) if provider_slots else nullcontext()
+
+    async def generate(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        temperature: float = 1.0,
+        max_tokens: int = 2048,
+        top_p: float = 1.0,
+        latency_slo_ms: Optional[int] = None,
+        provider_slots: bool = False,
+        **kwargs
+    ) -> LLMResponse:
+        slo_ms = DEFAULT_SLO_MS if latency_slo_ms is None else latency_slo_ms
+        candidates = self.candidates('generate')
+        attempts: List[Dict[str, Any]] = []
+        response = None
+        started = time.time()
+        for position, model in enumerate(candidates):
+            try:
+                llm, model_max_tokens = await self._prepare(
+                    model, system_prompt, user_prompt, max_tokens, kwargs.get('history')
+                )
+            except ValueError as e:  # no API key, or the prompt doesn't fit this model
+                attempts.append({'model': model, 'status': 'skipped', 'error_message': str(e)})
+                continue
+            last = position == len(candidates) - 1
+            attempt_started = time.perf_counter()
+            try:
+                async with self._slot(model, provider_slots):
+                    call = llm.generate(
+                        system_prompt=system_prompt,
+                        user_prompt=user_prompt,
+                        temperature=temperature,
+                        max_tokens=model_max_tokens,
+                        top_p=top_p,
+                        **kwargs
+                    )
+                    response = await (asyncio.wait_for(call, slo_ms / 1000) if slo_ms and not last else call)
+            except asyncio.TimeoutError:
+                model_scores.record(model, 'generate', slo_ms, False)
+                attempts.append({'model': model, 'status': 'slo_exceeded', 'response_time_ms': slo_ms})
+                logger.info(f"{self.model_id}: {model} exceeded {slo_ms} ms, trying the next model")
+                continue
+            except Exception as e:
+                elapsed_ms = int((time.perf_counter() - attempt_started) * 1000)
+                attempts.append({'model': model, 'status': 'error', 'response_time_ms': elapsed_ms, 'error_message': str(e)})
+                continue
+            attempts.append({'model': model, 'status': response.status, 'response_time_ms': response.response_time_ms})
+            if response.status == 'success':
+                break
+            logger.info(f"{self.model_id}: {model} returned {response.status}, trying the next model")
+
+        if response is None:
+            response = LLMResponse(
+                text="",
+                model=self.model_id,
+                tokens_used={'input': 0, 'output': 0, 'total': 0},
+                response_time_ms=0,
+                status="error",
+                error_message="No model in the chain could serve the request"
+            )
+        # Report the whole routed call's time, including abandoned attempts
+        response.response_time_ms = int((time.time() - started) * 1000)
+        response.routed_from = self.model_id
+        response.attempts = attempts
+        return response
+
+    async def stream_generate(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        temperature: float = 1.0,
+        max_tokens: int = 2048,
+        top_p: float = 1.0,
+        call_stats: Optional[CallStats] = None,
+        latency_slo_ms: Optional[int] = None,
+        provider_slots: bool = False,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """Stream from the first model that produces a good first chunk in time.
+
+        Falling through is only possible before any text reaches the caller,
+        so the SLO applies to time to first token.
+        """
+        slo_ms = DEFAULT_SLO_MS if latency_slo_ms is None else latency_slo_ms
+        candidates = self.candidates('stream')
+        attempts: List[Dict[str, Any]] = []
+        stats = CallStats()
+        served = False
+        token = None
+        try:
+            for position, model in enumerate(candidates):
+                try:
+                    llm, model_max_tokens = await self._prepare(
+                        model, system_prompt, user_prompt, max_tokens, kwargs.get('history')
+                    )
+                except ValueError as e:  # no API key, or the prompt doesn't fit this model
+                    attempts.append({'model': model, 'status': 'skipped', 'error_message': str(e)})
+                    continue
+                stats = CallStats()
+                # The SLO wait runs the first step in its own task; binding the stats here keeps
+                # later steps, which run in this context, reporting usage into the same call
+                bound = current_call.set(stats)
+                token = token or bound
+                async with self._slot(model, provider_slots):
+                    chunks = llm.stream_generate(
+                        system_prompt=system_prompt,
+                        user_prompt=user_prompt,
+                        temperature=temperature,
+                        max_tokens=model_max_tokens,
+                        top_p=top_p,
+                        call_stats=stats,
+                        **kwargs
+                    )
+                    last = position == len(candidates) - 1
+                    attempt_started = time.perf_counter()
+                    try:
+                        first = chunks.__anext__()
+                        first = await (asyncio.wait_for(first, slo_ms / 1000) if slo_ms and not last else first)
+                    except StopAsyncIteration:
+                        first = None
+                    except asyncio.TimeoutError:
+                        await chunks.aclose()
+                        model_scores.record(model, 'stream', slo_ms, False)
+                        attempts.append({'model': model, 'status': 'slo_exceeded', 'ttft_ms': slo_ms})
+                        logger.info(f"{self.model_id}: {model} had no first token after {slo_ms} ms, trying the next model")
+                        continue
+                    # Providers report stream failures in-band, marking the call as failed first
+                    if stats.status != 'success' and not last:
+                        await chunks.aclose()
+                        attempts.append({
+                            'model': model,
+                            'status': stats.status,
+                            'ttft_ms': int((time.perf_counter() - attempt_started) * 1000),
+                            'error_message': first,
+                        })
+                        logger.info(f"{self.model_id}: {model} stream failed, trying the next model")
+                        continue
+                    served = True
+                    try:
+                        if first is not None:
+                            yield first
+                        async for chunk in chunks:
+                            yield chunk
+                    finally:
+                        await chunks.aclose()
+                    attempts.append({'model': model, 'status': stats.status, 'ttft_ms': int(stats.ttft_ms or 0)})
+                    break
+
+            if not served:
+                yield "Error: No model in the chain could serve the request"
+                stats.status = 'error'
+            if call_stats is not None:
+                for f in fields(CallStats):
+                    setattr(call_stats, f.name, getattr(stats, f.name))
+                call_stats.routed_from = self.model_id
+                call_stats.attempts = attempts
+        finally:
+            if token is not None:
+                unbind_call(token)
@@ -0,0 +1,412 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from .llm_factory import LLMFactory
+from .router import is_routed, resolve
+from .settings import env_float, env_int
+from .tokenizer import MESSAGE_OVERHEAD_TOKENS, model_limits, token_counter
+
+logger = logging.getLogger(__name__)
+
+# Compaction estimates use the provider-neutral heuristic; fitting a turn to a model uses that model's tokenizer
+_ESTIMATE = ('session', 'session')
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Merge the previous summary with the new turns into one concise summary that keeps names, numbers, "
+    "decisions, open questions and the user's stated preferences. Write it in the conversation's language. "
+    "Reply with the summary only."
+)
+
+
+class SessionNotFound(LookupError):
+    """No session with this id (never created, deleted, expired or evicted)"""
+
+
+class SessionBusy(Exception):
+    """Another turn of the session is still running"""
+
+
+def validate_messages(messages: List[Dict[str, str]]):
+    """Seed history must be complete user/assistant pairs, oldest first"""
+    if len(messages) % 2:
+        raise ValueError("Session messages must be user/assistant pairs")
+    for index, message in enumerate(messages):
+        expected = 'user' if index % 2 == 0 else 'assistant'
+        if message.get('role') != expected:
+            raise ValueError(f"Session message {index} must have role {expected!r}")
+        if not isinstance(message.get('content'), str):
+            raise ValueError(f"Session message {index} has no text content")
+
+
+class Session:
+    """Message history of one conversation"""
+
+    def __init__(self, session_id: str, system_prompt: str):
+        self.session_id = session_id
+        self.system_prompt = system_prompt or ""
+        self.messages: List[Dict[str, str]] = []
+        self.message_tokens: List[int] = []  # heuristic estimate per message
+        self.summary = ""
+        self.summarized_messages = 0
+        self.turns = 0
+        self.created_at = time.time()
+        self.last_used = time.monotonic()
+        self.size_bytes = 0
+        self.lock = asyncio.Lock()
+        self.summary_task: Optional[asyncio.Task] = None
+
+    @property
+    def busy(self) -> bool:
+        return self.lock.locked()
+
+    @property
+    def history_tokens(self) -> int:
+        return sum(self.message_tokens)
+
+    def effective_system_prompt(self, system_prompt: Optional[str] = None) -> str:
+        base = self.system_prompt if system_prompt is None else system_prompt
+        if not self.summary:
+            return base
+        # After the stable system prompt, so the summary only changes the prefix when it is rewritten
+        return f"{base}\n\nSummary of the earlier conversation:\n{self.summary}".lstrip()
+
+    def append(self, role: str, content: str):
+        self.messages.append({'role': role, 'content': content})
+        self.message_tokens.append(token_counter.count(*_ESTIMATE, content) + MESSAGE_OVERHEAD_TOKENS)
+
+    def drop_oldest(self, count: int) -> List[Dict[str, str]]:
+        dropped = self.messages[:count]
+        del self.messages[:count]
+        del self.message_tokens[:count]
+        return dropped
+
+    def measure(self) -> int:
+        self.size_bytes = (
+            sys.getsizeof(self.system_prompt)
+            + sys.getsizeof(self.summary)
+            + sum(sys.getsizeof(m['content']) for m in self.messages)
+        )
+        return self.size_bytes
+
+    def to_dict(self, include_messages: bool = False) -> Dict[str, Any]:
+        info = {
+            'session_id': self.session_id,
+            'system_prompt': self.system_prompt,
+            'summary': self.summary or None,
+            'summarized_messages': self.summarized_messages,
+            'turns': self.turns,
+            'messages': len(self.messages),
+            'history_tokens': self.history_tokens,
+            'size_bytes': self.size_bytes,
+            'created_at': self.created_at,
+            'idle_s': round(time.monotonic() - self.last_used, 1),
+            'busy': self.busy,
+        }
+        if include_messages:
+            info['messages'] = list(self.messages)
+        return info
+
+
+class SessionTurn:
+    """One /generate call inside a session; holds the session's lock until released"""
+
+    def __init__(self, store: 'SessionStore', session: Session, system_prompt: Optional[str]):
+        self.store = store
+        self.session = session
+        # A request's own system prompt replaces the session's once the turn succeeds
+        self.system_prompt_override = system_prompt or None
+        self.history: List[Dict[str, str]] = []
+        self.released = False
+
+    @property
+    def system_prompt(self) -> str:
+        return self.session.effective_system_prompt(self.system_prompt_override)
+
+    def fit(self, provider: str, model_id: str, user_prompt: str, max_tokens: int) -> List[Dict[str, str]]:
+        """History for this call, oldest pairs left out when the model's window can't hold all of it"""
+        self.history = self.store.fit(self.session, provider, model_id, self.system_prompt, user_prompt, max_tokens)
+        return self.history
+
+    def commit(self, user_prompt: str, reply: str):
+        if self.released:
+            return
+        if self.system_prompt_override is not None:
+            self.session.system_prompt = self.system_prompt_override
+        self.store.commit(self.session, user_prompt, reply)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.store.release(self.session)
+
+
+class SessionStore:
+    """In-process conversation histories, so clients send only the new turn.
+
+    Each call gets the stored history assembled into the provider's message
+    list. Memory is bounded by session count and total text size (least
+    recently used idle sessions go first) and an idle TTL. Inside a session,
+    history beyond `history_tokens` is compacted by dropping the oldest turns
+    down to `keep_ratio` of that budget, and optionally folding them into a
+    summary written by `summary_model` in the background. Compacting in steps
+    rather than one turn at a time keeps the prompt prefix unchanged for
+    several turns, which is what provider prefix caches key on.
+
+    Sessions live in one process: with several workers a conversation must
+    stay on the worker that created it (a client seeing 404 can re-create it
+    with its messages).
+    """
+
+    def __init__(
+        self,
+        max_sessions: int,
+        max_bytes: int,
+        idle_ttl_s: float,
+        history_tokens: int,
+        keep_ratio: float,
+        summary_model: str,
+        summary_tokens: int,
+        turn_wait_s: float,
+        summary_wait_s: float,
+    ):
+        self.max_sessions = max(1, max_sessions)
+        self.max_bytes = max_bytes
+        self.idle_ttl_s = idle_ttl_s
+        self.history_tokens = history_tokens
+        self.keep_ratio = min(max(keep_ratio, 0.0), 1.0)
+        self.summary_model = summary_model
+        self.summary_tokens = summary_tokens
+        self.turn_wait_s = turn_wait_s
+        self.summary_wait_s = summary_wait_s
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.total_bytes = 0
+        self.created = 0
+        self.evicted = 0
+        self.expired = 0
+        self.compactions = 0
+        self.summaries = 0
+        self.summary_failures = 0
+        self.trimmed_calls = 0
+
+    def create(
+        self,
+        session_id: Optional[str] = None,
+        system_prompt: str = "",
+        messages: Optional[List[Dict[str, str]]] = None,
+    ) -> Session:
+        """New session, optionally seeded with earlier user/assistant messages; replaces an idle one with the same id"""
+        messages = messages or []
+        validate_messages(messages)
+        session_id = session_id or uuid.uuid4().hex
+        existing = self._sessions.get(session_id)
+        if existing is not None:
+            if existing.busy:
+                raise SessionBusy(f"Session {session_id} has a turn in progress")
+            self._remove(session_id)
+        session = Session(session_id, system_prompt)
+        for message in messages:
+            session.append(message['role'], message['content'])
+        self._compact(session)
+        self.total_bytes += session.measure()
+        self._sessions[session_id] = session
+        self.created += 1
+        self._evict()
+        return session
+
+    def get(self, session_id: str) -> Session:
+        session = self._sessions.get(session_id)
+        if session is not None and not session.busy and self._idle_expired(session):
+            self._remove(session_id)
+            self.expired += 1
+            session = None
+        if session is None:
+            raise SessionNotFound(f"Unknown or expired session {session_id}")
+        return session
+
+    def delete(self, session_id: str) -> Session:
+        session = self.get(session_id)
+        self._remove(session_id)
+        return session
+
+    async def begin(self, session_id: str, system_prompt: Optional[str] = None) -> SessionTurn:
+        """Wait for the session's previous turn (and pending summary), then open a new turn"""
+        session = self.get(session_id)
+        try:
+            await asyncio.wait_for(session.lock.acquire(), self.turn_wait_s)
+        except asyncio.TimeoutError:
+            raise SessionBusy(f"Session {session_id} is still answering an earlier turn")
+        try:
+            if self._sessions.get(session_id) is not session:
+                raise SessionNotFound(f"Session {session_id} was deleted")
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            if session.summary_task is not None and not session.summary_task.done():
+                try:
+                    # The summary replaces turns already dropped from the history; without it they'd be missing
+                    await asyncio.wait_for(asyncio.shield(session.summary_task), self.summary_wait_s)
+                except asyncio.TimeoutError:
+                    logger.warning(f"Session {session_id}: summary not ready after {self.summary_wait_s}s, continuing without it")
+        except BaseException:
+            session.lock.release()
+            raise
+        return SessionTurn(self, session, system_prompt)
+
+    def fit(
+        self,
+        session: Session,
+        provider: str,
+        model_id: str,
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int,
+    ) -> List[Dict[str, str]]:
+        history = session.messages
+        windows = [model_limits(model) for model in (resolve(model_id)[0] if is_routed(model_id) else [model_id])]
+        windows = [limits for limits in windows if limits is not None]
+        if not history or not windows:
+            return list(history)
+        limits = min(windows, key=lambda limits: limits.context_window)
+        budget = (
+            limits.context_window
+            - token_counter.count_prompt(provider, model_id, system_prompt, user_prompt)
+            - min(max_tokens, limits.max_output_tokens)
+        )
+        sizes = [token_counter.count(provider, model_id, m['content']) + MESSAGE_OVERHEAD_TOKENS for m in history]
+        start = 0
+        total = sum(sizes)
+        while start < len(history) and total > budget:
+            total -= sizes[start] + sizes[start + 1]
+            start += 2
+        if start:
+            self.trimmed_calls += 1
+            logger.info(f"Session {session.session_id}: left out {start} of {len(history)} messages to fit {model_id}")
+        return history[start:]
+
+    def commit(self, session: Session, user_prompt: str, reply: str):
+        """Append a finished turn and compact the history if it has outgrown its budget"""
+        if self._sessions.get(session.session_id) is not session:
+            # Deleted while the turn ran; its bytes are no longer counted
+            return
+        session.append('user', user_prompt)
+        session.append('assistant', reply)
+        session.turns += 1
+        session.last_used = time.monotonic()
+        self._compact(session)
+        self.total_bytes -= session.size_bytes
+        self.total_bytes += session.measure()
+
+    def release(self, session: Session):
+        session.last_used = time.monotonic()
+        if session.lock.locked():
+            session.lock.release()
+        self._evict()
+
+    def _compact(self, session: Session):
+        if self.history_tokens <= 0 or session.history_tokens <= self.history_tokens:
+            return
+        target = self.history_tokens * self.keep_ratio
+        total = session.history_tokens
+        count = 0
+        while count < len(session.messages) and total > target:
+            total -= session.message_tokens[count] + session.message_tokens[count + 1]
+            count += 2
+        dropped = session.drop_oldest(count)
+        self.compactions += 1
+        logger.info(f"Session {session.session_id}: compacted {count} messages (~{total} history tokens left)")
+        if self.summary_model and dropped:
+            previous = session.summary_task
+            session.summary_task = asyncio.ensure_future(self._summarize(session, dropped, previous))
+
+    async def _summarize(self, session: Session, dropped: List[Dict[str, str]], previous: Optional[asyncio.Task]):
+        if previous is not None and not previous.done():
+            await asyncio.wait([previous])
+        transcript = "\n\n".join(
+            f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}" for m in dropped
+        )
+        prompt = f"Previous summary:\n{session.summary or '(none)'}\n\nNew turns:\n{transcript}"
+        try:
+            await LLMFactory.load_providers(self.summary_model)
+            llm = LLMFactory.create_llm(self.summary_model)
+            response = await llm.generate(
+                system_prompt=SUMMARY_SYSTEM_PROMPT,
+                user_prompt=prompt,
+                temperature=0.2,
+                max_tokens=self.summary_tokens,
+            )
+            if response.status != 'success' or not response.text.strip():
+                raise RuntimeError(response.error_message or f"summary call returned {response.status}")
+        except Exception as e:
+            self.summary_failures += 1
+            logger.warning(f"Session {session.session_id}: could not summarize {len(dropped)} messages: {e}")
+            return
+        session.summary = response.text.strip()
+        session.summarized_messages += len(dropped)
+        self.summaries += 1
+        if self._sessions.get(session.session_id) is session:
+            self.total_bytes -= session.size_bytes
+            self.total_bytes += session.measure()
+
+    def _idle_expired(self, session: Session) -> bool:
+        return self.idle_ttl_s > 0 and time.monotonic() - session.last_used > self.idle_ttl_s
+
+    def _remove(self, session_id: str):
+        session = self._sessions.pop(session_id)
+        # A pending summary finishes on the detached session; a turn may be waiting on it
+        self.total_bytes -= session.size_bytes
+
+    def _evict(self):
+        """Drop expired sessions, then idle ones in LRU order while over the count or size cap"""
+        for session_id, session in list(self._sessions.items()):
+            if not session.busy and self._idle_expired(session):
+                self._remove(session_id)
+                self.expired += 1
+        if len(self._sessions) <= self.max_sessions and self.total_bytes <= self.max_bytes:
+            return
+        for session_id, session in list(self._sessions.items()):
+            if len(self._sessions) <= self.max_sessions and self.total_bytes <= self.max_bytes:
+                break
+            if session.busy:
+                continue  # its turn is still running; evicted later if still cold
+            self._remove(session_id)
+            self.evicted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'sessions': len(self._sessions),
+            'busy': sum(1 for session in self._sessions.values() if session.busy),
+            'max_sessions': self.max_sessions,
+            'total_mb': round(self.total_bytes / 1024 / 1024, 2),
+            'max_mb': round(self.max_bytes / 1024 / 1024, 2),
+            'idle_ttl_s': self.idle_ttl_s,
+            'history_tokens': self.history_tokens,
+            'summary_model': self.summary_model or None,
+            'created': self.created,
+            'evicted': self.evicted,
+            'expired': self.expired,
+            'compactions': self.compactions,
+            'summaries': self.summaries,
+            'summary_failures': self.summary_failures,
+            'trimmed_calls': self.trimmed_calls,
+        }
+
+
+sessions = SessionStore(
+    max_sessions=env_int('LLM_SESSION_MAX', 10000),
+    max_bytes=env_int('LLM_SESSION_MAX_MB', 256) * 1024 * 1024,
+    idle_ttl_s=env_float('LLM_SESSION_IDLE_TTL_S', 3600),
+    # History budget per session before the oldest turns are compacted (0: only fit each model's window)
+    history_tokens=env_int('LLM_SESSION_HISTORY_TOKENS', 32000),
+    keep_ratio=env_float('LLM_SESSION_KEEP_RATIO', 0.5),
+    # Model that folds compacted turns into a summary; unset drops them
+    summary_model=os.getenv('LLM_SESSION_SUMMARY_MODEL', ''),
+    summary_tokens=env_int('LLM_SESSION_SUMMARY_TOKENS', 512),
+    turn_wait_s=env_float('LLM_SESSION_TURN_WAIT_S', 30),
+    summary_wait_s=env_float('LLM_SESSION_SUMMARY_WAIT_S', 20),
+)
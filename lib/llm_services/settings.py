@@ -0,0 +1,25 @@
+import os
+
+
+def env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment, falling back on bad values"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment, falling back on bad values"""
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    """Read an on/off setting; 0/false/no/off disable it"""
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() not in ('0', 'false', 'no', 'off')
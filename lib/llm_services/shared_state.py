@@ -0,0 +1,177 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SharedStateStore:
+    """SQLite file shared by every worker process on the host.
+
+    Holds rate-limit bucket levels, 429 back-off deadlines and each worker's
+    latest metrics snapshot. Every operation is a short IMMEDIATE
+    transaction, so read-modify-write updates are atomic across processes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " key TEXT PRIMARY KEY,"
+            " capacity INTEGER,"
+            " level REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blocks ("
+            " key TEXT PRIMARY KEY,"
+            " until REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS metrics_snapshots ("
+            " worker TEXT PRIMARY KEY,"
+            " updated_at REAL NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+
+    @contextmanager
+    def bucket(self, key: str, bucket):
+        """Load the shared state into `bucket`, let the caller update it, then write it back atomically"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT capacity, level, updated_at FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    bucket.capacity, bucket.level, bucket.updated_at = row
+                yield
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, capacity, level, updated_at) VALUES (?, ?, ?, ?)",
+                    (key, bucket.capacity, bucket.level, bucket.updated_at)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def block_until(self, key: str, until: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO blocks (key, until) VALUES (?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET until = MAX(until, excluded.until)",
+                (key, until)
+            )
+
+    def blocked_until(self, key: str) -> float:
+        with self._lock:
+            row = self._conn.execute("SELECT until FROM blocks WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0.0
+
+    def publish_metrics(self, worker: str, snapshot: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO metrics_snapshots (worker, updated_at, data) VALUES (?, ?, ?)",
+                (worker, time.time(), json.dumps(snapshot))
+            )
+
+    def metrics_snapshots(self, max_age_s: float) -> List[Dict[str, Any]]:
+        """Latest snapshot of every worker that published within max_age_s"""
+        cutoff = time.time() - max_age_s
+        with self._lock:
+            self._conn.execute("DELETE FROM metrics_snapshots WHERE updated_at < ?", (cutoff,))
+            rows = self._conn.execute("SELECT data FROM metrics_snapshots").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def workers(self, max_age_s: float) -> int:
+        cutoff = time.time() - max_age_s
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM metrics_snapshots WHERE updated_at >= ?", (cutoff,)
+            ).fetchone()
+        return row[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MetricsPublisher:
+    """Periodically publish this worker's metrics snapshot so any worker can serve the aggregate"""
+
+    def __init__(self, store: SharedStateStore, registry, interval_s: float):
+        self.store = store
+        self.registry = registry
+        self.interval_s = interval_s
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._task = None
+
+    def publish(self):
+        self.store.publish_metrics(self.worker, self.registry.snapshot())
+
+    async def _run(self):
+        while True:
+            try:
+                # The write can wait on another worker's transaction; never block the loop on it
+                await asyncio.to_thread(self.publish)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not publish metrics snapshot: {e}")
+            await asyncio.sleep(self.interval_s)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Keep the final counts visible until the snapshot ages out
+        await asyncio.to_thread(self.publish)
+
+    async def aggregate(self):
+        """Registry summed over every live worker, including a fresh snapshot of this one"""
+        return await asyncio.to_thread(self._aggregate)
+
+    def _aggregate(self):
+        self.publish()
+        return type(self.registry).merge(self.store.metrics_snapshots(self.max_age_s))
+
+    @property
+    def max_age_s(self) -> float:
+        return max(60.0, self.interval_s * 12)
+
+
+def _open_store() -> Optional[SharedStateStore]:
+    directory = os.getenv('LLM_SHARED_STATE_DIR', '')
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'shared_state.sqlite3')
+    logger.info(f"Sharing limiter budgets and metrics across workers via {path}")
+    return SharedStateStore(path)
+
+
+def shared_path(name: str) -> Optional[str]:
+    """Path of another shared file (e.g. the response cache) in LLM_SHARED_STATE_DIR, if set"""
+    directory = os.getenv('LLM_SHARED_STATE_DIR', '')
+    return os.path.join(directory, name) if directory else None
+
+
+# None in single-process mode; set LLM_SHARED_STATE_DIR to share state between workers
+shared_store = _open_store()
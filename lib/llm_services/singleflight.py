@@ -0,0 +1,131 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """One in-flight upstream call and the callers waiting on it"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class _StreamFlight:
+    """One upstream stream fanned out to several subscribers through a replay buffer"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    """Coalesce identical concurrent requests onto a single provider call.
+
+    Callers that arrive while a call with the same fingerprint is running share
+    its result instead of starting their own. Streams are replayed from the
+    first chunk, so a late subscriber still receives the full text.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _StreamFlight] = {}
+        self.calls = 0
+        self.coalesced_calls = 0
+        self.streams = 0
+        self.coalesced_streams = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Run func once per key at a time and hand its result to every concurrent caller"""
+        call = self._calls.get(key)
+        if call is None:
+            self.calls += 1
+            call = _Call(asyncio.ensure_future(func()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.coalesced_calls += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            # Only abandon the upstream call once nobody is waiting for it
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: str, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def stream(self, key: str, func: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Subscribe to the upstream stream for key, starting it if nobody else has"""
+        flight = self._streams.get(key)
+        if flight is None:
+            self.streams += 1
+            flight = _StreamFlight()
+            self._streams[key] = flight
+            flight.task = asyncio.ensure_future(self._pump(key, flight, func))
+        else:
+            self.coalesced_streams += 1
+
+        flight.subscribers += 1
+        position = 0
+        try:
+            while True:
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: position < len(flight.chunks) or flight.done)
+                    pending = flight.chunks[position:]
+                    finished = flight.done
+                for chunk in pending:
+                    yield chunk
+                position += len(pending)
+                if finished and position >= len(flight.chunks):
+                    break
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    async def _pump(self, key: str, flight: _StreamFlight, func: Callable[[], AsyncIterator[str]]):
+        try:
+            async for chunk in func():
+                async with flight.changed:
+                    flight.chunks.append(chunk)
+                    flight.changed.notify_all()
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+        except Exception as e:
+            logger.error(f"Coalesced stream failed: {e}")
+            flight.error = e
+        finally:
+            # New requests after this point start a fresh upstream stream
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+            async with flight.changed:
+                flight.done = True
+                flight.changed.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'calls': self.calls,
+            'coalesced_calls': self.coalesced_calls,
+            'in_flight_calls': len(self._calls),
+            'streams': self.streams,
+            'coalesced_streams': self.coalesced_streams,
+            'in_flight_streams': len(self._streams),
+        }
+
+
+single_flight = SingleFlight()
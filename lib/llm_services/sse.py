@@ -0,0 +1,121 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Optional
+
+from .settings import env_float, env_int
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode to compact UTF-8 JSON bytes (orjson when installed)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def sse_frame(obj: Any) -> bytes:
+    """Pre-encoded `data:` event"""
+    return b"data: " + dumps(obj) + b"\n\n"
+
+
+DONE_FRAME = sse_frame({'done': True})
+
+# SSE comment line: ignored by clients, keeps proxies from closing an idle stream
+HEARTBEAT_FRAME = b": keep-alive\n\n"
+
+COALESCE_WINDOW_S = env_float('LLM_SSE_COALESCE_MS', 25.0) / 1000
+COALESCE_MAX_BYTES = env_int('LLM_SSE_COALESCE_BYTES', 512)
+HEARTBEAT_INTERVAL_S = env_float('LLM_SSE_HEARTBEAT_S', 15.0)
+
+
+async def coalesce(
+    chunks: AsyncIterator[Any],
+    window_s: Optional[float] = None,
+    max_bytes: Optional[int] = None,
+    idle_s: Optional[float] = None,
+) -> AsyncIterator[Any]:
+    """Merge small text deltas into fewer, larger pieces.
+
+    The first delta is passed through immediately so time to first token is
+    unchanged. After that, deltas are buffered until `window_s` has passed
+    since the first buffered delta or `max_bytes` characters are waiting.
+    Yields None when the upstream has been silent for `idle_s` so callers can
+    send a heartbeat. Non-string items (such as a trailing CallStats) are
+    passed through after any text buffered before them.
+    """
+    window_s = COALESCE_WINDOW_S if window_s is None else window_s
+    max_bytes = COALESCE_MAX_BYTES if max_bytes is None else max_bytes
+    idle_s = HEARTBEAT_INTERVAL_S if idle_s is None else idle_s
+
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    buffer = []
+    trailers = []
+    # Shared between the pump and the consumer; both run on the loop thread
+    state = {'size': 0, 'first': True, 'timer': None, 'done': False, 'error': None, 'idle': False}
+
+    async def pump():
+        try:
+            async for chunk in chunks:
+                if not isinstance(chunk, str):
+                    trailers.append(chunk)
+                    ready.set()
+                    continue
+                buffer.append(chunk)
+                state['size'] += len(chunk)
+                if state['first'] or window_s <= 0 or state['size'] >= max_bytes:
+                    state['first'] = False
+                    ready.set()
+                elif state['timer'] is None:
+                    state['timer'] = loop.call_later(window_s, ready.set)
+        except Exception as e:
+            state['error'] = e
+        finally:
+            state['done'] = True
+            ready.set()
+
+    def mark_idle():
+        state['idle'] = True
+        ready.set()
+
+    pump_task = asyncio.ensure_future(pump())
+    idle_timer = None
+    try:
+        while True:
+            if not buffer and not state['done'] and idle_s > 0:
+                idle_timer = loop.call_later(idle_s, mark_idle)
+            await ready.wait()
+            ready.clear()
+            if idle_timer is not None:
+                idle_timer.cancel()
+                idle_timer = None
+            if state['timer'] is not None:
+                state['timer'].cancel()
+                state['timer'] = None
+
+            if buffer:
+                text = "".join(buffer)
+                buffer.clear()
+                state['size'] = 0
+                state['idle'] = False
+                yield text
+            elif state['idle'] and not trailers:
+                state['idle'] = False
+                yield None
+            while trailers:
+                yield trailers.pop(0)
+
+            if state['done'] and not buffer:
+                if state['error'] is not None:
+                    raise state['error']
+                break
+    finally:
+        if idle_timer is not None:
+            idle_timer.cancel()
+        if state['timer'] is not None:
+            state['timer'].cancel()
+        pump_task.cancel()
@@ -0,0 +1,110 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Tuple
+
+from .settings import env_int
+
+# Long texts are sliced and encoded this many characters at a time, so a
+# multi-MB prompt never needs a second full-size copy just to be hashed
+CHUNK_CHARS = 1 << 20
+
+# Precomposed Hangul syllables (U+AC00..U+D7A3)
+_HANGUL = re.compile('[\uac00-\ud7a3]')
+
+
+def iter_chunks(text: str, size: int = CHUNK_CHARS) -> Iterator[str]:
+    if len(text) <= size:
+        yield text
+        return
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+@dataclass(frozen=True)
+class TextProfile:
+    """What the request path needs to know about a prompt, gathered in one pass"""
+    length: int
+    non_ascii: int
+    has_hangul: bool
+    digest: bytes  # blake2b-128 of the UTF-8 text
+
+
+def _scan(text: str) -> TextProfile:
+    digest = hashlib.blake2b(digest_size=16)
+    if text.isascii():
+        # O(1) check on CPython; nothing to count or detect
+        for piece in iter_chunks(text):
+            digest.update(piece.encode('ascii'))
+        return TextProfile(len(text), 0, False, digest.digest())
+
+    non_ascii = 0
+    has_hangul = False
+    for piece in iter_chunks(text):
+        digest.update(piece.encode('utf-8', 'surrogatepass'))
+        if not piece.isascii():
+            # C-speed count: whatever the ASCII codec has to drop
+            non_ascii += len(piece) - len(piece.encode('ascii', 'ignore'))
+            has_hangul = has_hangul or _HANGUL.search(piece) is not None
+    return TextProfile(len(text), non_ascii, has_hangul, digest.digest())
+
+
+class TextProfiler:
+    """Memoized TextProfile per prompt.
+
+    The same prompt is looked at by preflight, rate-limit reservation, prefix
+    caching and the provider adapter; with a 1M-token context each of those
+    used to re-encode and re-scan megabytes. Entries are keyed by length and
+    str hash (computed once and cached on the string object), so no prompt is
+    kept alive by the cache and equal prompts from different requests share
+    one entry.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._profiles: "OrderedDict[Tuple[int, int], TextProfile]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.scanned_chars = 0
+
+    def profile(self, text: str) -> TextProfile:
+        key = (len(text), hash(text))
+        with self._lock:
+            profile = self._profiles.get(key)
+            if profile is not None:
+                self._profiles.move_to_end(key)
+                self.hits += 1
+                return profile
+            self.misses += 1
+        profile = _scan(text)
+        with self._lock:
+            self.scanned_chars += len(text)
+            self._profiles[key] = profile
+            while len(self._profiles) > self.max_entries:
+                self._profiles.popitem(last=False)
+        return profile
+
+    def has_hangul(self, text: str) -> bool:
+        return bool(text) and not text.isascii() and self.profile(text).has_hangul
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._profiles),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'scanned_chars': self.scanned_chars,
+            }
+
+
+text_profiles = TextProfiler(env_int('LLM_TEXT_PROFILE_ENTRIES', 1024))
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+_executors: List["InstrumentedExecutor"] = []
+
+_DONE = object()
+
+
+class InstrumentedExecutor:
+    """Dedicated, sized thread pool for blocking SDK calls with queue-wait accounting.
+
+    Keeping blocking providers on their own pool stops them from starving the
+    loop's default executor (and everything else that relies on it).
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.active = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        _executors.append(self)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix=f"{self.name}-worker")
+            return self._executor
+
+    def _wrap(self, func: Callable[[], Any]) -> Callable[[], Any]:
+        submitted_at = time.perf_counter()
+
+        def run():
+            wait_ms = (time.perf_counter() - submitted_at) * 1000
+            with self._lock:
+                self.active += 1
+                self.total_wait_ms += wait_ms
+                self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            try:
+                result = func()
+                with self._lock:
+                    self.completed += 1
+                return result
+            except BaseException:
+                with self._lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self.active -= 1
+
+        with self._lock:
+            self.submitted += 1
+        return run
+
+    async def run(self, func: Callable[[], Any]) -> Any:
+        """Run a blocking callable on this pool and await its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool(), self._wrap(func))
+
+    async def iterate(self, factory: Callable[[], Iterable[Any]]) -> AsyncIterator[Any]:
+        """Consume a blocking iterator on a worker thread, handing items over through an asyncio queue.
+
+        The event loop only ever awaits the queue, so a slow upstream never
+        blocks it. Closing the async iterator asks the worker to stop at the
+        next item.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for item in factory():
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            except BaseException as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+                raise
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+
+        future = loop.run_in_executor(self._pool(), self._wrap(produce))
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            # The producer's own exception was already re-raised above
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            started = self.completed + self.failed + self.active
+            return {
+                'max_workers': self.max_workers,
+                'submitted': self.submitted,
+                'active': self.active,
+                'queued': max(0, self.submitted - started),
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_wait_ms': round(self.total_wait_ms / started, 2) if started else 0.0,
+                'max_wait_ms': round(self.max_wait_ms, 2),
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def executor_stats() -> Dict[str, Dict[str, Any]]:
+    """Stats for every dedicated executor created in this process"""
+    return {executor.name: executor.stats() for executor in _executors}
+
+
+def shutdown_executors():
+    for executor in _executors:
+        executor.shutdown()
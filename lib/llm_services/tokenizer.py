@@ -0,0 +1,312 @@
+import asyncio
+import importlib.util
+import logging
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .settings import env_int
+from .text_profile import text_profiles
+
+logger = logging.getLogger(__name__)
+
+# Chat formatting adds a few tokens around every message (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Texts at least this long are counted in a worker thread by precount() (BPE on a long prompt takes milliseconds)
+OFFLOAD_CHARS = env_int('LLM_TOKEN_OFFLOAD_CHARS', 32_768)
+
+
+class Tokenizer:
+    """Counts tokens for one provider/model family"""
+
+    name = "base"
+
+    def count(self, text: str) -> int:
+        raise NotImplementedError
+
+
+class HeuristicTokenizer(Tokenizer):
+    """Character-class estimate: ~4 ASCII characters per token, ~1 token per other character.
+
+    Plain `len(text) // 4` undercounts Korean and other non-Latin text several
+    times over, which is exactly the text that overflows a window unexpectedly.
+    """
+
+    name = "heuristic"
+
+    def __init__(self, ascii_chars_per_token: float = 4.0, other_chars_per_token: float = 1.0):
+        self.ascii_chars_per_token = ascii_chars_per_token
+        self.other_chars_per_token = other_chars_per_token
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if text.isascii():
+            return math.ceil(len(text) / self.ascii_chars_per_token)
+        other = text_profiles.profile(text).non_ascii
+        ascii_count = len(text) - other
+        return math.ceil(ascii_count / self.ascii_chars_per_token + other / self.other_chars_per_token)
+
+
+class TiktokenTokenizer(Tokenizer):
+    """Exact BPE counts for OpenAI models"""
+
+    def __init__(self, encoding_name: str):
+        import tiktoken
+        self.name = f"tiktoken:{encoding_name}"
+        self.encoding = tiktoken.get_encoding(encoding_name)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+def _openai_tokenizer(model_id: str) -> Tokenizer:
+    # Optional dependency for exact counts; imported on first use to keep startup light
+    if importlib.util.find_spec('tiktoken') is None:
+        return HeuristicTokenizer()
+    encoding = 'cl100k_base' if model_id.startswith(('gpt-3', 'gpt-4-')) or model_id == 'gpt-4' else 'o200k_base'
+    return TiktokenTokenizer(encoding)
+
+
+# provider -> factory(model_id); providers without an entry use the heuristic
+_TOKENIZER_FACTORIES: Dict[str, Callable[[str], Tokenizer]] = {
+    'openai': _openai_tokenizer,
+    # Anthropic and Gemini only count tokens through a network API; Hangul-heavy
+    # text comes out at ~1 token per syllable on both, which the heuristic assumes
+    'anthropic': lambda model_id: HeuristicTokenizer(3.5, 1.0),
+    'gemini': lambda model_id: HeuristicTokenizer(4.0, 1.0),
+}
+
+
+def register_tokenizer(provider: str, factory: Callable[[str], Tokenizer]):
+    """Plug in a tokenizer for a provider (e.g. a vendor library once one is installed)"""
+    _TOKENIZER_FACTORIES[provider] = factory
+    token_counter.clear()
+
+
+@dataclass(frozen=True)
+class ModelLimits:
+    context_window: int
+    max_output_tokens: int
+
+
+# Longest matching prefix wins
+_MODEL_LIMITS: Tuple[Tuple[str, ModelLimits], ...] = (
+    ('gpt-5', ModelLimits(400_000, 128_000)),
+    ('gpt-4.1', ModelLimits(1_047_576, 32_768)),
+    ('gpt-4o', ModelLimits(128_000, 16_384)),
+    ('gpt-4-turbo', ModelLimits(128_000, 4_096)),
+    ('gpt-4', ModelLimits(8_192, 4_096)),
+    ('gpt-3.5', ModelLimits(16_385, 4_096)),
+    ('claude-3-opus', ModelLimits(200_000, 4_096)),
+    ('claude-3-haiku', ModelLimits(200_000, 4_096)),
+    ('claude-3-5', ModelLimits(200_000, 8_192)),
+    ('claude-3-7', ModelLimits(200_000, 64_000)),
+    ('claude-sonnet-4', ModelLimits(200_000, 64_000)),
+    ('claude-opus-4', ModelLimits(200_000, 32_000)),
+    ('gemini-2.5', ModelLimits(1_048_576, 65_536)),
+    ('gemini-2', ModelLimits(1_048_576, 8_192)),
+    ('gemini-1.5-pro', ModelLimits(2_097_152, 8_192)),
+    ('gemini-1.5', ModelLimits(1_048_576, 8_192)),
+    ('mock', ModelLimits(32_768, 4_096)),
+)
+
+
+def model_limits(model_id: str) -> Optional[ModelLimits]:
+    """Context window and output cap for a model, or None when unknown"""
+    best = None
+    for prefix, limits in _MODEL_LIMITS:
+        if model_id.startswith(prefix) and (best is None or len(prefix) > len(best[0])):
+            best = (prefix, limits)
+    return best[1] if best else None
+
+
+class ContextWindowExceeded(ValueError):
+    """Prompt plus requested output does not fit the model's context window"""
+
+
+@dataclass
+class Preflight:
+    """Result of checking a request against the model's limits before any network I/O"""
+    prompt_tokens: int
+    max_tokens: int
+    requested_max_tokens: int
+    context_window: Optional[int]
+    max_output_tokens: Optional[int]
+    tokenizer: str
+
+    @property
+    def clamped(self) -> bool:
+        return self.max_tokens != self.requested_max_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'prompt_tokens': self.prompt_tokens,
+            'max_tokens': self.max_tokens,
+            'requested_max_tokens': self.requested_max_tokens,
+            'clamped': self.clamped,
+            'context_window': self.context_window,
+            'max_output_tokens': self.max_output_tokens,
+            'tokenizer': self.tokenizer,
+        }
+
+
+class TokenCounter:
+    """Per-provider tokenizers with an LRU cache of counts.
+
+    Keys are the text's memoized digest (see text_profile), so repeated
+    system prompts and batch iterations are counted once without keeping
+    large prompts alive or re-hashing them on every lookup.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._tokenizers: Dict[Tuple[str, str], Tokenizer] = {}
+        self._counts: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def tokenizer_for(self, provider: str, model_id: str) -> Tokenizer:
+        key = (provider, model_id)
+        tokenizer = self._tokenizers.get(key)
+        if tokenizer is None:
+            factory = _TOKENIZER_FACTORIES.get(provider)
+            try:
+                tokenizer = factory(model_id) if factory else HeuristicTokenizer()
+            except Exception as e:
+                # e.g. tiktoken installed but its encoding files cannot be downloaded
+                logger.warning(f"Tokenizer for {provider}/{model_id} unavailable ({e}); using heuristic")
+                tokenizer = HeuristicTokenizer()
+            self._tokenizers[key] = tokenizer
+        return tokenizer
+
+    def count(self, provider: str, model_id: str, text: str) -> int:
+        if not text:
+            return 0
+        tokenizer = self.tokenizer_for(provider, model_id)
+        key = (tokenizer.name, text_profiles.profile(text).digest)
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                self.hits += 1
+                return count
+            self.misses += 1
+        count = tokenizer.count(text)
+        with self._lock:
+            self._counts[key] = count
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return count
+
+    async def precount(self, provider: str, model_id: str, *texts: Optional[str]):
+        """Build the tokenizer and count long texts in a worker thread.
+
+        Called before the synchronous counting paths (preflight, rate-limit
+        estimates) so those only hit the cache instead of blocking the loop.
+        """
+        if (provider, model_id) not in self._tokenizers:
+            await asyncio.to_thread(self.tokenizer_for, provider, model_id)
+        long_texts = [text for text in texts if text and len(text) >= OFFLOAD_CHARS]
+        if long_texts:
+            await asyncio.to_thread(lambda: [self.count(provider, model_id, text) for text in long_texts])
+
+    async def precount_prompt(
+        self,
+        provider: str,
+        model_id: str,
+        system_prompt: Optional[str],
+        user_prompt: str,
+        history: Optional[List[Dict[str, str]]] = None,
+    ):
+        await self.precount(provider, model_id, system_prompt, user_prompt, *(m['content'] for m in history or ()))
+
+    def count_prompt(
+        self,
+        provider: str,
+        model_id: str,
+        system_prompt: Optional[str],
+        user_prompt: str,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> int:
+        """Prompt tokens including per-message formatting overhead"""
+        total = self.count(provider, model_id, user_prompt) + MESSAGE_OVERHEAD_TOKENS
+        if system_prompt:
+            total += self.count(provider, model_id, system_prompt) + MESSAGE_OVERHEAD_TOKENS
+        if history:
+            total += self.count_messages(provider, model_id, history)
+        return total
+
+    def count_messages(self, provider: str, model_id: str, messages: List[Dict[str, str]]) -> int:
+        return sum(self.count(provider, model_id, m['content']) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+    def preflight(
+        self,
+        provider: str,
+        model_id: str,
+        system_prompt: Optional[str],
+        user_prompt: str,
+        max_tokens: int,
+        overflow: str = "clamp",
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> Preflight:
+        """Check prompt + max_tokens against the model's limits.
+
+        With overflow="clamp", max_tokens is lowered to what still fits;
+        with "reject" (or when the prompt alone does not fit) a
+        ContextWindowExceeded is raised before anything is sent.
+        """
+        prompt_tokens = self.count_prompt(provider, model_id, system_prompt, user_prompt, history)
+        limits = model_limits(model_id)
+        result = Preflight(
+            prompt_tokens=prompt_tokens,
+            max_tokens=max_tokens,
+            requested_max_tokens=max_tokens,
+            context_window=limits.context_window if limits else None,
+            max_output_tokens=limits.max_output_tokens if limits else None,
+            tokenizer=self.tokenizer_for(provider, model_id).name,
+        )
+        if limits is None:
+            return result
+
+        room = limits.context_window - prompt_tokens
+        if room <= 0:
+            raise ContextWindowExceeded(
+                f"Prompt is ~{prompt_tokens} tokens; {model_id} has a {limits.context_window}-token context window"
+            )
+        allowed = min(room, limits.max_output_tokens)
+        if max_tokens > allowed:
+            if overflow == "reject":
+                raise ContextWindowExceeded(
+                    f"Prompt (~{prompt_tokens} tokens) plus max_tokens={max_tokens} exceeds what {model_id} allows "
+                    f"(context window {limits.context_window}, max output {limits.max_output_tokens}); "
+                    f"max_tokens can be at most {allowed}"
+                )
+            result.max_tokens = allowed
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._tokenizers.clear()
+            self._counts.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._counts),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'tokenizers': sorted({t.name for t in self._tokenizers.values()}),
+            }
+
+
+token_counter = TokenCounter(env_int('LLM_TOKEN_CACHE_ENTRIES', 4096))
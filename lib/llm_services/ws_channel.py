@@ -0,0 +1,181 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .cancellation import RequestHandle
+from .settings import env_int
+from .sse import dumps
+
+logger = logging.getLogger(__name__)
+
+# Frames a stream may send before the client grants more credit
+DEFAULT_STREAM_WINDOW = env_int('LLM_WS_STREAM_WINDOW', 32)
+MAX_STREAMS = env_int('LLM_WS_MAX_STREAMS', 100)
+SEND_QUEUE_FRAMES = env_int('LLM_WS_SEND_QUEUE', 256)
+
+
+class TooManyStreams(Exception):
+    """The connection already has LLM_WS_MAX_STREAMS requests running"""
+
+
+class StreamCredit:
+    """Per-stream flow-control window, counted in frames.
+
+    The stream spends one credit per chunk frame and waits at zero until the
+    client grants more. Output keeps arriving from the provider meanwhile
+    and is merged into the next frame, so a slow reader costs frames, not
+    provider time.
+    """
+
+    def __init__(self, window: int):
+        self.available = window
+        self.stalls = 0
+        self._granted = asyncio.Event()
+
+    def grant(self, n: int):
+        self.available += n
+        if self.available > 0:
+            self._granted.set()
+
+    async def take(self):
+        while self.available <= 0:
+            self.stalls += 1
+            self._granted.clear()
+            await self._granted.wait()
+        self.available -= 1
+
+    def release(self):
+        """Stop limiting the stream (it is being cancelled and must not wait for credit)"""
+        self.available = float('inf')
+        self._granted.set()
+
+
+class ChannelStream:
+    """One request multiplexed on a channel: its task, cancel handle and credit"""
+
+    def __init__(self, stream_id: str, credit: StreamCredit):
+        self.stream_id = stream_id
+        self.credit = credit
+        self.handle: Optional[RequestHandle] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+class Channel:
+    """A long-lived WebSocket carrying many concurrent generate requests.
+
+    Every frame is a JSON object tagged with the client-chosen stream `id`.
+    All frames go through one bounded queue drained by a single writer task,
+    so concurrent streams never interleave partial writes and a client that
+    stops reading eventually blocks the producers instead of growing memory.
+    """
+
+    def __init__(self, websocket, max_streams: int = MAX_STREAMS, send_queue: int = SEND_QUEUE_FRAMES):
+        self.websocket = websocket
+        self.max_streams = max_streams
+        self.streams: Dict[str, ChannelStream] = {}
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=send_queue)
+        self._writer: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def start(self):
+        self._writer = asyncio.ensure_future(self._write_loop())
+
+    async def _write_loop(self):
+        try:
+            while True:
+                frame = await self._outbox.get()
+                await self.websocket.send_text(frame)
+                channels.frames_sent += 1
+        except Exception as e:
+            # Socket gone: the reader sees the disconnect and closes the channel
+            self.closed = True
+            logger.debug(f"WebSocket writer stopped: {e}")
+
+    async def send(self, stream_id: Optional[str], frame_type: str, **fields):
+        if self.closed:
+            return
+        await self._outbox.put(dumps({'type': frame_type, 'id': stream_id, **fields}).decode('utf-8'))
+
+    def open(self, stream_id: str, window: Optional[int], run: Callable[[ChannelStream], Awaitable[Any]]) -> ChannelStream:
+        """Start a request on the channel; ids must be unique among running streams"""
+        if stream_id in self.streams:
+            raise ValueError(f"Stream {stream_id} is already running on this connection")
+        if len(self.streams) >= self.max_streams:
+            raise TooManyStreams(f"Connection already has {self.max_streams} running streams")
+        stream = ChannelStream(stream_id, StreamCredit(window or DEFAULT_STREAM_WINDOW))
+        self.streams[stream_id] = stream
+        channels.streams_opened += 1
+        stream.task = asyncio.ensure_future(run(stream))
+        stream.task.add_done_callback(lambda _: self._finished(stream))
+        return stream
+
+    def _finished(self, stream: ChannelStream):
+        if self.streams.get(stream.stream_id) is stream:
+            del self.streams[stream.stream_id]
+        channels.credit_stalls += stream.credit.stalls
+
+    def grant(self, stream_id: str, n: int) -> bool:
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            return False
+        stream.credit.grant(n)
+        return True
+
+    def cancel(self, stream_id: str, reason: str = "cancelled") -> bool:
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            return False
+        stream.credit.release()
+        if stream.handle is not None:
+            stream.handle.cancel(reason)
+        else:
+            # Still loading the model or checking limits
+            stream.task.cancel()
+        return True
+
+    async def close(self):
+        """Client went away: cancel every running stream and stop writing"""
+        self.closed = True
+        if self._writer is not None:
+            self._writer.cancel()
+        tasks = [stream.task for stream in self.streams.values()]
+        for stream_id in list(self.streams):
+            self.cancel(stream_id, 'client_disconnected')
+        # A stream blocked on the full outbox would never get to finish on its own
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks, timeout=5)
+
+
+class ChannelRegistry:
+    """Open channels and counters for /stats"""
+
+    def __init__(self):
+        self.open: set = set()
+        self.connections = 0
+        self.streams_opened = 0
+        self.frames_sent = 0
+        self.credit_stalls = 0
+
+    def add(self, channel: Channel):
+        self.open.add(channel)
+        self.connections += 1
+
+    def discard(self, channel: Channel):
+        self.open.discard(channel)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'open_connections': len(self.open),
+            'running_streams': sum(len(channel.streams) for channel in self.open),
+            'connections': self.connections,
+            'streams': self.streams_opened,
+            'frames_sent': self.frames_sent,
+            'credit_stalls': self.credit_stalls,
+            'default_window': DEFAULT_STREAM_WINDOW,
+            'max_streams_per_connection': MAX_STREAMS,
+        }
+
+
+channels = ChannelRegistry()
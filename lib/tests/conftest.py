@@ -0,0 +1,155 @@
+"""Shared fixtures: the FastAPI app on the local mock provider, driven on one event loop.
+
+Settings are read when the llm_services modules are imported, so the
+environment is prepared here before any test module imports them.
+Run from lib/: python -m pytest -q tests
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+import httpx
+import pytest
+
+LIB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if LIB_DIR not in sys.path:
+    sys.path.insert(0, LIB_DIR)
+
+# Fast, deterministic mock provider; real providers stay unconfigured so nothing reaches the network
+os.environ.update({
+    'LLM_MOCK_ENABLED': '1',
+    'LLM_MOCK_TTFT_MS': '5',
+    'LLM_MOCK_TTFT_JITTER_MS': '0',
+    'LLM_MOCK_TOKENS_PER_SEC': '2000',
+    'LLM_MOCK_OUTPUT_TOKENS': '8',
+    'LLM_MOCK_OUTPUT_DIST': 'fixed',
+    # Bulk jobs persist in SQLite; keep the tests' jobs out of the default temp-dir store
+    'LLM_BULK_DB_PATH': os.path.join(tempfile.mkdtemp(prefix='llm-tests-'), 'bulk_jobs.sqlite3'),
+})
+for name in (
+    'OPENAI_API_KEY', 'ANTHROPIC_API_KEY', 'GOOGLE_GEMINI_API_KEY',
+    'LLM_SHARED_STATE_DIR', 'LLM_CACHE_SQLITE_PATH', 'LLM_RECORD_PATH', 'LLM_REPLAY_PATH',
+    'LLM_WARMUP', 'LLM_HEDGE_ENABLED', 'LLM_CACHE_NONDETERMINISTIC', 'LLM_PREFIX_CACHE',
+    'LLM_NEAR_DUP_SERVE', 'LLM_SESSION_SUMMARY_MODEL', 'LLM_ROUTER_SLO_MS',
+):
+    os.environ.pop(name, None)
+
+
+@pytest.fixture(scope='session')
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def run(loop):
+    """Run a coroutine to completion on the shared loop (module singletons stay bound to it)"""
+    return loop.run_until_complete
+
+
+@pytest.fixture(scope='session')
+def app(loop):
+    from llm_api_server import app
+    lifespan = app.router.lifespan_context(app)
+    loop.run_until_complete(lifespan.__aenter__())
+    yield app
+    loop.run_until_complete(lifespan.__aexit__(None, None, None))
+
+
+@pytest.fixture(scope='session')
+def client(app, loop):
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test', timeout=30)
+    yield client
+    loop.run_until_complete(client.aclose())
+
+
+def parse_sse(body: str):
+    """JSON payloads of the `data:` events in an SSE body (comments such as heartbeats are skipped)"""
+    return [json.loads(line[len('data: '):]) for line in body.splitlines() if line.startswith('data: ')]
+
+
+def parse_ndjson(body: str):
+    return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+
+@pytest.fixture
+def sse():
+    return parse_sse
+
+
+@pytest.fixture
+def ndjson():
+    return parse_ndjson
+
+
+class WebSocketSession:
+    """Minimal in-process ASGI WebSocket client for /ws"""
+
+    def __init__(self, app, path: str = '/ws'):
+        self.app = app
+        self.path = path
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        self._task = None
+
+    async def connect(self):
+        scope = {
+            'type': 'websocket',
+            'asgi': {'version': '3.0'},
+            'scheme': 'ws',
+            'path': self.path,
+            'raw_path': self.path.encode(),
+            'query_string': b'',
+            'headers': [],
+            'client': ('testclient', 50000),
+            'server': ('testserver', 80),
+            'subprotocols': [],
+        }
+        await self._inbox.put({'type': 'websocket.connect'})
+        self._task = asyncio.ensure_future(self.app(scope, self._inbox.get, self._outbox.put))
+        message = await asyncio.wait_for(self._outbox.get(), 5)
+        assert message['type'] == 'websocket.accept', message
+        return self
+
+    async def send(self, frame: dict):
+        await self._inbox.put({'type': 'websocket.receive', 'text': json.dumps(frame)})
+
+    async def receive(self, timeout: float = 5) -> dict:
+        message = await asyncio.wait_for(self._outbox.get(), timeout)
+        assert message['type'] == 'websocket.send', message
+        return json.loads(message['text'])
+
+    async def until(self, stream_id, frame_type: str, timeout: float = 5) -> list:
+        """Frames for stream_id up to and including the first one of frame_type"""
+        frames = []
+        while True:
+            frame = await self.receive(timeout)
+            if frame.get('id') != stream_id:
+                continue
+            frames.append(frame)
+            if frame['type'] == frame_type:
+                return frames
+
+    async def close(self):
+        await self._inbox.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(self._task, 5)
+
+
+@pytest.fixture
+def ws(app, run):
+    """Factory for connected /ws sessions, closed after the test"""
+    opened = []
+
+    async def connect():
+        session = await WebSocketSession(app).connect()
+        opened.append(session)
+        return session
+
+    yield connect
+    for session in opened:
+        if not session._task.done():
+            run(session.close())
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from llm_services.circuit_breaker import CLOSED, breakers
+from llm_services.concurrency import provider_concurrency
+from llm_services.llm_factory import LLMFactory
+
+
+@pytest.fixture
+def mock_cap(monkeypatch):
+    """Cap the mock provider at two concurrent calls for the test"""
+    monkeypatch.setitem(provider_concurrency._limits, 'mock', 2)
+    monkeypatch.setitem(provider_concurrency._semaphores, 'mock', asyncio.Semaphore(2))
+
+
+async def peak_active(provider: str, work):
+    """Run work() while sampling how many calls of the provider hold a slot at once"""
+    peak = 0
+    task = asyncio.ensure_future(work())
+    while not task.done():
+        peak = max(peak, provider_concurrency._active.get(provider, 0))
+        await asyncio.sleep(0.001)
+    return peak, task.result()
+
+
+def test_batch_returns_every_iteration(client, run):
+    response = run(client.post('/batch_generate', json={
+        'model_id': 'mock-fast', 'user_prompt': 'batch please', 'iterations': 4
+    })).json()
+    assert sorted(r['iteration'] for r in response['results']) == [1, 2, 3, 4]
+    assert all(r['status'] == 'success' and r['text'] for r in response['results'])
+    assert response['request_id']
+
+
+def test_streamed_batch_sends_each_iteration_then_a_summary(client, run, ndjson, sse):
+    body = {'model_id': 'mock-fast', 'user_prompt': 'stream the batch', 'iterations': 3, 'stream': True}
+    lines = ndjson(run(client.post('/batch_generate', json=body)).text)
+    assert sorted(line['iteration'] for line in lines[:-1]) == [1, 2, 3]
+    assert lines[-1] == {'done': True, 'model': 'mock-fast', 'iterations': 3}
+
+    events = sse(run(client.post('/batch_generate', json={**body, 'format': 'sse'})).text)
+    assert len(events) == 4 and events[-1]['done']
+
+
+def test_batch_iterations_respect_the_provider_cap(client, run, mock_cap):
+    LLMFactory.create_llm('mock-batch-cap').ttft_ms = 30
+    body = {'model_id': 'mock-batch-cap', 'user_prompt': 'capped', 'iterations': 6}
+    peak, response = run(peak_active('mock', lambda: client.post('/batch_generate', json=body)))
+    assert len(response.json()['results']) == 6
+    assert peak == 2
+
+
+def test_routed_batch_takes_the_concrete_provider_slot(client, run, mock_cap):
+    LLMFactory.create_llm('mock-batch-route-a').ttft_ms = 30
+    body = {'model_id': 'mock-batch-route-a -> mock-batch-route-b', 'user_prompt': 'routed and capped', 'iterations': 6}
+    peak, response = run(peak_active('mock', lambda: client.post('/batch_generate', json=body)))
+    results = response.json()['results']
+    assert all(r['status'] == 'success' and r['model'] == 'mock-batch-route-a' for r in results)
+    assert peak == 2
+    assert 'router' not in provider_concurrency.stats()
+
+
+def test_iterations_turned_away_by_a_half_open_circuit_are_errors(client, run):
+    LLMFactory.create_llm('mock-batch-breaker')
+    circuit = breakers.get('mock', 'mock-batch-breaker')
+    circuit._open("tripped by test")
+    circuit.opened_at -= circuit.open_s  # past the open period: only probes get through
+    response = run(client.post('/batch_generate', json={
+        'model_id': 'mock-batch-breaker', 'user_prompt': 'probe', 'iterations': 3, 'temperature': 1.0
+    })).json()
+    # The single probe succeeds and closes the circuit; the other two were rejected while it ran
+    assert sorted(r['status'] for r in response['results']) == ['error', 'error', 'success']
+    assert all('circuit open' in r['error_message'] for r in response['results'] if r['status'] == 'error')
+    assert circuit.state == CLOSED
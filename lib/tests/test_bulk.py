@@ -0,0 +1,228 @@
+import asyncio
+from types import SimpleNamespace
+
+from llm_services.batch_backends import ENDED, EXPIRED, AnthropicBatchBackend, LocalBatchBackend, OpenAIBatchBackend
+from llm_services.bulk import BulkJobs
+from llm_services.llm_factory import LLMFactory
+
+
+def jobs_at(path, max_batch_items=100, resubmit_rounds=1, submit_attempts=3, delay_s=0.0) -> BulkJobs:
+    jobs = BulkJobs(str(path), max_batch_items, poll_max_s=0.05, poll_backoff=1.5,
+                    submit_attempts=submit_attempts, resubmit_rounds=resubmit_rounds, tick_s=0.01)
+    jobs._local = LocalBatchBackend(LLMFactory.create_llm, LLMFactory.provider_for)
+    jobs._local.first_poll_s = 0.01
+    jobs._local.delay_s = delay_s
+    return jobs
+
+
+def items(model_id, count, **fields):
+    return [
+        {'model_id': model_id, 'system_prompt': '', 'user_prompt': f'row {i}', 'temperature': 1.0,
+         'max_tokens': 8, 'top_p': 1.0, 'custom_id': f'{model_id}-{i}', **fields}
+        for i in range(count)
+    ]
+
+
+async def finished(jobs, job_id, timeout=5.0):
+    async def wait():
+        while True:
+            job = await jobs.status(job_id)
+            if job['finished_at'] is not None:
+                return job
+            await asyncio.sleep(0.01)
+    return await asyncio.wait_for(wait(), timeout)
+
+
+def test_items_are_packed_per_model_and_results_come_back(run, tmp_path):
+    jobs = jobs_at(tmp_path / 'bulk.sqlite3', max_batch_items=2)
+
+    async def main():
+        job = await jobs.submit(items('mock-bulk-a', 3) + items('mock-bulk-b', 1))
+        done = await finished(jobs, job['job_id'])
+        results = await jobs.results(job['job_id'])
+        await jobs.stop()
+        return job, done, results
+
+    job, done, results = run(main())
+    assert job['status'] == 'running' and job['pending'] == 4
+    assert [(b['model'], b['items']) for b in done['batches']] == [('mock-bulk-a', 2), ('mock-bulk-a', 1), ('mock-bulk-b', 1)]
+    assert done['status'] == 'completed' and done['succeeded'] == 4
+    assert [line['seq'] for line in results] == [1, 2, 3, 4]
+    assert sorted((line['index'], line['custom_id']) for line in results) == [
+        (0, 'mock-bulk-a-0'), (1, 'mock-bulk-a-1'), (2, 'mock-bulk-a-2'), (3, 'mock-bulk-b-0')]
+    assert all(line['text'].split() == [f"tok{i}" for i in range(8)] for line in results)
+    assert run(jobs.results(job['job_id'], after=3))[0]['seq'] == 4
+
+
+def test_poll_interval_backs_off_to_the_cap(tmp_path):
+    jobs = jobs_at(tmp_path / 'bulk.sqlite3')
+    assert 0.027 <= jobs._next_interval(0.02) <= 0.033
+    assert jobs._next_interval(1.0) <= 0.055
+
+
+def test_batches_lost_in_a_restart_are_resubmitted(run, tmp_path):
+    path = tmp_path / 'bulk.sqlite3'
+
+    async def main():
+        before = jobs_at(path, delay_s=10)
+        job = await before.submit(items('mock-bulk-restart', 2))
+        while not (await before.status(job['job_id']))['batches'][0]['provider_batch_id']:
+            await asyncio.sleep(0.01)
+        await before.stop()
+        for batch in before._local._batches.values():
+            batch.task.cancel()
+
+        after = jobs_at(path)  # same file and owner, but its local backend never saw the batch
+        after.start()
+        done = await finished(after, job['job_id'])
+        await after.stop()
+        return done
+
+    done = run(main())
+    assert [(b['round'], b['status']) for b in done['batches']] == [(0, ENDED), (1, ENDED)]
+    assert done['batches'][0]['error'] and done['succeeded'] == 2
+
+
+def test_items_an_expired_batch_never_ran_fail_after_the_last_round(run, tmp_path):
+    class Expiring(LocalBatchBackend):
+        async def poll(self, batch_id):
+            status = await super().poll(batch_id)
+            return status if status.state != ENDED else type(status)(EXPIRED, error="expired by test")
+
+        async def results(self, batch_id):
+            self._batches.pop(batch_id, None)
+            return
+            yield
+
+    jobs = jobs_at(tmp_path / 'bulk.sqlite3', resubmit_rounds=1)
+    jobs._local = Expiring(LLMFactory.create_llm, LLMFactory.provider_for)
+    jobs._local.first_poll_s = 0.01
+
+    async def main():
+        job = await jobs.submit(items('mock-bulk-expire', 1))
+        done = await finished(jobs, job['job_id'])
+        results = await jobs.results(job['job_id'])
+        await jobs.stop()
+        return done, results
+
+    done, results = run(main())
+    assert len(done['batches']) == 2 and done['failed'] == 1
+    assert results[0]['status'] == 'error' and results[0]['error_message'] == 'expired by test'
+
+
+class FakeAnthropicBatches:
+    """messages.batches of an Anthropic client whose first batch lets its last request expire"""
+
+    def __init__(self):
+        self.created = []
+
+    async def create(self, requests):
+        self.created.append([request['custom_id'] for request in requests])
+        return SimpleNamespace(id=f'msgbatch_{len(self.created)}')
+
+    def _outcomes(self, batch_id):
+        custom_ids = self.created[int(batch_id.split('_')[1]) - 1]
+        expire_last = batch_id == 'msgbatch_1'
+        return [(custom_id, 'expired' if expire_last and i == len(custom_ids) - 1 else 'succeeded')
+                for i, custom_id in enumerate(custom_ids)]
+
+    async def retrieve(self, batch_id):
+        outcomes = [outcome for _, outcome in self._outcomes(batch_id)]
+        counts = SimpleNamespace(succeeded=outcomes.count('succeeded'), errored=0, canceled=0,
+                                 expired=outcomes.count('expired'))
+        return SimpleNamespace(processing_status='ended', request_counts=counts)
+
+    async def results(self, batch_id):
+        async def entries():
+            for custom_id, outcome in self._outcomes(batch_id):
+                message = SimpleNamespace(content=[SimpleNamespace(text='done')],
+                                          usage=SimpleNamespace(input_tokens=3, output_tokens=1))
+                yield SimpleNamespace(custom_id=custom_id, result=SimpleNamespace(type=outcome, message=message))
+        return entries()
+
+
+def test_expired_anthropic_requests_are_resubmitted(run, tmp_path):
+    batches = FakeAnthropicBatches()
+    llm = SimpleNamespace(client=SimpleNamespace(messages=SimpleNamespace(batches=batches)),
+                          message_params=lambda *args: {})
+    jobs = jobs_at(tmp_path / 'bulk.sqlite3', resubmit_rounds=1)
+    jobs._local = AnthropicBatchBackend(llm)
+    jobs._local.first_poll_s = 0.01
+
+    async def main():
+        job = await jobs.submit(items('mock-bulk-anthropic', 2))
+        done = await finished(jobs, job['job_id'])
+        results = await jobs.results(job['job_id'])
+        await jobs.stop()
+        return done, results
+
+    done, results = run(main())
+    assert [len(ids) for ids in batches.created] == [2, 1]
+    assert [(b['round'], b['status']) for b in done['batches']] == [(0, ENDED), (1, ENDED)]
+    assert done['succeeded'] == 2 and all(line['text'] == 'done' for line in results)
+
+
+def test_submit_failures_are_retried_then_reported(run, tmp_path):
+    class Unavailable(LocalBatchBackend):
+        calls = 0
+
+        async def submit(self, items):
+            Unavailable.calls += 1
+            raise RuntimeError("batch API down")
+
+    jobs = jobs_at(tmp_path / 'bulk.sqlite3', submit_attempts=2)
+    jobs._local = Unavailable(LLMFactory.create_llm, LLMFactory.provider_for)
+
+    async def main():
+        job = await jobs.submit(items('mock-bulk-down', 2))
+        done = await finished(jobs, job['job_id'])
+        results = await jobs.results(job['job_id'])
+        await jobs.stop()
+        return done, results
+
+    done, results = run(main())
+    assert Unavailable.calls == 2
+    assert done['status'] == 'completed' and done['failed'] == 2
+    assert all('batch API down' in line['error_message'] for line in results)
+
+
+def test_cancelling_stops_submitted_batches(run, tmp_path):
+    jobs = jobs_at(tmp_path / 'bulk.sqlite3', max_batch_items=1, delay_s=10)
+
+    async def main():
+        job = await jobs.submit(items('mock-bulk-cancel', 2))
+        await asyncio.sleep(0.05)
+        await jobs.cancel(job['job_id'])
+        done = await finished(jobs, job['job_id'])
+        await jobs.stop()
+        return done
+
+    done = run(main())
+    assert done['status'] == 'cancelled' and done['succeeded'] == 0 and done['pending'] == 0
+
+
+def test_openai_result_lines_are_parsed():
+    ok = OpenAIBatchBackend._parse({'custom_id': 'i1', 'response': {'status_code': 200, 'body': {
+        'choices': [{'message': {'content': 'hi'}}],
+        'usage': {'prompt_tokens': 3, 'completion_tokens': 1, 'total_tokens': 4},
+    }}})
+    assert ok['text'] == 'hi' and ok['status'] == 'success' and ok['tokens_used']['total'] == 4
+    failed = OpenAIBatchBackend._parse({'custom_id': 'i2', 'response': {'status_code': 429, 'body': {}}})
+    assert failed['status'] == 'error' and failed['error_message'] == 'HTTP 429'
+
+
+def test_bulk_endpoints(client, run, ndjson):
+    body = {
+        'model_id': 'mock-bulk-api', 'user_prompt': 'default prompt', 'backend': 'local',
+        'items': [{'custom_id': 'row-1'}, {'custom_id': 'row-2', 'user_prompt': 'own prompt'}],
+    }
+    submitted = run(client.post('/bulk', json=body))
+    assert submitted.status_code == 202
+    job_id = submitted.json()['job_id']
+    lines = ndjson(run(client.get(f'/bulk/{job_id}/results', params={'follow': True})).text)
+    assert sorted(line['custom_id'] for line in lines) == ['row-1', 'row-2']
+    assert run(client.get(f'/bulk/{job_id}')).json()['status'] == 'completed'
+
+    assert run(client.post('/bulk', json={'model_id': 'auto:mock', 'user_prompt': 'x'})).status_code == 400
+    assert run(client.post('/bulk', json={'model_id': 'mock-bulk-api', 'items': [{}]})).status_code == 400
+    assert run(client.get('/bulk/bulk_missing')).status_code == 404
@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+import pytest
+
+from llm_services.cancellation import CancellationRegistry, run_attached
+from llm_services.llm_factory import LLMFactory
+
+
+def slow_mock(model_id: str):
+    LLMFactory.create_llm(model_id).ttft_ms = 2000
+    return model_id
+
+
+def cancel_after(client, request_id: str, delay_s: float = 0.1):
+    async def cancel():
+        await asyncio.sleep(delay_s)
+        return await client.post(f'/cancel/{request_id}')
+    return cancel()
+
+
+def test_registry_rejects_duplicate_ids_and_counts_savings():
+    registry = CancellationRegistry()
+    handle = registry.register('dup', 'mock', 'mock-x', max_tokens=100, expected_calls=3)
+    with pytest.raises(ValueError):
+        registry.register('dup', 'mock', 'mock-x', max_tokens=100)
+    handle.completed_calls = 1
+    assert registry.cancel('dup', 'cancelled')
+    registry.finish(handle)
+    assert registry.stats()['output_tokens_saved'] == 200
+    assert registry.stats()['cancelled'] == {'cancelled': 1}
+    assert not registry.cancel('dup')
+
+
+def test_run_attached_returns_none_once_cancelled(run):
+    handle = CancellationRegistry().register(None, 'mock', 'mock-x', max_tokens=10)
+
+    async def main():
+        work = asyncio.ensure_future(run_attached(handle, asyncio.sleep(10, result='late')))
+        await asyncio.sleep(0.01)
+        handle.cancel('cancelled')
+        return await work
+
+    assert run(main()) is None
+
+
+def test_cancel_endpoint_stops_a_running_generate(client, run):
+    model_id = slow_mock('mock-cancel-generate')
+    body = {'model_id': model_id, 'user_prompt': 'never finishes', 'request_id': 'cancel-generate'}
+
+    async def main():
+        return await asyncio.gather(client.post('/generate', json=body), cancel_after(client, 'cancel-generate'))
+
+    started = time.perf_counter()
+    generated, cancelled = run(main())
+    assert time.perf_counter() - started < 1.5
+    assert cancelled.json() == {'request_id': 'cancel-generate', 'cancelled': True}
+    assert generated.json()['status'] == 'cancelled'
+
+
+def test_cancel_endpoint_ends_a_stream_with_a_cancelled_event(client, run, sse):
+    model_id = slow_mock('mock-cancel-stream')
+    body = {'model_id': model_id, 'user_prompt': 'stream forever', 'stream': True, 'request_id': 'cancel-stream'}
+
+    async def main():
+        return await asyncio.gather(client.post('/generate', json=body), cancel_after(client, 'cancel-stream'))
+
+    streamed, _ = run(main())
+    events = sse(streamed.text)
+    assert {'cancelled': True, 'reason': 'cancelled'} in events
+    assert not any(e.get('text') for e in events)
+
+
+def test_cancelling_an_unknown_request_is_a_404(client, run):
+    assert run(client.post('/cancel/no-such-request')).status_code == 404
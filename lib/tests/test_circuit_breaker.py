@@ -0,0 +1,71 @@
+import time
+
+from llm_services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, breakers
+from llm_services.llm_factory import LLMFactory
+
+
+def breaker(**kwargs):
+    options = dict(window_s=60, min_calls=4, failure_rate=0.5, slow_call_s=10, slow_rate=0.8, open_s=0.05, probes=1)
+    options.update(kwargs)
+    return CircuitBreaker('m', **options)
+
+
+def calls(circuit, *outcomes, latency_s=0.1):
+    for ok in outcomes:
+        circuit.record(circuit.acquire(), ok, latency_s)
+
+
+def test_opens_once_enough_calls_fail():
+    circuit = breaker()
+    calls(circuit, True, False, False)
+    assert circuit.state == CLOSED  # fewer than min_calls so far
+    calls(circuit, True)
+    assert circuit.state == OPEN and circuit.trips == 1
+    assert circuit.acquire() is None and circuit.rejected == 1
+    assert 0 < circuit.retry_after_s() <= 0.05
+
+
+def test_slow_calls_open_the_circuit_too():
+    circuit = breaker()
+    calls(circuit, True, True, True, True, latency_s=20)
+    assert circuit.state == OPEN and 'slower' in circuit.last_reason
+
+
+def test_probe_closes_or_reopens_the_circuit():
+    circuit = breaker(min_calls=1)
+    calls(circuit, False)
+    time.sleep(0.06)
+    probe = circuit.acquire()
+    assert probe.probe and circuit.state == HALF_OPEN
+    assert circuit.acquire() is None  # one probe at a time
+    circuit.record(probe, False, 0.1)
+    assert circuit.state == OPEN and circuit.trips == 2
+
+    time.sleep(0.06)
+    circuit.record(circuit.acquire(), True, 0.1)
+    assert circuit.state == CLOSED
+
+
+def test_cancelled_probe_frees_its_slot():
+    circuit = breaker(min_calls=1)
+    calls(circuit, False)
+    time.sleep(0.06)
+    circuit.release(circuit.acquire())
+    assert circuit.acquire() is not None
+
+
+def test_open_circuit_fails_generate_fast_and_shows_in_models(client, run):
+    LLMFactory.create_llm('mock-breaker')
+    circuit = breakers.get('mock', 'mock-breaker')
+    circuit._open("tripped by test")
+
+    started = time.perf_counter()
+    response = run(client.post('/generate', json={'model_id': 'mock-breaker', 'user_prompt': 'down?'}))
+    assert time.perf_counter() - started < 0.5
+    assert response.status_code == 503
+    assert response.json()['detail']['status'] == 'circuit_open'
+    assert int(response.headers['Retry-After']) >= 1
+
+    models = run(client.get('/models')).json()
+    assert 'mock-breaker' in models['unavailable']
+    assert models['circuits']['mock-breaker']['state'] == OPEN
@@ -0,0 +1,68 @@
+from llm_services.client_pool import ClientPool, key_fingerprint
+from llm_services.llm_factory import LLMFactory
+
+
+def test_llm_instances_are_built_once_per_provider_key_and_model():
+    pool = ClientPool()
+    built = []
+
+    def builder():
+        built.append(object())
+        return built[-1]
+
+    first = pool.get_llm('openai', 'sk-one', 'gpt-4o', builder)
+    assert pool.get_llm('openai', 'sk-one', 'gpt-4o', builder) is first
+    assert pool.get_llm('openai', 'sk-two', 'gpt-4o', builder) is not first
+    assert pool.get_llm('openai', 'sk-one', 'gpt-4o-mini', builder) is not first
+    assert len(built) == 3
+    assert pool.stats()['hits'] == 1
+    assert pool.stats()['misses'] == 3
+    assert pool.stats()['llm_instances'] == 3
+
+
+def test_http_clients_are_shared_per_provider_and_key(run):
+    pool = ClientPool(max_connections=7, max_keepalive_connections=3, http2=False)
+    client = pool.get_http_client('openai', 'sk-one')
+    assert pool.get_http_client('openai', 'sk-one') is client
+    assert pool.get_http_client('anthropic', 'sk-one') is not client
+    assert pool.get_http_client('openai', 'sk-two') is not client
+    assert pool.stats()['http_clients'] == 3
+    assert pool.stats()['max_connections'] == 7
+
+    run(pool.aclose())
+    assert client.is_closed
+    assert pool.stats()['http_clients'] == 0
+    # A closed client is replaced on next use
+    assert not pool.get_http_client('openai', 'sk-one').is_closed
+    run(pool.aclose())
+
+
+def test_aclose_closes_llm_instances_and_forgets_them(run):
+    pool = ClientPool()
+    closed = []
+
+    class Closable:
+        async def aclose(self):
+            closed.append(self)
+
+    llm = pool.get_llm('mock', 'mock', 'mock-fast', Closable)
+    run(pool.aclose())
+    assert closed == [llm]
+    assert pool.get_llm('mock', 'mock', 'mock-fast', Closable) is not llm
+
+
+def test_key_fingerprint_does_not_expose_the_key():
+    fingerprint = key_fingerprint('sk-secret-value')
+    assert 'secret' not in fingerprint
+    assert fingerprint == key_fingerprint('sk-secret-value')
+    assert fingerprint != key_fingerprint('sk-other-value')
+
+
+def test_factory_reuses_pooled_instances(client, run):
+    before = LLMFactory.pool_stats()['hits']
+    llm = LLMFactory.create_llm('mock-pool-test')
+    assert LLMFactory.create_llm('mock-pool-test') is llm
+    assert LLMFactory.pool_stats()['hits'] == before + 1
+
+    stats = run(client.get('/stats')).json()
+    assert stats['client_pool']['llm_instances'] >= 1
@@ -0,0 +1,53 @@
+from llm_services.circuit_breaker import breakers
+
+
+def trip(model_id: str):
+    breakers.get('mock', model_id)._open("tripped by test")
+
+
+def test_streamed_compare_multiplexes_every_model(client, run, sse):
+    body = {'model_ids': ['mock-cmp-a', 'mock-cmp-b'], 'user_prompt': 'compare us'}
+    events = sse(run(client.post('/compare', json=body)).text)
+    done = {e['model']: e for e in events if e.get('done') and 'model' in e}
+    assert set(done) == {'mock-cmp-a', 'mock-cmp-b'}
+    assert all(e['status'] == 'success' for e in done.values())
+    assert {e['model'] for e in events if 'text' in e} == {'mock-cmp-a', 'mock-cmp-b'}
+    assert events[-1] == {'done': True, 'models': ['mock-cmp-a', 'mock-cmp-b']}
+
+
+def test_open_circuit_fails_only_that_model(client, run, sse):
+    trip('mock-cmp-down')
+    body = {'model_ids': ['mock-cmp-down', 'mock-cmp-up'], 'user_prompt': 'one is down'}
+
+    events = sse(run(client.post('/compare', json=body)).text)
+    down = next(e for e in events if e.get('model') == 'mock-cmp-down')
+    assert down['done'] and down['status'] == 'circuit_open' and down['retry_after_s'] > 0
+    assert not any(e.get('model') == 'mock-cmp-down' and 'text' in e for e in events)
+    up = next(e for e in events if e.get('model') == 'mock-cmp-up' and e.get('done'))
+    assert up['status'] == 'success'
+
+    results = run(client.post('/compare', json={**body, 'stream': False})).json()['results']
+    assert [r['model'] for r in results] == ['mock-cmp-down', 'mock-cmp-up']
+    assert results[0]['status'] == 'circuit_open'
+    assert results[1]['status'] == 'success'
+
+
+def test_max_tokens_is_clamped_per_model(client, run, sse):
+    body = {'model_ids': ['mock-cmp-clamp'], 'user_prompt': 'clamp me', 'max_tokens': 100_000}
+    done = [e for e in sse(run(client.post('/compare', json=body)).text) if e.get('model')][-1]
+    assert done['status'] == 'success' and done['max_tokens_clamped_to'] == 4096
+
+    result = run(client.post('/compare', json={**body, 'stream': False})).json()['results'][0]
+    assert result['status'] == 'success' and result['max_tokens_clamped_to'] == 4096
+
+
+def test_prompt_over_the_context_window_is_a_per_model_error(client, run):
+    body = {
+        'model_ids': ['mock-cmp-long'],
+        'user_prompt': 'word ' * 200_000,
+        'stream': False,
+    }
+    response = run(client.post('/compare', json=body))
+    assert response.status_code == 200
+    result = response.json()['results'][0]
+    assert result['status'] == 'error' and 'context' in result['error_message'].lower()
@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from llm_services.thread_bridge import InstrumentedExecutor
+
+gemini_llm = pytest.importorskip('llm_services.gemini_llm')
+
+
+def usage(prompt=3, output=2):
+    return SimpleNamespace(prompt_token_count=prompt, candidates_token_count=output,
+                           total_token_count=prompt + output, cached_content_token_count=0)
+
+
+def reply(text):
+    part = SimpleNamespace(text=text)
+    candidate = SimpleNamespace(content=SimpleNamespace(parts=[part]), finish_reason=1)
+    return SimpleNamespace(candidates=[candidate], usage_metadata=usage(), text=text)
+
+
+class FakeModel:
+    """Stands in for genai.GenerativeModel; the sync methods block like the real SDK"""
+
+    def __init__(self):
+        self.async_calls = 0
+        self.sync_threads = []
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        self.async_calls += 1
+        if stream:
+            async def chunks():
+                for text in ("Hel", "lo"):
+                    yield SimpleNamespace(text=text, usage_metadata=None)
+            return chunks()
+        return reply("async hello")
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        self.sync_threads.append(threading.current_thread().name)
+        if stream:
+            def chunks():
+                for text in ("bl", "ock", "ing"):
+                    time.sleep(0.03)
+                    yield SimpleNamespace(text=text, usage_metadata=None)
+            return chunks()
+        time.sleep(0.03)
+        return reply("sync hello")
+
+
+@pytest.fixture
+def gemini():
+    llm = gemini_llm.GeminiLLM('test-key', 'gemini-2.5-flash')
+    llm.model = FakeModel()
+    return llm
+
+
+async def ticks_while(awaitable):
+    """Count event-loop ticks while awaitable runs; a blocked loop gets none"""
+    ticks = 0
+    task = asyncio.ensure_future(awaitable)
+    while not task.done():
+        ticks += 1
+        await asyncio.sleep(0.005)
+    return ticks, task.result()
+
+
+def test_async_sdk_path_is_preferred(gemini, run):
+    assert gemini.use_async
+    response = run(gemini.generate('', 'hi', max_tokens=16))
+    assert response.status == 'success' and response.text == 'async hello'
+    assert response.tokens_used == {'input': 3, 'output': 2, 'total': 5}
+
+    async def collect():
+        return [chunk async for chunk in gemini.stream_generate('', 'hi', max_tokens=16)]
+
+    assert run(collect()) == ["Hel", "lo"]
+    assert gemini.model.async_calls == 2
+    assert gemini.model.sync_threads == []
+
+
+def test_sync_fallback_runs_on_the_gemini_pool_without_blocking_the_loop(gemini, run):
+    gemini.use_async = False
+    ticks, response = run(ticks_while(gemini.generate('', 'hi', max_tokens=16)))
+    assert response.text == 'sync hello'
+    assert ticks > 1
+
+    async def collect():
+        return [chunk async for chunk in gemini.stream_generate('', 'hi', max_tokens=16)]
+
+    ticks, chunks = run(ticks_while(collect()))
+    assert chunks == ["bl", "ock", "ing"]
+    assert ticks > 5
+    assert all(name.startswith('gemini-worker') for name in gemini.model.sync_threads)
+
+
+def test_executor_counts_calls_and_failures(run):
+    executor = InstrumentedExecutor('test-bridge', 2)
+    assert run(executor.run(lambda: 21 * 2)) == 42
+
+    def fail():
+        raise RuntimeError("sdk failure")
+
+    with pytest.raises(RuntimeError):
+        run(executor.run(fail))
+    stats = executor.stats()
+    assert stats['submitted'] == 2 and stats['completed'] == 1 and stats['failed'] == 1
+    assert stats['active'] == 0 and stats['queued'] == 0
+    executor.shutdown()
+
+
+def test_iterate_relays_items_and_errors(run):
+    executor = InstrumentedExecutor('test-iterate', 1)
+
+    def produce():
+        yield 1
+        yield 2
+        raise ValueError("stream broke")
+
+    async def collect():
+        items = []
+        with pytest.raises(ValueError):
+            async for item in executor.iterate(produce):
+                items.append(item)
+        return items
+
+    assert run(collect()) == [1, 2]
+    executor.shutdown()
+
+
+def test_closing_iterate_stops_the_producer(run):
+    executor = InstrumentedExecutor('test-iterate-stop', 1)
+    produced = []
+
+    def produce():
+        for i in range(100):
+            time.sleep(0.005)
+            produced.append(i)
+            yield i
+
+    async def take_two():
+        items = []
+        async for item in executor.iterate(produce):
+            items.append(item)
+            if len(items) == 2:
+                break
+        await asyncio.sleep(0.05)
+        return items
+
+    assert run(take_two()) == [0, 1]
+    assert len(produced) < 100
+    executor.shutdown()
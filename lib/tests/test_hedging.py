@@ -0,0 +1,102 @@
+import asyncio
+from types import SimpleNamespace
+
+from llm_services.hedging import Hedger, ModelHedger, hedger as shared_hedger
+from llm_services.llm_factory import LLMFactory
+
+
+def model_hedger(**kwargs):
+    options = dict(percentile=50, min_samples=3, window=10, budget_ratio=0.5, burst=2.0, min_delay_s=0.0)
+    options.update(kwargs)
+    return ModelHedger('m', **options)
+
+
+def hedger_for(**kwargs) -> Hedger:
+    hedger = Hedger()
+    hedger._models['m'] = model_hedger(**kwargs)
+    for _ in range(3):
+        hedger.observe('m', 0.01)
+    return hedger
+
+
+class Calls:
+    """Successive calls sleep for the given delays and return their position"""
+
+    def __init__(self, *delays, status='success'):
+        self.delays = list(delays)
+        self.started = 0
+        self.cancelled = 0
+        self.status = status
+
+    async def __call__(self):
+        position = self.started
+        self.started += 1
+        try:
+            await asyncio.sleep(self.delays[position])
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return SimpleNamespace(position=position, status=self.status)
+
+
+def test_delay_is_a_percentile_of_recent_latencies():
+    hedger = model_hedger(min_samples=4, min_delay_s=0.02)
+    for latency in (0.01, 0.03, 0.05):
+        hedger.observe(latency)
+    assert hedger.delay() is None
+    hedger.observe(0.07)
+    assert hedger.delay() == 0.05
+    assert model_hedger(min_samples=1, min_delay_s=0.5).delay() is None
+
+
+def test_budget_limits_how_often_calls_hedge():
+    hedger = model_hedger(budget_ratio=0.5, burst=1.0)
+    assert hedger.try_spend()
+    assert not hedger.try_spend()
+    hedger.earn()
+    hedger.earn()
+    assert hedger.try_spend()
+    assert hedger.stats()['skipped_budget'] == 1
+
+
+def test_fast_primary_never_hedges(run):
+    hedger = hedger_for()
+    calls = Calls(0.0)
+    assert run(hedger.run('m', calls)).position == 0
+    assert calls.started == 1
+
+
+def test_slow_primary_is_hedged_and_the_loser_cancelled(run):
+    hedger = hedger_for()
+    calls = Calls(0.5, 0.0)
+
+    async def main():
+        result = await hedger.run('m', calls)
+        await asyncio.sleep(0)  # let the cancelled primary unwind
+        return result
+
+    assert run(main()).position == 1
+    assert calls.cancelled == 1
+    assert hedger.get('m').won == 1
+
+
+def test_no_hedge_when_can_hedge_refuses(run):
+    hedger = hedger_for()
+    calls = Calls(0.05, 0.0)
+    assert run(hedger.run('m', calls, can_hedge=lambda: False)).position == 0
+    assert calls.started == 1
+
+
+def test_error_result_only_wins_when_both_fail(run):
+    hedger = hedger_for()
+    calls = Calls(0.03, 0.0, status='error')
+    result = run(hedger.run('m', calls))
+    assert result.status == 'error' and result.position == 0
+    assert calls.started == 2
+
+
+def test_generate_opts_in_per_call(run):
+    llm = LLMFactory.create_llm('mock-hedge')
+    response = run(llm.generate('', 'hedge me', max_tokens=4, hedge=True))
+    assert response.status == 'success'
+    assert shared_hedger.get('mock-hedge').calls == 1
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from llm_services.cancellation import CancellationRegistry
+from llm_services.job_queue import Job, JobQueue, JobQueueFull
+from llm_services.llm_factory import LLMFactory
+
+
+def job(job_id: str, iterations: int, priority: str, order: list, delay_s: float = 0.0) -> Job:
+    handle = CancellationRegistry().register(job_id, 'mock', 'mock-x', max_tokens=10, expected_calls=iterations)
+
+    async def run_iteration(iteration):
+        order.append((job_id, iteration))
+        await asyncio.sleep(delay_s)
+        return {'iteration': iteration, 'status': 'success'}
+
+    return Job(handle, iterations, priority, run_iteration)
+
+
+def test_high_priority_iterations_overtake_queued_ones(run):
+    order = []
+
+    async def main():
+        queue = JobQueue(workers=1, max_pending=10, max_finished=10, retention_s=60)
+        queue.start()
+        low = job('low', 3, 'low', order, delay_s=0.01)
+        high = job('high', 2, 'high', order, delay_s=0.01)
+        queue.submit(low)
+        queue.submit(high)
+        while not (low.finished and high.finished):
+            await asyncio.sleep(0.005)
+        await queue.stop()
+        return low, high
+
+    low, high = run(main())
+    # Both jobs are queued before the single worker starts, so every high iteration runs first
+    assert [job_id for job_id, _ in order] == ['high', 'high', 'low', 'low', 'low']
+    assert low.status == high.status == 'completed'
+
+
+def test_position_counts_queued_iterations_ahead(run):
+    async def main():
+        queue = JobQueue(workers=1, max_pending=10, max_finished=10, retention_s=60)
+        queue.start()
+        running = job('running', 1, 'normal', [], delay_s=0.05)
+        queue.submit(running)
+        await asyncio.sleep(0.01)  # the only worker has picked it up
+        low, normal, high = job('low', 2, 'low', []), job('normal', 3, 'normal', []), job('high', 1, 'high', [])
+        for queued in (low, normal, high):
+            queue.submit(queued)
+        positions = [queue.position(queued) for queued in (running, low, normal, high)]
+        while not low.finished:
+            await asyncio.sleep(0.005)
+        positions.append(queue.position(low))
+        await queue.stop()
+        return positions
+
+    assert run(main()) == [4, 4, 1, 0, 0]
+
+
+def test_full_queue_rejects_new_jobs(run):
+    async def main():
+        queue = JobQueue(workers=1, max_pending=1, max_finished=10, retention_s=60)
+        queue.start()
+        queue.submit(job('first', 1, 'normal', [], delay_s=0.05))
+        with pytest.raises(JobQueueFull):
+            queue.submit(job('second', 1, 'normal', []))
+        await queue.stop()
+        return queue.stats()
+
+    assert run(main())['rejected'] == 1
+
+
+def test_finished_jobs_are_evicted_oldest_first(run):
+    async def main():
+        queue = JobQueue(workers=2, max_pending=10, max_finished=1, retention_s=60)
+        queue.start()
+        first, second = job('a', 1, 'normal', []), job('b', 1, 'normal', [])
+        queue.submit(first)
+        await asyncio.sleep(0.01)
+        queue.submit(second)
+        while not second.finished:
+            await asyncio.sleep(0.005)
+        await queue.stop()
+        return queue
+
+    queue = run(main())
+    assert queue.get('a') is None and queue.get('b') is not None
+    assert queue.stats()['evicted'] == 1
+
+
+def test_submit_and_long_poll_a_job(client, run):
+    submitted = run(client.post('/jobs', json={'model_id': 'mock-jobs', 'user_prompt': 'queued', 'iterations': 3}))
+    assert submitted.status_code == 202
+    job_id = submitted.json()['job_id']
+
+    done = run(client.get(f'/jobs/{job_id}', params={'wait': 5, 'after': 2})).json()
+    while done['status'] != 'completed':
+        done = run(client.get(f'/jobs/{job_id}', params={'wait': 5})).json()
+    assert done['completed_iterations'] == 3
+    full = run(client.get(f'/jobs/{job_id}')).json()
+    assert sorted(r['iteration'] for r in full['results']) == [1, 2, 3]
+
+
+def test_job_events_stream_each_iteration_then_a_summary(client, run, sse):
+    job_id = run(client.post('/jobs', json={'model_id': 'mock-jobs-sse', 'user_prompt': 'events', 'iterations': 2})).json()['job_id']
+    events = sse(run(client.get(f'/jobs/{job_id}/events')).text)
+    assert sorted(e['iteration'] for e in events[:-1]) == [1, 2]
+    assert events[-1]['done'] and events[-1]['status'] == 'completed'
+
+
+def test_deleting_a_job_cancels_it(client, run):
+    LLMFactory.create_llm('mock-jobs-cancel').ttft_ms = 2000
+    job_id = run(client.post('/jobs', json={'model_id': 'mock-jobs-cancel', 'user_prompt': 'stop', 'iterations': 2})).json()['job_id']
+    run(asyncio.sleep(0.05))
+    run(client.delete(f'/jobs/{job_id}'))
+    result = run(client.get(f'/jobs/{job_id}', params={'wait': 5})).json()
+    while result['status'] != 'cancelled':
+        result = run(client.get(f'/jobs/{job_id}', params={'wait': 5})).json()
+    assert result['completed_iterations'] == 2
+
+    assert run(client.get('/jobs/no-such-job')).status_code == 404
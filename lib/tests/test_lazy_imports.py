@@ -0,0 +1,46 @@
+import json
+import os
+import subprocess
+import sys
+
+from llm_services import llm_factory
+from llm_services.client_pool import client_pool
+from llm_services.llm_factory import LLMFactory
+from llm_services.tokenizer import token_counter
+
+LIB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SDK_MODULES = ['openai', 'anthropic', 'google.generativeai']
+
+
+def test_server_import_leaves_provider_sdks_unloaded():
+    script = (
+        "import json, sys; import llm_api_server; "
+        f"print(json.dumps([name for name in {SDK_MODULES!r} if name in sys.modules]))"
+    )
+    env = dict(os.environ, OPENAI_API_KEY='sk-test', ANTHROPIC_API_KEY='sk-ant-test')
+    result = subprocess.run([sys.executable, '-c', script], cwd=LIB_DIR, env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert json.loads(result.stdout.splitlines()[-1]) == []
+
+
+def test_load_providers_imports_only_configured_providers(run):
+    run(LLMFactory.load_providers('mock-lazy -> gpt-4o'))
+    assert 'mock' in LLMFactory.loaded_providers()
+    assert 'openai' not in LLMFactory.loaded_providers()
+    # A bad model ID is left for create_llm to report
+    run(LLMFactory.load_providers('not-a-model'))
+
+
+def test_warm_up_builds_clients_and_tokenizers():
+    misses = client_pool.misses
+    LLMFactory.warm_up(['mock-warm', 'gpt-4o'])  # gpt-4o has no key and is skipped
+    assert client_pool.misses == misses + 1
+    assert ('mock', 'mock-warm') in token_counter._tokenizers
+    assert set(LLMFactory.loaded_providers()) >= set(LLMFactory.configured_providers())
+    assert 'openai' not in llm_factory._provider_classes
+
+
+def test_stats_report_provider_import_times(client, run):
+    run(client.post('/generate', json={'model_id': 'mock-lazy-stats', 'user_prompt': 'hi'}))
+    loaded = run(client.get('/stats')).json()['providers_loaded']
+    assert loaded['mock'] >= 0
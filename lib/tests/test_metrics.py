@@ -0,0 +1,70 @@
+from llm_services.llm_factory import LLMFactory
+from llm_services.metrics import CallStats, MetricsRegistry, current_call
+
+
+def stream(llm, **kwargs):
+    async def main():
+        stats = CallStats()
+        chunks = [chunk async for chunk in llm.stream_generate('', 'measure me', call_stats=stats, **kwargs)]
+        # The consumer's context must not keep pointing at the finished call
+        return chunks, stats, current_call.get()
+    return main()
+
+
+def test_stream_records_ttft_and_usage_then_unbinds(run):
+    llm = LLMFactory.create_llm('mock-metrics')
+    chunks, stats, bound = run(stream(llm, max_tokens=16))
+    assert bound is None
+    assert stats.status == 'success' and stats.mode == 'stream'
+    assert stats.ttft_ms is not None and stats.ttft_ms <= stats.duration_ms
+    assert stats.chunks == len(chunks) == 8
+    assert stats.tokens_used['output'] == 8 and not stats.tokens_estimated
+    assert stats.output_tokens_per_sec > 0
+
+
+def test_routed_stream_unbinds_every_attempt(run):
+    llm = LLMFactory.create_llm('mock-metrics-a -> mock-metrics-b')
+    chunks, stats, bound = run(stream(llm, max_tokens=16))
+    assert bound is None
+    assert stats.routed_from == 'mock-metrics-a -> mock-metrics-b'
+    assert [a['model'] for a in stats.attempts] == ['mock-metrics-a']
+
+
+def test_abandoned_stream_does_not_leak_its_stats(run):
+    llm = LLMFactory.create_llm('mock-metrics-abandon')
+
+    async def main():
+        chunks = llm.stream_generate('', 'stop early', max_tokens=16)
+        await chunks.__anext__()
+        await chunks.aclose()
+        return current_call.get()
+
+    assert run(main()) is None
+
+
+def test_generate_records_a_call(run):
+    llm = LLMFactory.create_llm('mock-metrics-generate')
+    stats = CallStats()
+    response = run(llm.generate('', 'measure me', max_tokens=16, call_stats=stats))
+    assert response.status == 'success'
+    assert stats.mode == 'generate' and stats.duration_ms > 0
+    assert stats.tokens_used == response.tokens_used
+
+
+def test_snapshots_merge_into_one_registry():
+    first, second = MetricsRegistry(), MetricsRegistry()
+    for registry, ttft_ms in ((first, 100.0), (second, 300.0)):
+        registry.record_call(CallStats(model='m', mode='stream', ttft_ms=ttft_ms, duration_ms=500.0,
+                                       tokens_used={'input': 5, 'output': 10, 'total': 15}))
+    merged = MetricsRegistry.merge([first.snapshot(), second.snapshot()])
+    text = merged.render_prometheus()
+    assert 'llm_time_to_first_token_seconds_count{model="m"} 2' in text
+    assert 'llm_requests_total{mode="stream",model="m",status="success"} 2.0' in text
+    assert 'llm_tokens_total{kind="output",model="m"} 20.0' in text
+
+
+def test_metrics_endpoint_serves_prometheus_text(client, run):
+    run(client.post('/generate', json={'model_id': 'mock-metrics-http', 'user_prompt': 'hi', 'stream': True}))
+    response = run(client.get('/metrics'))
+    assert response.headers['content-type'].startswith('text/plain')
+    assert 'llm_time_to_first_token_seconds_bucket{model="mock-metrics-http"' in response.text
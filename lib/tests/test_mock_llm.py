@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from llm_services.llm_factory import LLMFactory
+from llm_services.mock_llm import MockLLM, MockProviderError
+
+
+def test_slow_models_are_four_times_slower():
+    fast, slow = MockLLM('', 'mock-fast-x'), MockLLM('', 'mock-slow-x')
+    assert slow.ttft_ms == fast.ttft_ms * 4
+    assert slow.tokens_per_sec == fast.tokens_per_sec / 4
+
+
+@pytest.mark.parametrize('distribution', ['fixed', 'uniform', 'lognormal'])
+def test_output_length_stays_within_one_and_max_tokens(distribution):
+    llm = MockLLM('', 'mock-dist')
+    llm.output_distribution = distribution
+    llm.output_tokens = 100
+    random.seed(7)
+    lengths = [llm._output_length(max_tokens=120) for _ in range(200)]
+    assert all(1 <= length <= 120 for length in lengths)
+    if distribution == 'fixed':
+        assert set(lengths) == {100}
+    if distribution == 'uniform':
+        assert all(50 <= length <= 120 for length in lengths)
+
+
+def test_injected_rate_limits_carry_retry_after():
+    llm = MockLLM('', 'mock-429')
+    llm.rate_limit_rate = 1.0
+    llm.retry_after_s = 2.5
+    with pytest.raises(MockProviderError) as raised:
+        llm._maybe_fail()
+    assert raised.value.status_code == 429
+    assert raised.value.response.headers == {'retry-after': '2.5'}
+
+
+def test_generate_reports_usage_for_the_fake_output(run):
+    llm = MockLLM('', 'mock-usage')
+    response = run(llm.generate('be brief', 'hello there', max_tokens=5))
+    assert response.status == 'success'
+    assert response.text.split() == [f"tok{i}" for i in range(5)]
+    assert response.tokens_used['output'] == 5
+    assert response.tokens_used['total'] == response.tokens_used['input'] + 5
+
+
+def test_stream_groups_tokens_per_chunk(run):
+    llm = MockLLM('', 'mock-chunks')
+    llm.chunk_tokens = 3
+
+    async def collect():
+        return [chunk async for chunk in llm.stream_generate('', 'hi', max_tokens=8)]
+
+    chunks = run(collect())
+    assert len(chunks) == 3
+    assert "".join(chunks).split() == [f"tok{i}" for i in range(8)]
+
+
+def test_injected_errors_become_error_responses(run):
+    llm = MockLLM('', 'mock-errors')
+    llm.error_rate = 1.0
+    llm.max_retries = 1
+    response = run(llm.generate('', 'fail', max_tokens=5))
+    assert response.status == 'error' and 'internal server error' in response.error_message
+
+
+def test_factory_serves_mock_models_when_enabled():
+    assert 'mock-fast' in LLMFactory.get_available_models()
+    assert LLMFactory.provider_for('mock-anything') == 'mock'
+    assert isinstance(LLMFactory.create_llm('mock-anything'), MockLLM)
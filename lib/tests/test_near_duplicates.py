@@ -0,0 +1,95 @@
+import pytest
+
+from llm_services import near_duplicates as near_duplicates_module
+from llm_services.near_duplicates import NearDuplicateIndex, minhash, normalize, scope_of, similarity
+
+PROMPT = "Summarize the quarterly sales report for the northern region and list the three largest accounts."
+NEAR = "summarize the quarterly sales report, for the NORTHERN region and list the three biggest accounts!"
+OTHER = "Write a haiku about autumn leaves falling on a quiet mountain lake at dawn."
+SCOPE = scope_of('mock-fast', '', 0.0, 16, 1.0)
+
+
+def index(**kwargs) -> NearDuplicateIndex:
+    options = dict(enabled=True, serve=False, max_entries=100, threshold=0.5, num_perm=64, bands=16,
+                   shingle_chars=5, max_chars=8192)
+    options.update(kwargs)
+    return NearDuplicateIndex(**options)
+
+
+def jaccard(a: str, b: str, k: int = 5) -> float:
+    shingles = [{text[i:i + k] for i in range(len(text) - k + 1)} for text in (normalize(a), normalize(b))]
+    return len(shingles[0] & shingles[1]) / len(shingles[0] | shingles[1])
+
+
+def test_normalize_ignores_case_width_punctuation_and_spacing():
+    assert normalize("  Hello,\tＷＯＲＬＤ!! ") == "hello world"
+
+
+@pytest.mark.parametrize('vectorized', [False, True])
+def test_signatures_estimate_jaccard_similarity(monkeypatch, vectorized):
+    if vectorized:
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(near_duplicates_module, 'numpy', None)
+    signatures = [minhash(normalize(text), 128) for text in (PROMPT, NEAR, OTHER)]
+    assert similarity(signatures[0], minhash(normalize(PROMPT.upper()), 128)) == 1.0
+    assert abs(similarity(signatures[0], signatures[1]) - jaccard(PROMPT, NEAR)) < 0.2
+    assert similarity(signatures[0], signatures[2]) < 0.2
+    # Short texts fill every bin by borrowing from their neighbours
+    assert minhash("hi there", 64).count((1 << 64) - 1) == 0
+
+
+def test_lookup_finds_near_duplicates_within_a_scope():
+    near_duplicates = index()
+    near_duplicates.add(SCOPE, PROMPT, 'key-1')
+    near_duplicates.add(SCOPE, OTHER, 'key-2')
+
+    [(score, _, key)] = near_duplicates.lookup(SCOPE, NEAR)
+    assert key == 'key-1' and score >= 0.5
+    assert near_duplicates.lookup(SCOPE, PROMPT.lower() + "  ")[0][0] == 1.0
+    assert near_duplicates.lookup(SCOPE, NEAR, threshold=1.0) == []
+    assert near_duplicates.lookup(scope_of('mock-fast', 'other system', 0.0, 16, 1.0), PROMPT) == []
+    stats = near_duplicates.stats()
+    assert stats['lookups'] == 4 and stats['hits'] == 2 and stats['lookup_ms_p50'] is not None
+
+
+def test_index_is_bounded_and_keeps_one_entry_per_prompt():
+    near_duplicates = index(max_entries=2, max_chars=200)
+    near_duplicates.add(SCOPE, PROMPT, 'old')
+    near_duplicates.add(SCOPE, PROMPT + "!", 'new')  # same normalized text: the newest response wins
+    assert near_duplicates.stats()['entries'] == 1
+    assert near_duplicates.lookup(SCOPE, PROMPT)[0][2] == 'new'
+
+    near_duplicates.add(SCOPE, OTHER, 'other')
+    near_duplicates.add(SCOPE, "An entirely different request about databases and indexes.", 'third')
+    assert near_duplicates.stats()['evicted'] == 1
+    assert near_duplicates.lookup(SCOPE, PROMPT) == []  # least recently used went first
+
+    near_duplicates.add(SCOPE, "x" * 201, 'too long')
+    assert near_duplicates.stats()['skipped'] == 1
+
+    for entry_id in list(near_duplicates._entries):
+        near_duplicates.remove(entry_id)
+    assert near_duplicates._tables == {} and near_duplicates._by_text == {}
+
+
+def test_signature_size_must_split_into_bands():
+    with pytest.raises(ValueError):
+        index(num_perm=48, bands=16)
+
+
+def test_generate_serves_a_near_duplicate_on_request(client, run):
+    body = {'model_id': 'mock-near-dup', 'user_prompt': PROMPT, 'temperature': 0.0, 'max_tokens': 16}
+    original = run(client.post('/generate', json=body)).json()
+    assert original['near_duplicate_similarity'] is None
+
+    plain = run(client.post('/generate', json=dict(body, user_prompt=NEAR))).json()
+    assert plain['near_duplicate_similarity'] is None and not plain['cache_hit']
+
+    # Differs from the indexed NEAR prompt only in case and punctuation, which the exact cache can't see past
+    served = run(client.post('/generate', json=dict(body, user_prompt=NEAR.upper() + "??", near_duplicate=True))).json()
+    assert served['near_duplicate_similarity'] == 1.0
+
+    suggested = run(client.post('/near_duplicates', json={**body, 'user_prompt': NEAR, 'threshold': 0.5})).json()
+    assert len(suggested['matches']) == 2  # the original prompt and its near-duplicate NEAR
+    assert 0.5 <= suggested['matches'][1]['similarity'] < 1.0
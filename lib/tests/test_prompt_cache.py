@@ -0,0 +1,77 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import llm_api_server
+from llm_services.llm_factory import LLMFactory
+from llm_services.prompt_cache import (
+    EPHEMERAL, anthropic_tokens, cacheable_prefix, gemini_tokens, min_cacheable_tokens, openai_tokens,
+    prefix_cache_enabled,
+)
+
+LONG_PROMPT = "shared context " * 2000
+
+
+def test_request_flag_overrides_the_default():
+    assert prefix_cache_enabled(True)
+    assert not prefix_cache_enabled(False)
+    assert prefix_cache_enabled(None) is False
+
+
+def test_only_long_prompts_on_caching_providers_are_cacheable():
+    assert min_cacheable_tokens('anthropic', 'claude-3-5-haiku-20241022') == 2048
+    assert min_cacheable_tokens('mock', 'mock-fast') is None
+    assert cacheable_prefix('openai', 'gpt-4o', LONG_PROMPT, 'question')
+    assert not cacheable_prefix('openai', 'gpt-4o', '', 'short question')
+    assert not cacheable_prefix('mock', 'mock-fast', LONG_PROMPT, 'question')
+
+
+def test_usage_reports_cached_input_per_provider():
+    anthropic = anthropic_tokens(SimpleNamespace(
+        input_tokens=10, output_tokens=5, cache_read_input_tokens=1000, cache_creation_input_tokens=0))
+    assert anthropic == {'input': 1010, 'output': 5, 'total': 1015, 'cached_input': 1000, 'cache_write': 0}
+
+    openai = openai_tokens(SimpleNamespace(
+        prompt_tokens=1200, completion_tokens=5, total_tokens=1205,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=1024)))
+    assert openai['cached_input'] == 1024 and openai['input'] == 1200
+
+    gemini = gemini_tokens(SimpleNamespace(
+        prompt_token_count=20, candidates_token_count=3, total_token_count=23, cached_content_token_count=0))
+    assert 'cached_input' not in gemini
+
+
+def test_anthropic_marks_cache_breakpoints_only_when_enabled():
+    anthropic_llm = pytest.importorskip('llm_services.anthropic_llm')
+    llm = anthropic_llm.AnthropicLLM('test-key', 'claude-sonnet-4-20250514')
+    history = [{'role': 'user', 'content': 'earlier'}, {'role': 'assistant', 'content': 'reply'}]
+
+    plain = llm.message_params('system', 'question', 1.0, 100, 1.0, prefix_cache=False, history=history)
+    assert plain['system'] == 'system'
+    assert plain['messages'][-1] == {'role': 'user', 'content': 'question'}
+
+    cached = llm.message_params('system', 'question', 1.0, 100, 1.0, prefix_cache=True, history=history)
+    assert cached['system'][0]['cache_control'] == EPHEMERAL
+    assert cached['messages'][1]['content'][0]['cache_control'] == EPHEMERAL
+    assert cached['messages'][-1]['content'][0] == {'type': 'text', 'text': 'question', 'cache_control': EPHEMERAL}
+    # The caller's history is left untouched
+    assert history[1]['content'] == 'reply'
+
+
+def test_gemini_keeps_the_system_prompt_first_when_caching():
+    gemini_llm = pytest.importorskip('llm_services.gemini_llm')
+    llm = gemini_llm.GeminiLLM('test-key', 'gemini-2.5-flash')
+    assert llm._build_prompt('system', '안녕하세요', prefix_cache=True).startswith("System: system")
+    assert not llm._build_prompt('system', '안녕하세요', prefix_cache=False).startswith("System:")
+
+
+def test_batch_lets_the_first_iteration_write_the_cache(client, run, ndjson, monkeypatch):
+    monkeypatch.setattr(llm_api_server, 'cacheable_prefix', lambda *args: True)
+    LLMFactory.create_llm('mock-prefix-batch').ttft_ms = 100
+    body = {'model_id': 'mock-prefix-batch', 'user_prompt': 'iterate', 'iterations': 3, 'stream': True, 'prefix_cache': True}
+    started = time.perf_counter()
+    lines = ndjson(run(client.post('/batch_generate', json=body)).text)
+    assert lines[0]['iteration'] == 1
+    # The other iterations only start once the first has finished
+    assert time.perf_counter() - started >= 0.2
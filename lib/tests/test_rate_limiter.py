@@ -0,0 +1,114 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from llm_services.mock_llm import MockLLM
+from llm_services.rate_limiter import ModelLimiter, Reservation, TokenBucket, _parse_duration
+
+
+class FrozenBucket(TokenBucket):
+    """Never refills, so every change to the level comes from the limiter itself"""
+    clock = staticmethod(lambda: 0.0)
+
+
+@pytest.fixture
+def failing_mock(monkeypatch):
+    llm = MockLLM('', 'mock-refund')
+    llm.max_retries = 1
+    llm.error_rate = 1.0
+    monkeypatch.setattr(llm.rate_limiter, 'tokens', FrozenBucket(10_000))
+    return llm
+
+
+def test_parse_duration_accepts_provider_formats():
+    assert _parse_duration('2') == 2.0
+    assert _parse_duration('6m0s') == 360.0
+    assert _parse_duration('20ms') == pytest.approx(0.02)
+    assert _parse_duration('soon') is None
+
+
+def test_waiters_are_served_in_arrival_order(run):
+    limiter = ModelLimiter('mock', 'mock-fifo', rpm=None, tpm=600)
+    order = []
+
+    async def take(name, tokens):
+        await limiter.acquire(tokens)
+        order.append(name)
+
+    async def main():
+        await limiter.acquire(590)
+        big = asyncio.ensure_future(take('big', 20))
+        await asyncio.sleep(0)
+        small = asyncio.ensure_future(take('small', 5))
+        await asyncio.gather(big, small)
+
+    run(main())
+    # 'small' fits the budget straight away but still waits behind 'big'
+    assert order == ['big', 'small']
+    assert limiter.stats()['delayed'] == 2
+
+
+def test_settle_reconciles_the_estimate_once():
+    limiter = ModelLimiter('mock', 'mock-settle', rpm=None, tpm=None)
+    limiter.tokens = FrozenBucket(1000)
+    limiter.tokens.consume(300)
+    reservation = Reservation(limiter, 300, 0.0)
+    reservation.settle(120)
+    reservation.settle(50)
+    reservation.refund()
+    assert limiter.tokens.available() == 880
+    assert limiter.stats()['estimate_error_tokens'] == -180
+    assert limiter.stats()['refunded'] == 0
+
+
+def test_failed_generate_refunds_its_reservation(run, failing_mock):
+    response = run(failing_mock.generate('', 'this call will fail', max_tokens=100))
+    assert response.status == 'error'
+    assert failing_mock.rate_limiter.tokens.available() == 10_000
+    assert failing_mock.rate_limiter.stats()['refunded'] == 1
+
+
+def test_stream_failing_before_output_refunds_its_reservation(run, failing_mock):
+    async def collect():
+        return [chunk async for chunk in failing_mock.stream_generate('', 'this stream will fail', max_tokens=100)]
+
+    chunks = run(collect())
+    assert chunks[-1].startswith('Error:')
+    assert failing_mock.rate_limiter.tokens.available() == 10_000
+
+
+def test_successful_stream_settles_actual_usage(run, monkeypatch):
+    llm = MockLLM('', 'mock-settle-stream')
+    monkeypatch.setattr(llm.rate_limiter, 'tokens', FrozenBucket(10_000))
+
+    async def collect():
+        return [chunk async for chunk in llm.stream_generate('', 'hi', max_tokens=100)]
+
+    run(collect())
+    used = llm.calculate_tokens('hi') + llm.output_tokens
+    assert llm.rate_limiter.tokens.available() == 10_000 - used
+    assert llm.rate_limiter.stats()['refunded'] == 0
+
+
+def test_gemini_stream_settles_with_the_reported_usage(run, monkeypatch):
+    gemini_llm = pytest.importorskip('llm_services.gemini_llm')
+    llm = gemini_llm.GeminiLLM('test-key', 'gemini-2.5-flash')
+
+    class StreamingModel:
+        async def generate_content_async(self, prompt, stream=False, **kwargs):
+            async def chunks():
+                yield SimpleNamespace(text="Hi", usage_metadata=None)
+                yield SimpleNamespace(text=" there", usage_metadata=SimpleNamespace(
+                    prompt_token_count=4, candidates_token_count=3, total_token_count=7,
+                    cached_content_token_count=0))
+            return chunks()
+
+    llm.model = StreamingModel()
+    monkeypatch.setattr(llm.rate_limiter, 'tokens', FrozenBucket(10_000))
+
+    async def collect():
+        return [chunk async for chunk in llm.stream_generate('', 'hi', max_tokens=500)]
+
+    assert run(collect()) == ["Hi", " there"]
+    assert llm.rate_limiter.tokens.available() == 10_000 - 7
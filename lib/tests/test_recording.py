@@ -0,0 +1,107 @@
+import json
+import time
+
+import pytest
+
+from llm_services import base_llm, replay_llm
+from llm_services.llm_factory import LLMFactory
+from llm_services.recording import TrafficRecorder, fingerprint_of
+from llm_services.replay_llm import ReplayLLM
+
+REQUEST = {'system_prompt': '', 'user_prompt': 'replay me', 'temperature': 0.0, 'max_tokens': 8, 'top_p': 1.0}
+
+
+@pytest.fixture
+def recorder(tmp_path, monkeypatch):
+    recorder = TrafficRecorder(str(tmp_path / 'capture.jsonl'), flush_interval_s=0.01, max_batch=100, max_pending=100)
+    monkeypatch.setattr(base_llm, 'recorder', recorder)
+    return recorder
+
+
+def replayer(monkeypatch, path, model_id, **settings):
+    monkeypatch.setenv('LLM_REPLAY_PATH', str(path))
+    monkeypatch.setattr(replay_llm, '_store', None)
+    for name, value in settings.items():
+        monkeypatch.setenv(name, value)
+    return ReplayLLM('replay', model_id)
+
+
+def write_capture(path, *entries):
+    path.write_text("".join(json.dumps(entry) + "\n" for entry in entries))
+
+
+def stream_entry(model_id, chunks):
+    return {
+        'fingerprint': fingerprint_of(model_id, REQUEST), 'model': model_id, 'mode': 'stream',
+        'request': REQUEST, 'chunks': chunks, 'response': {'status': 'success', 'tokens_used': {'total': 3}},
+    }
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_recorded_calls_replay_the_same_output(run, recorder, monkeypatch):
+    llm = LLMFactory.create_llm('mock-recorded')
+
+    async def main():
+        response = await llm.generate(**REQUEST)
+        chunks = await collect(llm.stream_generate(**REQUEST))
+        await recorder.stop()
+        return response, chunks
+
+    response, chunks = run(main())
+    entries = [json.loads(line) for line in open(recorder.path)]
+    assert [entry['mode'] for entry in entries] == ['generate', 'stream']
+    assert entries[0]['request'] == REQUEST and entries[0]['response']['text'] == response.text
+    offsets = [offset for offset, _ in entries[1]['chunks']]
+    assert offsets == sorted(offsets) and [text for _, text in entries[1]['chunks']] == chunks
+    assert recorder.stats()['written'] == 2 and recorder.stats()['pending'] == 0
+
+    replay = replayer(monkeypatch, recorder.path, 'mock-recorded', LLM_REPLAY_SPEED='0')
+    replayed = run(replay.generate(**REQUEST))
+    assert replayed.status == 'success' and replayed.text == response.text
+    assert run(collect(replay.stream_generate(**REQUEST))) == chunks
+    assert replay.store.stats()['hits'] == 2
+
+
+def test_writer_appends_in_batches_and_drops_past_its_cap(run, tmp_path):
+    recorder = TrafficRecorder(str(tmp_path / 'capped.jsonl'), flush_interval_s=60, max_batch=100, max_pending=2)
+
+    async def main():
+        for i in range(3):
+            recorder.record({'fingerprint': str(i), 'model': 'm'})
+        await recorder.stop()
+
+    run(main())
+    assert recorder.stats()['dropped'] == 1 and recorder.stats()['written'] == 2
+    assert recorder._executor.stats()['completed'] == 1  # one batched append
+
+
+def test_replay_follows_recorded_timing_scaled_by_speed(run, tmp_path, monkeypatch):
+    path = tmp_path / 'timed.jsonl'
+    write_capture(path, stream_entry('mock-timed', [[0, 'a'], [100, 'b'], [200, 'c']]))
+
+    started = time.perf_counter()
+    assert run(collect(replayer(monkeypatch, path, 'mock-timed').stream_generate(**REQUEST))) == ['a', 'b', 'c']
+    assert time.perf_counter() - started >= 0.19
+
+    started = time.perf_counter()
+    run(collect(replayer(monkeypatch, path, 'mock-timed', LLM_REPLAY_SPEED='4').stream_generate(**REQUEST)))
+    assert time.perf_counter() - started < 0.15
+
+
+def test_unrecorded_requests_miss_or_fall_back_to_the_model(run, tmp_path, monkeypatch):
+    path = tmp_path / 'other.jsonl'
+    write_capture(path, stream_entry('mock-known', [[0, 'recorded']]))
+    with open(path, 'a') as f:
+        f.write('{"fingerprint": "torn')
+
+    other = dict(REQUEST, user_prompt='never recorded')
+    strict = replayer(monkeypatch, path, 'mock-known', LLM_REPLAY_SPEED='0')
+    assert strict.store.stats()['skipped_lines'] == 1
+    miss = run(strict.generate(**other))
+    assert miss.status == 'error' and 'No recorded response' in miss.error_message
+
+    lenient = replayer(monkeypatch, path, 'mock-known', LLM_REPLAY_SPEED='0', LLM_REPLAY_ON_MISS='model')
+    assert run(lenient.generate(**other)).text == 'recorded'
@@ -0,0 +1,72 @@
+import gzip
+import hashlib
+import json
+
+from llm_services import request_body
+from llm_services.fingerprint import request_fingerprint
+from llm_services.request_body import decoded_bodies
+from llm_services.text_profile import CHUNK_CHARS, TextProfiler, iter_chunks
+
+BODY = {'model_id': 'mock-fast', 'user_prompt': '안녕하세요 ' * 2000 + 'long context', 'max_tokens': 16}
+
+
+def post(client, run, data: bytes, encoding: str):
+    headers = {'Content-Type': 'application/json', 'Content-Encoding': encoding}
+    return run(client.post('/count_tokens', content=data, headers=headers))
+
+
+def test_gzip_body_is_served_like_a_plain_one(client, run):
+    plain = run(client.post('/count_tokens', json=BODY))
+    before = decoded_bodies.stats()
+    compressed = post(client, run, gzip.compress(json.dumps(BODY).encode()), 'gzip')
+    assert compressed.status_code == 200 and compressed.json() == plain.json()
+    after = run(client.get('/stats')).json()['request_bodies']
+    assert after['decoded_bodies'] == before['decoded_bodies'] + 1
+    assert after['decoded_bytes'] - before['decoded_bytes'] == len(json.dumps(BODY).encode())
+
+
+def test_bad_bodies_are_rejected(client, run, monkeypatch):
+    data = gzip.compress(json.dumps(BODY).encode())
+    assert post(client, run, data, 'br').status_code == 415
+    assert post(client, run, b'not gzip at all', 'gzip').status_code == 400
+    assert post(client, run, data[:len(data) // 2], 'gzip').status_code == 400
+
+    monkeypatch.setattr(decoded_bodies, 'max_decoded_bytes', 1024)
+    too_large = post(client, run, data, 'gzip')
+    assert too_large.status_code == 413 and 'exceeds' in too_large.json()['detail']
+
+
+def test_zstd_needs_the_optional_package(client, run, monkeypatch):
+    monkeypatch.setattr(request_body, 'zstandard', None)
+    response = post(client, run, b'\x28\xb5\x2f\xfd', 'zstd')
+    assert response.status_code == 415 and 'gzip' in response.json()['detail']
+
+
+def test_profiles_are_scanned_once_per_text():
+    profiler = TextProfiler(max_entries=2)
+    text = 'x' * CHUNK_CHARS + '한' + 'é'
+    profile = profiler.profile(text)
+    assert profile.non_ascii == 2 and profile.has_hangul and profile.length == len(text)
+    assert profile.digest == hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    assert profiler.profile(''.join([text])) is profile
+    assert profiler.stats()['misses'] == 1 and profiler.stats()['hits'] == 1
+
+    assert not profiler.has_hangul('plain ascii') and not profiler.has_hangul('café')
+    profiler.profile('a second')
+    profiler.profile('a third')
+    assert profiler.stats()['entries'] == 2
+
+
+def test_chunked_fingerprint_matches_the_whole_document():
+    # Quotes, escapes and non-ASCII straddle the chunk boundaries
+    long_prompt = ('say "hi"\n\\ 안녕 ' * (CHUNK_CHARS // 5))[:2 * CHUNK_CHARS + 5]
+    assert len(list(iter_chunks(long_prompt))) == 3
+    ascii_prompt = long_prompt.encode('ascii', 'ignore').decode()
+    # DEL is ASCII but only the ensure_ascii encoder escapes it
+    for prompt in (long_prompt, ascii_prompt, ascii_prompt[:CHUNK_CHARS] + '\x7f\x01' + ascii_prompt):
+        payload = {
+            'model_id': 'mock-fast', 'system_prompt': 'sys', 'user_prompt': prompt,
+            'temperature': 0.0, 'max_tokens': 16, 'top_p': 1.0,
+        }
+        document = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        assert request_fingerprint('mock-fast', 'sys', prompt, 0, 16, 1) == hashlib.sha256(document.encode()).hexdigest()
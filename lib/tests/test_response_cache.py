@@ -0,0 +1,108 @@
+import time
+
+from llm_services.base_llm import LLMResponse
+from llm_services.response_cache import ResponseCache
+
+
+def response(text="hello", status="success"):
+    return LLMResponse(text=text, model="mock-fast", tokens_used={'input': 1, 'output': 1, 'total': 2},
+                       response_time_ms=120, status=status)
+
+
+class Generator:
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return self.result
+
+
+def memory_cache(**kwargs):
+    options = dict(enabled=True, max_entries=100, ttl_seconds=3600, sqlite_path='', cache_nondeterministic=False)
+    options.update(kwargs)
+    return ResponseCache(**options)
+
+
+def test_only_deterministic_requests_are_cacheable():
+    cache = memory_cache()
+    assert cache.is_cacheable(0.0)
+    assert not cache.is_cacheable(0.7)
+    assert not cache.is_cacheable(0.0, use_cache=False)
+    assert memory_cache(cache_nondeterministic=True).is_cacheable(0.7)
+    assert not memory_cache(enabled=False).is_cacheable(0.0)
+
+
+def test_hit_skips_the_provider_and_reports_saved_latency(run):
+    cache = memory_cache()
+    generate = Generator(response())
+    first = run(cache.get_or_generate('k', 0.0, True, generate))
+    second = run(cache.get_or_generate('k', 0.0, True, generate))
+    assert generate.calls == 1
+    assert not first.cache_hit
+    assert second.cache_hit and second.text == "hello"
+    assert second.saved_latency_ms == 120
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_sampled_requests_and_errors_are_not_cached(run):
+    cache = memory_cache()
+    sampled = Generator(response())
+    run(cache.get_or_generate('k', 1.0, True, sampled))
+    run(cache.get_or_generate('k', 1.0, True, sampled))
+    assert sampled.calls == 2
+    assert cache.stats()['skipped'] == 2
+
+    failing = Generator(response(status="error"))
+    run(cache.get_or_generate('e', 0.0, True, failing))
+    run(cache.get_or_generate('e', 0.0, True, failing))
+    assert failing.calls == 2
+
+
+def test_lru_eviction_by_entry_count(run):
+    cache = memory_cache(max_entries=2)
+    for key in ('a', 'b'):
+        run(cache.put(key, response(key)))
+    assert run(cache.get('a')) is not None  # a is now most recently used
+    run(cache.put('c', response('c')))
+    assert run(cache.get('b')) is None
+    assert run(cache.get('a')) is not None
+    assert cache.stats()['entries'] == 2
+
+
+def test_entries_expire_after_ttl(run):
+    cache = memory_cache(ttl_seconds=0.05)
+    run(cache.put('k', response()))
+    assert run(cache.get('k')) is not None
+    time.sleep(0.1)
+    assert run(cache.get('k')) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_sqlite_tier_survives_a_new_cache_instance(run, tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    cache = memory_cache(sqlite_path=path)
+    run(cache.put('k', response("persisted")))
+    cache.close()
+
+    restarted = memory_cache(sqlite_path=path)
+    found = run(restarted.get('k'))
+    assert found is not None and found.text == "persisted" and found.cache_hit
+    assert restarted.stats()['disk_hits'] == 1
+    restarted.close()
+
+
+def test_generate_endpoint_caches_temperature_zero_only(client, run):
+    body = {'model_id': 'mock-fast', 'user_prompt': 'cache endpoint test', 'temperature': 0}
+    first = run(client.post('/generate', json=body)).json()
+    second = run(client.post('/generate', json=body)).json()
+    assert first['status'] == 'success' and not first['cache_hit']
+    assert second['cache_hit'] and second['text'] == first['text']
+
+    opted_out = run(client.post('/generate', json={**body, 'cache': False})).json()
+    assert not opted_out['cache_hit']
+
+    sampled = {**body, 'temperature': 1.0}
+    run(client.post('/generate', json=sampled))
+    assert not run(client.post('/generate', json=sampled)).json()['cache_hit']
@@ -0,0 +1,87 @@
+import pytest
+
+from llm_services.circuit_breaker import breakers
+from llm_services.llm_factory import LLMFactory
+from llm_services.metrics import CallStats, model_scores
+from llm_services.router import RoutedLLM, resolve, tier_models
+
+
+def routed(model_id: str) -> RoutedLLM:
+    return LLMFactory.create_llm(model_id)
+
+
+def stream(llm, **kwargs):
+    async def main():
+        stats = CallStats()
+        text = "".join([chunk async for chunk in llm.stream_generate('', 'route me', call_stats=stats, **kwargs)])
+        return text, stats
+    return main()
+
+
+def test_resolve_tiers_and_chains(monkeypatch):
+    assert resolve('a -> b ->c') == (['a', 'b', 'c'], False)
+    assert resolve('auto:mock') == (['mock-fast', 'mock-slow'], True)
+    monkeypatch.setenv('LLM_ROUTER_TIER_CHEAP', 'x -> y')
+    assert tier_models('cheap') == ['x', 'y']
+    with pytest.raises(ValueError):
+        resolve('auto:nonexistent')
+
+
+def test_adaptive_tiers_prefer_the_faster_model():
+    llm = RoutedLLM('auto:mock', LLMFactory.create_llm, LLMFactory.provider_for)
+    for _ in range(5):
+        model_scores.record('mock-fast', 'generate', 900, True)
+        model_scores.record('mock-slow', 'generate', 100, True)
+    assert llm.candidates('generate') == ['mock-slow', 'mock-fast']
+    # An explicit chain keeps its order
+    chain = RoutedLLM('mock-fast -> mock-slow', LLMFactory.create_llm, LLMFactory.provider_for)
+    assert chain.candidates('generate') == ['mock-fast', 'mock-slow']
+
+
+def test_open_circuits_go_last():
+    breakers.get('mock', 'mock-route-down')._open("tripped by test")
+    llm = routed('mock-route-down -> mock-route-up')
+    assert llm.candidates('generate') == ['mock-route-up', 'mock-route-down']
+
+
+def test_generate_falls_through_failing_models(run):
+    LLMFactory.create_llm('mock-route-broken').error_rate = 1.0
+    LLMFactory.create_llm('mock-route-broken').max_retries = 1
+    response = run(routed('mock-route-broken -> mock-route-ok').generate('', 'route me', max_tokens=8))
+    assert response.status == 'success' and response.model == 'mock-route-ok'
+    assert [a['status'] for a in response.attempts] == ['error', 'success']
+    assert response.routed_from == 'mock-route-broken -> mock-route-ok'
+
+
+def test_slo_abandons_slow_models(run):
+    LLMFactory.create_llm('mock-route-laggard').ttft_ms = 1000
+    llm = routed('mock-route-laggard -> mock-route-quick')
+    response = run(llm.generate('', 'route me', max_tokens=8, latency_slo_ms=50))
+    assert response.model == 'mock-route-quick'
+    assert response.attempts[0] == {'model': 'mock-route-laggard', 'status': 'slo_exceeded', 'response_time_ms': 50}
+    assert response.response_time_ms < 500
+
+    text, stats = run(stream(llm, max_tokens=8, latency_slo_ms=50))
+    assert text.split() == [f"tok{i}" for i in range(8)]
+    assert [a['status'] for a in stats.attempts] == ['slo_exceeded', 'success']
+
+
+def test_stream_falls_through_before_any_text(run):
+    LLMFactory.create_llm('mock-route-stream-broken').error_rate = 1.0
+    text, stats = run(stream(routed('mock-route-stream-broken -> mock-route-stream-ok'), max_tokens=8))
+    assert not text.startswith('Error')
+    assert stats.model == 'mock-route-stream-ok' and stats.status == 'success'
+
+
+def test_unservable_chain_reports_an_error(run):
+    too_long = "word " * 40_000  # over every mock model's context window
+    response = run(routed('mock-route-small-a -> mock-route-small-b').generate('', too_long, max_tokens=8))
+    assert response.status == 'error'
+    assert [a['status'] for a in response.attempts] == ['skipped', 'skipped']
+
+
+def test_generate_endpoint_names_the_serving_model(client, run):
+    body = {'model_id': 'mock-route-api-a -> mock-route-api-b', 'user_prompt': 'via http'}
+    response = run(client.post('/generate', json=body)).json()
+    assert response['status'] == 'success'
+    assert response['model'] == 'mock-route-api-a'
@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+import pytest
+
+from llm_services.llm_factory import LLMFactory
+from llm_services.sessions import SessionBusy, SessionNotFound, SessionStore
+
+
+def store(**kwargs) -> SessionStore:
+    options = dict(max_sessions=100, max_bytes=1 << 30, idle_ttl_s=0, history_tokens=0, keep_ratio=0.5,
+                   summary_model='', summary_tokens=64, turn_wait_s=1.0, summary_wait_s=1.0)
+    options.update(kwargs)
+    return SessionStore(**options)
+
+
+def pairs(count, text='message'):
+    return [{'role': role, 'content': f'{text} {i}'} for i in range(count) for role in ('user', 'assistant')]
+
+
+async def turn(sessions, session_id, prompt, reply):
+    current = await sessions.begin(session_id)
+    current.commit(prompt, reply)
+    current.release()
+
+
+def test_seed_messages_must_be_user_assistant_pairs():
+    sessions = store()
+    with pytest.raises(ValueError):
+        sessions.create(messages=pairs(1)[:1])
+    with pytest.raises(ValueError):
+        sessions.create(messages=list(reversed(pairs(1))))
+    assert len(sessions.create('seeded', 'system', pairs(2)).messages) == 4
+
+
+def test_least_recently_used_sessions_are_evicted(run):
+    sessions = store(max_sessions=2)
+    sessions.create('a')
+    sessions.create('b')
+    run(turn(sessions, 'a', 'hi', 'hello'))  # a is now the most recently used
+    sessions.create('c')
+    with pytest.raises(SessionNotFound):
+        sessions.get('b')
+    assert sessions.get('a') and sessions.stats()['evicted'] == 1
+
+    sized = store(max_bytes=2000)
+    sized.create('big', messages=pairs(1, 'x' * 1500))
+    sized.create('small')
+    assert sized.stats()['sessions'] == 1 and sized.get('small')
+
+
+def test_idle_sessions_expire():
+    sessions = store(idle_ttl_s=0.01)
+    sessions.create('idle')
+    time.sleep(0.02)
+    with pytest.raises(SessionNotFound):
+        sessions.get('idle')
+    assert sessions.stats()['expired'] == 1
+
+
+def test_turns_wait_for_each_other(run):
+    sessions = store(turn_wait_s=0.05)
+    sessions.create('busy')
+
+    async def main():
+        first = await sessions.begin('busy')
+        with pytest.raises(SessionBusy):
+            await sessions.begin('busy')
+        first.release()
+        (await sessions.begin('busy')).release()
+
+    run(main())
+
+
+def test_deleting_a_session_during_a_turn_frees_its_bytes(run):
+    sessions = store()
+    sessions.create('gone', messages=pairs(2))
+
+    async def main():
+        current = await sessions.begin('gone')
+        sessions.delete('gone')
+        current.commit('late question', 'late answer')
+        current.release()
+
+    run(main())
+    assert sessions.stats()['sessions'] == 0 and sessions.total_bytes == 0
+
+
+def test_long_histories_are_compacted_and_summarized(run):
+    LLMFactory.create_llm('mock-summary')
+    sessions = store(history_tokens=100, summary_model='mock-summary')
+    sessions.create('long')
+
+    async def main():
+        for i in range(6):
+            await turn(sessions, 'long', f'question {i} ' * 5, f'answer {i} ' * 5)
+        current = await sessions.begin('long', 'be brief')  # waits for the pending summary
+        current.release()
+        return current
+
+    current = run(main())
+    session = sessions.get('long')
+    assert session.history_tokens <= 100 and session.messages[-1]['content'].startswith('answer 5')
+    assert sessions.stats()['compactions'] >= 1 and sessions.stats()['summaries'] >= 1
+    assert session.summarized_messages == 12 - len(session.messages)
+    assert current.system_prompt.startswith('be brief\n\nSummary of the earlier conversation:\n')
+
+
+def test_history_is_trimmed_to_the_model_window():
+    sessions = store()
+    session = sessions.create('wide', messages=pairs(2, 'word ' * 12000))
+    history = sessions.fit(session, 'mock', 'mock-fast', '', 'next question', 2048)
+    assert 0 < len(history) < 4 and history == session.messages[-len(history):]
+    assert sessions.stats()['trimmed_calls'] == 1
+
+
+def test_generate_sends_only_the_new_turn(client, run):
+    created = run(client.post('/sessions', json={'system_prompt': 'You are terse.', 'messages': pairs(1)}))
+    assert created.status_code == 201
+    session_id = created.json()['session_id']
+
+    body = {'model_id': 'mock-session', 'user_prompt': 'next turn', 'session_id': session_id, 'temperature': 1.0}
+    first = run(client.post('/generate', json=body)).json()
+    second = run(client.post('/generate', json=dict(body, user_prompt='and another'))).json()
+    assert first['history_messages'] == 2 and second['history_messages'] == 4
+
+    stored = run(client.get(f'/sessions/{session_id}')).json()
+    assert [m['content'] for m in stored['messages'][2::2]] == ['next turn', 'and another']
+    assert stored['messages'][3]['content'] == first['text'] and stored['turns'] == 2
+
+    batch = dict(body, iterations=2)
+    assert run(client.post('/batch_generate', json=batch)).status_code == 400
+    assert run(client.delete(f'/sessions/{session_id}')).status_code == 200
+    assert run(client.post('/generate', json=body)).status_code == 404
+
+
+def test_concurrent_turns_of_one_session_run_in_order(client, run):
+    LLMFactory.create_llm('mock-session-order').ttft_ms = 50
+    session_id = run(client.post('/sessions', json={})).json()['session_id']
+    body = {'model_id': 'mock-session-order', 'session_id': session_id, 'temperature': 1.0}
+
+    async def main():
+        return await asyncio.gather(*(
+            client.post('/generate', json=dict(body, user_prompt=f'turn {i}')) for i in range(3)
+        ))
+
+    responses = run(main())
+    assert sorted(r.json()['history_messages'] for r in responses) == [0, 2, 4]
+    assert run(client.get(f'/sessions/{session_id}')).json()['turns'] == 3
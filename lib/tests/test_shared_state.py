@@ -0,0 +1,80 @@
+import asyncio
+import threading
+
+import pytest
+
+from llm_services.metrics import CallStats, MetricsRegistry
+from llm_services.rate_limiter import ModelLimiter
+from llm_services.shared_state import MetricsPublisher, SharedStateStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SharedStateStore(str(tmp_path / 'shared_state.sqlite3'))
+    yield store
+    store.close()
+
+
+def worker_limiter(store, tpm=600):
+    """A limiter as another worker process would build it over the same store"""
+    return ModelLimiter('mock', 'mock-shared', rpm=None, tpm=tpm, store=store)
+
+
+async def settled(limiter):
+    while limiter._updates:
+        await asyncio.gather(*limiter._updates)
+
+
+def test_workers_draw_from_one_budget(run, store):
+    first, second = worker_limiter(store), worker_limiter(store)
+    run(first.acquire(500))
+    assert second._try_take(200) > 0
+    assert second._try_take(100) <= 0
+
+
+def test_shared_transactions_run_off_the_event_loop(run, store, monkeypatch):
+    threads = []
+    bucket = store.bucket
+
+    def recording_bucket(key, target):
+        threads.append(threading.current_thread())
+        return bucket(key, target)
+
+    monkeypatch.setattr(store, 'bucket', recording_bucket)
+    limiter = worker_limiter(store)
+
+    async def main():
+        reservation = await limiter.acquire(300)
+        reservation.settle(100)
+        await settled(limiter)
+
+    run(main())
+    assert threads and threading.current_thread() not in threads
+    assert 500 <= limiter.tokens.available() < 510
+
+
+def test_refund_and_back_off_reach_other_workers(run, store):
+    first, second = worker_limiter(store), worker_limiter(store)
+
+    async def main():
+        reservation = await first.acquire(400)
+        reservation.refund()
+        first.block_for(30)
+        await settled(first)
+
+    run(main())
+    assert second.tokens.available() == 600
+    assert second._try_take(10) > 25
+
+
+def test_metrics_aggregate_over_workers(run, store):
+    registries = [MetricsRegistry(), MetricsRegistry()]
+    publishers = [MetricsPublisher(store, registry, 5.0) for registry in registries]
+    publishers[1].worker += '-other'
+    for registry in registries:
+        registry.record_call(CallStats(model='m', mode='generate', duration_ms=100.0))
+
+    run(publishers[1].stop())
+    text = run(publishers[0].aggregate()).render_prometheus()
+    assert 'llm_requests_total{mode="generate",model="m",status="success"} 2.0' in text
+    assert store.workers(60) == 2
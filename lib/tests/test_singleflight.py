@@ -0,0 +1,95 @@
+import asyncio
+
+from llm_services.llm_factory import LLMFactory
+from llm_services.singleflight import SingleFlight, single_flight
+
+
+def slow_mock(model_id: str, ttft_ms: float = 100):
+    """A pooled mock model slow enough that concurrent requests overlap"""
+    llm = LLMFactory.create_llm(model_id)
+    llm.ttft_ms = ttft_ms
+    return llm
+
+
+def test_do_runs_one_call_for_concurrent_callers(run):
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*[flight.do('k', work) for _ in range(5)])
+
+    assert run(main()) == ["result"] * 5
+    assert len(calls) == 1
+    assert flight.stats()['coalesced_calls'] == 4
+    assert flight.stats()['in_flight_calls'] == 0
+
+
+def test_late_stream_subscriber_replays_from_the_first_chunk(run):
+    flight = SingleFlight()
+    started = []
+
+    async def upstream():
+        started.append(1)
+        for chunk in ("a", "b", "c"):
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def consume(delay):
+        await asyncio.sleep(delay)
+        return [chunk async for chunk in flight.stream('k', upstream)]
+
+    async def main():
+        return await asyncio.gather(consume(0), consume(0.015))
+
+    assert run(main()) == [["a", "b", "c"], ["a", "b", "c"]]
+    assert len(started) == 1
+
+
+def test_deterministic_streams_share_one_upstream(client, run, sse):
+    slow_mock('mock-sf-stream')
+    body = {'model_id': 'mock-sf-stream', 'user_prompt': 'coalesce me', 'temperature': 0, 'stream': True}
+    before = single_flight.stats()['coalesced_streams']
+
+    async def main():
+        return await asyncio.gather(*[client.post('/generate', json=body) for _ in range(3)])
+
+    texts = ["".join(e.get('text', '') for e in sse(r.text)) for r in run(main())]
+    assert single_flight.stats()['coalesced_streams'] == before + 2
+    assert len(set(texts)) == 1 and texts[0]
+
+
+def test_sampled_requests_are_never_coalesced(client, run):
+    slow_mock('mock-sf-sampled')
+    body = {'model_id': 'mock-sf-sampled', 'user_prompt': 'sample me', 'temperature': 1.0}
+    before = single_flight.stats()
+
+    async def main():
+        return await asyncio.gather(
+            *[client.post('/generate', json={**body, 'stream': True}) for _ in range(3)],
+            *[client.post('/generate', json=body) for _ in range(3)],
+        )
+
+    assert all(r.status_code == 200 for r in run(main()))
+    after = single_flight.stats()
+    assert after['coalesced_streams'] == before['coalesced_streams']
+    assert after['coalesced_calls'] == before['coalesced_calls']
+    assert after['streams'] == before['streams']
+
+
+def test_concurrent_deterministic_generates_share_one_call(client, run):
+    llm = slow_mock('mock-sf-generate')
+    body = {'model_id': 'mock-sf-generate', 'user_prompt': 'one call please', 'temperature': 0}
+    before = single_flight.stats()['coalesced_calls']
+
+    async def main():
+        return await asyncio.gather(*[client.post('/generate', json=body) for _ in range(3)])
+
+    results = [r.json() for r in run(main())]
+    assert single_flight.stats()['coalesced_calls'] == before + 2
+    assert llm.rate_limiter.acquired == 1
+    assert {r['text'] for r in results} == {results[0]['text']}
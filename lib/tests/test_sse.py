@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import pytest
+
+from llm_services.sse import DONE_FRAME, coalesce, dumps, sse_frame
+
+
+async def deltas(items, gap_s=0.0):
+    for item in items:
+        if gap_s:
+            await asyncio.sleep(gap_s)
+        yield item
+
+
+def collect(run, chunks, **kwargs):
+    async def main():
+        return [piece async for piece in coalesce(chunks, **kwargs)]
+    return run(main())
+
+
+def test_frames_are_compact_utf8_json():
+    assert dumps({'text': 'héllo', 'n': 1}) == '{"text":"héllo","n":1}'.encode('utf-8')
+    assert sse_frame({'a': 1}) == b'data: {"a":1}\n\n'
+    assert json.loads(DONE_FRAME[len(b"data: "):]) == {'done': True}
+
+
+def test_first_delta_is_sent_alone_then_the_rest_is_merged(run):
+    pieces = collect(run, deltas(["a", "b", "c", "d"], gap_s=0.005), window_s=10, max_bytes=1000, idle_s=0)
+    assert pieces == ["a", "bcd"]
+
+
+def test_size_threshold_flushes_before_the_window(run):
+    pieces = collect(run, deltas(["x"] * 9, gap_s=0.001), window_s=10, max_bytes=4, idle_s=0)
+    assert pieces[0] == "x"
+    assert "".join(pieces) == "x" * 9
+    assert all(len(piece) <= 4 for piece in pieces[1:-1])
+    assert len(pieces) < 9
+
+
+def test_zero_window_passes_every_delta_through(run):
+    assert collect(run, deltas(["a", "b", "c"], gap_s=0.001), window_s=0, idle_s=0) == ["a", "b", "c"]
+
+
+def test_trailers_follow_the_text_buffered_before_them(run):
+    trailer = object()
+    pieces = collect(run, deltas(["a", "b", trailer]), window_s=10, max_bytes=1000, idle_s=0)
+    assert pieces == ["ab", trailer]
+
+
+def test_silence_yields_a_heartbeat_marker(run):
+    pieces = collect(run, deltas(["a", "b"], gap_s=0.05), window_s=0, idle_s=0.01)
+    assert None in pieces
+    assert [p for p in pieces if p is not None] == ["a", "b"]
+
+
+def test_upstream_errors_surface_after_buffered_text(run):
+    async def failing():
+        yield "a"
+        yield "b"
+        raise RuntimeError("upstream broke")
+
+    async def main():
+        seen = []
+        with pytest.raises(RuntimeError):
+            async for piece in coalesce(failing(), window_s=10, idle_s=0):
+                seen.append(piece)
+        return seen
+
+    assert "".join(run(main())) == "ab"
+
+
+def test_generate_stream_carries_the_whole_text_in_fewer_events(client, run, sse):
+    body = {'model_id': 'mock-sse', 'user_prompt': 'stream me', 'temperature': 1.0, 'stream': True, 'max_tokens': 64}
+    events = sse(run(client.post('/generate', json=body)).text)
+    text_events = [e for e in events if 'text' in e]
+    text = "".join(e['text'] for e in text_events)
+    assert text.split() == [f"tok{i}" for i in range(8)]
+    assert events[-1]['done']
@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+from llm_services import tokenizer
+from llm_services.llm_factory import LLMFactory
+from llm_services.tokenizer import ContextWindowExceeded, HeuristicTokenizer, Tokenizer, token_counter
+
+
+class ThreadRecordingTokenizer(Tokenizer):
+    """Remembers which threads built it and counted with it"""
+
+    name = "recording"
+
+    def __init__(self, threads):
+        self.threads = threads
+        threads.append(('build', threading.current_thread()))
+
+    def count(self, text: str) -> int:
+        self.threads.append(('count', threading.current_thread()))
+        return len(text.split())
+
+
+@pytest.fixture
+def recording(monkeypatch):
+    threads = []
+    monkeypatch.setitem(tokenizer._TOKENIZER_FACTORIES, 'recording', lambda model_id: ThreadRecordingTokenizer(threads))
+    yield threads
+    token_counter.clear()
+
+
+def test_heuristic_counts_non_latin_text_per_character():
+    heuristic = HeuristicTokenizer()
+    assert heuristic.count("abcdefgh") == 2
+    assert heuristic.count("안녕하세요") == 5
+    assert heuristic.count("") == 0
+
+
+def test_preflight_clamps_or_rejects():
+    check = token_counter.preflight('mock', 'mock-tok', '', 'hello', 100_000)
+    assert check.clamped and check.max_tokens == 4096
+    with pytest.raises(ContextWindowExceeded):
+        token_counter.preflight('mock', 'mock-tok', '', 'hello', 100_000, overflow="reject")
+    with pytest.raises(ContextWindowExceeded):
+        token_counter.preflight('mock', 'mock-tok', '', 'word ' * 200_000, 10)
+
+
+def test_precount_builds_the_tokenizer_and_counts_long_texts_off_the_loop(run, recording):
+    long_text = "word " * (tokenizer.OFFLOAD_CHARS // 5 + 1)
+    run(token_counter.precount_prompt('recording', 'model', 'short system prompt', long_text))
+    # The long prompt was counted in a worker; the short one is left to the cheap synchronous path
+    assert [kind for kind, _ in recording] == ['build', 'count']
+    assert all(thread is not threading.current_thread() for _, thread in recording)
+
+    hits = token_counter.hits
+    token_counter.count_prompt('recording', 'model', '', long_text)
+    assert token_counter.hits == hits + 1
+    assert len(recording) == 2
+
+
+def test_precount_skips_work_already_done(run, recording):
+    run(token_counter.precount('recording', 'model', 'tiny'))
+    run(token_counter.precount('recording', 'model', 'tiny'))
+    assert [kind for kind, _ in recording] == ['build']
+
+
+def test_warm_up_builds_tokenizers():
+    token_counter.clear()
+    LLMFactory.warm_up(['mock-warm-tokenizer'])
+    assert ('mock', 'mock-warm-tokenizer') in token_counter._tokenizers
+
+
+def test_count_tokens_endpoint(client, run):
+    body = {'model_id': 'mock-count', 'user_prompt': 'count these tokens', 'max_tokens': 100_000}
+    result = run(client.post('/count_tokens', json=body)).json()
+    assert result['prompt_tokens'] > 0 and not result['fits']
+    assert result['max_tokens'] == 4096 and result['tokenizer'] == 'heuristic'
+
+    assert run(client.post('/count_tokens', json={**body, 'model_id': 'nope'})).status_code == 400
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from llm_services.llm_factory import LLMFactory
+
+
+def generate(stream_id, model_id, **fields):
+    return {'type': 'generate', 'id': stream_id, 'model_id': model_id, 'user_prompt': 'over the channel', **fields}
+
+
+async def finish(session, stream_ids):
+    """Frames per stream until every stream has sent done or error"""
+    frames = {stream_id: [] for stream_id in stream_ids}
+    pending = set(stream_ids)
+    while pending:
+        frame = await session.receive()
+        frames[frame['id']].append(frame)
+        if frame['type'] in ('done', 'error'):
+            pending.discard(frame['id'])
+    return frames
+
+
+def test_concurrent_streams_share_one_connection(run, ws):
+    async def main():
+        session = await ws()
+        for stream_id in ('a', 'b'):
+            await session.send(generate(stream_id, 'mock-ws', stream=True, temperature=1.0))
+        return await finish(session, ['a', 'b'])
+
+    for frames in run(main()).values():
+        types = [frame['type'] for frame in frames]
+        assert types[0] == 'start' and types[-2:] == ['stats', 'done']
+        text = "".join(frame['text'] for frame in frames if frame['type'] == 'chunk')
+        assert text.split() == [f"tok{i}" for i in range(8)]
+        assert frames[-2]['stats']['status'] == 'success' and frames[-1]['cancelled'] is None
+
+
+def test_stream_waits_for_credit(run, ws):
+    LLMFactory.create_llm('mock-ws-credit').tokens_per_sec = 200
+
+    async def main():
+        session = await ws()
+        await session.send(generate('c', 'mock-ws-credit', stream=True, temperature=1.0, window=1))
+        frames = await session.until('c', 'chunk')
+        with pytest.raises(asyncio.TimeoutError):
+            await session.receive(timeout=0.2)
+        await session.send({'type': 'credit', 'id': 'c', 'n': 100})
+        return frames + await session.until('c', 'done')
+
+    frames = run(main())
+    text = "".join(frame['text'] for frame in frames if frame['type'] == 'chunk')
+    # Output produced while the stream waited arrives merged into the next frames
+    assert text.split() == [f"tok{i}" for i in range(8)]
+    assert sum(frame['type'] == 'chunk' for frame in frames) < 8
+
+
+def test_cancel_frame_stops_one_stream(run, ws):
+    LLMFactory.create_llm('mock-ws-cancel').ttft_ms = 2000
+
+    async def main():
+        session = await ws()
+        await session.send(generate('slow', 'mock-ws-cancel', stream=True, temperature=1.0))
+        await session.send(generate('fast', 'mock-ws', stream=True, temperature=1.0))
+        await session.until('slow', 'start')
+        await session.send({'type': 'cancel', 'id': 'slow'})
+        await session.send({'type': 'cancel', 'id': 'unknown'})
+        return await finish(session, ['slow', 'fast', 'unknown'])
+
+    frames = run(main())
+    assert frames['slow'][-1] == {'type': 'done', 'id': 'slow', 'cancelled': 'cancelled'}
+    assert frames['fast'][-1]['type'] == 'done' and frames['fast'][-1]['cancelled'] is None
+    assert frames['unknown'][-1]['status'] == 'not_running'
+
+
+def test_result_frames_honour_the_cache_flag(run, ws):
+    async def main():
+        session = await ws()
+        results = []
+        for stream_id, cache in (('1', True), ('2', True), ('3', False)):
+            await session.send(generate(stream_id, 'mock-ws-cache', temperature=0.0, cache=cache))
+            results.append((await session.until(stream_id, 'result'))[-1])
+            await session.until(stream_id, 'done')
+        return results
+
+    first, cached, uncached = run(main())
+    assert first['status'] == 'success' and not first['cache_hit']
+    assert cached['cache_hit']
+    assert not uncached['cache_hit']
+
+
+def test_bad_frames_get_error_frames(run, ws):
+    async def main():
+        session = await ws()
+        await session._inbox.put({'type': 'websocket.receive', 'text': 'not json'})
+        invalid = await session.receive()
+        await session.send({'type': 'bogus', 'id': 'x'})
+        unknown = await session.receive()
+        await session.send({'type': 'generate', 'id': 'y'})  # no model_id
+        missing = await session.receive()
+        await session.send({'type': 'ping', 'id': 'p'})
+        pong = await session.receive()
+        return invalid, unknown, missing, pong
+
+    invalid, unknown, missing, pong = run(main())
+    assert invalid['status'] == unknown['status'] == 'invalid_frame'
+    assert missing['status'] == 'invalid_request' and missing['id'] == 'y'
+    assert pong == {'type': 'pong', 'id': 'p'}